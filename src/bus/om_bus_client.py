@@ -17,28 +17,32 @@ IPC Bus messaging client
 """
 
 import logging
+import socket
 import time
-import ujson as json
-from multiprocessing.connection import Client
-from threading import Thread, Lock
+from threading import Thread, Lock, Event
 from signal import signal, SIGTERM
 from bus.om_bus_events import OMBusEvents
+from bus.om_bus_protocol import SOCKET_PATH, pack_frame, read_payload, unpack_payload
 
 logger = logging.getLogger('openmotics')
 
 
 class MessageClient(object):
 
-    def __init__(self, name, ip='localhost', port=10000, authkey='openmotics'):
-        self.address = (ip, port)  # family is deduced to be 'AF_INET'
-        self.authkey = authkey
-        self.callbacks = []
+    STATE_MAX_AGE = 2  # Seconds a published state can be used without requesting it
+
+    def __init__(self, name, socket_path=SOCKET_PATH):
+        self.socket_path = socket_path
+        self.callbacks = []  # List of (callback, event types), None meaning all event types
         self.client = None
         self._get_state = None
         self.client_name = name
-        self.latest_state_received = {}
+        self._states = {}  # Source -> (state, receive time)
+        self._state_waiters = {}
+        self._state_sources = set()  # Clients of which the published states are received
         self._connected = False
-        self._get_state_lock = Lock()
+        self._state_lock = Lock()
+        self._send_lock = Lock()
         self._stop = False
         self._start()
 
@@ -48,21 +52,29 @@ class MessageClient(object):
             self._send(msg, msg_type='state', destination=source)
 
     def _process_message(self, payload):
-        msg = json.loads(payload)
+        msg = unpack_payload(payload)
         data = msg['data']
         source = msg['source']
         if msg['type'] == 'request_state':
             self._send_state(source)
         if msg['type'] == 'state':
-            self.latest_state_received[source] = data
+            self._states[source] = (data, time.time())
+            with self._state_lock:
+                waiters = self._state_waiters.pop(source, [])
+            for waiter in waiters:
+                waiter.set()
         if msg['type'] == 'event':
+            if data.get('event_type') == OMBusEvents.CLIENT_DISCOVERY:
+                self._send_state(None)  # Let the new client know our state
             self._process_event(data)
 
     def _process_event(self, data):
         try:
             event_type = data['event_type']
             payload = data['payload']
-            for callback in self.callbacks:
+            for callback, event_types in self.callbacks:
+                if event_types is not None and event_type not in event_types:
+                    continue
                 try:
                     callback(event_type, payload)
                 except Exception:
@@ -75,8 +87,8 @@ class MessageClient(object):
         self._stop = False
         while not self._stop:
             try:
-                msg = self.client.recv_bytes()
-                self._process_message(msg)
+                payload = read_payload(self.client)
+                self._process_message(payload)
             except EOFError:
                 logger.error('Client connection closed unexpectedly')
                 self.client.close()
@@ -91,19 +103,42 @@ class MessageClient(object):
 
     def _send(self, data, msg_type='event', destination=None):
         payload = {'type': msg_type, 'source': self.client_name, 'destination': destination, 'data': data}
-        msg = json.dumps(payload)
-        if self.client is not None and self.client.closed is False and self._connected:
-            self.client.send_bytes(msg)
+        msg_frame = pack_frame(payload)
+        if self.client is not None and self._connected:
+            try:
+                with self._send_lock:
+                    self.client.sendall(msg_frame)
+            except socket.error as ex:
+                logger.error('Unable to send payload: {0}'.format(ex))
         else:
             logger.error('Unable to send payload. Client still connected?')
 
+    def _get_topics(self):
+        """ Returns the topics this client needs, None if it needs all of them """
+        topics = set()
+        for _, event_types in self.callbacks:
+            if event_types is None:
+                return None
+            topics.update(event_types)
+        if self._get_state is not None:
+            topics.add(OMBusEvents.CLIENT_DISCOVERY)
+        topics.update('state.{0}'.format(source) for source in list(self._state_sources))
+        return sorted(topics)
+
+    def _subscribe(self):
+        if self._connected:
+            self._send(self._get_topics(), msg_type='subscribe')
+
     def _connect(self):
         while not self._connected:
             try:
-                self.client = Client(self.address, authkey=self.authkey)
+                client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                client.connect(self.socket_path)
+                self.client = client
                 self._connected = True
+                self._subscribe()
                 self.send_event(OMBusEvents.CLIENT_DISCOVERY, None)
-            except IOError as io_error:
+            except socket.error as io_error:
                 logger.error('Could not connect to message server: {}'.format(io_error))
                 time.sleep(1)
             except Exception as e:
@@ -121,17 +156,36 @@ class MessageClient(object):
         receiver.daemon = True
         receiver.start()
 
-    def get_state(self, destination, default=None, timeout=5):
-        with self._get_state_lock:
+    def get_state(self, destination, default=None, timeout=5, max_age=STATE_MAX_AGE):
+        """
+        Returns the state of another client. A state published by that client is used when it's not older than
+        `max_age` seconds, otherwise the state is requested. Concurrent requests for the same client share a request.
+        """
+        state = self._states.get(destination)
+        if state is not None and state[1] > time.time() - max_age:
+            return state[0]
+        waiter = Event()
+        with self._state_lock:
+            subscribe = destination not in self._state_sources  # Receive the states it publishes from now on
+            self._state_sources.add(destination)
+            waiters = self._state_waiters.setdefault(destination, [])
+            waiters.append(waiter)
+            request = len(waiters) == 1
+        if subscribe:
+            self._subscribe()
+        if request:
             self._send(None, msg_type='request_state', destination=destination)
-            t_end = time.time() + timeout
-            while time.time() < t_end:
-                latest_state = self.latest_state_received.pop(destination, None)
-                if latest_state is not None:
-                    return latest_state
-                else:
-                    time.sleep(0.2)
+        if not waiter.wait(timeout):
+            with self._state_lock:
+                waiters = self._state_waiters.get(destination, [])
+                if waiter in waiters:
+                    waiters.remove(waiter)
             return default
+        return self._states[destination][0]
+
+    def publish_state(self):
+        """ Sends the state to all clients, so they don't have to request it """
+        self._send_state(None)
 
     def send_event(self, event_type, payload):
         data = {'event_type': event_type, 'payload': payload}
@@ -139,6 +193,12 @@ class MessageClient(object):
 
     def set_state_handler(self, state_handler):
         self._get_state = state_handler
-
-    def add_event_handler(self, callback):
-        self.callbacks.append(callback)
+        self._subscribe()
+
+    def add_event_handler(self, callback, event_types=None):
+        """
+        Adds a callback for events
+        :param event_types: Event types the callback handles, None for all event types. Other events aren't sent to this client.
+        """
+        self.callbacks.append((callback, event_types))
+        self._subscribe()
@@ -0,0 +1,75 @@
+# Copyright (C) 2019 OpenMotics BV
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+IPC Bus wire protocol: msgpack encoded messages, prefixed with their length, over a Unix domain socket
+"""
+
+import struct
+import msgpack
+
+SOCKET_PATH = '/tmp/openmotics_bus.sock'
+
+_LENGTH = struct.Struct('>I')
+MAX_PAYLOAD_SIZE = 16 * 1024 * 1024
+
+
+class FrameError(ValueError):
+    """ The frame can't be read, the connection can't be used anymore """
+    pass
+
+
+def pack_frame(message):
+    """ Encodes a message into a frame """
+    return frame(msgpack.dumps(message))
+
+
+def frame(payload):
+    """ Frames an already encoded message """
+    return _LENGTH.pack(len(payload)) + payload
+
+
+def unpack_payload(payload):
+    return msgpack.loads(payload)
+
+
+def read_payload(connection):
+    """
+    Reads the (encoded) message of the next frame, raises EOFError when the connection is closed and FrameError
+    when the length is beyond any sane message (e.g. not a bus client), instead of trying to read it all
+    """
+    length = _LENGTH.unpack(_read(connection, _LENGTH.size))[0]
+    if length > MAX_PAYLOAD_SIZE:
+        raise FrameError('Frame of {0} bytes exceeds the maximum of {1} bytes'.format(length, MAX_PAYLOAD_SIZE))
+    return _read(connection, length)
+
+
+def get_topic(message):
+    """ Returns the topic of a broadcasted message: the event type for events, `state.<source>` for published states """
+    if message['type'] == 'event':
+        return message['data']['event_type']
+    if message['type'] == 'state':
+        return 'state.{0}'.format(message['source'])
+    return message['type']
+
+
+def _read(connection, length):
+    chunks = []
+    while length > 0:
+        chunk = connection.recv(min(length, 65536))
+        if not chunk:
+            raise EOFError('Connection closed')
+        chunks.append(chunk)
+        length -= len(chunk)
+    return ''.join(chunks)
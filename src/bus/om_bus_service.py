@@ -17,83 +17,115 @@ IPC Bus messaging service
 """
 
 import logging
+import os
+import socket
 import time
-import ujson as json
-from multiprocessing.connection import Listener
-from threading import Thread
+from threading import Thread, Lock
 from signal import signal, SIGTERM
+from bus.om_bus_protocol import SOCKET_PATH, FrameError, frame, read_payload, unpack_payload, get_topic
 
 logger = logging.getLogger('openmotics')
 
 
 class MessageService(object):
 
-    def __init__(self, ip='localhost', port=10000, authkey='openmotics'):
-        self.connections = {}
-        self.address = (ip, port)  # family is deduced to be 'AF_INET'
-        self.authkey = authkey
-        self.listener = Listener(self.address, authkey=self.authkey)
+    def __init__(self, socket_path=SOCKET_PATH):
+        self.connections = {}  # Connection -> client name
+        self.subscriptions = {}  # Connection -> set of topics, None for all topics
+        self.socket_path = socket_path
+        self.listener = None
+        self._send_locks = {}
+        self._lock = Lock()
         self._stop = False
 
-    def _multicast(self, source, msg):
-        for connection, client_name in self.connections.iteritems():
-            if client_name != source and connection is not None:
-                self._send(connection, msg)
-
-    def _unicast(self, destination, msg):
-        for connection, client_name in self.connections.iteritems():
-            if client_name == destination and connection is not None:
-                self._send(connection, msg)
-                break
-
-    def _send(self, conn, msg):
-        payload = json.dumps(msg)
-        conn.send_bytes(payload)
+    def _listen(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o600)  # Only the (root) services can connect
+        listener.listen(16)
+        self.listener = listener
+
+    def _multicast(self, source, topic, msg_frame):
+        with self._lock:
+            connections = [(connection, self._send_locks[connection])
+                           for connection, client_name in self.connections.iteritems()
+                           if client_name != source and (self.subscriptions.get(connection) is None or topic in self.subscriptions[connection])]
+        for connection, send_lock in connections:
+            self._send(connection, send_lock, msg_frame)
+
+    def _unicast(self, destination, msg_frame):
+        with self._lock:
+            connections = [(connection, self._send_locks[connection])
+                           for connection, client_name in self.connections.iteritems()
+                           if client_name == destination]
+        for connection, send_lock in connections[:1]:
+            self._send(connection, send_lock, msg_frame)
+
+    def _send(self, conn, send_lock, msg_frame):
+        try:
+            with send_lock:
+                conn.sendall(msg_frame)
+        except socket.error as ex:
+            logger.error('Error sending message to client {0}: {1}'.format(self.connections.get(conn), ex))
 
     def _verify_client(self, conn, msg):
         should_be = self.connections.get(conn, None)
         if should_be is None:
-            self.connections[conn] = msg['source']
+            with self._lock:
+                self.connections[conn] = msg['source']
             should_be = msg['source']
             logger.info('Detected new client name {0}'.format(msg['source']))
         pretends_to_be = msg['source']
         if pretends_to_be != should_be:
             raise EOFError('Client cannot use name {0} on connection for {1}'.format(pretends_to_be, should_be))
 
-    def _process_message(self, conn, msg):
+    def _process_message(self, conn, payload):
+        msg = unpack_payload(payload)
+
         # 1. update client name for connection
         self._verify_client(conn, msg)
 
-        # 2. route message based on destination
+        # 2. keep track of the topics the client is interested in
+        if msg['type'] == 'subscribe':
+            topics = msg['data']
+            with self._lock:
+                self.subscriptions[conn] = set(topics) if topics is not None else None
+            return
+
+        # 3. route message based on destination, forwarding the frame as it was received
         destination = msg.get('destination', None)
         if destination is None:
-            source = msg.get('source', None)
-            self._multicast(source, msg)
+            self._multicast(msg.get('source', None), get_topic(msg), frame(payload))
         else:
-            self._unicast(destination, msg)
+            self._unicast(destination, frame(payload))
 
     def _receiver(self, conn):
-        while not conn.closed:
+        while conn in self._send_locks:
             try:
-                payload = conn.recv_bytes()
-                msg = json.loads(payload)
-                self._process_message(conn, msg)
-            except IOError as io_error:
-                logger.exception('Error receiving message from client {0}: {1}'.format(self.connections.get(conn, None), io_error))
+                payload = read_payload(conn)
+                self._process_message(conn, payload)
+            except socket.error as socket_error:
+                logger.exception('Error receiving message from client {0}: {1}'.format(self.connections.get(conn, None), socket_error))
                 self._close(conn)
-            except ValueError:
+            except FrameError as frame_error:
+                logger.error('Invalid frame from client {0}: {1}'.format(self.connections.get(conn, None), frame_error))
+                self._close(conn)  # The rest of the stream can't be framed anymore
+            except (ValueError, TypeError, KeyError):
                 logger.exception('Error decoding payload from client {0}'.format(self.connections.get(conn, None)))
-            except EOFError as e:
+            except EOFError:
                 self._close(conn)
             except Exception:
                 logger.exception('Unknown error in receiver')
                 self._close(conn)
 
     def _close(self, conn):
-        client_name = self.connections.get(conn, 'unknown')
+        with self._lock:
+            client_name = self.connections.pop(conn, 'unknown')
+            self.subscriptions.pop(conn, None)
+            self._send_locks.pop(conn, None)
         conn.close()
-        if conn in self.connections:
-            del self.connections[conn]
         logger.info('Connection closed from {0}'.format(client_name))
 
     def _server(self):
@@ -101,18 +133,20 @@ class MessageService(object):
         self._stop = False
         while not self._stop:
             try:
-                conn = self.listener.accept()
-                logger.info('connection accepted from {0}'.format(self.listener.last_accepted))
+                conn, _ = self.listener.accept()
+                logger.info('connection accepted')
+                with self._lock:
+                    self._send_locks[conn] = Lock()
                 receiver = Thread(target=self._receiver, args=(conn,))
                 receiver.daemon = True
                 receiver.start()
-            except IOError as io_error:
-                logger.error('IOError in accepting connection: {0}'.format(io_error))
-            except Exception as e:
+            except socket.error as socket_error:
+                logger.error('Error in accepting connection: {0}'.format(socket_error))
+            except Exception:
                 logger.exception('Error in message service. Restarting...')
                 self.listener.close()
                 time.sleep(1)
-                self.listener = Listener(self.address, authkey=self.authkey)
+                self._listen()
 
     def start(self):
         def stop(signum, frame):
@@ -123,6 +157,7 @@ class MessageService(object):
             logger.info('Stopping OM messaging service... Done')
         signal(SIGTERM, stop)
 
+        self._listen()
         server = Thread(target=self._server)
         server.daemon = True
         server.start()
@@ -0,0 +1,248 @@
+# Copyright (C) 2019 OpenMotics BV
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Database utils contains the shared access layer for the SQLite databases.
+"""
+
+import atexit
+import logging
+import os
+import sqlite3
+import time
+import weakref
+from collections import namedtuple
+from Queue import Queue, Empty
+from threading import Thread, Event, Lock, current_thread
+
+logger = logging.getLogger('openmotics')
+
+WriteResult = namedtuple('WriteResult', ['lastrowid', 'rowcount'])
+
+
+class _TimedCursor(object):
+    """ The cursor handed to transactions, timing every statement """
+
+    def __init__(self, database, cursor):
+        self._database = database
+        self._cursor = cursor
+
+    def execute(self, statement, parameters=()):
+        """ Executes a statement, returns the underlying sqlite3 cursor (for fetching, lastrowid and rowcount) """
+        return self._database._timed_execute(self._cursor, statement, parameters)
+
+
+class Database(object):
+    """
+    Access to a SQLite database in WAL mode. Reads borrow a connection from a small pool, so reads don't wait for
+    each other or for writes, and short-lived threads don't leave connections behind. All writes are handed to a
+    single writer thread, which commits everything that was queued in one transaction (group commit). Locked
+    databases are retried by SQLite itself (busy timeout).
+    """
+
+    BUSY_TIMEOUT = 10000  # Milliseconds
+    STATEMENT_CACHE_SIZE = 200
+    POOL_SIZE = 4  # Idle read connections that are kept open
+    MAX_BATCH = 500
+
+    _instances = weakref.WeakSet()
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._pool = Queue()  # Idle read connections
+        self._connections = []
+        self._connections_lock = Lock()
+        self._queue = Queue()
+        self._writer = None
+        self._writer_lock = Lock()
+        self._stats_lock = Lock()
+        self._statements = {}  # Statement -> [count, total duration, maximum duration]
+        self._commits = 0
+        self._writes = 0
+        Database._instances.add(self)
+
+    @staticmethod
+    def get_instances():
+        return list(Database._instances)
+
+    def get_name(self):
+        return os.path.splitext(os.path.basename(self._filename))[0]
+
+    def _connect(self):
+        connection = sqlite3.connect(self._filename,
+                                     detect_types=sqlite3.PARSE_DECLTYPES,
+                                     check_same_thread=False,
+                                     isolation_level=None,
+                                     timeout=Database.BUSY_TIMEOUT / 1000.0,
+                                     cached_statements=Database.STATEMENT_CACHE_SIZE)
+        connection.execute('PRAGMA journal_mode=WAL;')
+        connection.execute('PRAGMA synchronous=NORMAL;')  # Safe in WAL mode, only the last commits can be lost on power loss
+        connection.execute('PRAGMA busy_timeout={0};'.format(Database.BUSY_TIMEOUT))
+        with self._connections_lock:
+            self._connections.append(connection)
+        return connection
+
+    def _borrow_connection(self):
+        try:
+            return self._pool.get_nowait()
+        except Empty:
+            return self._connect()
+
+    def _release_connection(self, connection):
+        with self._connections_lock:
+            if connection not in self._connections:
+                return  # Closed in the meantime
+            if self._pool.qsize() < Database.POOL_SIZE:
+                self._pool.put(connection)
+                return
+            self._connections.remove(connection)
+        connection.close()
+
+    def _timed_execute(self, cursor, statement, parameters):
+        start = time.time()
+        try:
+            return cursor.execute(statement, parameters)
+        finally:
+            duration = time.time() - start
+            with self._stats_lock:
+                stats = self._statements.get(statement)
+                if stats is None:
+                    stats = self._statements.setdefault(statement, [0, 0.0, 0.0])
+                stats[0] += 1
+                stats[1] += duration
+                stats[2] = max(stats[2], duration)
+
+    def execute(self, statement, parameters=()):
+        """ Executes a read-only statement, returns all rows """
+        if current_thread() is self._writer:
+            return self._timed_execute(self._writer_connection.cursor(), statement, parameters).fetchall()
+        connection = self._borrow_connection()
+        try:
+            return self._timed_execute(connection.cursor(), statement, parameters).fetchall()
+        finally:
+            self._release_connection(connection)
+
+    def execute_one(self, statement, parameters=()):
+        """ Executes a read-only statement, returns the first row or None """
+        rows = self.execute(statement, parameters)
+        return rows[0] if rows else None
+
+    def write(self, statement, parameters=()):
+        """ Executes a statement changing the database, returns a WriteResult once it's committed """
+        def _write(cursor):
+            result = cursor.execute(statement, parameters)
+            return WriteResult(result.lastrowid, result.rowcount)
+        return self.transaction(_write)
+
+    def transaction(self, function):
+        """
+        Executes a function in the writer thread, inside a transaction. The function gets a cursor (with an `execute`
+        method) and can both read and write: nothing else writes while it runs. When it raises, only its own changes
+        are rolled back. Returns the result of the function once it's committed.
+        """
+        if current_thread() is self._writer:
+            return function(_TimedCursor(self, self._writer_connection.cursor()))
+        self._ensure_writer()
+        request = {'function': function, 'done': Event(), 'result': None, 'exception': None}
+        self._queue.put(request)
+        request['done'].wait()
+        if request['exception'] is not None:
+            raise request['exception']
+        return request['result']
+
+    def _ensure_writer(self):
+        if self._writer is not None:
+            return
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer_connection = self._connect()
+                writer = Thread(target=self._write_batches, name='Database writer {0}'.format(self.get_name()))
+                writer.daemon = True
+                self._writer = writer
+                writer.start()
+
+    def _write_batches(self):
+        while True:
+            requests = [self._queue.get()]
+            if requests[0] is None:
+                return
+            stop = False
+            try:
+                while len(requests) < Database.MAX_BATCH:
+                    request = self._queue.get_nowait()
+                    if request is None:
+                        stop = True  # Writes queued after the stop are left for the next writer
+                        break
+                    requests.append(request)
+            except Empty:
+                pass
+            cursor = self._writer_connection.cursor()
+            timed_cursor = _TimedCursor(self, cursor)
+            try:
+                cursor.execute('BEGIN IMMEDIATE;')
+                for request in requests:
+                    cursor.execute('SAVEPOINT request;')
+                    try:
+                        request['result'] = request['function'](timed_cursor)
+                        cursor.execute('RELEASE SAVEPOINT request;')
+                    except Exception as ex:
+                        request['exception'] = ex
+                        cursor.execute('ROLLBACK TO SAVEPOINT request;')
+                        cursor.execute('RELEASE SAVEPOINT request;')
+                cursor.execute('COMMIT;')
+                with self._stats_lock:
+                    self._commits += 1
+                    self._writes += len(requests)
+            except Exception as ex:
+                logger.exception('Could not commit to database {0}'.format(self.get_name()))
+                try:
+                    cursor.execute('ROLLBACK;')
+                except sqlite3.Error:
+                    pass
+                for request in requests:
+                    request['exception'] = ex
+            for request in requests:
+                request['done'].set()
+            if stop:
+                return
+
+    def get_statistics(self):
+        """ Returns the number of executions and the durations per statement, and the number of (group) commits """
+        with self._stats_lock:
+            return {'statements': dict((statement, {'count': stats[0], 'duration': stats[1], 'max': stats[2]})
+                                       for statement, stats in self._statements.iteritems()),
+                    'commits': self._commits,
+                    'writes': self._writes}
+
+    def _stop_writer(self, timeout=None):
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join(timeout)
+            self._writer = None
+
+    def close(self):
+        """ Waits for the queued writes and closes all connections """
+        self._stop_writer()
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+            self._pool = Queue()
+
+
+@atexit.register
+def _stop_writers():
+    """ Lets the writers finish the queued writes, instead of being killed while waiting for more """
+    for database in Database.get_instances():
+        database._stop_writer(timeout=5)
@@ -17,11 +17,11 @@ Configuration controller
 """
 
 import time
-import sqlite3
 import logging
 import ujson as json
-from random import randint
+from threading import Lock
 from ioc import Injectable, Inject, Singleton, INJECTED
+from database_utils import Database
 
 logger = logging.getLogger("openmotics")
 
@@ -29,36 +29,33 @@ logger = logging.getLogger("openmotics")
 @Injectable.named('configuration_controller')
 @Singleton
 class ConfigurationController(object):
+    """
+    Keeps all settings in memory. Readers get them from an immutable snapshot, writes go through to the database.
+    Changes made by other processes are picked up within `REFRESH_INTERVAL` seconds.
+    """
+
+    REFRESH_INTERVAL = 1
 
     @Inject
-    def __init__(self, config_db=INJECTED, config_db_lock=INJECTED):
+    def __init__(self, config_db=INJECTED):
         """
         Constructs a new ConfigController.
 
         :param config_db: filename of the sqlite database used to store the configuration
-        :param config_db_lock: DB lock
         """
-        self.__lock = config_db_lock
-        self.__connection = sqlite3.connect(config_db,
-                                            detect_types=sqlite3.PARSE_DECLTYPES,
-                                            check_same_thread=False,
-                                            isolation_level=None)
-        self.__cursor = self.__connection.cursor()
+        self.__database = Database(config_db)
+        self.__settings = {}  # Setting -> (encoded value, value), replaced (never modified) on every change
+        self.__subscriptions = []
+        self.__update_lock = Lock()
+        self.__next_refresh = 0
         self.__check_tables()
 
-    def __execute(self, *args, **kwargs):
-        with self.__lock:
-            try:
-                return self.__cursor.execute(*args, **kwargs)
-            except (sqlite3.OperationalError, sqlite3.InterfaceError):
-                time.sleep(randint(1, 20) / 10.0)
-                return self.__cursor.execute(*args, **kwargs)
-
     def __check_tables(self):
         """
         Creates tables and execute migrations
         """
-        self.__execute('CREATE TABLE IF NOT EXISTS settings (id INTEGER PRIMARY KEY, setting TEXT UNIQUE, data TEXT);')
+        self.__database.write('CREATE TABLE IF NOT EXISTS settings (id INTEGER PRIMARY KEY, setting TEXT UNIQUE, data TEXT);')
+        self.__refresh()
         for setting, default_setting in {'cloud_enabled': True,
                                          'cloud_endpoint': 'cloud.openmotics.com',
                                          'cloud_endpoint_metrics': 'portal/metrics/',
@@ -74,17 +71,70 @@ class ConfigurationController(object):
                 self.set_setting(setting, default_setting)
 
     def get_setting(self, setting, fallback=None):
-        for setting in self.__execute('SELECT data FROM settings WHERE setting=?;', (setting.lower(),)):
-            return json.loads(setting[0])
-        return fallback
+        if time.time() > self.__next_refresh:
+            self.__refresh()
+        entry = self.__settings.get(setting.lower())
+        if entry is None:
+            return fallback
+        if isinstance(entry[1], (dict, list)):
+            return json.loads(entry[0])  # Callers get their own copy of mutable values
+        return entry[1]
 
     def set_setting(self, setting, value):
-        self.__execute('INSERT OR REPLACE INTO settings (setting, data) VALUES (?, ?);',
-                       (setting.lower(), json.dumps(value)))
+        setting = setting.lower()
+        data = json.dumps(value)
+        with self.__update_lock:
+            self.__database.write('INSERT OR REPLACE INTO settings (setting, data) VALUES (?, ?);', (setting, data))
+            changes = self.__apply({setting: (data, json.loads(data))}, [])
+        self.__notify(changes)
 
     def remove_setting(self, setting):
-        self.__execute('DELETE FROM settings WHERE setting=?;', (setting.lower(),))
+        setting = setting.lower()
+        with self.__update_lock:
+            self.__database.write('DELETE FROM settings WHERE setting=?;', (setting,))
+            changes = self.__apply({}, [setting])
+        self.__notify(changes)
+
+    def subscribe(self, prefix, callback):
+        """
+        Subscribes to changes of all settings starting with a given prefix, also the ones made by other processes.
+        :param callback: Called with the setting and its new value (None when the setting was removed)
+        """
+        self.__subscriptions.append((prefix.lower(), callback))
+
+    def __refresh(self):
+        """ Loads the settings, picking up the changes made by other processes """
+        self.__next_refresh = time.time() + ConfigurationController.REFRESH_INTERVAL
+        with self.__update_lock:
+            stored = dict((setting, (data, json.loads(data)))
+                          for setting, data in self.__database.execute('SELECT setting, data FROM settings;'))
+            changes = self.__apply(stored, [setting for setting in self.__settings if setting not in stored])
+        self.__notify(changes)
+
+    def __apply(self, changed, removed):
+        """ Replaces the snapshot by one with the given changes, returns the settings that actually changed """
+        settings = dict(self.__settings)
+        changes = []
+        for setting, entry in changed.iteritems():
+            old_entry = settings.get(setting)
+            if old_entry is None or old_entry[0] != entry[0]:
+                changes.append((setting, entry[1]))
+            settings[setting] = entry
+        for setting in removed:
+            if settings.pop(setting, None) is not None:
+                changes.append((setting, None))
+        self.__settings = settings
+        return changes
+
+    def __notify(self, changes):
+        for setting, value in changes:
+            for prefix, callback in self.__subscriptions:
+                if setting.startswith(prefix):
+                    try:
+                        callback(setting, value)
+                    except Exception:
+                        logger.exception('Error notifying the change of setting {0}'.format(setting))
 
     def close(self):
         """ Close the database connection. """
-        self.__connection.close()
+        self.__database.close()
@@ -38,6 +38,7 @@ from platform_utils import Platform
 from serial_utils import CommunicationTimedOutException
 from gateway.observer import Observer
 from gateway.maintenance_communicator import InMaintenanceModeException
+from gateway.status_snapshot import StatusSnapshot
 from master import master_api
 from power import power_api
 from master.eeprom_controller import EepromAddress
@@ -109,6 +110,14 @@ class GatewayApi(object):
         self.__message_client = message_client
         self.__observer = observer
         self.__shutter_controller = shutter_controller
+        self.__status_snapshot = observer.get_status_snapshot()
+        self.__status_loaders = {StatusSnapshot.Keys.OUTPUTS: self.__load_output_status,
+                                 StatusSnapshot.Keys.THERMOSTATS: self.__observer.get_thermostats,
+                                 StatusSnapshot.Keys.SENSOR_TEMPERATURE: lambda: GatewayApi.__pad_sensor_values(self.__master_controller.get_sensors_temperature()),
+                                 StatusSnapshot.Keys.SENSOR_HUMIDITY: lambda: GatewayApi.__pad_sensor_values(self.__master_controller.get_sensors_humidity()),
+                                 StatusSnapshot.Keys.SENSOR_BRIGHTNESS: lambda: GatewayApi.__pad_sensor_values(self.__master_controller.get_sensors_brightness()),
+                                 StatusSnapshot.Keys.REALTIME_POWER: self.__load_realtime_power,
+                                 StatusSnapshot.Keys.TOTAL_ENERGY: self.__load_total_energy}
 
         self.__discover_mode_timer = None
 
@@ -132,6 +141,16 @@ class GatewayApi(object):
         if Platform.get_platform() == Platform.Type.CLASSIC:
             self.__master_checker_thread.start()
 
+    def get_snapshot_status(self, key, since_version=None):
+        """
+        Returns a status from the status snapshot, only querying the master or energy modules when it's outdated.
+
+        :param key: One of the StatusSnapshot.Keys
+        :param since_version: Only return the elements that changed since this version
+        :returns: Tuple (status, version, delta), see StatusSnapshot.get
+        """
+        return self.__status_snapshot.get(key, self.__status_loaders[key], since_version)
+
     def set_plugin_controller(self, plugin_controller):
         """
         Set the plugin controller.
@@ -413,6 +432,10 @@ class GatewayApi(object):
                 'version': '%d.%d.%d' % (out_dict['f1'], out_dict['f2'], out_dict['f3']),
                 'hw_version': out_dict['h']}
 
+    def get_configuration_version(self):
+        """ Returns a version of the master configuration (changes on every change), or None when unknown """
+        return self.__master_controller.get_configuration_version()
+
     def get_master_version(self):
         """ Returns the master firmware version as tuple """
         master_version = self.get_status()['version']
@@ -659,6 +682,9 @@ class GatewayApi(object):
 
         :returns: A list is a dicts containing the following keys: id, status, ctimer and dimmer.
         """
+        return self.get_snapshot_status(StatusSnapshot.Keys.OUTPUTS)[0]
+
+    def __load_output_status(self):
         outputs = self.__observer.get_outputs()
         return [{'id': output['id'],
                  'status': output['status'],
@@ -877,7 +903,7 @@ class GatewayApi(object):
         'id', 'act', 'csetp', 'output0', 'output1', 'outside', 'mode', 'name', 'sensor_nr',
         'automatic', 'setpoint'.
         """
-        return self.__observer.get_thermostats()
+        return self.get_snapshot_status(StatusSnapshot.Keys.THERMOSTATS)[0]
 
     @staticmethod
     def __check_thermostat(thermostat):
@@ -1040,21 +1066,19 @@ class GatewayApi(object):
 
     def get_sensor_temperature_status(self):
         """ Get the current temperature of all sensors. """
-        values = self.__master_controller.get_sensors_temperature()[:32]
-        if len(values) < 32:
-            values += [None] * (32 - len(values))
-        return values
+        return self.get_snapshot_status(StatusSnapshot.Keys.SENSOR_TEMPERATURE)[0]
 
     def get_sensor_humidity_status(self):
         """ Get the current humidity of all sensors. """
-        values = self.__master_controller.get_sensors_humidity()[:32]
-        if len(values) < 32:
-            values += [None] * (32 - len(values))
-        return values
+        return self.get_snapshot_status(StatusSnapshot.Keys.SENSOR_HUMIDITY)[0]
 
     def get_sensor_brightness_status(self):
         """ Get the current brightness of all sensors. """
-        values = self.__master_controller.get_sensors_brightness()[:32]
+        return self.get_snapshot_status(StatusSnapshot.Keys.SENSOR_BRIGHTNESS)[0]
+
+    @staticmethod
+    def __pad_sensor_values(values):
+        values = values[:32]
         if len(values) < 32:
             values += [None] * (32 - len(values))
         return values
@@ -1394,6 +1418,21 @@ class GatewayApi(object):
             return 0
         return self.__power_communicator.get_seconds_since_last_success()
 
+    def get_communication_statistics(self):
+        """ Get the (in-memory) serial communication statistics of the master and power bus.
+
+        :returns: dict with 'bytes_read' and 'bytes_written' per bus and the number of recent succeeded/timed out master calls.
+        """
+        master_statistics = self.__master_communicator.get_communication_statistics()
+        statistics = {'master': {'bytes_read': self.__master_communicator.get_bytes_read(),
+                                 'bytes_written': self.__master_communicator.get_bytes_written(),
+                                 'calls_succeeded': len(master_statistics['calls_succeeded']),
+                                 'calls_timedout': len(master_statistics['calls_timedout'])}}
+        if self.__power_communicator is not None:
+            statistics['power'] = {'bytes_read': self.__power_communicator.get_bytes_read(),
+                                   'bytes_written': self.__power_communicator.get_bytes_written()}
+        return statistics
+
     def master_clear_error_list(self):
         """ Clear the number of errors.
 
@@ -2205,6 +2244,9 @@ class GatewayApi(object):
         :returns: dict with the module id as key and the following array as value: \
         [voltage, frequency, current, power].
         """
+        return self.get_snapshot_status(StatusSnapshot.Keys.REALTIME_POWER)[0]
+
+    def __load_realtime_power(self):
         output = {}
         if self.__power_communicator is None or self.__power_controller is None:
             return output
@@ -2256,6 +2298,9 @@ class GatewayApi(object):
 
         :returns: dict with the module id as key and the following array as value: [day, night].
         """
+        return self.get_snapshot_status(StatusSnapshot.Keys.TOTAL_ENERGY)[0]
+
+    def __load_total_energy(self):
         output = {}
         if self.__power_communicator is None or self.__power_controller is None:
             return output
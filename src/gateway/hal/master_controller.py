@@ -86,6 +86,10 @@ class MasterController(object):
     def get_firmware_version(self):
         raise NotImplementedError()
 
+    def get_configuration_version(self):
+        """ Returns a version that changes whenever the configuration changes, or None if it can't be tracked """
+        return None
+
     # Memory (eeprom/fram)
 
     def eeprom_read_page(self, page):
@@ -106,6 +106,9 @@ class MasterClassicController(MasterController):
         out_dict = self._master_communicator.do_command(master_api.status())
         return int(out_dict['f1']), int(out_dict['f2']), int(out_dict['f3'])
 
+    def get_configuration_version(self):
+        return self._eeprom_controller.generation
+
     # Memory (eeprom/fram)
 
     def eeprom_read_page(self, page):
@@ -16,12 +16,10 @@
 Metrics caching/buffer controller
 """
 
-import time
-import sqlite3
 import logging
 import ujson as json
-from random import randint
 from ioc import Injectable, Inject, INJECTED, Singleton
+from database_utils import Database
 
 logger = logging.getLogger("openmotics")
 
@@ -31,45 +29,29 @@ logger = logging.getLogger("openmotics")
 class MetricsCacheController(object):
 
     @Inject
-    def __init__(self, metrics_db=INJECTED, metrics_db_lock=INJECTED):
+    def __init__(self, metrics_db=INJECTED):
         """
         Constructs a new MetricsCacheController.
 
         :param metrics_db: filename of the sqlite database used to store the cache/buffer
-        :param metrics_db_lock: DB lock
         """
-        self._lock = metrics_db_lock
-        self._connection = sqlite3.connect(metrics_db,
-                                           detect_types=sqlite3.PARSE_DECLTYPES,
-                                           check_same_thread=False,
-                                           isolation_level=None)
-        self._cursor = self._connection.cursor()
+        self._database = Database(metrics_db)
         self._check_tables()
 
-    def _execute(self, *args, **kwargs):
-        with self._lock:
-            return self._execute_unlocked(*args, **kwargs)
-
-    def _execute_unlocked(self, *args, **kwargs):
-        try:
-            return self._cursor.execute(*args, **kwargs)
-        except sqlite3.OperationalError:
-            time.sleep(randint(1, 20) / 10.0)
-            return self._cursor.execute(*args, **kwargs)
-
     def _check_tables(self):
         """
         Creates tables and execute migrations
         """
-        self._execute("CREATE TABLE IF NOT EXISTS counter_sources (id INTEGER PRIMARY KEY, source TEXT, type TEXT, identifier TEXT);")
-        self._execute("CREATE TABLE IF NOT EXISTS counters (id INTEGER PRIMARY KEY, source_id INTEGER , name TEXT, last_value REAL, counter REAL, timestamp INTEGER);")
-        self._execute("CREATE TABLE IF NOT EXISTS counters_buffer (id INTEGER PRIMARY KEY, source_id INTEGER, counters TEXT, timestamp INTEGER);")
+        self._database.write("CREATE TABLE IF NOT EXISTS counter_sources (id INTEGER PRIMARY KEY, source TEXT, type TEXT, identifier TEXT);")
+        self._database.write("CREATE TABLE IF NOT EXISTS counters (id INTEGER PRIMARY KEY, source_id INTEGER , name TEXT, last_value REAL, counter REAL, timestamp INTEGER);")
+        self._database.write("CREATE TABLE IF NOT EXISTS counters_buffer (id INTEGER PRIMARY KEY, source_id INTEGER, counters TEXT, timestamp INTEGER);")
 
     def process_counter(self, source, mtype, tags, name, value, timestamp):
-        with self._lock:
-            identifier = json.dumps(tags, sort_keys=True)
-            id = self._get_counter_id(source, mtype, identifier)
-            data = self._execute_unlocked("SELECT last_value, counter FROM counters WHERE source_id=? AND name=?;", (id, name))
+        identifier = json.dumps(tags, sort_keys=True)
+
+        def _process(cursor):
+            id = MetricsCacheController._get_counter_id(cursor, source, mtype, identifier)
+            data = cursor.execute("SELECT last_value, counter FROM counters WHERE source_id=? AND name=?;", (id, name)).fetchall()
             for entry in data:
                 last_value, counter = entry
                 if last_value == value:
@@ -78,28 +60,30 @@ class MetricsCacheController(object):
                     counter += (value - last_value)
                 else:
                     counter += value
-                self._execute_unlocked("UPDATE counters SET last_value=?, counter=?, timestamp=? WHERE source_id=? AND name=?;", (value, counter, timestamp, id, name))
+                cursor.execute("UPDATE counters SET last_value=?, counter=?, timestamp=? WHERE source_id=? AND name=?;", (value, counter, timestamp, id, name))
                 return counter
-            self._execute_unlocked("INSERT INTO counters (source_id, name, last_value, counter, timestamp) VALUES (?, ?, ?, ?, ?);", (id, name, value, value, timestamp))
+            cursor.execute("INSERT INTO counters (source_id, name, last_value, counter, timestamp) VALUES (?, ?, ?, ?, ?);", (id, name, value, value, timestamp))
             return value
+        return self._database.transaction(_process)
 
     def buffer_counter(self, source, mtype, tags, counters, timestamp):
-        with self._lock:
-            identifier = json.dumps(tags, sort_keys=True)
-            id = self._get_counter_id(source, mtype, identifier)
-            data = self._execute_unlocked("SELECT timestamp FROM counters_buffer WHERE source_id=? ORDER BY timestamp DESC LIMIT 1;", (id,)).fetchone()
+        identifier = json.dumps(tags, sort_keys=True)
+
+        def _buffer(cursor):
+            id = MetricsCacheController._get_counter_id(cursor, source, mtype, identifier)
+            data = cursor.execute("SELECT timestamp FROM counters_buffer WHERE source_id=? ORDER BY timestamp DESC LIMIT 1;", (id,)).fetchone()
             if data is None or MetricsCacheController._floored_timestamp(data[0]) < MetricsCacheController._floored_timestamp(timestamp):
-                self._execute_unlocked("INSERT INTO counters_buffer (source_id, counters, timestamp) VALUES (?, ?, ?);", (id, json.dumps(counters), timestamp))
+                cursor.execute("INSERT INTO counters_buffer (source_id, counters, timestamp) VALUES (?, ?, ?);", (id, json.dumps(counters), timestamp))
                 return True
             return False
+        return self._database.transaction(_buffer)
 
     @staticmethod
     def _floored_timestamp(timestamp, window=60 * 60 * 24):
         return int(timestamp) - (int(timestamp) % window)
 
     def load_buffer(self, before):
-        with self._lock:
-            buffer_items = self._execute_unlocked("SELECT source, type, identifier, counters, timestamp FROM counters_buffer INNER JOIN counter_sources ON counter_sources.id = counters_buffer.source_id;")
+        buffer_items = self._database.execute("SELECT source, type, identifier, counters, timestamp FROM counters_buffer INNER JOIN counter_sources ON counter_sources.id = counters_buffer.source_id;")
         for item in buffer_items:
             if before == -1 or before > item[4]:
                 yield {'source': item[0],
@@ -109,17 +93,16 @@ class MetricsCacheController(object):
                        'timestamp': item[4]}
 
     def clear_buffer(self, timestamp):
-        with self._lock:
-            self._execute_unlocked("DELETE FROM counters_buffer WHERE timestamp < ?;", (timestamp,))
-            return self._execute_unlocked("SELECT changes();").fetchone()[0]
+        return self._database.write("DELETE FROM counters_buffer WHERE timestamp < ?;", (timestamp,)).rowcount
 
-    def _get_counter_id(self, source, mtype, identifier):
-        data = self._execute_unlocked("SELECT id FROM counter_sources WHERE source=? AND type=? AND identifier=?;", (source, mtype, identifier)).fetchone()
+    @staticmethod
+    def _get_counter_id(cursor, source, mtype, identifier):
+        data = cursor.execute("SELECT id FROM counter_sources WHERE source=? AND type=? AND identifier=?;", (source, mtype, identifier)).fetchone()
         if data is not None:
             return data[0]
-        result = self._execute_unlocked("INSERT INTO counter_sources (source, type, identifier) VALUES (?, ?, ?);", (source, mtype, identifier))
+        result = cursor.execute("INSERT INTO counter_sources (source, type, identifier) VALUES (?, ?, ?);", (source, mtype, identifier))
         return result.lastrowid
 
     def close(self):
         """ Close the database connection. """
-        self._connection.close()
+        self._database.close()
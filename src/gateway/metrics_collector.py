@@ -16,10 +16,15 @@
 This module collects OpenMotics metrics and makes them available to the MetricsController
 """
 
+import os
 import time
+import heapq
 import logging
 import psutil
-from threading import Thread, Event
+import random
+import select
+from Queue import Queue
+from threading import Thread, Lock
 from collections import deque
 from ioc import Injectable, Inject, INJECTED, Singleton
 from serial_utils import CommunicationTimedOutException
@@ -37,12 +42,16 @@ class MetricsCollector(object):
     """
 
     @Inject
-    def __init__(self, gateway_api=INJECTED, pulse_controller=INJECTED):
+    def __init__(self, gateway_api=INJECTED, pulse_controller=INJECTED, workers=3, jitter=0.05):
         """
         :param gateway_api: Gateway API
         :type gateway_api: gateway.gateway_api.GatewayApi
         :param pulse_controller: Pulse Controller
         :type pulse_controller: gateway.pulses.PulseCounterController
+        :param workers: Amount of threads running the collectors
+        :type workers: int
+        :param jitter: Maximum random delay added to each run, as a fraction of the interval, to spread the load
+        :type jitter: float
         """
         self._start = time.time()
         self._last_service_uptime = 0
@@ -65,9 +74,27 @@ class MetricsCollector(object):
         self._plugin_intervals = {metric_type: [] for metric_type in self._min_intervals}
         self._websocket_intervals = {metric_type: {} for metric_type in self._min_intervals}
         self._cloud_intervals = {metric_type: 900 for metric_type in self._min_intervals}
-        self._sleepers = {metric_type: {'event': Event(),
-                                        'start': 0,
-                                        'end': 0} for metric_type in self._min_intervals}
+        self._emission_policies = {}
+        self._last_values = {}  # Last emitted values and timestamp per series, for metric types with an emission policy
+
+        self._workloads = {'load_configuration': self._load_environment_configurations,
+                           'system': self._run_system,
+                           'output': self._run_outputs,
+                           'sensor': self._run_sensors,
+                           'thermostat': self._run_thermostats,
+                           'error': self._run_errors,
+                           'counter': self._run_pulsecounters,
+                           'energy': self._run_power_openmotics,
+                           'energy_analytics': self._run_power_openmotics_analytics}
+        self._workers = workers
+        self._jitter = jitter
+        self._schedule = []  # Heap of (due, metric_type)
+        self._schedule_lock = Lock()
+        self._next_runs = {}  # Due time of the next run per metric type, None while running
+        self._last_runs = {}  # Start time of the last run per metric type
+        self._work_queue = Queue()
+        self._wakeup_pipe = None
+        self._scheduler_wakeup = 0
 
         self._gateway_api = gateway_api
         self._pulse_controller = pulse_controller
@@ -76,22 +103,33 @@ class MetricsCollector(object):
     def start(self):
         self._start = time.time()
         self._stopped = False
-        MetricsCollector._start_thread(self._load_environment_configurations, 'load_configuration', 900)
-        MetricsCollector._start_thread(self._run_system, 'system')
-        MetricsCollector._start_thread(self._run_outputs, 'output')
-        MetricsCollector._start_thread(self._run_sensors, 'sensor')
-        MetricsCollector._start_thread(self._run_thermostats, 'thermostat')
-        MetricsCollector._start_thread(self._run_errors, 'error')
-        MetricsCollector._start_thread(self._run_pulsecounters, 'counter')
-        MetricsCollector._start_thread(self._run_power_openmotics, 'energy')
-        MetricsCollector._start_thread(self._run_power_openmotics_analytics, 'energy_analytics')
-        thread = Thread(target=self._sleep_manager)
-        thread.setName('Metric collector - Sleep manager')
+        if self._wakeup_pipe is None:
+            self._wakeup_pipe = os.pipe()
+        with self._schedule_lock:
+            self._schedule = []
+            for metric_type in self._workloads:
+                delay = 0
+                if metric_type in self._min_intervals:
+                    # Spread the first runs, but make sure they all happen soon
+                    delay = random.uniform(0, self._jitter * self._min_intervals[metric_type])
+                self._last_runs[metric_type] = self._start
+                self._schedule_run(metric_type, self._start + delay)
+        for i in xrange(self._workers):
+            thread = Thread(target=self._work)
+            thread.setName('Metric collector - Worker {0}'.format(i))
+            thread.daemon = True
+            thread.start()
+        thread = Thread(target=self._run_scheduler)
+        thread.setName('Metric collector - Scheduler')
         thread.daemon = True
         thread.start()
 
     def stop(self):
         self._stopped = True
+        for _ in xrange(self._workers):
+            self._work_queue.put(None)
+        if self._wakeup_pipe is not None:
+            os.write(self._wakeup_pipe[1], 'x')
 
     def collect_metrics(self):
         # Yield all metrics in the Queue
@@ -147,6 +185,59 @@ class MetricsCollector(object):
         self.intervals[metric_type] = interval
         self.maybe_wake_earlier(metric_type, interval)
 
+    def set_emission_policy(self, metric_type, mode='always', deadband=0, heartbeat=900):
+        """
+        Configures when metrics of a given type are emitted:
+        * always: Every time they are collected
+        * change: Only when one of the values changed
+        * deadband: Only when one of the numeric values changed more than `deadband`, or a non-numeric value changed
+        Unless `mode` is `always`, an unchanged series is still emitted at least every `heartbeat` seconds.
+        """
+        if metric_type not in self._min_intervals:  # e.g. event metric types, which aren't collected
+            raise ValueError('Unknown metric type: {0}'.format(metric_type))
+        if mode not in ['always', 'change', 'deadband']:
+            raise ValueError('Unknown emission policy mode: {0}'.format(mode))
+        deadband, heartbeat = float(deadband), float(heartbeat)
+        if mode == 'always':
+            self._emission_policies.pop(metric_type, None)
+        else:
+            self._emission_policies[metric_type] = {'deadband': deadband if mode == 'deadband' else 0,
+                                                    'heartbeat': heartbeat}
+        for key in self._last_values.keys():
+            if key[0] == metric_type:
+                self._last_values.pop(key, None)
+
+    def _should_emit(self, metric_type, values, tags, timestamp):
+        policy = self._emission_policies.get(metric_type)
+        if policy is None:
+            return True
+        key = (metric_type, tuple(sorted(tags.iteritems())))
+        last = self._last_values.get(key)
+        if last is not None and timestamp < last[1] + policy['heartbeat']:
+            last_values = last[0]
+            if len(last_values) == len(values):
+                deadband = policy['deadband']
+                changed = False
+                for name, value in values.iteritems():
+                    if name not in last_values:
+                        changed = True
+                    elif deadband > 0 and MetricsCollector._is_number(value):
+                        # A value that (was) None or not numeric counts as a change
+                        last_value = last_values[name]
+                        changed = not MetricsCollector._is_number(last_value) or abs(value - last_value) > deadband
+                    else:
+                        changed = value != last_values[name]
+                    if changed:
+                        break
+                if not changed:
+                    return False
+        self._last_values[key] = (dict(values), timestamp)
+        return True
+
+    @staticmethod
+    def _is_number(value):
+        return isinstance(value, (int, long, float)) and not isinstance(value, bool)
+
     def _enqueue_metrics(self, metric_type, values, tags, timestamp):
         """
         metric_type = 'system'
@@ -154,6 +245,8 @@ class MetricsCollector(object):
         tags = {'name': 'gateway'}
         timestamp = 12346789
         """
+        if not self._should_emit(metric_type, values, tags, timestamp):
+            return
         self._metrics_queue.appendleft({'source': 'OpenMotics',
                                         'type': metric_type,
                                         'timestamp': timestamp,
@@ -161,42 +254,72 @@ class MetricsCollector(object):
                                         'values': values})
 
     def maybe_wake_earlier(self, metric_type, duration):
-        if metric_type in self._sleepers:
-            current_end = self._sleepers[metric_type]['end']
-            new_end = self._sleepers[metric_type]['start'] + duration
-            self._sleepers[metric_type]['end'] = min(current_end, new_end)
+        with self._schedule_lock:
+            next_run = self._next_runs.get(metric_type)
+            if next_run is None:
+                return  # Not scheduled (yet), or currently running
+            new_run = self._last_runs[metric_type] + duration
+            if new_run < next_run:
+                self._schedule_run(metric_type, new_run)
 
-    def _sleep_manager(self):
-        while True:
-            for sleep_data in self._sleepers.itervalues():
-                if not sleep_data['event'].is_set() and sleep_data['end'] < time.time():
-                    sleep_data['event'].set()
-            time.sleep(0.1)
+    def _get_interval(self, metric_type):
+        if metric_type == 'load_configuration':
+            return 900
+        return self.intervals[metric_type]
 
-    @staticmethod
-    def _start_thread(workload, name, interval=None):
-        args = [name]
-        if interval is not None:
-            args.append(interval)
-        thread = Thread(target=workload, args=args)
-        thread.setName('Metric collector ({0})'.format(name))
-        thread.daemon = True
-        thread.start()
-        return thread
+    def _get_jitter(self, metric_type):
+        if self._jitter <= 0:
+            return 0
+        return random.uniform(0, self._jitter * self._get_interval(metric_type))
 
-    def _pause(self, start, metric_type, interval=None):
-        if interval is None:
-            interval = self.intervals[metric_type]
-        if metric_type in self._sleepers:
-            sleep_data = self._sleepers[metric_type]
-            sleep_data['start'] = start
-            sleep_data['end'] = start + interval
-            sleep_data['event'].clear()
-            sleep_data['event'].wait()
-        else:
-            elapsed = time.time() - start
-            sleep = max(0.1, interval - elapsed)
-            time.sleep(sleep)
+    def _schedule_run(self, metric_type, due):
+        """ Schedules the next run of a collector. Must be called while holding the schedule lock. """
+        self._next_runs[metric_type] = due
+        heapq.heappush(self._schedule, (due, metric_type))
+        if due < self._scheduler_wakeup and self._wakeup_pipe is not None:
+            self._scheduler_wakeup = due
+            os.write(self._wakeup_pipe[1], 'x')
+
+    def _dispatch_due_runs(self, now):
+        """
+        Hands all collectors that are due to the workers. Entries that were rescheduled in the meantime are skipped.
+        :returns: The time until the next collector is due, or None if nothing is scheduled
+        """
+        with self._schedule_lock:
+            while self._schedule and self._schedule[0][0] <= now:
+                due, metric_type = heapq.heappop(self._schedule)
+                if self._next_runs.get(metric_type) != due:
+                    continue  # Stale entry
+                self._next_runs[metric_type] = None
+                self._work_queue.put(metric_type)
+            if not self._schedule:
+                self._scheduler_wakeup = float('inf')
+                return None
+            self._scheduler_wakeup = self._schedule[0][0]
+            return self._schedule[0][0] - now
+
+    def _run_scheduler(self):
+        wakeup_read = self._wakeup_pipe[0]
+        while not self._stopped:
+            wait = self._dispatch_due_runs(time.time())
+            # Sleeps until the next collector is due, or until a collector is scheduled earlier
+            readable, _, _ = select.select([wakeup_read], [], [], wait)
+            if readable:
+                os.read(wakeup_read, 4096)
+
+    def _work(self):
+        while not self._stopped:
+            metric_type = self._work_queue.get()
+            if metric_type is None:
+                return
+            start = time.time()
+            try:
+                self._workloads[metric_type](metric_type)
+            except Exception as ex:
+                logger.exception('Error running collector {0}: {1}'.format(metric_type, ex))
+            with self._schedule_lock:
+                self._last_runs[metric_type] = start
+                self._schedule_run(metric_type, start + self._get_interval(metric_type) + self._get_jitter(metric_type))
 
     def process_observer_event(self, event):
         if event.type == ObserverEvent.Types.OUTPUT_CHANGE:
@@ -257,523 +380,478 @@ class MetricsCollector(object):
             logger.exception('Error processing input: {0}'.format(ex))
 
     def _run_system(self, metric_type):
-        while not self._stopped:
-            start = time.time()
-            now = time.time()
-            try:
-                values = {}
-                with open('/proc/uptime', 'r') as f:
-                    system_uptime = float(f.readline().split()[0])
-                service_uptime = time.time() - self._start
-                if service_uptime > self._last_service_uptime + 3600:
-                    self._start = time.time()
-                    service_uptime = 0
-                self._last_service_uptime = service_uptime
+        now = time.time()
+        try:
+            values = {}
+            with open('/proc/uptime', 'r') as f:
+                system_uptime = float(f.readline().split()[0])
+            service_uptime = time.time() - self._start
+            if service_uptime > self._last_service_uptime + 3600:
+                self._start = time.time()
+                service_uptime = 0
+            self._last_service_uptime = service_uptime
 
-                values['service_uptime'] = float(service_uptime)
-                values['system_uptime'] = float(system_uptime)
+            values['service_uptime'] = float(service_uptime)
+            values['system_uptime'] = float(system_uptime)
 
-                try:
-                    values['cpu_percent'] = float(psutil.cpu_percent())
-                    cpu_load = [x / psutil.cpu_count() * 100 for x in psutil.getloadavg()]
-                    values['cpu_load_1'] = float(cpu_load[0])
-                    values['cpu_load_5'] = float(cpu_load[1])
-                    values['cpu_load_15'] = float(cpu_load[2])
-                except Exception as ex:
-                    logger.error('Error loading cpu metrics: {0}'.format(ex))
+            try:
+                values['cpu_percent'] = float(psutil.cpu_percent())
+                cpu_load = [x / psutil.cpu_count() * 100 for x in psutil.getloadavg()]
+                values['cpu_load_1'] = float(cpu_load[0])
+                values['cpu_load_5'] = float(cpu_load[1])
+                values['cpu_load_15'] = float(cpu_load[2])
+            except Exception as ex:
+                logger.error('Error loading cpu metrics: {0}'.format(ex))
 
-                try:
-                    memory = dict(psutil.virtual_memory()._asdict())
-                    for reading in ['available', 'used', 'percent', 'free', 'inactive', 'shared', 'active', 'total']:
-                        try:
-                            key = 'memory_{0}'.format(reading)
-                            value = memory[reading]
-                            values[key] = int(value) if reading != 'percent' else float(value)
-                        except Exception as ex:
-                            logger.error('error loading memory metric: {0}'.format(ex))
-                except Exception as ex:
-                    logger.error('Error loading memory metrics: {0}'.format(ex))
+            try:
+                memory = dict(psutil.virtual_memory()._asdict())
+                for reading in ['available', 'used', 'percent', 'free', 'inactive', 'shared', 'active', 'total']:
+                    try:
+                        key = 'memory_{0}'.format(reading)
+                        value = memory[reading]
+                        values[key] = int(value) if reading != 'percent' else float(value)
+                    except Exception as ex:
+                        logger.error('error loading memory metric: {0}'.format(ex))
+            except Exception as ex:
+                logger.error('Error loading memory metrics: {0}'.format(ex))
 
-                try:
-                    disk = dict(psutil.disk_usage('/')._asdict())
-                    for reading in ['total', 'used', 'percent', 'free']:
-                        try:
-                            key = 'disk_{0}'.format(reading)
-                            value = disk[reading]
-                            values[key] = int(value) if reading != 'percent' else float(value)
-                        except Exception as ex:
-                            logger.error('Error loading disk metric: {0}'.format(ex))
+            try:
+                disk = dict(psutil.disk_usage('/')._asdict())
+                for reading in ['total', 'used', 'percent', 'free']:
+                    try:
+                        key = 'disk_{0}'.format(reading)
+                        value = disk[reading]
+                        values[key] = int(value) if reading != 'percent' else float(value)
+                    except Exception as ex:
+                        logger.error('Error loading disk metric: {0}'.format(ex))
 
-                    disk_io = dict(psutil.disk_io_counters()._asdict())
-                    for reading in ['read_count', 'write_count', 'read_bytes', 'write_bytes']:
-                        try:
-                            key = 'disk_{0}'.format(reading)
-                            value = disk_io[reading]
-                            values[key] = int(value)
-                        except Exception as ex:
-                            logger.error('Error loading disk io metric: {0}'.format(ex))
-                except Exception as ex:
-                    logger.error('Error loading disk metrics: {0}'.format(ex))
+                disk_io = dict(psutil.disk_io_counters()._asdict())
+                for reading in ['read_count', 'write_count', 'read_bytes', 'write_bytes']:
+                    try:
+                        key = 'disk_{0}'.format(reading)
+                        value = disk_io[reading]
+                        values[key] = int(value)
+                    except Exception as ex:
+                        logger.error('Error loading disk io metric: {0}'.format(ex))
+            except Exception as ex:
+                logger.error('Error loading disk metrics: {0}'.format(ex))
 
-                try:
-                    network = dict(psutil.net_io_counters()._asdict())
-                    for reading in ['bytes_sent', 'bytes_recv', 'packets_sent', 'packets_recv']:
-                        try:
-                            key = 'net_{0}'.format(reading)
-                            value = network[reading]
-                            values[key] = int(value)
-                        except Exception as ex:
-                            logger.error('Error loading network metric: {0}'.format(ex))
-                except Exception as ex:
-                    logger.error('Error loading network metrics: {0}'.format(ex))
+            try:
+                network = dict(psutil.net_io_counters()._asdict())
+                for reading in ['bytes_sent', 'bytes_recv', 'packets_sent', 'packets_recv']:
+                    try:
+                        key = 'net_{0}'.format(reading)
+                        value = network[reading]
+                        values[key] = int(value)
+                    except Exception as ex:
+                        logger.error('Error loading network metric: {0}'.format(ex))
+            except Exception as ex:
+                logger.error('Error loading network metrics: {0}'.format(ex))
 
+            self._enqueue_metrics(metric_type=metric_type,
+                                  values=values,
+                                  tags={'name': 'gateway',
+                                        'section': 'main'},
+                                  timestamp=now)
+        except Exception as ex:
+            logger.exception('Error sending system data: {0}'.format(ex))
+        if self._metrics_controller is not None:
+            try:
                 self._enqueue_metrics(metric_type=metric_type,
-                                      values=values,
                                       tags={'name': 'gateway',
-                                            'section': 'main'},
+                                            'section': 'plugins'},
+                                      values={'queue_length': len(self._metrics_controller.metrics_queue_plugins)},
                                       timestamp=now)
-            except Exception as ex:
-                logger.exception('Error sending system data: {0}'.format(ex))
-            if self._metrics_controller is not None:
-                try:
+                self._enqueue_metrics(metric_type=metric_type,
+                                      tags={'name': 'gateway',
+                                            'section': 'openmotics'},
+                                      values={'queue_length': len(self._metrics_controller.metrics_queue_openmotics)},
+                                      timestamp=now)
+                self._enqueue_metrics(metric_type=metric_type,
+                                      tags={'name': 'gateway',
+                                            'section': 'cloud'},
+                                      values={'cloud_queue_length': self._metrics_controller.cloud_stats['queue'],
+                                              'cloud_buffer_length': self._metrics_controller.cloud_stats['buffer'],
+                                              'cloud_time_ago_send': self._metrics_controller.cloud_stats['time_ago_send'],
+                                              'cloud_time_ago_try': self._metrics_controller.cloud_stats['time_ago_try']},
+                                      timestamp=now)
+                for plugin in self._plugin_controller.get_plugins():
                     self._enqueue_metrics(metric_type=metric_type,
                                           tags={'name': 'gateway',
-                                                'section': 'plugins'},
-                                          values={'queue_length': len(self._metrics_controller.metrics_queue_plugins)},
+                                                'section': plugin.name},
+                                          values={'queue_length': plugin.get_queue_length()},
                                           timestamp=now)
+                for key in set(self._metrics_controller.inbound_rates.keys()) | set(self._metrics_controller.outbound_rates.keys()):
                     self._enqueue_metrics(metric_type=metric_type,
                                           tags={'name': 'gateway',
-                                                'section': 'openmotics'},
-                                          values={'queue_length': len(self._metrics_controller.metrics_queue_openmotics)},
+                                                'section': key},
+                                          values={'metrics_in': self._metrics_controller.inbound_rates.get(key, 0),
+                                                  'metrics_out': self._metrics_controller.outbound_rates.get(key, 0)},
                                           timestamp=now)
+                for mtype in self.intervals:
                     self._enqueue_metrics(metric_type=metric_type,
                                           tags={'name': 'gateway',
-                                                'section': 'cloud'},
-                                          values={'cloud_queue_length': self._metrics_controller.cloud_stats['queue'],
-                                                  'cloud_buffer_length': self._metrics_controller.cloud_stats['buffer'],
-                                                  'cloud_time_ago_send': self._metrics_controller.cloud_stats['time_ago_send'],
-                                                  'cloud_time_ago_try': self._metrics_controller.cloud_stats['time_ago_try']},
+                                                'section': mtype},
+                                          values={'metric_interval': self.intervals[mtype]},
                                           timestamp=now)
-                    for plugin in self._plugin_controller.get_plugins():
-                        self._enqueue_metrics(metric_type=metric_type,
-                                              tags={'name': 'gateway',
-                                                    'section': plugin.name},
-                                              values={'queue_length': plugin.get_queue_length()},
-                                              timestamp=now)
-                    for key in set(self._metrics_controller.inbound_rates.keys()) | set(self._metrics_controller.outbound_rates.keys()):
-                        self._enqueue_metrics(metric_type=metric_type,
-                                              tags={'name': 'gateway',
-                                                    'section': key},
-                                              values={'metrics_in': self._metrics_controller.inbound_rates.get(key, 0),
-                                                      'metrics_out': self._metrics_controller.outbound_rates.get(key, 0)},
-                                              timestamp=now)
-                    for mtype in self.intervals:
-                        self._enqueue_metrics(metric_type=metric_type,
-                                              tags={'name': 'gateway',
-                                                    'section': mtype},
-                                              values={'metric_interval': self.intervals[mtype]},
-                                              timestamp=now)
-                except Exception as ex:
-                    logger.error('Could not collect metric metrics: {0}'.format(ex))
-            if self._stopped:
-                return
-            self._pause(start, metric_type)
+            except Exception as ex:
+                logger.error('Could not collect metric metrics: {0}'.format(ex))
 
     def _run_outputs(self, metric_type):
-        while not self._stopped:
-            start = time.time()
-            try:
-                result = self._gateway_api.get_output_status()
-                for output in result:
-                    output_id = output['id']
-                    if output_id not in self._environment['outputs']:
-                        continue
-                    self._environment['outputs'][output_id]['status'] = output['status']
-                    self._environment['outputs'][output_id]['dimmer'] = output['dimmer']
-            except CommunicationTimedOutException:
-                logger.error('Error getting output status: CommunicationTimedOutException')
-            except InMaintenanceModeException:
-                logger.info('Error getting output status: InMaintenanceModeException')
-            except Exception as ex:
-                logger.exception('Error getting output status: {0}'.format(ex))
-            self._process_outputs(self._environment['outputs'].keys(), metric_type)
-            if self._stopped:
-                return
-            self._pause(start, metric_type)
+        try:
+            result = self._gateway_api.get_output_status()
+            for output in result:
+                output_id = output['id']
+                if output_id not in self._environment['outputs']:
+                    continue
+                self._environment['outputs'][output_id]['status'] = output['status']
+                self._environment['outputs'][output_id]['dimmer'] = output['dimmer']
+        except CommunicationTimedOutException:
+            logger.error('Error getting output status: CommunicationTimedOutException')
+        except InMaintenanceModeException:
+            logger.info('Error getting output status: InMaintenanceModeException')
+        except Exception as ex:
+            logger.exception('Error getting output status: {0}'.format(ex))
+        self._process_outputs(self._environment['outputs'].keys(), metric_type)
 
     def _run_sensors(self, metric_type):
-        while not self._stopped:
-            start = time.time()
-            try:
-                now = time.time()
-                temperatures = self._gateway_api.get_sensor_temperature_status()
-                humidities = self._gateway_api.get_sensor_humidity_status()
-                brightnesses = self._gateway_api.get_sensor_brightness_status()
-                for sensor_id, sensor in self._environment['sensors'].iteritems():
-                    name = sensor['name']
-                    if name == '' or name == 'NOT_IN_USE':
-                        continue
-                    tags = {'id': sensor_id,
-                            'name': name}
-                    values = {}
-                    if temperatures[sensor_id] is not None:
-                        values['temp'] = temperatures[sensor_id]
-                    if humidities[sensor_id] is not None:
-                        values['hum'] = humidities[sensor_id]
-                    if brightnesses[sensor_id] is not None:
-                        values['bright'] = brightnesses[sensor_id]
-                    if len(values) == 0:
-                        continue
-                    self._enqueue_metrics(metric_type=metric_type,
-                                          values=values,
-                                          tags=tags,
-                                          timestamp=now)
-            except CommunicationTimedOutException:
-                logger.error('Error getting sensor status: CommunicationTimedOutException')
-            except InMaintenanceModeException:
-                logger.info('Error getting sensor status: InMaintenanceModeException')
-            except Exception as ex:
-                logger.exception('Error getting sensor status: {0}'.format(ex))
-            if self._stopped:
-                return
-            self._pause(start, metric_type)
+        try:
+            now = time.time()
+            temperatures = self._gateway_api.get_sensor_temperature_status()
+            humidities = self._gateway_api.get_sensor_humidity_status()
+            brightnesses = self._gateway_api.get_sensor_brightness_status()
+            for sensor_id, sensor in self._environment['sensors'].iteritems():
+                name = sensor['name']
+                if name == '' or name == 'NOT_IN_USE':
+                    continue
+                tags = {'id': sensor_id,
+                        'name': name}
+                values = {}
+                if temperatures[sensor_id] is not None:
+                    values['temp'] = temperatures[sensor_id]
+                if humidities[sensor_id] is not None:
+                    values['hum'] = humidities[sensor_id]
+                if brightnesses[sensor_id] is not None:
+                    values['bright'] = brightnesses[sensor_id]
+                if len(values) == 0:
+                    continue
+                self._enqueue_metrics(metric_type=metric_type,
+                                      values=values,
+                                      tags=tags,
+                                      timestamp=now)
+        except CommunicationTimedOutException:
+            logger.error('Error getting sensor status: CommunicationTimedOutException')
+        except InMaintenanceModeException:
+            logger.info('Error getting sensor status: InMaintenanceModeException')
+        except Exception as ex:
+            logger.exception('Error getting sensor status: {0}'.format(ex))
 
     def _run_thermostats(self, metric_type):
-        while not self._stopped:
-            start = time.time()
-            try:
-                now = time.time()
-                thermostats = self._gateway_api.get_thermostat_status()
+        try:
+            now = time.time()
+            thermostats = self._gateway_api.get_thermostat_status()
+            self._enqueue_metrics(metric_type=metric_type,
+                                  values={'on': thermostats['thermostats_on'],
+                                          'cooling': thermostats['cooling']},
+                                  tags={'id': 'G.0',
+                                        'name': 'Global configuration'},
+                                  timestamp=now)
+            for thermostat in thermostats['status']:
+                values = {'setpoint': int(thermostat['setpoint']),
+                          'output0': float(thermostat['output0']),
+                          'output1': float(thermostat['output1']),
+                          'mode': int(thermostat['mode']),
+                          'type': 'tbs' if thermostat['sensor_nr'] == 240 else 'normal',
+                          'automatic': thermostat['automatic'],
+                          'current_setpoint': thermostat['csetp']}
+                if thermostat['outside'] is not None:
+                    values['outside'] = thermostat['outside']
+                if thermostat['sensor_nr'] != 240 and thermostat['act'] is not None:
+                    values['temperature'] = thermostat['act']
                 self._enqueue_metrics(metric_type=metric_type,
-                                      values={'on': thermostats['thermostats_on'],
-                                              'cooling': thermostats['cooling']},
-                                      tags={'id': 'G.0',
-                                            'name': 'Global configuration'},
+                                      values=values,
+                                      tags={'id': '{0}.{1}'.format('C' if thermostats['cooling'] is True else 'H',
+                                                                   thermostat['id']),
+                                            'name': thermostat['name']},
                                       timestamp=now)
-                for thermostat in thermostats['status']:
-                    values = {'setpoint': int(thermostat['setpoint']),
-                              'output0': float(thermostat['output0']),
-                              'output1': float(thermostat['output1']),
-                              'mode': int(thermostat['mode']),
-                              'type': 'tbs' if thermostat['sensor_nr'] == 240 else 'normal',
-                              'automatic': thermostat['automatic'],
-                              'current_setpoint': thermostat['csetp']}
-                    if thermostat['outside'] is not None:
-                        values['outside'] = thermostat['outside']
-                    if thermostat['sensor_nr'] != 240 and thermostat['act'] is not None:
-                        values['temperature'] = thermostat['act']
-                    self._enqueue_metrics(metric_type=metric_type,
-                                          values=values,
-                                          tags={'id': '{0}.{1}'.format('C' if thermostats['cooling'] is True else 'H',
-                                                                       thermostat['id']),
-                                                'name': thermostat['name']},
-                                          timestamp=now)
-            except CommunicationTimedOutException:
-                logger.error('Error getting thermostat status: CommunicationTimedOutException')
-            except InMaintenanceModeException:
-                logger.info('Error getting thermostat status: InMaintenanceModeException')
-            except Exception as ex:
-                logger.exception('Error getting thermostat status: {0}'.format(ex))
-            if self._stopped:
-                return
-            self._pause(start, metric_type)
+        except CommunicationTimedOutException:
+            logger.error('Error getting thermostat status: CommunicationTimedOutException')
+        except InMaintenanceModeException:
+            logger.info('Error getting thermostat status: InMaintenanceModeException')
+        except Exception as ex:
+            logger.exception('Error getting thermostat status: {0}'.format(ex))
 
     def _run_errors(self, metric_type):
-        while not self._stopped:
-            start = time.time()
-            try:
-                now = time.time()
-                errors = self._gateway_api.master_error_list()
-                for error in errors:
-                    om_module = error[0]
-                    count = error[1]
-                    types = {'i': 'Input',
-                             'I': 'Input',
-                             't': 'Temperature',
-                             'T': 'Temperature',
-                             'o': 'Output',
-                             'O': 'Output',
-                             'd': 'Dimmer',
-                             'D': 'Dimmer',
-                             'R': 'Shutter',
-                             'C': 'CAN',
-                             'L': 'OLED'}
-                    self._enqueue_metrics(metric_type=metric_type,
-                                          values={'value': int(count)},
-                                          tags={'type': types[om_module[0]],
-                                                'id': om_module,
-                                                'name': '{0} {1}'.format(types[om_module[0]], om_module)},
-                                          timestamp=now)
-            except CommunicationTimedOutException:
-                logger.error('Error getting module errors: CommunicationTimedOutException')
-            except InMaintenanceModeException:
-                logger.info('Error getting module errors: InMaintenanceModeException')
-            except Exception as ex:
-                logger.exception('Error getting module errors: {0}'.format(ex))
-            if self._stopped:
-                return
-            self._pause(start, metric_type)
+        try:
+            now = time.time()
+            errors = self._gateway_api.master_error_list()
+            for error in errors:
+                om_module = error[0]
+                count = error[1]
+                types = {'i': 'Input',
+                         'I': 'Input',
+                         't': 'Temperature',
+                         'T': 'Temperature',
+                         'o': 'Output',
+                         'O': 'Output',
+                         'd': 'Dimmer',
+                         'D': 'Dimmer',
+                         'R': 'Shutter',
+                         'C': 'CAN',
+                         'L': 'OLED'}
+                self._enqueue_metrics(metric_type=metric_type,
+                                      values={'value': int(count)},
+                                      tags={'type': types[om_module[0]],
+                                            'id': om_module,
+                                            'name': '{0} {1}'.format(types[om_module[0]], om_module)},
+                                      timestamp=now)
+        except CommunicationTimedOutException:
+            logger.error('Error getting module errors: CommunicationTimedOutException')
+        except InMaintenanceModeException:
+            logger.info('Error getting module errors: InMaintenanceModeException')
+        except Exception as ex:
+            logger.exception('Error getting module errors: {0}'.format(ex))
 
     def _run_pulsecounters(self, metric_type):
-        while not self._stopped:
-            start = time.time()
-            now = time.time()
-            counters_data = {}
-            try:
-                for counter_id, counter in self._environment['pulse_counters'].iteritems():
-                    counters_data[counter_id] = {'name': counter['name'],
-                                                 'input': counter['input']}
-                result = self._gateway_api.get_pulse_counter_status()
-                counters = result
-                for counter_id in counters_data:
-                    if len(counters) > counter_id:
-                        counters_data[counter_id]['count'] = counters[counter_id]
-                for counter_id in counters_data:
-                    counter = counters_data[counter_id]
-                    if counter['name'] != '' and counter['count'] is not None:
-                        self._enqueue_metrics(metric_type=metric_type,
-                                              values={'value': int(counter['count'])},
-                                              tags={'name': counter['name'],
-                                                    'input': counter['input'],
-                                                    'id': 'P{0}'.format(counter_id)},
-                                              timestamp=now)
-            except CommunicationTimedOutException:
-                logger.error('Error getting pulse counter status: CommunicationTimedOutException')
-            except InMaintenanceModeException:
-                logger.info('Error getting pulse counter status: InMaintenanceModeException')
-            except Exception as ex:
-                logger.exception('Error getting pulse counter status: {0}'.format(ex))
-            if self._stopped:
-                return
-            self._pause(start, metric_type)
+        now = time.time()
+        counters_data = {}
+        try:
+            for counter_id, counter in self._environment['pulse_counters'].iteritems():
+                counters_data[counter_id] = {'name': counter['name'],
+                                             'input': counter['input']}
+            result = self._gateway_api.get_pulse_counter_status()
+            counters = result
+            for counter_id in counters_data:
+                if len(counters) > counter_id:
+                    counters_data[counter_id]['count'] = counters[counter_id]
+            for counter_id in counters_data:
+                counter = counters_data[counter_id]
+                if counter['name'] != '' and counter['count'] is not None:
+                    self._enqueue_metrics(metric_type=metric_type,
+                                          values={'value': int(counter['count'])},
+                                          tags={'name': counter['name'],
+                                                'input': counter['input'],
+                                                'id': 'P{0}'.format(counter_id)},
+                                          timestamp=now)
+        except CommunicationTimedOutException:
+            logger.error('Error getting pulse counter status: CommunicationTimedOutException')
+        except InMaintenanceModeException:
+            logger.info('Error getting pulse counter status: InMaintenanceModeException')
+        except Exception as ex:
+            logger.exception('Error getting pulse counter status: {0}'.format(ex))
 
     def _run_power_openmotics(self, metric_type):
-        while not self._stopped:
-            start = time.time()
-            now = time.time()
-            mapping = {}
-            power_data = {}
-            try:
-                result = self._gateway_api.get_power_modules()
-                for power_module in result:
-                    device_id = '{0}.{{0}}'.format(power_module['address'])
-                    mapping[str(power_module['id'])] = device_id
-                    if power_module['version'] in [8, 12]:
-                        for i in xrange(power_module['version']):
-                            power_data[device_id.format(i)] = {'name': power_module['input{0}'.format(i)]}
-            except CommunicationTimedOutException:
-                logger.error('Error getting power modules: CommunicationTimedOutException')
-            except InMaintenanceModeException:
-                logger.info('Error getting power modules: InMaintenanceModeException')
-            except Exception as ex:
-                logger.exception('Error getting power modules: {0}'.format(ex))
-            try:
-                result = self._gateway_api.get_realtime_power()
-                for module_id, device_id in mapping.iteritems():
-                    if module_id in result:
-                        for index, entry in enumerate(result[module_id]):
-                            if device_id.format(index) in power_data:
-                                usage = power_data[device_id.format(index)]
-                                usage.update({'voltage': entry[0],
-                                              'frequency': entry[1],
-                                              'current': entry[2],
-                                              'power': entry[3]})
-            except CommunicationTimedOutException:
-                logger.error('Error getting realtime power: CommunicationTimedOutException')
-            except InMaintenanceModeException:
-                logger.info('Error getting realtime power: InMaintenanceModeException')
-            except Exception as ex:
-                logger.exception('Error getting realtime power: {0}'.format(ex))
+        now = time.time()
+        mapping = {}
+        power_data = {}
+        try:
+            result = self._gateway_api.get_power_modules()
+            for power_module in result:
+                device_id = '{0}.{{0}}'.format(power_module['address'])
+                mapping[str(power_module['id'])] = device_id
+                if power_module['version'] in [8, 12]:
+                    for i in xrange(power_module['version']):
+                        power_data[device_id.format(i)] = {'name': power_module['input{0}'.format(i)]}
+        except CommunicationTimedOutException:
+            logger.error('Error getting power modules: CommunicationTimedOutException')
+        except InMaintenanceModeException:
+            logger.info('Error getting power modules: InMaintenanceModeException')
+        except Exception as ex:
+            logger.exception('Error getting power modules: {0}'.format(ex))
+        try:
+            result = self._gateway_api.get_realtime_power()
+            for module_id, device_id in mapping.iteritems():
+                if module_id in result:
+                    for index, entry in enumerate(result[module_id]):
+                        if device_id.format(index) in power_data:
+                            usage = power_data[device_id.format(index)]
+                            usage.update({'voltage': entry[0],
+                                          'frequency': entry[1],
+                                          'current': entry[2],
+                                          'power': entry[3]})
+        except CommunicationTimedOutException:
+            logger.error('Error getting realtime power: CommunicationTimedOutException')
+        except InMaintenanceModeException:
+            logger.info('Error getting realtime power: InMaintenanceModeException')
+        except Exception as ex:
+            logger.exception('Error getting realtime power: {0}'.format(ex))
+        try:
+            result = self._gateway_api.get_total_energy()
+            for module_id, device_id in mapping.iteritems():
+                if module_id in result:
+                    for index, entry in enumerate(result[module_id]):
+                        if device_id.format(index) in power_data:
+                            usage = power_data[device_id.format(index)]
+                            usage.update({'counter': entry[0] + entry[1],
+                                          'counter_day': entry[0],
+                                          'counter_night': entry[1]})
+        except CommunicationTimedOutException:
+            logger.error('Error getting total energy: CommunicationTimedOutException')
+        except InMaintenanceModeException:
+            logger.info('Error getting total energy: InMaintenanceModeException')
+        except Exception as ex:
+            logger.exception('Error getting total energy: {0}'.format(ex))
+        for device_id in power_data:
+            device = power_data[device_id]
             try:
-                result = self._gateway_api.get_total_energy()
-                for module_id, device_id in mapping.iteritems():
-                    if module_id in result:
-                        for index, entry in enumerate(result[module_id]):
-                            if device_id.format(index) in power_data:
-                                usage = power_data[device_id.format(index)]
-                                usage.update({'counter': entry[0] + entry[1],
-                                              'counter_day': entry[0],
-                                              'counter_night': entry[1]})
-            except CommunicationTimedOutException:
-                logger.error('Error getting total energy: CommunicationTimedOutException')
-            except InMaintenanceModeException:
-                logger.info('Error getting total energy: InMaintenanceModeException')
+                if device['name'] != '' and 'voltage' in device and 'counter' in device:
+                    self._enqueue_metrics(metric_type=metric_type,
+                                          values={'voltage': device['voltage'],
+                                                  'current': device['current'],
+                                                  'frequency': device['frequency'],
+                                                  'power': device['power'],
+                                                  'counter': float(device['counter']),
+                                                  'counter_day': float(device['counter_day']),
+                                                  'counter_night': float(device['counter_night'])},
+                                          tags={'type': 'openmotics',
+                                                'id': device_id,
+                                                'name': device['name']},
+                                          timestamp=now)
             except Exception as ex:
-                logger.exception('Error getting total energy: {0}'.format(ex))
-            for device_id in power_data:
-                device = power_data[device_id]
-                try:
-                    if device['name'] != '' and 'voltage' in device and 'counter' in device:
-                        self._enqueue_metrics(metric_type=metric_type,
-                                              values={'voltage': device['voltage'],
-                                                      'current': device['current'],
-                                                      'frequency': device['frequency'],
-                                                      'power': device['power'],
-                                                      'counter': float(device['counter']),
-                                                      'counter_day': float(device['counter_day']),
-                                                      'counter_night': float(device['counter_night'])},
-                                              tags={'type': 'openmotics',
-                                                    'id': device_id,
-                                                    'name': device['name']},
-                                              timestamp=now)
-                except Exception as ex:
-                    logger.exception('Error processing OpenMotics power device {0}: {1}'.format(device_id, ex))
-            if self._stopped:
-                return
-            self._pause(start, metric_type)
+                logger.exception('Error processing OpenMotics power device {0}: {1}'.format(device_id, ex))
 
     def _run_power_openmotics_analytics(self, metric_type):
-        while not self._stopped:
-            start = time.time()
-            try:
-                now = time.time()
-                result = self._gateway_api.get_power_modules()
-                for power_module in result:
-                    device_id = '{0}.{{0}}'.format(power_module['address'])
-                    if power_module['version'] != 12:
+        try:
+            now = time.time()
+            result = self._gateway_api.get_power_modules()
+            for power_module in result:
+                device_id = '{0}.{{0}}'.format(power_module['address'])
+                if power_module['version'] != 12:
+                    continue
+                result = self._gateway_api.get_energy_time(power_module['id'])
+                abort = False
+                for i in xrange(12):
+                    if abort is True:
+                        break
+                    name = power_module['input{0}'.format(i)]
+                    if name == '':
                         continue
-                    result = self._gateway_api.get_energy_time(power_module['id'])
-                    abort = False
-                    for i in xrange(12):
-                        if abort is True:
-                            break
-                        name = power_module['input{0}'.format(i)]
-                        if name == '':
-                            continue
-                        timestamp = now
-                        length = min(len(result[str(i)]['current']), len(result[str(i)]['voltage']))
-                        for j in xrange(length):
-                            self._enqueue_metrics(metric_type=metric_type,
-                                                  values={'current': result[str(i)]['current'][j],
-                                                          'voltage': result[str(i)]['voltage'][j]},
-                                                  tags={'id': device_id.format(i),
-                                                        'name': name,
-                                                        'type': 'time'},
-                                                  timestamp=timestamp)
-                            timestamp += 0.250  # Stretch actual data by 1000 for visualtisation purposes
-                    result = self._gateway_api.get_energy_frequency(power_module['id'])
-                    abort = False
-                    for i in xrange(12):
-                        if abort is True:
-                            break
-                        name = power_module['input{0}'.format(i)]
-                        if name == '':
-                            continue
-                        timestamp = now
-                        length = min(len(result[str(i)]['current'][0]), len(result[str(i)]['voltage'][0]))
-                        for j in xrange(length):
-                            self._enqueue_metrics(metric_type=metric_type,
-                                                  values={'current_harmonics': result[str(i)]['current'][0][j],
-                                                          'current_phase': result[str(i)]['current'][1][j],
-                                                          'voltage_harmonics': result[str(i)]['voltage'][0][j],
-                                                          'voltage_phase': result[str(i)]['voltage'][1][j]},
-                                                  tags={'id': device_id.format(i),
-                                                        'name': name,
-                                                        'type': 'frequency'},
-                                                  timestamp=timestamp)
-                            timestamp += 0.250  # Stretch actual data by 1000 for visualtisation purposes
-            except CommunicationTimedOutException:
-                logger.error('Error getting power analytics: CommunicationTimedOutException')
-            except InMaintenanceModeException:
-                logger.info('Error getting power analytics: InMaintenanceModeException')
-            except Exception as ex:
-                logger.exception('Error getting power analytics: {0}'.format(ex))
-            if self._stopped:
-                return
-            self._pause(start, metric_type)
-
-    def _load_environment_configurations(self, name, interval):
-        while not self._stopped:
-            start = time.time()
-            # Inputs
-            try:
-                result = self._gateway_api.get_input_configurations()
-                ids = []
-                for config in result:
-                    input_id = config['id']
-                    ids.append(input_id)
-                    self._environment['inputs'][input_id] = config
-                for input_id in self._environment['inputs'].keys():
-                    if input_id not in ids:
-                        del self._environment['inputs'][input_id]
-            except CommunicationTimedOutException:
-                logger.error('Error while loading input configurations: CommunicationTimedOutException')
-            except InMaintenanceModeException:
-                logger.info('Error while loading input configurations: InMaintenanceModeException')
-            except Exception as ex:
-                logger.exception('Error while loading input configurations: {0}'.format(ex))
-            # Outputs
-            try:
-                result = self._gateway_api.get_output_configurations()
-                ids = []
-                for config in result:
-                    if config['module_type'] not in ['o', 'O', 'd', 'D']:
+                    timestamp = now
+                    length = min(len(result[str(i)]['current']), len(result[str(i)]['voltage']))
+                    for j in xrange(length):
+                        self._enqueue_metrics(metric_type=metric_type,
+                                              values={'current': result[str(i)]['current'][j],
+                                                      'voltage': result[str(i)]['voltage'][j]},
+                                              tags={'id': device_id.format(i),
+                                                    'name': name,
+                                                    'type': 'time'},
+                                              timestamp=timestamp)
+                        timestamp += 0.250  # Stretch actual data by 1000 for visualtisation purposes
+                result = self._gateway_api.get_energy_frequency(power_module['id'])
+                abort = False
+                for i in xrange(12):
+                    if abort is True:
+                        break
+                    name = power_module['input{0}'.format(i)]
+                    if name == '':
                         continue
-                    output_id = config['id']
-                    ids.append(output_id)
-                    type_mapping = {0: 'outlet',
-                                    1: 'valve',
-                                    2: 'alarm',
-                                    3: 'appliance',
-                                    4: 'pump',
-                                    5: 'hvac',
-                                    6: 'generic',
-                                    7: 'motor',
-                                    8: 'ventilation',
-                                    255: 'light'}
-                    self._environment['outputs'][output_id] = {'name': config['name'],
-                                                               'module_type': {'o': 'output',
-                                                                               'O': 'output',
-                                                                               'd': 'dimmer',
-                                                                               'D': 'dimmer'}[config['module_type']],
-                                                               'floor': config['floor'],
-                                                               'type': type_mapping.get(config['type'], 'generic')}
-                for output_id in self._environment['outputs'].keys():
-                    if output_id not in ids:
-                        del self._environment['outputs'][output_id]
-            except CommunicationTimedOutException:
-                logger.error('Error while loading output configurations: CommunicationTimedOutException')
-            except InMaintenanceModeException:
-                logger.info('Error while loading output configurations: InMaintenanceModeException')
-            except Exception as ex:
-                logger.exception('Error while loading output configurations: {0}'.format(ex))
-            # Sensors
-            try:
-                result = self._gateway_api.get_sensor_configurations()
-                ids = []
-                for config in result:
-                    input_id = config['id']
-                    ids.append(input_id)
-                    self._environment['sensors'][input_id] = config
-                for input_id in self._environment['sensors'].keys():
-                    if input_id not in ids:
-                        del self._environment['sensors'][input_id]
-            except CommunicationTimedOutException:
-                logger.error('Error while loading sensor configurations: CommunicationTimedOutException')
-            except InMaintenanceModeException:
-                logger.info('Error while loading sensor configurations: InMaintenanceModeException')
-            except Exception as ex:
-                logger.exception('Error while loading sensor configurations: {0}'.format(ex))
-            # Pulse counters
-            try:
-                result = self._gateway_api.get_pulse_counter_configurations()
-                ids = []
-                for config in result:
-                    input_id = config['id']
-                    ids.append(input_id)
-                    self._environment['pulse_counters'][input_id] = config
-                for input_id in self._environment['pulse_counters'].keys():
-                    if input_id not in ids:
-                        del self._environment['pulse_counters'][input_id]
-            except CommunicationTimedOutException:
-                logger.error('Error while loading pulse counter configurations: CommunicationTimedOutException')
-            except InMaintenanceModeException:
-                logger.info('Error while loading pulse counter configurations: InMaintenanceModeException')
-            except Exception as ex:
-                logger.exception('Error while loading pulse counter configurations: {0}'.format(ex))
-            if self._stopped:
-                return
-            self._pause(start, name, interval)
+                    timestamp = now
+                    length = min(len(result[str(i)]['current'][0]), len(result[str(i)]['voltage'][0]))
+                    for j in xrange(length):
+                        self._enqueue_metrics(metric_type=metric_type,
+                                              values={'current_harmonics': result[str(i)]['current'][0][j],
+                                                      'current_phase': result[str(i)]['current'][1][j],
+                                                      'voltage_harmonics': result[str(i)]['voltage'][0][j],
+                                                      'voltage_phase': result[str(i)]['voltage'][1][j]},
+                                              tags={'id': device_id.format(i),
+                                                    'name': name,
+                                                    'type': 'frequency'},
+                                              timestamp=timestamp)
+                        timestamp += 0.250  # Stretch actual data by 1000 for visualtisation purposes
+        except CommunicationTimedOutException:
+            logger.error('Error getting power analytics: CommunicationTimedOutException')
+        except InMaintenanceModeException:
+            logger.info('Error getting power analytics: InMaintenanceModeException')
+        except Exception as ex:
+            logger.exception('Error getting power analytics: {0}'.format(ex))
+
+    def _load_environment_configurations(self, name):
+        # Inputs
+        try:
+            result = self._gateway_api.get_input_configurations()
+            ids = []
+            for config in result:
+                input_id = config['id']
+                ids.append(input_id)
+                self._environment['inputs'][input_id] = config
+            for input_id in self._environment['inputs'].keys():
+                if input_id not in ids:
+                    del self._environment['inputs'][input_id]
+        except CommunicationTimedOutException:
+            logger.error('Error while loading input configurations: CommunicationTimedOutException')
+        except InMaintenanceModeException:
+            logger.info('Error while loading input configurations: InMaintenanceModeException')
+        except Exception as ex:
+            logger.exception('Error while loading input configurations: {0}'.format(ex))
+        # Outputs
+        try:
+            result = self._gateway_api.get_output_configurations()
+            ids = []
+            for config in result:
+                if config['module_type'] not in ['o', 'O', 'd', 'D']:
+                    continue
+                output_id = config['id']
+                ids.append(output_id)
+                type_mapping = {0: 'outlet',
+                                1: 'valve',
+                                2: 'alarm',
+                                3: 'appliance',
+                                4: 'pump',
+                                5: 'hvac',
+                                6: 'generic',
+                                7: 'motor',
+                                8: 'ventilation',
+                                255: 'light'}
+                self._environment['outputs'][output_id] = {'name': config['name'],
+                                                           'module_type': {'o': 'output',
+                                                                           'O': 'output',
+                                                                           'd': 'dimmer',
+                                                                           'D': 'dimmer'}[config['module_type']],
+                                                           'floor': config['floor'],
+                                                           'type': type_mapping.get(config['type'], 'generic')}
+            for output_id in self._environment['outputs'].keys():
+                if output_id not in ids:
+                    del self._environment['outputs'][output_id]
+        except CommunicationTimedOutException:
+            logger.error('Error while loading output configurations: CommunicationTimedOutException')
+        except InMaintenanceModeException:
+            logger.info('Error while loading output configurations: InMaintenanceModeException')
+        except Exception as ex:
+            logger.exception('Error while loading output configurations: {0}'.format(ex))
+        # Sensors
+        try:
+            result = self._gateway_api.get_sensor_configurations()
+            ids = []
+            for config in result:
+                input_id = config['id']
+                ids.append(input_id)
+                self._environment['sensors'][input_id] = config
+            for input_id in self._environment['sensors'].keys():
+                if input_id not in ids:
+                    del self._environment['sensors'][input_id]
+        except CommunicationTimedOutException:
+            logger.error('Error while loading sensor configurations: CommunicationTimedOutException')
+        except InMaintenanceModeException:
+            logger.info('Error while loading sensor configurations: InMaintenanceModeException')
+        except Exception as ex:
+            logger.exception('Error while loading sensor configurations: {0}'.format(ex))
+        # Pulse counters
+        try:
+            result = self._gateway_api.get_pulse_counter_configurations()
+            ids = []
+            for config in result:
+                input_id = config['id']
+                ids.append(input_id)
+                self._environment['pulse_counters'][input_id] = config
+            for input_id in self._environment['pulse_counters'].keys():
+                if input_id not in ids:
+                    del self._environment['pulse_counters'][input_id]
+        except CommunicationTimedOutException:
+            logger.error('Error while loading pulse counter configurations: CommunicationTimedOutException')
+        except InMaintenanceModeException:
+            logger.info('Error while loading pulse counter configurations: InMaintenanceModeException')
+        except Exception as ex:
+            logger.exception('Error while loading pulse counter configurations: {0}'.format(ex))
 
     def get_definitions(self):
         """
@@ -25,10 +25,61 @@ from threading import Thread
 from collections import deque
 from ioc import Injectable, Inject, INJECTED, Singleton
 from bus.om_bus_events import OMBusEvents
+from database_utils import Database
+from gateway.metrics_exporter import MetricsSnapshot, format_family, format_histogram
 
 logger = logging.getLogger("openmotics")
 
 
+class MetricsRoutingTable(object):
+    """
+    Maps each (source, metric_type) on the subscribers that are interested in it. Routes are resolved
+    once per (source, metric_type) using the source and metric_type filters of the subscriptions, so
+    routing a metric is a single dictionary lookup.
+    """
+
+    def __init__(self, subscriptions, get_filter, get_rate_key):
+        """
+        :param subscriptions: Tuple of (subscriber, source filter, metric_type filter) tuples
+        :type subscriptions: tuple
+        :param get_filter: Resolves a filter to a set of sources or metric types
+        :param get_rate_key: Returns the (interned) rate key for a source and metric_type
+        """
+        self._subscriptions = subscriptions
+        self._get_filter = get_filter
+        self._get_rate_key = get_rate_key
+        self._routes = {}
+        self._generation = 0
+
+    def get(self, source, metric_type):
+        """
+        Returns the rate key and the subscribers for a given source and metric_type
+        :rtype: tuple of (str, list)
+        """
+        key = (source, metric_type)
+        route = self._routes.get(key)
+        if route is None:
+            generation = self._generation
+            subscribers = []
+            for subscriber, source_filter, metric_type_filter in self._subscriptions:
+                try:
+                    if source in self._get_filter('source', source_filter) and metric_type in self._get_filter('metric_type', metric_type_filter):
+                        subscribers.append(subscriber)
+                except Exception as ex:
+                    logger.error('Could not resolve metric filters for {0}: {1}'.format(subscriber, ex))
+            route = (self._get_rate_key(source, metric_type), subscribers)
+            if generation == self._generation:
+                self._routes[key] = route  # Not cached when it was invalidated in the meantime, it might be stale
+        return route
+
+    def invalidate(self, sources, metric_types):
+        """ Removes the routes of the given sources or metric types, they are resolved again when needed """
+        self._generation += 1
+        for key in self._routes.keys():
+            if key[0] in sources or key[1] in metric_types:
+                self._routes.pop(key, None)
+
+
 @Injectable.named('metrics_controller')
 @Singleton
 class MetricsController(object):
@@ -59,8 +110,12 @@ class MetricsController(object):
         self._persist_counters = {}
         self._buffer_counters = {}
         self.definitions = {}
+        self.definitions_version = 0
         self._definition_filters = {'source': {}, 'metric_type': {}}
+        self._routing_tables = {}
+        self._rate_keys = {}
         self._metrics_cache = {}
+        self.snapshot = MetricsSnapshot()
         self._collector_plugins = None
         self._collector_openmotics = None
         self._internal_stats = None
@@ -90,6 +145,13 @@ class MetricsController(object):
             interval = self._config_controller.get_setting('cloud_metrics_interval|{0}'.format(metric_type), 300)
             self.cloud_intervals[metric_type] = interval
             self._metrics_collector.set_cloud_interval(metric_type, interval)
+            policy = self._config_controller.get_setting('metrics_emission_policy|{0}'.format(metric_type))
+            if policy is not None:
+                try:
+                    self._metrics_collector.set_emission_policy(metric_type, **policy)
+                except (TypeError, ValueError) as ex:
+                    logger.error('Invalid emission policy {0} for {1}, using always: {2}'.format(policy, metric_type, ex))
+                    self._metrics_collector.set_emission_policy(metric_type, 'always')
 
         # Metrics generated by the Metrics_Controller_ are also defined in the collector. Trying to get them in one place.
         for definition in self._metrics_collector.get_definitions():
@@ -97,6 +159,7 @@ class MetricsController(object):
             settings = MetricsController._parse_definition(definition)
             self._persist_counters.setdefault('OpenMotics', {})[definition['type']] = settings['persist']
             self._buffer_counters.setdefault('OpenMotics', {})[definition['type']] = settings['buffer']
+        self.snapshot.set_definitions(self.definitions)
 
     def start(self):
         self._collector_plugins = Thread(target=self._collect_plugins)
@@ -125,6 +188,16 @@ class MetricsController(object):
         self._metrics_collector.set_cloud_interval(metric_type, interval)
         self._config_controller.set_setting('cloud_metrics_interval|{0}'.format(metric_type), interval)
 
+    def set_emission_policy(self, metric_type, mode='always', deadband=0, heartbeat=900):
+        if metric_type not in self._metrics_collector.intervals:
+            raise ValueError('Unknown metric type: {0}, expected one of: {1}'.format(
+                metric_type, ', '.join(sorted(self._metrics_collector.intervals))
+            ))
+        logger.info('setting emission policy {0}_{1}'.format(metric_type, mode))
+        policy = {'mode': mode, 'deadband': deadband, 'heartbeat': heartbeat}
+        self._metrics_collector.set_emission_policy(metric_type, **policy)
+        self._config_controller.set_setting('metrics_emission_policy|{0}'.format(metric_type), policy)
+
     def add_receiver(self, receiver):
         self._openmotics_receivers.append(receiver)
 
@@ -151,7 +224,156 @@ class MetricsController(object):
             self._definition_filters['metric_type'][metric_filter] = results
             return results
 
+    def get_openmetrics_families(self):
+        """ Returns the internal statistics of the metrics pipeline, formatted as OpenMetrics families """
+        queue_lengths = [({'queue': 'plugins'}, len(self.metrics_queue_plugins)),
+                         ({'queue': 'openmotics'}, len(self.metrics_queue_openmotics)),
+                         ({'queue': 'cloud'}, self.cloud_stats['queue']),
+                         ({'queue': 'cloud_buffer'}, self.cloud_stats['buffer'])]
+        ring_lag = []
+        ring_dropped = []
+        async_stats = dict((key, []) for key in ['delivered', 'dropped', 'coalesced', 'latency'])
+        resources = dict((key, []) for key in ['cpu', 'rss', 'threads', 'ipc', 'latency', 'timeouts', 'http_active', 'http_rejected'])
+        for plugin in self._plugin_controller.get_plugins():
+            queue_lengths.append(({'queue': 'plugin', 'plugin': plugin.name}, plugin.get_queue_length()))
+            resource_stats = plugin.get_resource_stats()
+            if resource_stats['cpu'] is not None:
+                resources['cpu'].append(({'plugin': plugin.name, 'mode': 'user'}, resource_stats['cpu']['user']))
+                resources['cpu'].append(({'plugin': plugin.name, 'mode': 'system'}, resource_stats['cpu']['system']))
+                resources['rss'].append(({'plugin': plugin.name}, resource_stats['rss']))
+                resources['threads'].append(({'plugin': plugin.name}, resource_stats['threads']))
+            for direction in ['in', 'out']:
+                resources['ipc'].append(({'plugin': plugin.name, 'direction': direction}, resource_stats['ipc']['bytes_{0}'.format(direction)]))
+            resources['http_active'].append(({'plugin': plugin.name}, resource_stats['http']['active']))
+            resources['http_rejected'].append(({'plugin': plugin.name}, resource_stats['http']['rejected']))
+            for action, latencies in resource_stats['commands'].iteritems():
+                labels = {'plugin': plugin.name, 'action': action}
+                resources['latency'].append((labels, latencies['buckets'], latencies['count'], latencies['sum']))
+                resources['timeouts'].append((labels, latencies['timeouts']))
+            for key, value in plugin.get_async_stats().iteritems():
+                async_stats[key].append(({'plugin': plugin.name}, value))
+            if plugin.uses_metrics_ring():
+                ring_stats = plugin.get_metrics_ring_stats()
+                ring_lag.append(({'plugin': plugin.name}, ring_stats['lag']))
+                ring_dropped.append(({'plugin': plugin.name}, ring_stats['dropped']))
+        database_stats = MetricsController._get_database_stats()
+        # The total isn't exported, it would be counted twice when summing the series
+        return u''.join([format_family('gateway_metrics_in', 'counter', 'Metrics received',
+                                       [({'key': key}, rate) for key, rate in self.inbound_rates.items() if key != 'total']),
+                         format_family('gateway_metrics_out', 'counter', 'Metrics delivered',
+                                       [({'key': key}, rate) for key, rate in self.outbound_rates.items() if key != 'total']),
+                         format_family('gateway_metrics_queue_length', 'gauge', 'Metrics queue lengths', queue_lengths),
+                         format_family('gateway_metrics_ring_lag', 'gauge', 'Metrics ring records a plugin was behind', ring_lag),
+                         format_family('gateway_metrics_ring_dropped', 'counter', 'Metrics ring records a plugin lost', ring_dropped),
+                         format_family('gateway_plugin_async_delivered', 'counter', 'Events and metrics delivered to a plugin', async_stats['delivered']),
+                         format_family('gateway_plugin_async_dropped', 'counter', 'Events and metrics dropped because the plugin queue was full', async_stats['dropped']),
+                         format_family('gateway_plugin_async_coalesced', 'counter', 'States replaced by a newer state before delivery', async_stats['coalesced']),
+                         format_family('gateway_plugin_async_latency_seconds', 'gauge', 'Average delivery latency to a plugin', async_stats['latency']),
+                         format_family('gateway_plugin_cpu_seconds', 'counter', 'CPU time used by a plugin runtime', resources['cpu']),
+                         format_family('gateway_plugin_rss_bytes', 'gauge', 'Resident memory of a plugin runtime', resources['rss']),
+                         format_family('gateway_plugin_threads', 'gauge', 'Threads of a plugin runtime', resources['threads']),
+                         format_family('gateway_plugin_ipc_bytes', 'counter', 'Bytes sent to (out) and received from (in) a plugin runtime', resources['ipc']),
+                         format_histogram('gateway_plugin_command_latency_seconds', 'Plugin command round trip latency', resources['latency']),
+                         format_family('gateway_plugin_command_timeouts', 'counter', 'Plugin commands without a response in time', resources['timeouts']),
+                         format_family('gateway_plugin_http_active', 'gauge', 'Webserver threads waiting for a plugin', resources['http_active']),
+                         format_family('gateway_plugin_http_rejected', 'counter', 'Plugin HTTP requests refused because the plugin was busy', resources['http_rejected']),
+                         format_family('gateway_database_statements', 'counter', 'Executed database statements', database_stats['statements']),
+                         format_family('gateway_database_statement_seconds', 'counter', 'Time spent executing database statements', database_stats['duration']),
+                         format_family('gateway_database_statement_max_seconds', 'gauge', 'Slowest execution of a database statement', database_stats['max']),
+                         format_family('gateway_database_commits', 'counter', 'Database transactions committed by the writers', database_stats['commits']),
+                         format_family('gateway_database_writes', 'counter', 'Database writes, grouped into the commits', database_stats['writes'])])
+
+    @staticmethod
+    def _get_database_stats():
+        """ Returns the statistics of all databases, combining the ones using the same file """
+        statements = {}  # (database, statement) -> [count, duration, max]
+        totals = {}  # Database -> [commits, writes]
+        for database in Database.get_instances():
+            name = database.get_name()
+            statistics = database.get_statistics()
+            for statement, stats in statistics['statements'].iteritems():
+                combined = statements.setdefault((name, statement), [0, 0.0, 0.0])
+                combined[0] += stats['count']
+                combined[1] += stats['duration']
+                combined[2] = max(combined[2], stats['max'])
+            total = totals.setdefault(name, [0, 0])
+            total[0] += statistics['commits']
+            total[1] += statistics['writes']
+        result = dict((key, []) for key in ['statements', 'duration', 'max', 'commits', 'writes'])
+        for (name, statement), stats in sorted(statements.iteritems()):
+            labels = {'database': name, 'statement': statement}
+            result['statements'].append((labels, stats[0]))
+            result['duration'].append((labels, stats[1]))
+            result['max'].append((labels, stats[2]))
+        for name, total in sorted(totals.iteritems()):
+            result['commits'].append(({'database': name}, total[0]))
+            result['writes'].append(({'database': name}, total[1]))
+        return result
+
+    def get_rate_key(self, source, metric_type):
+        """ Returns the (interned) key used to keep track of the rates of a given source and metric_type """
+        rate_key = self._rate_keys.get((source, metric_type))
+        if rate_key is None:
+            rate_key = intern('{0}.{1}'.format(source.lower(), metric_type.lower()))
+            self._rate_keys[(source, metric_type)] = rate_key
+        return rate_key
+
+    def get_routing_table(self, subscriptions):
+        """
+        Returns the routing table for the given subscriptions. Routing tables are cached, and are rebuilt
+        whenever the subscriptions or the metric definitions change.
+        :param subscriptions: Tuple of (subscriber, source filter, metric_type filter) tuples
+        :type subscriptions: tuple
+        :rtype: gateway.metrics_controller.MetricsRoutingTable
+        """
+        routing_tables = self._routing_tables
+        routing_table = routing_tables.get(subscriptions)
+        if routing_table is None:
+            if len(routing_tables) >= 10:
+                # Subscriptions changed; previous tables are most likely stale
+                routing_tables.clear()
+            routing_table = MetricsRoutingTable(subscriptions, self.get_filter, self.get_rate_key)
+            routing_tables[subscriptions] = routing_table
+        return routing_table
+
     def set_plugin_definitions(self, definitions):
+        """ Replaces the definitions of all plugins, all cached filters and routing tables are rebuilt """
+        removed = [source for source in self.definitions if source != 'OpenMotics' and source not in definitions]
+        self._update_definitions(definitions, removed)
+        self._definition_filters = {'source': {}, 'metric_type': {}}
+        self._routing_tables = {}
+
+    def update_plugin_definitions(self, definitions, removed=None):
+        """
+        Updates the definitions of the given plugins only. Only those definitions are validated, and only the
+        cached filters and routes that can be affected by them are refreshed.
+        :param definitions: New definitions per plugin
+        :type definitions: dict
+        :param removed: Plugins of which the definitions should be removed
+        :type removed: list
+        """
+        metric_types = self._get_metric_types()
+        affected = self._update_definitions(definitions, removed or [])
+        changed_types = metric_types.symmetric_difference(self._get_metric_types())
+
+        source_filters = {}
+        for metric_filter, sources in self._definition_filters['source'].items():
+            re_filter = None if metric_filter is None else re.compile(metric_filter)
+            sources = sources - affected
+            sources.update(source for source in affected
+                           if source in self.definitions and (re_filter is None or re_filter.match(source)))
+            source_filters[metric_filter] = sources
+        # Metric type filters only change when a metric type appears or disappears
+        self._definition_filters = {'source': source_filters,
+                                    'metric_type': {} if changed_types else self._definition_filters['metric_type']}
+        for routing_table in self._routing_tables.values():
+            routing_table.invalidate(affected, changed_types)
+
+    def _get_metric_types(self):
+        return set(metric_type for source_definitions in self.definitions.values() for metric_type in source_definitions)
+
+    def _update_definitions(self, definitions, removed):
+        """ Validates and stores the definitions of the given plugins, returns the plugins of which the definitions changed """
         # {
         #     "type": "energy",
         #     "tags": ["device", "id"],
@@ -160,6 +382,29 @@ class MetricsController(object):
         #                  "type": "counter",
         #                  "unit": "kWh"}]
         # }
+        all_definitions = dict(self.definitions)
+        for plugin in set(removed) | set(definitions):
+            all_definitions.pop(plugin, None)
+            self._persist_counters.pop(plugin, None)
+            self._buffer_counters.pop(plugin, None)
+        for plugin, plugin_definitions in definitions.iteritems():
+            log = self._plugin_controller.get_logger(plugin)
+            for definition in plugin_definitions:
+                if MetricsController._validate_definition(definition, log):
+                    all_definitions.setdefault(plugin, {})[definition['type']] = definition
+                    settings = MetricsController._parse_definition(definition)
+                    self._persist_counters.setdefault(plugin, {})[definition['type']] = settings['persist']
+                    self._buffer_counters.setdefault(plugin, {})[definition['type']] = settings['buffer']
+        changed = set(plugin for plugin in set(removed) | set(definitions)
+                      if all_definitions.get(plugin) != self.definitions.get(plugin))
+        self.definitions = all_definitions
+        if changed:
+            self.definitions_version += 1
+            self.snapshot.set_definitions(self.definitions)
+        return changed
+
+    @staticmethod
+    def _validate_definition(definition, log):
         required_keys = {'type': basestring,
                          'metrics': list,
                          'tags': list}
@@ -167,53 +412,26 @@ class MetricsController(object):
                         'description': basestring,
                         'type': basestring,
                         'unit': basestring}
-        expected_plugins = []
-        for plugin, plugin_definitions in definitions.iteritems():
-            log = self._plugin_controller.get_logger(plugin)
-            for definition in plugin_definitions:
-                definition_ok = True
-                for key, key_type in required_keys.iteritems():
-                    if key not in definition:
-                        log('Definitions should contain keys: {0}'.format(', '.join(required_keys.keys())))
-                        definition_ok = False
-                        break
-                    if not isinstance(definition[key], key_type):
-                        log('Definitions key {0} should be of type {1}'.format(key, key_type))
-                        definition_ok = False
-                        break
-                    if key == 'metrics':
-                        for metric_definition in definition[key]:
-                            if definition_ok is False:
-                                break
-                            if not isinstance(metric_definition, dict):
-                                log('Metric definitions should be dictionaries')
-                                definition_ok = False
-                                break
-                            for mkey, mkey_type in metrics_keys.iteritems():
-                                if mkey not in metric_definition:
-                                    log('Metric definitions should contain keys: {0}'.format(', '.join(metrics_keys.keys())))
-                                    definition_ok = False
-                                    break
-                                if not isinstance(metric_definition[mkey], mkey_type):
-                                    log('Metric definitions key {0} should be of type {1}'.format(mkey, mkey_type))
-                                    definition_ok = False
-                                    break
-                    if definition_ok is False:
-                        break
-                if definition_ok is True:
-                    expected_plugins.append(plugin)
-                    self.definitions.setdefault(plugin, {})[definition['type']] = definition
-                    settings = MetricsController._parse_definition(definition)
-                    self._persist_counters.setdefault(plugin, {})[definition['type']] = settings['persist']
-                    self._buffer_counters.setdefault(plugin, {})[definition['type']] = settings['buffer']
-        for source in self.definitions.keys():
-            # Remove plugins from the self.definitions dict that are not found anymore
-            if source != 'OpenMotics' and source not in expected_plugins:
-                self.definitions.pop(source, None)
-                self._persist_counters.pop(source, None)
-                self._buffer_counters.pop(source, None)
-        self._definition_filters['source'] = {}
-        self._definition_filters['metric_type'] = {}
+        for key, key_type in required_keys.iteritems():
+            if key not in definition:
+                log('Definitions should contain keys: {0}'.format(', '.join(required_keys.keys())))
+                return False
+            if not isinstance(definition[key], key_type):
+                log('Definitions key {0} should be of type {1}'.format(key, key_type))
+                return False
+            if key == 'metrics':
+                for metric_definition in definition[key]:
+                    if not isinstance(metric_definition, dict):
+                        log('Metric definitions should be dictionaries')
+                        return False
+                    for mkey, mkey_type in metrics_keys.iteritems():
+                        if mkey not in metric_definition:
+                            log('Metric definitions should contain keys: {0}'.format(', '.join(metrics_keys.keys())))
+                            return False
+                        if not isinstance(metric_definition[mkey], mkey_type):
+                            log('Metric definitions key {0} should be of type {1}'.format(mkey, mkey_type))
+                            return False
+        return True
 
     def _load_cloud_buffer(self):
         oldest_queue_timestamp = min([time.time()] + [metric[0]['timestamp'] for metric in self._cloud_queue])
@@ -396,12 +614,11 @@ class MetricsController(object):
                 self._load_cloud_buffer()
 
     def _put(self, metric):
-        rate_key = '{0}.{1}'.format(metric['source'].lower(), metric['type'].lower())
-        if rate_key not in self.inbound_rates:
-            self.inbound_rates[rate_key] = 0
-        self.inbound_rates[rate_key] += 1
+        rate_key = self.get_rate_key(metric['source'], metric['type'])
+        self.inbound_rates[rate_key] = self.inbound_rates.get(rate_key, 0) + 1
         self.inbound_rates['total'] += 1
         self._transform_counters(metric)  # Convert counters to "ever increasing counters"
+        self.snapshot.update(metric)
         # No need to make a deep copy; openmotics doesn't alter the object, and for the plugins the metric gets (de)serialized
         self.metrics_queue_plugins.appendleft(metric)
         self.metrics_queue_openmotics.appendleft(metric)
@@ -440,7 +657,7 @@ class MetricsController(object):
         >                   "values": {"power": 1234}}
         """
         while not self._stopped:
-            start = time.time()
+            # Blocks until the next plugin metric collector is due, while yielding the metrics that are collected
             for metric in self._plugin_controller.collect_metrics():
                 # Validation, part 1
                 source = metric['source']
@@ -481,8 +698,6 @@ class MetricsController(object):
                 if metric_ok is False:
                     continue
                 self._put(metric)
-            if not self._stopped:
-                time.sleep(max(0.1, 1 - (time.time() - start)))
 
     def _collect_openmotics(self):
         while not self._stopped:
@@ -516,15 +731,13 @@ class MetricsController(object):
         while not self._stopped:
             try:
                 metric = self.metrics_queue_openmotics.pop()
+                rate_key = self.get_rate_key(metric['source'], metric['type'])
                 for receiver in self._openmotics_receivers:
                     try:
                         receiver(metric)
                     except Exception as ex:
                         logger.exception('Error distributing metrics to internal receivers: {0}'.format(ex))
-                    rate_key = '{0}.{1}'.format(metric['source'].lower(), metric['type'].lower())
-                    if rate_key not in self.outbound_rates:
-                        self.outbound_rates[rate_key] = 0
-                    self.outbound_rates[rate_key] += 1
+                    self.outbound_rates[rate_key] = self.outbound_rates.get(rate_key, 0) + 1
                     self.outbound_rates['total'] += 1
             except IndexError:
                 time.sleep(0.1)
@@ -0,0 +1,164 @@
+# Copyright (C) 2019 OpenMotics BV
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+The metrics exporter module renders metrics in the OpenMetrics text format
+"""
+
+import re
+from threading import Lock
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+_INVALID_NAME_CHARACTERS = re.compile(r'[^a-zA-Z0-9_]')
+
+
+def format_name(name):
+    """ Converts a string into a valid OpenMetrics metric or label name """
+    name = _INVALID_NAME_CHARACTERS.sub('_', u'{0}'.format(name)).lower()
+    if name[:1].isdigit():
+        name = u'_{0}'.format(name)
+    return name
+
+
+def format_labels(labels):
+    """ Formats a dict of labels, e.g. `id="1",name="foo"` """
+    return u','.join(u'{0}="{1}"'.format(format_name(key), u'{0}'.format(labels[key]).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                     for key in sorted(labels))
+
+
+def format_value(value):
+    """ Formats a sample value, returns None for values that can't be exported (e.g. strings) """
+    if isinstance(value, bool):
+        return u'1' if value else u'0'
+    if isinstance(value, (int, long)):
+        return u'{0}'.format(value)
+    if isinstance(value, float):
+        return repr(value).decode('ascii')
+    return None
+
+
+def format_header(name, metric_type, description, unit=None):
+    if unit:
+        # The unit is only mentioned in the help text, OpenMetrics requires a UNIT to be a suffix of the name
+        description = u'{0} ({1})'.format(description or name, unit)
+    header = u'# TYPE {0} {1}\n'.format(name, metric_type)
+    if description:
+        header += u'# HELP {0} {1}\n'.format(name, description.replace('\\', '\\\\').replace('\n', '\\n'))
+    return header
+
+
+def format_family(name, metric_type, description, samples):
+    """
+    Formats a complete metric family.
+    :param samples: List of (labels, value) tuples
+    """
+    sample_name = '{0}_total'.format(name) if metric_type == 'counter' else name
+    lines = [format_header(name, metric_type, description)]
+    for labels, value in samples:
+        value = format_value(value)
+        if value is not None:
+            lines.append(u'{0}{{{1}}} {2}\n'.format(sample_name, format_labels(labels), value))
+    return u''.join(lines)
+
+
+def format_histogram(name, description, samples):
+    """
+    Formats a complete histogram metric family.
+    :param samples: List of (labels, buckets, count, sum) tuples, buckets being a list of (upper bound, cumulative count)
+    """
+    lines = [format_header(name, 'histogram', description)]
+    for labels, buckets, count, total in samples:
+        for upper_bound, bucket_count in buckets:
+            lines.append(u'{0}_bucket{{{1}}} {2}\n'.format(name, format_labels(dict(labels, le=format_value(float(upper_bound)))), bucket_count))
+        lines.append(u'{0}_bucket{{{1}}} {2}\n'.format(name, format_labels(dict(labels, le='+Inf')), count))
+        lines.append(u'{0}_count{{{1}}} {2}\n'.format(name, format_labels(labels), count))
+        lines.append(u'{0}_sum{{{1}}} {2}\n'.format(name, format_labels(labels), format_value(float(total))))
+    return u''.join(lines)
+
+
+class MetricsSnapshot(object):
+    """
+    Keeps the latest value of every series as a pre-rendered OpenMetrics sample. The snapshot is updated with
+    every metric that passes through the MetricsController, so rendering it never needs to collect anything.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._families = {}  # Family name -> {'header': header, 'samples': {labels: sample}}
+        self._families_per_type = {}  # (source, metric_type) -> {value name: (family name, sample name)}
+
+    def set_definitions(self, definitions):
+        """
+        Sets the metric definitions, families of which the definition is gone are removed.
+        :param definitions: Metric definitions per source and metric type
+        :type definitions: dict
+        """
+        families_per_type = {}
+        headers = {}
+        for source, source_definitions in definitions.iteritems():
+            for metric_type, definition in source_definitions.iteritems():
+                type_families = {}
+                for metric_definition in definition.get('metrics', []):
+                    name = format_name(u'{0}_{1}_{2}'.format(source, metric_type, metric_definition['name']))
+                    family_type = 'counter' if metric_definition.get('type') == 'counter' else 'gauge'
+                    sample_name = u'{0}_total'.format(name) if family_type == 'counter' else name
+                    type_families[metric_definition['name']] = (name, sample_name)
+                    headers[name] = format_header(name, family_type,
+                                                  metric_definition.get('description'),
+                                                  metric_definition.get('unit'))
+                families_per_type[(source, metric_type)] = type_families
+        with self._lock:
+            families = {}
+            for name, header in headers.iteritems():
+                family = self._families.get(name, {'samples': {}})
+                family['header'] = header
+                families[name] = family
+            self._families = families
+            self._families_per_type = families_per_type
+
+    def update(self, metric):
+        """ Updates the snapshot with the values of a given metric """
+        type_families = self._families_per_type.get((metric['source'], metric['type']))
+        if not type_families:
+            return
+        labels = format_labels(metric['tags'])
+        timestamp = format_value(float(metric['timestamp']))
+        families = self._families
+        for value_name, value in metric['values'].iteritems():
+            family_info = type_families.get(value_name)
+            if family_info is None:
+                continue
+            value = format_value(value)
+            if value is None:
+                continue
+            family = families.get(family_info[0])
+            if family is not None:
+                family['samples'][labels] = u'{0}{{{1}}} {2} {3}\n'.format(family_info[1], labels, value, timestamp)
+
+    def render(self, extra_families=u''):
+        """
+        Renders the snapshot in the OpenMetrics text format
+        :param extra_families: Additional, already formatted, metric families
+        """
+        with self._lock:
+            families = [(name, family['header'], family['samples'].values()) for name, family in self._families.iteritems()]
+        parts = []
+        for _, header, samples in sorted(families):
+            if samples:
+                parts.append(header)
+                parts.extend(samples)
+        parts.append(extra_families)
+        parts.append(u'# EOF\n')
+        return u''.join(parts).encode('utf-8')
@@ -24,6 +24,7 @@ from threading import Thread
 from platform_utils import Platform
 from gateway.hal.master_controller import MasterEvent
 from gateway.maintenance_communicator import InMaintenanceModeException
+from gateway.status_snapshot import StatusSnapshot
 from master.thermostats import ThermostatStatus
 from master.inputs import InputStatus
 from master import master_api
@@ -54,6 +55,8 @@ class Event(object):
         ACTION = 'ACTION'
         PING = 'PING'
         PONG = 'PONG'
+        STATE_SNAPSHOT = 'STATE_SNAPSHOT'
+        STATE_DELTA = 'STATE_DELTA'
 
     def __init__(self, event_type, data):
         self.type = event_type
@@ -133,6 +136,7 @@ class Observer(object):
         self._master_online = False
         self._background_consumers_registered = False
         self._master_version = None
+        self._status_snapshot = StatusSnapshot()
 
         self._thread = Thread(target=self._monitor)
         self._thread.daemon = True
@@ -145,6 +149,10 @@ class Observer(object):
         """
         self._gateway_api = gateway_api
 
+    def get_status_snapshot(self):
+        """ Returns the status snapshot, kept up to date by the observer """
+        return self._status_snapshot
+
     def subscribe_master(self, event, callback):
         """
         Subscribes a callback to a certain event
@@ -173,8 +181,11 @@ class Observer(object):
         """
         if object_type is None or object_type == Observer.Types.THERMOSTATS:
             self._thermostats_last_updated = 0
+            self._status_snapshot.invalidate(StatusSnapshot.Keys.THERMOSTATS)
         if object_type is None or object_type == Observer.Types.SHUTTERS:
             self._shutters_last_updated = 0
+        if object_type is None:
+            self._status_snapshot.invalidate()
         self._master_controller.invalidate_caches()
 
     def increase_interval(self, object_type, interval, window):
@@ -265,6 +276,7 @@ class Observer(object):
         :type master_event: gateway.hal.master_controller.MasterEvent
         """
         if master_event.type == MasterEvent.Types.OUTPUT_CHANGE:
+            self._status_snapshot.invalidate(StatusSnapshot.Keys.OUTPUTS)
             self._message_client.send_event(OMBusEvents.OUTPUT_CHANGE, {'id': master_event.data['id']})
             for callback in self._event_subscriptions:
                 callback(Event(event_type=Event.Types.OUTPUT_CHANGE,
@@ -358,6 +370,7 @@ class Observer(object):
     def _thermostat_changed(self, thermostat_id, status):
         """ Executed by the Thermostat Status tracker when an output changed state """
         self._message_client.send_event(OMBusEvents.THERMOSTAT_CHANGE, {'id': thermostat_id})
+        self._status_snapshot.invalidate(StatusSnapshot.Keys.THERMOSTATS)
         location = {'room_id': self._thermostats_config[thermostat_id]['room']}
         for callback in self._event_subscriptions:
             callback(Event(event_type=Event.Types.THERMOSTAT_CHANGE,
@@ -371,6 +384,7 @@ class Observer(object):
 
     def _thermostat_group_changed(self, status):
         self._message_client.send_event(OMBusEvents.THERMOSTAT_CHANGE, {'id': None})
+        self._status_snapshot.invalidate(StatusSnapshot.Keys.THERMOSTATS)
         for callback in self._event_subscriptions:
             callback(Event(event_type=Event.Types.THERMOSTAT_GROUP_CHANGE,
                            data={'id': 0,
@@ -431,4 +445,5 @@ class Observer(object):
                                              'setpoint': setpoint,
                                              'cooling': cooling,
                                              'status': thermostats})
+        self._status_snapshot.set(StatusSnapshot.Keys.THERMOSTATS, self._thermostat_status.get_thermostats())
         self._thermostats_last_updated = time.time()
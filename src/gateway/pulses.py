@@ -16,10 +16,10 @@
 The pulses module contains the PulseCounterController.
 """
 
-import sqlite3
 import logging
 import master.master_api as master_api
 from ioc import Injectable, Inject, INJECTED, Singleton
+from database_utils import Database
 from master.eeprom_models import PulseCounterConfiguration
 
 logger = logging.getLogger('openmotics')
@@ -41,43 +41,38 @@ class PulseCounterController(object):
 
         :param pulse_db: filename of the sqlite database used to store the pulse counters.
         """
-        self._connection = sqlite3.connect(pulse_db,
-                                           detect_types=sqlite3.PARSE_DECLTYPES,
-                                           check_same_thread=False,
-                                           isolation_level=None)
-        self._cursor = self._connection.cursor()
+        self._database = Database(pulse_db)
         self._check_tables()
 
         self._master_communicator = master_communicator
         self._eeprom_controller = eeprom_controller
         self._counts = {}
 
-    def _execute(self, *args, **kwargs):
-        return self._cursor.execute(*args, **kwargs)
-
     def _check_tables(self):
         """
         Creates the table.
         """
-        self._execute('CREATE TABLE IF NOT EXISTS pulse_counters ' 
-                      '(id INTEGER PRIMARY KEY, name TEXT, room INTEGER, persistent INTEGER);')
+        self._database.write('CREATE TABLE IF NOT EXISTS pulse_counters '
+                             '(id INTEGER PRIMARY KEY, name TEXT, room INTEGER, persistent INTEGER);')
 
     def set_pulse_counter_amount(self, amount):
         if amount < MASTER_PULSE_COUNTERS:
             raise ValueError('Amount should be {0} or more'.format(MASTER_PULSE_COUNTERS))
 
-        # Create new pulse counters if required
-        for i in xrange(24, amount):
-            self._execute('INSERT INTO pulse_counters (id, name, room, persistent) ' 
-                          'SELECT ?, "", 255, 0 ' 
-                          'WHERE NOT EXISTS (SELECT 1 FROM pulse_counters WHERE id = ?);', (i, i))
+        def _set_amount(cursor):
+            # Create new pulse counters if required
+            for i in xrange(24, amount):
+                cursor.execute('INSERT INTO pulse_counters (id, name, room, persistent) '
+                               'SELECT ?, "", 255, 0 '
+                               'WHERE NOT EXISTS (SELECT 1 FROM pulse_counters WHERE id = ?);', (i, i))
 
-        # Delete pulse counters with a higher id
-        self._execute('DELETE FROM pulse_counters WHERE id >= ?;', (amount,))
+            # Delete pulse counters with a higher id
+            cursor.execute('DELETE FROM pulse_counters WHERE id >= ?;', (amount,))
+        self._database.transaction(_set_amount)
         return amount
 
     def get_pulse_counter_amount(self):
-        for row in self._execute('SELECT max(id) FROM pulse_counters;'):
+        for row in self._database.execute('SELECT max(id) FROM pulse_counters;'):
             max_id = row[0]
             return max_id + 1 if max_id is not None else 24
 
@@ -96,7 +91,7 @@ class PulseCounterController(object):
     def get_pulse_counter_status(self):
         pulse_counter_status = self._get_master_pulse_counter_status()
 
-        for row in self._execute('SELECT id FROM pulse_counters ORDER BY id ASC;'):
+        for row in self._database.execute('SELECT id FROM pulse_counters ORDER BY id ASC;'):
             pulse_counter_status.append(self._counts.get(row[0]))
 
         return pulse_counter_status
@@ -118,14 +113,14 @@ class PulseCounterController(object):
                 persistent=False
             )
         else:
-            for row in self._execute('SELECT id, name, room, persistent FROM pulse_counters WHERE id = ?;', (pulse_counter_id,)):
+            for row in self._database.execute('SELECT id, name, room, persistent FROM pulse_counters WHERE id = ?;', (pulse_counter_id,)):
                 return PulseCounterController._row_to_config(row)
 
     def get_configurations(self, fields=None):
         configs = [dict(o.serialize(), persistent=False)
                    for o in self._eeprom_controller.read_all(PulseCounterConfiguration, fields)]
 
-        for row in self._execute('SELECT id, name, room, persistent FROM pulse_counters ORDER BY id ASC;'):
+        for row in self._database.execute('SELECT id, name, room, persistent FROM pulse_counters ORDER BY id ASC;'):
             configs.append(PulseCounterController._row_to_config(row))
 
         return configs
@@ -146,7 +141,7 @@ class PulseCounterController(object):
                 if 'persistent' in config:
                     persistent = ', persistent = ?'
                     values = (config['name'], config['room'], 1 if config['persistent'] else 0, config['id'])
-                self._execute('UPDATE pulse_counters SET name = ?, room = ?{0} WHERE id = ?;'.format(persistent), values)
+                self._database.write('UPDATE pulse_counters SET name = ?, room = ?{0} WHERE id = ?;'.format(persistent), values)
 
     def set_configurations(self, config):
         for item in config:
@@ -154,6 +149,6 @@ class PulseCounterController(object):
 
     def get_persistence(self):
         configs = [False for _ in xrange(0, MASTER_PULSE_COUNTERS)]
-        for row in self._execute('SELECT persistent FROM pulse_counters ORDER BY id ASC;'):
+        for row in self._database.execute('SELECT persistent FROM pulse_counters ORDER BY id ASC;'):
             configs.append(row[0] >= 1)
         return configs
@@ -16,16 +16,15 @@
 The scheduling module contains the SchedulingController, this controller is used for scheduling various actions
 """
 
-import sqlite3
 import logging
 import time
 import pytz
 from datetime import datetime
 from croniter import croniter
-from random import randint
 from threading import Thread
 from ioc import Injectable, Inject, INJECTED, Singleton
 from platform_utils import Platform
+from database_utils import Database
 from gateway.webservice import params_parser
 import ujson as json
 
@@ -125,24 +124,18 @@ class SchedulingController(object):
     """
 
     @Inject
-    def __init__(self, scheduling_db=INJECTED, scheduling_db_lock=INJECTED, gateway_api=INJECTED):
+    def __init__(self, scheduling_db=INJECTED, gateway_api=INJECTED):
         """
         Constructs a new ConfigController.
 
         :param scheduling_db: filename of the sqlite database used to store the scheduling
-        :param scheduling_db_lock: DB lock
         :param gateway_api: GatewayAPI
         :type gateway_api: gateway.gateway_api.GatewayApi
         """
         self._gateway_api = gateway_api
         self._web_interface = None
 
-        self._lock = scheduling_db_lock
-        self._connection = sqlite3.connect(scheduling_db,
-                                           detect_types=sqlite3.PARSE_DECLTYPES,
-                                           check_same_thread=False,
-                                           isolation_level=None)
-        self._cursor = self._connection.cursor()
+        self._database = Database(scheduling_db)
         self._check_tables()
         self._schedules = {}
         self._stop = False
@@ -166,23 +159,15 @@ class SchedulingController(object):
     def schedules(self):
         return self._schedules.values()
 
-    def _execute(self, *args, **kwargs):
-        with self._lock:
-            try:
-                return self._cursor.execute(*args, **kwargs)
-            except sqlite3.OperationalError:
-                time.sleep(randint(1, 20) / 10.0)
-                return self._cursor.execute(*args, **kwargs)
-
     def _check_tables(self):
         """
         Creates tables and execute migrations
         """
-        self._execute('CREATE TABLE IF NOT EXISTS schedules (id INTEGER PRIMARY KEY, name TEXT, start INTEGER, '
-                      'repeat TEXT, duration INTEGER, end INTEGER, type TEXT, arguments TEXT, status TEXT);')
+        self._database.write('CREATE TABLE IF NOT EXISTS schedules (id INTEGER PRIMARY KEY, name TEXT, start INTEGER, '
+                             'repeat TEXT, duration INTEGER, end INTEGER, type TEXT, arguments TEXT, status TEXT);')
 
     def _load_schedule(self):
-        for row in self._execute('SELECT id, name, start, repeat, duration, end, type, arguments, status FROM schedules;'):
+        for row in self._database.execute('SELECT id, name, start, repeat, duration, end, type, arguments, status FROM schedules;'):
             schedule_id = row[0]
             self._schedules[schedule_id] = Schedule(id=schedule_id,
                                                     name=row[1],
@@ -195,24 +180,24 @@ class SchedulingController(object):
                                                     status=row[8])
 
     def _update_schedule_status(self, schedule_id, status):
-        self._execute('UPDATE schedules SET status = ? WHERE id = ?;', (status, schedule_id))
+        self._database.write('UPDATE schedules SET status = ? WHERE id = ?;', (status, schedule_id))
         self._schedules[schedule_id].status = status
 
     def remove_schedule(self, schedule_id):
-        self._execute('DELETE FROM schedules WHERE id = ?;', (schedule_id,))
+        self._database.write('DELETE FROM schedules WHERE id = ?;', (schedule_id,))
         self._schedules.pop(schedule_id, None)
 
     def add_schedule(self, name, start, schedule_type, arguments, repeat, duration, end):
         self._validate(name, start, schedule_type, arguments, repeat, duration, end)
-        self._execute('INSERT INTO schedules (name, start, repeat, duration, end, type, arguments, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
-                      (name,
-                       start,
-                       json.dumps(repeat) if repeat is not None else None,
-                       duration,
-                       end,
-                       schedule_type,
-                       json.dumps(arguments) if arguments is not None else None,
-                       'ACTIVE'))
+        self._database.write('INSERT INTO schedules (name, start, repeat, duration, end, type, arguments, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                             (name,
+                              start,
+                              json.dumps(repeat) if repeat is not None else None,
+                              duration,
+                              end,
+                              schedule_type,
+                              json.dumps(arguments) if arguments is not None else None,
+                              'ACTIVE'))
         self._load_schedule()
 
     def start(self):
@@ -0,0 +1,185 @@
+# Copyright (C) 2019 OpenMotics BV
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+The state stream module keeps the state clients can subscribe to over a websocket, as a snapshot followed by
+sequence-numbered changes.
+"""
+
+import logging
+import time
+from collections import deque
+from threading import Lock
+from gateway.observer import Event
+
+logger = logging.getLogger('openmotics')
+
+
+class StateStream(object):
+    """
+    Keeps the state of the subscribable domains, per element (e.g. per output), and numbers every change of an
+    element. A subscriber gets a snapshot of its domains and then only the changes. The most recent changes are
+    kept, so a subscriber that reconnects with the last sequence it got only receives what it missed.
+    """
+
+    class Domains(object):
+        OUTPUTS = 'outputs'
+        INPUTS = 'inputs'
+        SHUTTERS = 'shutters'
+        THERMOSTATS = 'thermostats'
+        SENSORS = 'sensors'
+        POWER = 'power'
+
+    HISTORY_SIZE = 1000
+    CLOSED_SUBSCRIPTIONS = 100  # Subscriptions of which the domains are remembered, for resuming clients
+    POLL_INTERVAL = 1.0  # Seconds between refreshes of domains that weren't invalidated
+
+    def __init__(self, loaders, history_size=None):
+        """
+        :param loaders: Function per domain, returning the current state of that domain as a dict with a state per element
+        :type loaders: dict
+        :param history_size: Number of changes kept for resuming subscribers
+        """
+        self._loaders = loaders
+        self._lock = Lock()
+        self._states = {}
+        self._history = deque(maxlen=history_size or StateStream.HISTORY_SIZE)
+        # Sequences continue over restarts, so a sequence of a previous run is never resumed
+        self._sequence = int(time.time() * 1000)
+        self._first_sequence = self._sequence
+        self._subscribers = {}  # Client id -> (domains, send, sequence of the subscription)
+        self._closed_subscriptions = deque(maxlen=StateStream.CLOSED_SUBSCRIPTIONS)  # (domains, first sequence, last sequence)
+        self._invalidated = set()
+        self._last_poll = 0
+
+    def get_domains(self):
+        return list(self._loaders.keys())
+
+    def invalidate(self, domain):
+        """ Refreshes the domain on the next refresh. Doesn't load anything, so it can be called from any thread """
+        self._invalidated.add(domain)
+
+    def subscribe(self, client_id, domains, send, sequence=None):
+        """
+        Subscribes to the changes of the given domains. A STATE_SNAPSHOT replaces the state of the domains it
+        contains: a resumed subscription only gets a snapshot of the domains it didn't have before.
+
+        :param client_id: Id of the subscriber, a next subscription of the same id replaces the previous one
+        :param domains: The domains to subscribe to
+        :param send: Called with an Event (STATE_SNAPSHOT or STATE_DELTA) for every frame, it should not block
+        :param sequence: Last sequence the client received, to resume where it left off
+        :returns: Whether the subscription resumed from the sequence, otherwise a snapshot was sent
+        """
+        domains = set(domain for domain in domains if domain in self._loaders)
+        # Domains without subscribers aren't refreshed, they're brought up to date first
+        self.refresh(domains=domains - self._get_subscribed_domains())
+        with self._lock:
+            self._close_subscription(client_id)
+            changes = None
+            resumed_domains = set()
+            if sequence is not None:
+                changes = self._get_changes_since(sequence, domains)
+                if changes is not None:
+                    resumed_domains = domains & self._get_previous_domains(sequence)
+            self._subscribers[client_id] = (domains, send, self._sequence)
+            new_domains = domains - resumed_domains
+            if new_domains or not resumed_domains:
+                send(Event(event_type=Event.Types.STATE_SNAPSHOT,
+                           data={'sequence': self._sequence,
+                                 'state': dict((domain, dict(self._states.get(domain, {}))) for domain in new_domains)}))
+            if resumed_domains:
+                send(Event(event_type=Event.Types.STATE_DELTA,
+                           data={'sequence': self._sequence,
+                                 'changes': [change for change in changes if change[0] in resumed_domains]}))
+                return True
+            return False
+
+    def unsubscribe(self, client_id):
+        with self._lock:
+            self._close_subscription(client_id)
+
+    def _close_subscription(self, client_id):
+        subscription = self._subscribers.pop(client_id, None)
+        if subscription is not None:
+            self._closed_subscriptions.append((subscription[0], subscription[2], self._sequence))
+
+    def _get_subscribed_domains(self):
+        with self._lock:
+            domains = set()
+            for subscribed_domains, _, _ in self._subscribers.itervalues():
+                domains |= subscribed_domains
+            return domains
+
+    def _get_previous_domains(self, sequence):
+        """
+        Returns the domains a client that received the sequence had a snapshot of: the domains all closed subscriptions
+        that could have received that sequence had in common
+        """
+        domains = None
+        for subscribed_domains, first_sequence, last_sequence in self._closed_subscriptions:
+            if first_sequence <= sequence <= last_sequence:
+                domains = subscribed_domains if domains is None else domains & subscribed_domains
+        return domains or set()
+
+    def _get_changes_since(self, sequence, domains):
+        if sequence > self._sequence or sequence < self._first_sequence:
+            return None  # Unknown, e.g. of a previous run
+        if self._history and sequence < self._history[0][0] - 1:
+            return None  # Too old
+        return [[domain, element_id, state] for change_sequence, domain, element_id, state in self._history
+                if change_sequence > sequence and domain in domains]
+
+    def refresh(self, domains=None, now=None):
+        """
+        Loads the domains and sends the changes to the subscribers. By default the invalidated domains are refreshed,
+        and all domains once every poll interval, but only the ones that are subscribed to.
+        """
+        if domains is None:
+            if now is None:
+                now = time.time()
+            invalidated, self._invalidated = self._invalidated, set()
+            subscribed_domains = self._get_subscribed_domains()
+            domains = invalidated & subscribed_domains
+            if now >= self._last_poll + StateStream.POLL_INTERVAL:
+                self._last_poll = now
+                domains = subscribed_domains
+        for domain in domains:
+            try:
+                state = self._loaders[domain]()
+            except Exception as ex:
+                logger.error('Could not load the {0} state: {1}'.format(domain, ex))
+                continue
+            with self._lock:
+                self._update(domain, state)
+
+    def _update(self, domain, state):
+        old_state = self._states.get(domain, {})
+        changes = []
+        for element_id, element_state in state.iteritems():
+            if element_id not in old_state or old_state[element_id] != element_state:
+                changes.append([domain, element_id, element_state])
+        for element_id in old_state:
+            if element_id not in state:
+                changes.append([domain, element_id, None])  # Removed
+        self._states[domain] = state
+        if not changes:
+            return
+        for change in changes:
+            self._sequence += 1
+            self._history.append((self._sequence, change[0], change[1], change[2]))
+        event = Event(event_type=Event.Types.STATE_DELTA,
+                      data={'sequence': self._sequence, 'changes': changes})
+        for subscribed_domains, send, _ in self._subscribers.values():
+            if domain in subscribed_domains:
+                send(event)
@@ -0,0 +1,145 @@
+# Copyright (C) 2019 OpenMotics BV
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+The status snapshot module keeps versioned copies of the status information (outputs, thermostats, sensors, power)
+so clients polling the status don't cause traffic on the master or energy bus.
+"""
+
+import time
+from threading import Lock
+
+
+class StatusSnapshot(object):
+    """
+    Read-through cache of status information. Every change of a status gets a new version, which is also tracked
+    per element (e.g. per output or per power module) so clients can fetch only what changed since a version they know.
+    """
+
+    class Keys(object):
+        OUTPUTS = 'outputs'
+        THERMOSTATS = 'thermostats'
+        SENSOR_TEMPERATURE = 'sensor_temperature'
+        SENSOR_HUMIDITY = 'sensor_humidity'
+        SENSOR_BRIGHTNESS = 'sensor_brightness'
+        REALTIME_POWER = 'realtime_power'
+        TOTAL_ENERGY = 'total_energy'
+
+    DEFAULT_MAX_AGES = {Keys.OUTPUTS: 1,
+                        Keys.THERMOSTATS: 5,
+                        Keys.SENSOR_TEMPERATURE: 5,
+                        Keys.SENSOR_HUMIDITY: 5,
+                        Keys.SENSOR_BRIGHTNESS: 5,
+                        Keys.REALTIME_POWER: 1,
+                        Keys.TOTAL_ENERGY: 10}
+
+    def __init__(self, max_ages=None):
+        """
+        :param max_ages: Seconds a status can be served without loading it again, per key
+        :type max_ages: dict
+        """
+        self._lock = Lock()
+        self._load_locks = {}
+        self._max_ages = dict(StatusSnapshot.DEFAULT_MAX_AGES)
+        self._max_ages.update(max_ages or {})
+        self._entries = {}
+        # Versions continue over restarts, so a version (or ETag) of a previous run never matches a new status
+        self._version = int(time.time() * 1000)
+
+    def set_max_age(self, key, max_age):
+        self._max_ages[key] = max_age
+
+    def get(self, key, load, since_version=None):
+        """
+        Returns a status, loading it when it's older than the maximum age of the key.
+        :param key: Status key
+        :param load: Function returning the current status
+        :param since_version: Only return the elements that changed since this version
+        :returns: Tuple (status, version, delta). The status only contains the changed elements if delta is True.
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry['timestamp'] + self._max_ages.get(key, 0) < time.time():
+            with self._lock:
+                load_lock = self._load_locks.setdefault(key, Lock())
+            with load_lock:
+                # Concurrent requests wait for a single load instead of all querying the bus
+                entry = self._entries.get(key)
+                if entry is None or entry['timestamp'] + self._max_ages.get(key, 0) < time.time():
+                    self.set(key, load())
+                    entry = self._entries[key]
+        return StatusSnapshot._get_changes(entry, since_version)
+
+    def set(self, key, status):
+        """ Stores a status, returns its version """
+        with self._lock:
+            now = time.time()
+            entry = self._entries.get(key)
+            if entry is not None and entry['status'] == status:
+                entry['timestamp'] = now
+                return entry['version']
+            self._version += 1
+            version = self._version
+            elements = StatusSnapshot._get_elements(status)
+            element_versions = {}
+            full_version = version
+            if entry is not None and elements is not None and entry['elements'] is not None:
+                old_elements = entry['elements']
+                for element_key, element in elements.iteritems():
+                    if element_key in old_elements and old_elements[element_key] == element:
+                        element_versions[element_key] = entry['element_versions'][element_key]
+                    else:
+                        element_versions[element_key] = version
+                if all(element_key in elements for element_key in old_elements):
+                    full_version = entry['full_version']  # Nothing removed, so older versions can still get a delta
+            elif elements is not None:
+                element_versions = dict((element_key, version) for element_key in elements)
+            self._entries[key] = {'status': status,
+                                  'version': version,
+                                  'full_version': full_version,
+                                  'timestamp': now,
+                                  'elements': elements,
+                                  'element_versions': element_versions}
+            return version
+
+    def invalidate(self, key=None):
+        """ Makes sure the next request loads the status again. The versions are kept, so deltas keep working """
+        with self._lock:
+            for entry_key, entry in self._entries.iteritems():
+                if key is None or entry_key == key:
+                    entry['timestamp'] = 0
+
+    @staticmethod
+    def _get_elements(status):
+        """ Returns the individually versioned elements: the items of a dict or the entries of a list of dicts with an id """
+        if isinstance(status, dict):
+            return dict(status)
+        if isinstance(status, list) and all(isinstance(element, dict) and 'id' in element for element in status):
+            return dict((element['id'], element) for element in status)
+        return None
+
+    @staticmethod
+    def _get_changes(entry, since_version):
+        status = entry['status']
+        version = entry['version']
+        if since_version is None:
+            return status, version, False
+        if since_version >= version:
+            return type(status)(), version, True
+        if entry['elements'] is None or since_version < entry['full_version']:
+            return status, version, False
+        if isinstance(status, dict):
+            return dict((element_key, element) for element_key, element in status.iteritems()
+                        if entry['element_versions'][element_key] > since_version), version, True
+        return [element for element in status
+                if entry['element_versions'][element['id']] > since_version], version, True
@@ -17,12 +17,134 @@ The users module contains the UserController class, which provides methods for c
 and authenticating users.
 """
 
-import sqlite3
 import hashlib
+import heapq
 import uuid
 import time
-from random import randint
+from threading import Lock
 from ioc import Injectable, Inject, Singleton, INJECTED
+from database_utils import Database
+
+
+class TokenStore(object):
+    """
+    Keeps the valid tokens. A token is checked with a single lookup, the tokens of a user are indexed by username and
+    expired tokens are popped from a heap ordered by expiry time. When a database is given, the tokens are stored so
+    they survive a restart. Only a hash of every token is stored, so the stored hashes can't be used as tokens. The
+    tokens loaded after a restart are therefore kept by their hash, until they are used for the first time.
+    """
+
+    def __init__(self, database=None):
+        self._database = database
+        self._tokens = {}  # Token -> (username, valid until)
+        self._loaded = {}  # Hash of a loaded token that wasn't used yet -> (username, valid until)
+        self._user_tokens = {}  # Username -> set of tokens
+        self._expiry = []  # Heap of (valid until, token or hash of a loaded token)
+        self._lock = Lock()
+        if self._database is not None:
+            self._database.write('CREATE TABLE IF NOT EXISTS tokens (hash TEXT PRIMARY KEY, username TEXT, valid_until REAL);')
+            for token_hash, username, valid_until in self._database.execute('SELECT hash, username, valid_until FROM tokens WHERE valid_until >= ?;',
+                                                                            (time.time(),)):
+                self._loaded[token_hash] = (username, valid_until)
+                heapq.heappush(self._expiry, (valid_until, token_hash))
+
+    @staticmethod
+    def _hash(token):
+        if isinstance(token, unicode):
+            token = token.encode('utf-8')
+        return hashlib.sha256(token).hexdigest()
+
+    def _add(self, token, username, valid_until):
+        self._tokens[token] = (username, valid_until)
+        self._user_tokens.setdefault(username, set()).add(token)
+        heapq.heappush(self._expiry, (valid_until, token))
+
+    def _remove(self, token):
+        entry = self._tokens.pop(token, None)
+        if entry is not None:
+            user_tokens = self._user_tokens[entry[0]]
+            user_tokens.discard(token)
+            if not user_tokens:
+                del self._user_tokens[entry[0]]
+        return entry
+
+    def _purge(self, now):
+        """ Removes the expired tokens from memory, the stored ones are removed when a token is added """
+        expiry = self._expiry
+        while expiry and expiry[0][0] < now:
+            valid_until, key = heapq.heappop(expiry)
+            entry = self._tokens.get(key)
+            if entry is not None and entry[1] == valid_until:
+                self._remove(key)
+            elif key in self._loaded:
+                del self._loaded[key]
+
+    def _load(self, token):
+        """ Looks up a token loaded after a restart, and keeps it by the token itself from now on """
+        token_hash = TokenStore._hash(token)
+        if token_hash not in self._loaded:
+            return None  # Most likely an invalid token, which doesn't need to wait for the lock
+        with self._lock:
+            entry = self._loaded.pop(token_hash, None)
+            if entry is not None:
+                self._add(token, entry[0], entry[1])
+        return entry
+
+    def add(self, username, valid_until):
+        """ Generates a new token for the given user """
+        token = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._purge(now)
+            self._add(token, username, valid_until)
+        if self._database is not None:
+            token_hash = TokenStore._hash(token)
+
+            def _store(cursor):
+                cursor.execute('DELETE FROM tokens WHERE valid_until < ?;', (now,))
+                cursor.execute('INSERT INTO tokens (hash, username, valid_until) VALUES (?, ?, ?);', (token_hash, username, valid_until))
+            self._database.transaction(_store)
+        return token
+
+    def check(self, token):
+        """ Returns True if the token is valid """
+        if token is None:
+            return False
+        entry = self._tokens.get(token)
+        if entry is None:
+            if not self._loaded:
+                return False
+            entry = self._load(token)
+            if entry is None:
+                return False
+        now = time.time()
+        if entry[1] < now:
+            with self._lock:
+                self._purge(now)
+            return False
+        return True
+
+    def remove(self, token):
+        """ Removes a single token """
+        if token is None:
+            return
+        token_hash = TokenStore._hash(token)
+        with self._lock:
+            entry = self._remove(token)
+            if entry is None:
+                entry = self._loaded.pop(token_hash, None)
+        if entry is not None and self._database is not None:
+            self._database.write('DELETE FROM tokens WHERE hash = ?;', (token_hash,))
+
+    def remove_user(self, username):
+        """ Removes all tokens of a given user """
+        with self._lock:
+            for token in list(self._user_tokens.get(username, [])):
+                self._remove(token)
+            for token_hash in [token_hash for token_hash, entry in self._loaded.iteritems() if entry[0] == username]:
+                del self._loaded[token_hash]
+        if self._database is not None:
+            self._database.write('DELETE FROM tokens WHERE username = ?;', (username,))
 
 
 @Injectable.named('user_controller')
@@ -33,62 +155,44 @@ class UserController(object):
     TERMS_VERSION = 1
 
     @Inject
-    def __init__(self, user_db=INJECTED, user_db_lock=INJECTED, config=INJECTED, token_timeout=INJECTED):
+    def __init__(self, user_db=INJECTED, config=INJECTED, token_timeout=INJECTED, persist_tokens=True):
         """ Constructor a new UserController.
 
         :param user_db: filename of the sqlite database used to store the users and tokens.
-        :param lock: shared lock for the given DB
-        :type lock: threading.Lock
         :param config: Contains the OpenMotics cloud username and password.
         :type config: A dict with keys 'username' and 'password'.
         :param token_timeout: the number of seconds a token is valid.
+        :param persist_tokens: keep the tokens valid after a restart.
         """
-        self._lock = user_db_lock
         self._config = config
-        self._connection = sqlite3.connect(user_db,
-                                           detect_types=sqlite3.PARSE_DECLTYPES,
-                                           check_same_thread=False,
-                                           isolation_level=None)
-        self._cursor = self._connection.cursor()
+        self._database = Database(user_db)
         self._token_timeout = token_timeout
-        self._tokens = {}
         self._schema = {'username': "TEXT UNIQUE",
                         'password': "TEXT",
                         'role': "TEXT",
                         'enabled': "INT",
                         'accepted_terms': "INT default 0"}
         self._check_tables()
+        self._tokens = TokenStore(self._database if persist_tokens else None)
 
         # Create the user for the cloud
         self.create_user(self._config['username'].lower(), self._config['password'], "admin", True, True)
 
-    def _execute(self, *args, **kwargs):
-        lock = kwargs.pop('lock', True)
-        try:
-            if lock:
-                self._lock.acquire()
-            return self._cursor.execute(*args, **kwargs)
-        except sqlite3.OperationalError:
-            time.sleep(randint(1, 20) / 10.0)
-            return self._cursor.execute(*args, **kwargs)
-        finally:
-            if lock:
-                self._lock.release()
-
     def _check_tables(self):
         """
         Creates tables and execute migrations
         """
-        with self._lock:
-            self._execute("CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, {0});".format(
+        def _migrate(cursor):
+            cursor.execute("CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, {0});".format(
                 ", ".join(['{0} {1}'.format(key, value) for key, value in self._schema.iteritems()])
-            ), lock=False)
+            ))
             fields = []
-            for row in self._execute("PRAGMA table_info('users');", lock=False):
+            for row in cursor.execute("PRAGMA table_info('users');").fetchall():
                 fields.append(row[1])
             for field, field_type in self._schema.iteritems():
                 if field not in fields:
-                    self._execute("ALTER TABLE users ADD COLUMN {0} {1};".format(field, field_type), lock=False)
+                    cursor.execute("ALTER TABLE users ADD COLUMN {0} {1};".format(field, field_type))
+        self._database.transaction(_migrate)
 
     @staticmethod
     def _hash(password):
@@ -111,8 +215,8 @@ class UserController(object):
         username = username.lower()
         accepted_terms = UserController.TERMS_VERSION if accept_terms else 0
 
-        self._execute("INSERT OR REPLACE INTO users (username, password, role, enabled, accepted_terms) VALUES (?, ?, ?, ?, ?);",
-                      (username, UserController._hash(password), role, int(enabled), accepted_terms))
+        self._database.write("INSERT OR REPLACE INTO users (username, password, role, enabled, accepted_terms) VALUES (?, ?, ?, ?, ?);",
+                             (username, UserController._hash(password), role, int(enabled), accepted_terms))
 
     def get_usernames(self):
         """ Get all usernames.
@@ -120,7 +224,7 @@ class UserController(object):
         :returns: a list of strings.
         """
         usernames = []
-        for row in self._execute("SELECT username FROM users;"):
+        for row in self._database.execute("SELECT username FROM users;"):
             usernames.append(row[0])
         return usernames
 
@@ -134,19 +238,12 @@ class UserController(object):
         if self.get_role(username) == "admin" and self._get_num_admins() == 1:
             raise Exception("Cannot delete last admin account")
         else:
-            self._execute("DELETE FROM users WHERE username = ?;", (username,))
-
-            to_remove = []
-            for token in self._tokens:
-                if self._tokens[token][0] == username:
-                    to_remove.append(token)
-
-            for token in to_remove:
-                del self._tokens[token]
+            self._database.write("DELETE FROM users WHERE username = ?;", (username,))
+            self._tokens.remove_user(username)
 
     def _get_num_admins(self):
         """ Get the number of admin users in the system. """
-        for row in self._execute("SELECT count(*) FROM users WHERE role = ?", ("admin",)):
+        for row in self._database.execute("SELECT count(*) FROM users WHERE role = ?", ("admin",)):
             return row[0]
         return 0
 
@@ -165,50 +262,39 @@ class UserController(object):
         if timeout is None:
             timeout = self._token_timeout
 
-        for row in self._execute("SELECT id, accepted_terms FROM users WHERE username = ? AND password = ? AND enabled = ?;",
-                                 (username, UserController._hash(password), 1)):
+        for row in self._database.execute("SELECT id, accepted_terms FROM users WHERE username = ? AND password = ? AND enabled = ?;",
+                                          (username, UserController._hash(password), 1)):
             user_id, accepted_terms = row[0], row[1]
             if accepted_terms == UserController.TERMS_VERSION:
                 return True, self._gen_token(username, time.time() + timeout)
             if accept_terms is True:
-                self._execute("UPDATE users SET accepted_terms = ? WHERE id = ?;",
-                              (UserController.TERMS_VERSION, user_id))
+                self._database.write("UPDATE users SET accepted_terms = ? WHERE id = ?;",
+                                     (UserController.TERMS_VERSION, user_id))
                 return True, self._gen_token(username, time.time() + timeout)
             return False, 'terms_not_accepted'
         return False, 'invalid_credentials'
 
     def logout(self, token):
         """ Removes the token from the controller. """
-        self._tokens.pop(token, None)
+        self._tokens.remove(token)
 
     def get_role(self, username):
         """ Get the role for a certain user. Returns None is user was not found. """
         username = username.lower()
 
-        for row in self._execute("SELECT role FROM users WHERE username = ?;", (username,)):
+        for row in self._database.execute("SELECT role FROM users WHERE username = ?;", (username,)):
             return row[0]
 
         return None
 
     def _gen_token(self, username, valid_until):
-        """ Generate a token and insert it into the tokens dict. """
-        ret = uuid.uuid4().hex
-        self._tokens[ret] = (username, valid_until)
-
-        # Delete the expired tokens
-        for token in self._tokens.keys():
-            if self._tokens[token][1] < time.time():
-                self._tokens.pop(token, None)
-
-        return ret
+        """ Generate a token and insert it into the token store. """
+        return self._tokens.add(username, valid_until)
 
     def check_token(self, token):
         """ Returns True if the token is valid, False if the token is invalid. """
-        if token is None or token not in self._tokens:
-            return False
-        else:
-            return self._tokens[token][1] >= time.time()
+        return self._tokens.check(token)
 
     def close(self):
         """ Cose the database connection. """
-        self._connection.close()
+        self._database.close()
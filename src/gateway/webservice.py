@@ -27,13 +27,19 @@ import sys
 import threading
 import time
 import uuid
+import zlib
 import ujson as json
 from ioc import Injectable, Inject, INJECTED, Singleton
 from cherrypy.lib.static import serve_file
+from cherrypy.process.plugins import Monitor
 from decorator import decorator
 from bus.om_bus_events import OMBusEvents
 from gateway.shutters import ShutterController
+from gateway.observer import Event
+from gateway.state_stream import StateStream
+from gateway.status_snapshot import StatusSnapshot
 from gateway.maintenance_communicator import InMaintenanceModeException
+from gateway.metrics_exporter import CONTENT_TYPE as OPENMETRICS_CONTENT_TYPE, format_family
 from power.power_communicator import InAddressModeException
 from platform_utils import System
 from serial_utils import CommunicationTimedOutException
@@ -42,30 +48,22 @@ from gateway.websockets import OMPlugin, OMSocketTool, MetricsSocket, EventsSock
 logger = logging.getLogger("openmotics")
 
 
-class FloatWrapper(float):
-    """ Wrapper for float value that limits the number of digits when printed. """
-
-    def __repr__(self):
-        return '%.2f' % self
+FLOAT_PRECISION = 2  # Digits of the floats in API responses
+GZIP_MIN_SIZE = 1024  # Smaller responses aren't worth compressing
+GZIP_LEVEL = 6
+RESPONSE_CACHE_SIZE = 32
 
 
 class BadRequestException(Exception):
         pass
 
 
-def limit_floats(struct):
+def dumps_limited(data):
     """
-    Usage: json.dumps(limit_floats(struct)). This limits the number of digits in the json string.
-    :param struct: Structure of which floats will be shortended
+    Serializes data to json, limiting the number of digits of the floats. The digits are limited by the encoder
+    itself, so the data doesn't need to be copied.
     """
-    if isinstance(struct, (list, tuple)):
-        return [limit_floats(element) for element in struct]
-    elif isinstance(struct, dict):
-        return dict((key, limit_floats(value)) for key, value in struct.items())
-    elif isinstance(struct, float):
-        return FloatWrapper(struct)
-    else:
-        return struct
+    return json.dumps(data, double_precision=FLOAT_PRECISION)
 
 
 def error_generic(status, message, *args, **kwargs):
@@ -101,7 +99,7 @@ def params_parser(params, param_types):
             elif param_types[key] == bool:
                 params[key] = str(value).lower() not in ['false', '0', '0.0', 'no']
             elif param_types[key] == 'json':
-                params[key] = json.loads(value)
+                params[key] = json.loads(value) if isinstance(value, basestring) else value
             elif param_types[key] == int:
                 # Double convertion. Params come in as strings, and int('0.0') fails, while int(float('0.0')) works as expected
                 params[key] = int(float(value))
@@ -177,31 +175,138 @@ cherrypy.tools.authenticated = cherrypy.Tool('before_handler', authentication_ha
 cherrypy.tools.params = cherrypy.Tool('before_handler', params_handler)
 
 
-@decorator
-def _openmotics_api(f, *args, **kwargs):
-    start = time.time()
-    timings = {}
-    status = 200  # OK
+_response_cache = {}  # (API call, parameters) -> [version, contents, gzipped contents]
+_timings = threading.local()  # The Server-Timing entries of the API call being executed by the thread
+_etags = threading.local()  # The ETag of the API call being served over HTTP by the thread
+
+
+def _accepts_gzip():
+    """ Returns whether the client accepts gzip encoded responses """
+    accept_encoding = cherrypy.request.headers.get('Accept-Encoding')
+    if accept_encoding is None:
+        return False
+    for encoding in accept_encoding.split(','):
+        parts = encoding.strip().split(';')
+        if parts[0].strip().lower() in ['gzip', '*']:
+            for parameter in parts[1:]:
+                key, _, value = parameter.strip().partition('=')
+                if key == 'q':
+                    try:
+                        return float(value) > 0
+                    except ValueError:
+                        return False
+            return True
+    return False
+
+
+def _gzip(contents):
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # 16+: gzip header and trailer
+    return compressor.compress(contents) + compressor.flush()
+
+
+def _gzip_etag(etag):
+    """ The gzip encoded response is another representation, so it has its own (strong) ETag """
+    return etag[:-1] + '-gzip"'
+
+
+def _send(contents, gzipped=None):
+    """ Returns the response body, gzip encoded if the client accepts it. Returns the gzipped contents to cache """
+    response = cherrypy.response
+    response.headers['Vary'] = 'Accept-Encoding'
+    if len(contents) < GZIP_MIN_SIZE or not _accepts_gzip():
+        return contents, gzipped
+    if gzipped is None:
+        gzipped = _gzip(contents)
+    response.headers['Content-Encoding'] = 'gzip'
+    etag = response.headers.get('ETag')
+    if etag is not None:
+        response.headers['ETag'] = _gzip_etag(etag)
+    return gzipped, gzipped
+
+
+def _get_cached(f, args, kwargs):
+    """
+    Returns the cache key, cache entry and ETag of an API call of which the data has a version, raises a 304 Not
+    Modified when the client already has it. Unchanged data doesn't need to be loaded and serialized again.
+    """
+    version = f.cache_version(args[0])
+    if version is None:
+        return None, None, None
+    parameters = json.dumps([args[1:], kwargs], sort_keys=True)
+    key = (f.__name__, parameters)
+    etag = '"{0}-{1}-{2:x}"'.format(f.__name__, version, zlib.crc32(parameters) & 0xffffffff)
+    _check_if_none_match(etag)
+    entry = _response_cache.get(key)
+    if entry is not None and entry[0] == version:
+        return key, entry, etag
+    return key, [version, None, None], etag
+
+
+def set_etag(etag):
+    """
+    Sets the ETag of the API call being served over HTTP, it's sent (or answered with a 304 Not Modified) when the call
+    succeeds. Ignored when the call is executed for a plugin or in a batch, as there's no conditional request then.
+    """
+    etags = getattr(_etags, 'current', None)
+    if etags is not None:
+        etags[0] = etag
+
+
+def add_server_timing(key, description, duration):
+    """ Adds an entry to the Server-Timing header of the API call being executed """
+    timings = getattr(_timings, 'current', None)
+    if timings is not None:
+        timings[key] = (description, duration)
+
+
+def _execute(f, args, kwargs):
+    """ Executes an API function, returns the HTTP status and the response data """
     try:
-        return_data = f(*args, **kwargs)
-        data = limit_floats(dict({'success': True}.items() + return_data.items()))
+        data = {'success': True}
+        data.update(f(*args, **kwargs))
+        return 200, data  # OK
+    except cherrypy.HTTPRedirect:
+        raise  # E.g. 304 Not Modified
     except cherrypy.HTTPError as ex:
-        status = ex.status
-        data = {'success': False, 'msg': ex._message}
+        return ex.status, {'success': False, 'msg': ex._message}
     except (InMaintenanceModeException, InAddressModeException):
-        status = 503  # Service Unavailable
-        data = {'success': False, 'msg': 'maintenance_mode'}
+        return 503, {'success': False, 'msg': 'maintenance_mode'}  # Service Unavailable
     except CommunicationTimedOutException:
         logger.error('Communication timeout during API call %s', f.__name__)
-        status = 200  # OK
-        data = {'success': False, 'msg': 'Internal communication timeout'}
+        return 200, {'success': False, 'msg': 'Internal communication timeout'}
     except Exception as ex:
         logger.exception('Unexpected error during API call %s', f.__name__)
-        status = 200  # OK
-        data = {'success': False, 'msg': str(ex)}
+        return 200, {'success': False, 'msg': str(ex)}
+
+
+@decorator
+def _openmotics_api(f, *args, **kwargs):
+    start = time.time()
+    cache_key, entry, etag = None, None, None
+    if f.cache_version is not None:
+        cache_key, entry, etag = _get_cached(f, args, kwargs)
+        if entry is not None and entry[1] is not None:
+            cherrypy.response.headers['ETag'] = etag
+            cherrypy.response.headers['Content-Type'] = 'application/json'
+            cherrypy.response.headers['Server-Timing'] = 'cache={0}; "Cached"'.format((time.time() - start) * 1000)
+            contents, entry[2] = _send(entry[1], entry[2])
+            return contents
+    timings = {}
+    etags = [etag]
+    previous_timings, previous_etags = getattr(_timings, 'current', None), getattr(_etags, 'current', None)
+    _timings.current, _etags.current = timings, etags
+    try:
+        status, data = _execute(f, args, kwargs)
+    finally:
+        _timings.current, _etags.current = previous_timings, previous_etags
+    etag = etags[0]
     timings['process'] = ('Processing', time.time() - start)
+    if status != 200 or data['success'] is not True:
+        cherrypy.response.headers.pop('ETag', None)  # Only the data of a successful call is identified by the ETag
+    elif etag is not None:
+        check_etag(etag)
     serialization_start = time.time()
-    contents = json.dumps(data)
+    contents = dumps_limited(data)
     timings['serialization'] = 'Serialization', time.time() - serialization_start
     cherrypy.response.headers['Content-Type'] = 'application/json'
     cherrypy.response.headers['Server-Timing'] = ','.join(['{0}={1}; "{2}"'.format(key, value[1] * 1000, value[0])
@@ -209,12 +314,49 @@ def _openmotics_api(f, *args, **kwargs):
     if hasattr(f, 'deprecated') and f.deprecated is not None:
         cherrypy.response.headers['Warning'] = 'Warning: 299 - "Deprecated, replaced by: {0}"'.format(f.deprecated)
     cherrypy.response.status = status
+    if entry is not None and status == 200 and data['success'] is True:
+        if len(_response_cache) >= RESPONSE_CACHE_SIZE:
+            _response_cache.clear()
+        entry[1] = contents
+        _response_cache[cache_key] = entry
+    contents, gzipped = _send(contents)
+    if entry is not None:
+        entry[2] = gzipped
     return contents
 
 
-def openmotics_api(auth=False, check=None, pass_token=False, plugin_exposed=True, deprecated=None):
+def check_etag(etag):
+    """ Sets the ETag of the response, raises a 304 Not Modified if the client already has it (in any encoding) """
+    cherrypy.response.headers['ETag'] = etag
+    _check_if_none_match(etag)
+
+
+def _check_if_none_match(etag):
+    """ Raises a 304 Not Modified if the client already has the ETag (in any encoding) """
+    if_none_match = cherrypy.request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        if etag in tags:
+            cherrypy.response.headers['ETag'] = etag
+            raise cherrypy.HTTPRedirect([], 304)
+        if _gzip_etag(etag) in tags:
+            cherrypy.response.headers['ETag'] = _gzip_etag(etag)
+            raise cherrypy.HTTPRedirect([], 304)
+
+
+def _configuration_version(web_interface):
+    return web_interface._gateway_api.get_configuration_version()
+
+
+def openmotics_api(auth=False, check=None, pass_token=False, plugin_exposed=True, deprecated=None, cache_version=None):
+    """
+    :param cache_version: Function returning the version of the data of the call (given the WebInterface), or None when
+                          the version isn't known. Versioned calls get an ETag and are cached until the version changes.
+    """
     def wrapper(func):
         func.deprecated = deprecated
+        func.cache_version = cache_version
+        api_function = func
         func = _openmotics_api(func)
         if auth is True:
             func = cherrypy.tools.authenticated(pass_token=pass_token)(func)
@@ -222,7 +364,9 @@ def openmotics_api(auth=False, check=None, pass_token=False, plugin_exposed=True
             func = cherrypy.tools.params(**check)(func)
         func.exposed = True
         func.plugin_exposed = plugin_exposed
+        func.pass_token = pass_token
         func.check = check
+        func.api_function = api_function
         return func
     return wrapper
 
@@ -236,6 +380,16 @@ def types(**kwargs):
 class WebInterface(object):
     """ This class defines the web interface served by cherrypy. """
 
+    TOKEN_CHECK_INTERVAL = 60
+    MAX_BATCH_CALLS = 100
+    METRICS_FLUSH_FREQUENCY = 0.25
+    STATE_REFRESH_FREQUENCY = 0.25
+    STATE_EVENT_DOMAINS = {Event.Types.OUTPUT_CHANGE: StateStream.Domains.OUTPUTS,
+                           Event.Types.INPUT_CHANGE: StateStream.Domains.INPUTS,
+                           Event.Types.SHUTTER_CHANGE: StateStream.Domains.SHUTTERS,
+                           Event.Types.THERMOSTAT_CHANGE: StateStream.Domains.THERMOSTATS,
+                           Event.Types.THERMOSTAT_GROUP_CHANGE: StateStream.Domains.THERMOSTATS}
+
     @Inject
     def __init__(self,
                  user_controller=INJECTED, gateway_api=INJECTED, maintenance_controller=INJECTED,
@@ -264,27 +418,64 @@ class WebInterface(object):
 
         self._ws_metrics_registered = False
         self._power_dirty = False
+        self._state_stream = StateStream(loaders={StateStream.Domains.OUTPUTS: self._load_output_state,
+                                                  StateStream.Domains.INPUTS: self._load_input_state,
+                                                  StateStream.Domains.SHUTTERS: self._load_shutter_state,
+                                                  StateStream.Domains.THERMOSTATS: self._load_thermostat_state,
+                                                  StateStream.Domains.SENSORS: self._load_sensor_state,
+                                                  StateStream.Domains.POWER: self._load_power_state})
 
     def in_authorized_mode(self):
         return self._message_client.get_state('led_service', {}).get('authorized_mode', False)
 
+    def _check_receiver_token(self, receiver_info):
+        """ Validates the token of a websocket receiver, but only once every `TOKEN_CHECK_INTERVAL` seconds """
+        now = time.time()
+        if receiver_info.get('token_checked', 0) > now - WebInterface.TOKEN_CHECK_INTERVAL:
+            return True
+        if cherrypy.request.remote.ip != '127.0.0.1' and not self._user_controller.check_token(receiver_info['token']):
+            return False
+        receiver_info['token_checked'] = now
+        return True
+
+    def _get_status(self, key, since_version, field=None):
+        """
+        Returns a status from the status snapshot. The ETag is the version of the status, so polling clients get
+        a 304 as long as nothing changed. When a since_version is given, the response also contains the version and
+        whether the status only contains the changes (delta) or is complete.
+        """
+        status, version, delta = self._gateway_api.get_snapshot_status(key, since_version)
+        set_etag('"{0}-{1}"'.format(key, version))
+        data = {field: status} if field is not None else dict(status)
+        if since_version is not None:
+            data.update({'version': version, 'delta': delta})
+        return data
+
     def distribute_metric(self, metric):
         try:
-            answers = cherrypy.engine.publish('get-metrics-receivers')
+            answers = cherrypy.engine.publish('get-metrics-subscriptions')
             if not answers:
                 return
-            receivers = answers.pop()
-            for client_id in receivers.keys():
+            routing_table = self._metrics_controller.get_routing_table(answers.pop())
+            _, subscribers = routing_table.get(metric['source'], metric['type'])
+            if not subscribers:
+                return
+            receivers = cherrypy.engine.publish('get-metrics-receivers').pop()
+            packed_metric = None
+            for client_id in subscribers:
                 receiver_info = receivers.get(client_id)
                 if receiver_info is None:
                     continue
                 try:
-                    if cherrypy.request.remote.ip != '127.0.0.1' and not self._user_controller.check_token(receiver_info['token']):
+                    if not self._check_receiver_token(receiver_info):
                         raise cherrypy.HTTPError(401, 'invalid_token')
-                    sources = self._metrics_controller.get_filter('source', receiver_info['source'])
-                    metric_types = self._metrics_controller.get_filter('metric_type', receiver_info['metric_type'])
-                    if metric['source'] in sources and metric['type'] in metric_types:
-                        receiver_info['socket'].send(msgpack.dumps(metric), binary=True)
+                    if packed_metric is None:
+                        packed_metric = msgpack.dumps(metric)
+                    stream = receiver_info.get('stream')
+                    if stream is None:
+                        receiver_info['socket'].send(packed_metric, binary=True)
+                    else:
+                        stream.add(metric, packed_metric)
                 except cherrypy.HTTPError as ex:  # As might be caught from the `check_token` function
                     receiver_info['socket'].close(ex.code, ex.message)
                 except Exception as ex:
@@ -293,7 +484,70 @@ class WebInterface(object):
         except Exception as ex:
             logger.error('Failed to distribute metrics to WebSockets: %s', ex)
 
+    def flush_metrics_websockets(self):
+        """ Sends the buffered metrics of all batched metrics websockets of which the flush interval has passed """
+        try:
+            answers = cherrypy.engine.publish('get-metrics-receivers')
+            if not answers:
+                return
+            receivers = answers.pop()
+            now = time.time()
+            for client_id in receivers.keys():
+                receiver_info = receivers.get(client_id)
+                if receiver_info is None or receiver_info.get('stream') is None:
+                    continue
+                try:
+                    frame = receiver_info['stream'].pop_frame(now)
+                    if frame is not None:
+                        receiver_info['socket'].send(frame, binary=True)
+                except Exception as ex:
+                    logger.error('Failed to flush metrics to WebSocket: %s', ex)
+                    cherrypy.engine.publish('remove-metrics-receiver', client_id)
+        except Exception as ex:
+            logger.error('Failed to flush metrics to WebSockets: %s', ex)
+
+    @staticmethod
+    def _by_id(elements):
+        return dict((element['id'], dict((key, value) for key, value in element.iteritems() if key != 'id'))
+                    for element in elements)
+
+    def _load_output_state(self):
+        return WebInterface._by_id(self._gateway_api.get_snapshot_status(StatusSnapshot.Keys.OUTPUTS)[0])
+
+    def _load_input_state(self):
+        return WebInterface._by_id(self._gateway_api.get_input_status())
+
+    def _load_shutter_state(self):
+        return dict(self._gateway_api.get_shutter_status()['detail'])
+
+    def _load_thermostat_state(self):
+        status = self._gateway_api.get_snapshot_status(StatusSnapshot.Keys.THERMOSTATS)[0]
+        state = WebInterface._by_id(status.get('status', []))
+        state['group'] = dict((key, value) for key, value in status.iteritems() if key != 'status')
+        return state
+
+    def _load_sensor_state(self):
+        values = [self._gateway_api.get_snapshot_status(key)[0] for key in [StatusSnapshot.Keys.SENSOR_TEMPERATURE,
+                                                                            StatusSnapshot.Keys.SENSOR_HUMIDITY,
+                                                                            StatusSnapshot.Keys.SENSOR_BRIGHTNESS]]
+        return dict((sensor_id, {'temperature': temperature, 'humidity': humidity, 'brightness': brightness})
+                    for sensor_id, (temperature, humidity, brightness) in enumerate(zip(*values))
+                    if (temperature, humidity, brightness) != (None, None, None))  # Skip the unused sensors
+
+    def _load_power_state(self):
+        return dict(self._gateway_api.get_snapshot_status(StatusSnapshot.Keys.REALTIME_POWER)[0])
+
+    def refresh_state_stream(self):
+        """ Sends the state changes to the events websockets subscribed to them """
+        try:
+            self._state_stream.refresh()
+        except Exception as ex:
+            logger.error('Failed to refresh the state stream: %s', ex)
+
     def send_event_websocket(self, event):
+        domain = WebInterface.STATE_EVENT_DOMAINS.get(event.type)
+        if domain is not None:
+            self._state_stream.invalidate(domain)
         try:
             answers = cherrypy.engine.publish('get-events-receivers')
             if not answers:
@@ -306,11 +560,12 @@ class WebInterface(object):
                 try:
                     if event.type not in receiver_info['subscribed_types']:
                         continue
-                    if cherrypy.request.remote.ip != '127.0.0.1' and not self._user_controller.check_token(receiver_info['token']):
+                    if not self._check_receiver_token(receiver_info):
                         raise cherrypy.HTTPError(401, 'invalid_token')
-                    receiver_info['socket'].send(msgpack.dumps(event.serialize()), binary=True)
+                    if not receiver_info['sender'].send(msgpack.dumps(event.serialize())):
+                        cherrypy.engine.publish('remove-events-receiver', client_id)  # Too slow
                 except cherrypy.HTTPError as ex:  # As might be caught from the `check_token` function
-                    receiver_info['socket'].close(ex.code, ex.message)
+                    receiver_info['sender'].close(ex.code, ex.message)
                 except Exception as ex:
                     logger.error('Failed to distribute events to WebSocket: %s', ex)
                     cherrypy.engine.publish('remove-events-receiver', client_id)
@@ -333,6 +588,71 @@ class WebInterface(object):
         """ Sets the metrics controller """
         self._metrics_controller = metrics_controller
 
+    def plugin_api_call(self, name, params):
+        """
+        Executes an API call on behalf of a plugin, without going through the HTTP stack.
+
+        :param name: Name of the API call
+        :param params: The parameters, as they would be received as query parameters
+        :returns: The json encoded response
+        :rtype: str
+        """
+        func = getattr(self, name, None)
+        if func is None or getattr(func, 'plugin_exposed', False) is not True:
+            return json.dumps({'success': False, 'msg': 'unknown_call'})
+        # Not through the cherrypy handler: there is no request, so no conditional requests and encodings either
+        return dumps_limited(self._execute_call(name, params))
+
+    @openmotics_api(auth=True, check=types(calls='json'))
+    def batch(self, calls):
+        """
+        Executes several API calls in one request, sequentially and with the authentication of the batch.
+        Identical read-only calls (get_* calls with the same parameters) are executed only once.
+
+        :param calls: List of calls, e.g. [{"name": "get_output_status"}, {"name": "get_output_configuration", "params": {"id": 1}}].
+                      The parameters are given as they would be as query parameters, or as JSON values.
+        :type calls: list
+        :returns: 'responses': List with the response of every call, in the order of the calls
+        """
+        if not isinstance(calls, list) or len(calls) > WebInterface.MAX_BATCH_CALLS:
+            raise cherrypy.HTTPError(406, 'invalid_parameters')
+        responses = []
+        executed = {}
+        for index, call in enumerate(calls):
+            name = call.get('name') if isinstance(call, dict) else None
+            params = dict(call.get('params') or {}) if isinstance(call, dict) else {}
+            key = (name, json.dumps(params, sort_keys=True))
+            if key not in executed:
+                start = time.time()
+                response = self._execute_call(name, params)
+                add_server_timing('call{0}'.format(index), name, time.time() - start)
+                if not isinstance(name, basestring) or not name.startswith('get_'):
+                    responses.append(response)  # Writes are executed every time, in order
+                    continue
+                executed[key] = response
+            responses.append(executed[key])
+        return {'responses': responses}
+
+    def _execute_call(self, name, params):
+        """ Executes an API call outside of its own request, returns the response data """
+        func = getattr(self, name, None) if isinstance(name, basestring) else None
+        if func is None or getattr(func, 'api_function', None) is None or func.pass_token is True or name == 'batch':
+            return {'success': False, 'msg': 'unknown_call'}
+        if func.check is not None:
+            try:
+                params_parser(params, func.check)
+            except ValueError:
+                return {'success': False, 'msg': 'invalid_parameters'}
+        previous_etags = getattr(_etags, 'current', None)
+        _etags.current = None  # Not served over HTTP, so not conditional (a plugin thread doesn't even have a request)
+        try:
+            _, data = _execute(func.api_function, (self,), params)
+        except cherrypy.HTTPRedirect:
+            return {'success': False, 'msg': 'redirect'}
+        finally:
+            _etags.current = previous_etags
+        return data
+
     @cherrypy.expose
     def index(self):
         """
@@ -558,14 +878,16 @@ class WebInterface(object):
         """
         return {'status': self._gateway_api.get_input_status()}
 
-    @openmotics_api(auth=True)
-    def get_output_status(self):
+    @openmotics_api(auth=True, check=types(since_version=int))
+    def get_output_status(self, since_version=None):
         """
         Get the status of the outputs.
 
+        :param since_version: Only return the outputs that changed since this version
+        :type since_version: int
         :returns: 'status': list of dictionaries with the following keys: id, status, dimmer and ctimer.
         """
-        return {'status': self._gateway_api.get_output_status()}
+        return self._get_status(StatusSnapshot.Keys.OUTPUTS, since_version, field='status')
 
     @openmotics_api(auth=True, check=types(id=int, is_on=bool, dimmer=int, timer=int))
     def set_output(self, id, is_on, dimmer=None, timer=None):
@@ -740,18 +1062,21 @@ class WebInterface(object):
         """
         return self._gateway_api.do_shutter_group_stop(id)
 
-    @openmotics_api(auth=True)
-    def get_thermostat_status(self):
+    @openmotics_api(auth=True, check=types(since_version=int))
+    def get_thermostat_status(self, since_version=None):
         """
         Get the status of the thermostats.
 
+        :param since_version: Only return the fields that changed since this version
+        :type since_version: int
+
         :returns: global status information about the thermostats: 'thermostats_on', \
             'automatic' and 'setpoint' and 'status': a list with status information for all \
             thermostats, each element in the list is a dict with the following keys: \
             'id', 'act', 'csetp', 'output0', 'output1', 'outside', 'mode'.
         :rtype: dict
         """
-        return self._gateway_api.get_thermostat_status()
+        return self._get_status(StatusSnapshot.Keys.THERMOSTATS, since_version)
 
     @openmotics_api(auth=True, check=types(thermostat=int, temperature=float))
     def set_current_setpoint(self, thermostat, temperature):
@@ -834,35 +1159,41 @@ class WebInterface(object):
         """
         return self._gateway_api.set_airco_status(thermostat_id, airco_on)
 
-    @openmotics_api(auth=True)
-    def get_sensor_temperature_status(self):
+    @openmotics_api(auth=True, check=types(since_version=int))
+    def get_sensor_temperature_status(self, since_version=None):
         """
         Get the current temperature of all sensors.
 
+        :param since_version: Only return the values if they changed since this version
+        :type since_version: int
         :returns: 'status': list of 32 temperatures, 1 for each sensor.
         :rtype: dict
         """
-        return {'status': self._gateway_api.get_sensor_temperature_status()}
+        return self._get_status(StatusSnapshot.Keys.SENSOR_TEMPERATURE, since_version, field='status')
 
-    @openmotics_api(auth=True)
-    def get_sensor_humidity_status(self):
+    @openmotics_api(auth=True, check=types(since_version=int))
+    def get_sensor_humidity_status(self, since_version=None):
         """
         Get the current humidity of all sensors.
 
+        :param since_version: Only return the values if they changed since this version
+        :type since_version: int
         :returns: 'status': List of 32 bytes, 1 for each sensor.
         :rtype: dict
         """
-        return {'status': self._gateway_api.get_sensor_humidity_status()}
+        return self._get_status(StatusSnapshot.Keys.SENSOR_HUMIDITY, since_version, field='status')
 
-    @openmotics_api(auth=True)
-    def get_sensor_brightness_status(self):
+    @openmotics_api(auth=True, check=types(since_version=int))
+    def get_sensor_brightness_status(self, since_version=None):
         """
         Get the current brightness of all sensors.
 
+        :param since_version: Only return the values if they changed since this version
+        :type since_version: int
         :returns: 'status': List of 32 bytes, 1 for each sensor.
         :rtype: dict
         """
-        return {'status': self._gateway_api.get_sensor_brightness_status()}
+        return self._get_status(StatusSnapshot.Keys.SENSOR_BRIGHTNESS, since_version, field='status')
 
     @openmotics_api(auth=True, check=types(sensor_id=int, temperature=float, humidity=float, brightness=int))
     def set_virtual_sensor(self, sensor_id, temperature, humidity, brightness):
@@ -1001,7 +1332,7 @@ class WebInterface(object):
         """
         return self._gateway_api.master_clear_error_list
 
-    @openmotics_api(auth=True, check=types(id=int, fields='json'))
+    @openmotics_api(auth=True, check=types(id=int, fields='json'), cache_version=_configuration_version)
     def get_output_configuration(self, id, fields=None):
         """
         Get a specific output_configuration defined by its id.
@@ -1015,7 +1346,7 @@ class WebInterface(object):
         """
         return {'config': self._gateway_api.get_output_configuration(id, fields)}
 
-    @openmotics_api(auth=True, check=types(fields='json'))
+    @openmotics_api(auth=True, check=types(fields='json'), cache_version=_configuration_version)
     def get_output_configurations(self, fields=None):
         """
         Get all output_configurations.
@@ -1049,7 +1380,7 @@ class WebInterface(object):
         self._gateway_api.set_output_configurations(config)
         return {}
 
-    @openmotics_api(auth=True, check=types(id=int, fields='json'))
+    @openmotics_api(auth=True, check=types(id=int, fields='json'), cache_version=_configuration_version)
     def get_shutter_configuration(self, id, fields=None):
         """
         Get a specific shutter_configuration defined by its id.
@@ -1063,7 +1394,7 @@ class WebInterface(object):
         """
         return {'config': self._gateway_api.get_shutter_configuration(id, fields)}
 
-    @openmotics_api(auth=True, check=types(fields='json'))
+    @openmotics_api(auth=True, check=types(fields='json'), cache_version=_configuration_version)
     def get_shutter_configurations(self, fields=None):
         """
         Get all shutter_configurations.
@@ -1097,7 +1428,7 @@ class WebInterface(object):
         self._gateway_api.set_shutter_configurations(config)
         return {}
 
-    @openmotics_api(auth=True, check=types(id=int, fields='json'))
+    @openmotics_api(auth=True, check=types(id=int, fields='json'), cache_version=_configuration_version)
     def get_shutter_group_configuration(self, id, fields=None):
         """
         Get a specific shutter_group_configuration defined by its id.
@@ -1111,7 +1442,7 @@ class WebInterface(object):
         """
         return {'config': self._gateway_api.get_shutter_group_configuration(id, fields)}
 
-    @openmotics_api(auth=True, check=types(fields='json'))
+    @openmotics_api(auth=True, check=types(fields='json'), cache_version=_configuration_version)
     def get_shutter_group_configurations(self, fields=None):
         """
         Get all shutter_group_configurations.
@@ -1145,7 +1476,7 @@ class WebInterface(object):
         self._gateway_api.set_shutter_group_configurations(config)
         return {}
 
-    @openmotics_api(auth=True, check=types(id=int, fields='json'))
+    @openmotics_api(auth=True, check=types(id=int, fields='json'), cache_version=_configuration_version)
     def get_input_configuration(self, id, fields=None):
         """
         Get a specific input_configuration defined by its id.
@@ -1159,7 +1490,7 @@ class WebInterface(object):
         """
         return {'config': self._gateway_api.get_input_configuration(id, fields)}
 
-    @openmotics_api(auth=True, check=types(fields='json'))
+    @openmotics_api(auth=True, check=types(fields='json'), cache_version=_configuration_version)
     def get_input_configurations(self, fields=None):
         """
         Get all input_configurations.
@@ -1193,7 +1524,7 @@ class WebInterface(object):
         self._gateway_api.set_input_configurations(config)
         return {}
 
-    @openmotics_api(auth=True, check=types(id=int, fields='json'))
+    @openmotics_api(auth=True, check=types(id=int, fields='json'), cache_version=_configuration_version)
     def get_thermostat_configuration(self, id, fields=None):
         """
         Get a specific thermostat_configuration defined by its id.
@@ -1207,7 +1538,7 @@ class WebInterface(object):
         """
         return {'config': self._gateway_api.get_thermostat_configuration(id, fields)}
 
-    @openmotics_api(auth=True, check=types(fields='json'))
+    @openmotics_api(auth=True, check=types(fields='json'), cache_version=_configuration_version)
     def get_thermostat_configurations(self, fields=None):
         """
         Get all thermostat_configurations.
@@ -1241,7 +1572,7 @@ class WebInterface(object):
         self._gateway_api.set_thermostat_configurations(config)
         return {}
 
-    @openmotics_api(auth=True, check=types(id=int, fields='json'))
+    @openmotics_api(auth=True, check=types(id=int, fields='json'), cache_version=_configuration_version)
     def get_sensor_configuration(self, id, fields=None):
         """
         Get a specific sensor_configuration defined by its id.
@@ -1255,7 +1586,7 @@ class WebInterface(object):
         """
         return {'config': self._gateway_api.get_sensor_configuration(id, fields)}
 
-    @openmotics_api(auth=True, check=types(fields='json'))
+    @openmotics_api(auth=True, check=types(fields='json'), cache_version=_configuration_version)
     def get_sensor_configurations(self, fields=None):
         """
         Get all sensor_configurations.
@@ -1289,7 +1620,7 @@ class WebInterface(object):
         self._gateway_api.set_sensor_configurations(config)
         return {}
 
-    @openmotics_api(auth=True, check=types(id=int, fields='json'))
+    @openmotics_api(auth=True, check=types(id=int, fields='json'), cache_version=_configuration_version)
     def get_pump_group_configuration(self, id, fields=None):
         """
         Get a specific pump_group_configuration defined by its id.
@@ -1303,7 +1634,7 @@ class WebInterface(object):
         """
         return {'config': self._gateway_api.get_pump_group_configuration(id, fields)}
 
-    @openmotics_api(auth=True, check=types(fields='json'))
+    @openmotics_api(auth=True, check=types(fields='json'), cache_version=_configuration_version)
     def get_pump_group_configurations(self, fields=None):
         """
         Get all pump_group_configurations.
@@ -1337,7 +1668,7 @@ class WebInterface(object):
         self._gateway_api.set_pump_group_configurations(config)
         return {}
 
-    @openmotics_api(auth=True, check=types(id=int, fields='json'))
+    @openmotics_api(auth=True, check=types(id=int, fields='json'), cache_version=_configuration_version)
     def get_cooling_configuration(self, id, fields=None):
         """
         Get a specific cooling_configuration defined by its id.
@@ -1351,7 +1682,7 @@ class WebInterface(object):
         """
         return {'config': self._gateway_api.get_cooling_configuration(id, fields)}
 
-    @openmotics_api(auth=True, check=types(fields='json'))
+    @openmotics_api(auth=True, check=types(fields='json'), cache_version=_configuration_version)
     def get_cooling_configurations(self, fields=None):
         """
         Get all cooling_configurations.
@@ -1385,7 +1716,7 @@ class WebInterface(object):
         self._gateway_api.set_cooling_configurations(config)
         return {}
 
-    @openmotics_api(auth=True, check=types(id=int, fields='json'))
+    @openmotics_api(auth=True, check=types(id=int, fields='json'), cache_version=_configuration_version)
     def get_cooling_pump_group_configuration(self, id, fields=None):
         """
         Get a specific cooling_pump_group_configuration defined by its id.
@@ -1399,7 +1730,7 @@ class WebInterface(object):
         """
         return {'config': self._gateway_api.get_cooling_pump_group_configuration(id, fields)}
 
-    @openmotics_api(auth=True, check=types(fields='json'))
+    @openmotics_api(auth=True, check=types(fields='json'), cache_version=_configuration_version)
     def get_cooling_pump_group_configurations(self, fields=None):
         """
         Get all cooling_pump_group_configurations.
@@ -1433,7 +1764,7 @@ class WebInterface(object):
         self._gateway_api.set_cooling_pump_group_configurations(config)
         return {}
 
-    @openmotics_api(auth=True, check=types(fields='json'))
+    @openmotics_api(auth=True, check=types(fields='json'), cache_version=_configuration_version)
     def get_global_rtd10_configuration(self, fields=None):
         """
         Get the global_rtd10_configuration.
@@ -1456,7 +1787,7 @@ class WebInterface(object):
         self._gateway_api.set_global_rtd10_configuration(config)
         return {}
 
-    @openmotics_api(auth=True, check=types(id=int, fields='json'))
+    @openmotics_api(auth=True, check=types(id=int, fields='json'), cache_version=_configuration_version)
     def get_rtd10_heating_configuration(self, id, fields=None):
         """
         Get a specific rtd10_heating_configuration defined by its id.
@@ -1470,7 +1801,7 @@ class WebInterface(object):
         """
         return {'config': self._gateway_api.get_rtd10_heating_configuration(id, fields)}
 
-    @openmotics_api(auth=True, check=types(fields='json'))
+    @openmotics_api(auth=True, check=types(fields='json'), cache_version=_configuration_version)
     def get_rtd10_heating_configurations(self, fields=None):
         """
         Get all rtd10_heating_configurations.
@@ -1504,7 +1835,7 @@ class WebInterface(object):
         self._gateway_api.set_rtd10_heating_configurations(config)
         return {}
 
-    @openmotics_api(auth=True, check=types(id=int, fields='json'))
+    @openmotics_api(auth=True, check=types(id=int, fields='json'), cache_version=_configuration_version)
     def get_rtd10_cooling_configuration(self, id, fields=None):
         """
         Get a specific rtd10_cooling_configuration defined by its id.
@@ -1518,7 +1849,7 @@ class WebInterface(object):
         """
         return {'config': self._gateway_api.get_rtd10_cooling_configuration(id, fields)}
 
-    @openmotics_api(auth=True, check=types(fields='json'))
+    @openmotics_api(auth=True, check=types(fields='json'), cache_version=_configuration_version)
     def get_rtd10_cooling_configurations(self, fields=None):
         """
         Get all rtd10_cooling_configurations.
@@ -1552,7 +1883,7 @@ class WebInterface(object):
         self._gateway_api.set_rtd10_cooling_configurations(config)
         return {}
 
-    @openmotics_api(auth=True, check=types(id=int, fields='json'))
+    @openmotics_api(auth=True, check=types(id=int, fields='json'), cache_version=_configuration_version)
     def get_group_action_configuration(self, id, fields=None):
         """
         Get a specific group_action_configuration defined by its id.
@@ -1566,7 +1897,7 @@ class WebInterface(object):
         """
         return {'config': self._gateway_api.get_group_action_configuration(id, fields)}
 
-    @openmotics_api(auth=True, check=types(fields='json'))
+    @openmotics_api(auth=True, check=types(fields='json'), cache_version=_configuration_version)
     def get_group_action_configurations(self, fields=None):
         """
         Get all group_action_configurations.
@@ -1600,7 +1931,7 @@ class WebInterface(object):
         self._gateway_api.set_group_action_configurations(config)
         return {}
 
-    @openmotics_api(auth=True, check=types(id=int, fields='json'))
+    @openmotics_api(auth=True, check=types(id=int, fields='json'), cache_version=_configuration_version)
     def get_scheduled_action_configuration(self, id, fields=None):
         """
         Get a specific scheduled_action_configuration defined by its id.
@@ -1614,7 +1945,7 @@ class WebInterface(object):
         """
         return {'config': self._gateway_api.get_scheduled_action_configuration(id, fields)}
 
-    @openmotics_api(auth=True, check=types(fields='json'))
+    @openmotics_api(auth=True, check=types(fields='json'), cache_version=_configuration_version)
     def get_scheduled_action_configurations(self, fields=None):
         """
         Get all scheduled_action_configurations.
@@ -1696,7 +2027,7 @@ class WebInterface(object):
         self._gateway_api.set_pulse_counter_configurations(config)
         return {}
 
-    @openmotics_api(auth=True, check=types(fields='json'))
+    @openmotics_api(auth=True, check=types(fields='json'), cache_version=_configuration_version)
     def get_startup_action_configuration(self, fields=None):
         """
         Get the startup_action_configuration.
@@ -1719,7 +2050,7 @@ class WebInterface(object):
         self._gateway_api.set_startup_action_configuration(config)
         return {}
 
-    @openmotics_api(auth=True, check=types(fields='json'))
+    @openmotics_api(auth=True, check=types(fields='json'), cache_version=_configuration_version)
     def get_dimmer_configuration(self, fields=None):
         """
         Get the dimmer_configuration.
@@ -1742,7 +2073,7 @@ class WebInterface(object):
         self._gateway_api.set_dimmer_configuration(config)
         return {}
 
-    @openmotics_api(auth=True, check=types(fields='json'))
+    @openmotics_api(auth=True, check=types(fields='json'), cache_version=_configuration_version)
     def get_global_thermostat_configuration(self, fields=None):
         """
         Get the global_thermostat_configuration.
@@ -1765,7 +2096,7 @@ class WebInterface(object):
         self._gateway_api.set_global_thermostat_configuration(config)
         return {}
 
-    @openmotics_api(auth=True, check=types(id=int, fields='json'))
+    @openmotics_api(auth=True, check=types(id=int, fields='json'), cache_version=_configuration_version)
     def get_can_led_configuration(self, id, fields=None):
         """
         Get a specific can_led_configuration defined by its id.
@@ -1779,7 +2110,7 @@ class WebInterface(object):
         """
         return {'config': self._gateway_api.get_can_led_configuration(id, fields)}
 
-    @openmotics_api(auth=True, check=types(fields='json'))
+    @openmotics_api(auth=True, check=types(fields='json'), cache_version=_configuration_version)
     def get_can_led_configurations(self, fields=None):
         """
         Get all can_led_configurations.
@@ -1813,7 +2144,7 @@ class WebInterface(object):
         self._gateway_api.set_can_led_configurations(config)
         return {}
 
-    @openmotics_api(auth=True, check=types(id=int, fields='json'))
+    @openmotics_api(auth=True, check=types(id=int, fields='json'), cache_version=_configuration_version)
     def get_room_configuration(self, id, fields=None):
         """
         Get a specific room_configuration defined by its id.
@@ -1827,7 +2158,7 @@ class WebInterface(object):
         """
         return {'config': self._gateway_api.get_room_configuration(id, fields)}
 
-    @openmotics_api(auth=True, check=types(fields='json'))
+    @openmotics_api(auth=True, check=types(fields='json'), cache_version=_configuration_version)
     def get_room_configurations(self, fields=None):
         """
         Get all room_configurations.
@@ -1899,25 +2230,29 @@ class WebInterface(object):
         """
         return self._gateway_api.set_power_modules(json.loads(modules))
 
-    @openmotics_api(auth=True)
-    def get_realtime_power(self):
+    @openmotics_api(auth=True, check=types(since_version=int))
+    def get_realtime_power(self, since_version=None):
         """
         Get the realtime power measurements.
 
+        :param since_version: Only return the modules that changed since this version
+        :type since_version: int
         :returns: module id as the keys: [voltage, frequency, current, power].
         :rtype: dict
         """
-        return self._gateway_api.get_realtime_power()
+        return self._get_status(StatusSnapshot.Keys.REALTIME_POWER, since_version)
 
-    @openmotics_api(auth=True)
-    def get_total_energy(self):
+    @openmotics_api(auth=True, check=types(since_version=int))
+    def get_total_energy(self, since_version=None):
         """
         Get the total energy (Wh) consumed by the power modules.
 
+        :param since_version: Only return the modules that changed since this version
+        :type since_version: int
         :returns: modules id as key: [day, night].
         :rtype: dict
         """
-        return self._gateway_api.get_total_energy()
+        return self._get_status(StatusSnapshot.Keys.TOTAL_ENERGY, since_version)
 
     @openmotics_api(auth=True)
     def start_power_address_mode(self):
@@ -2226,6 +2561,32 @@ class WebInterface(object):
         """
         return {'logs': self._plugin_controller.get_logs()}
 
+    @openmotics_api(auth=True, plugin_exposed=False)
+    def get_plugin_resources(self):
+        """
+        Get the resource usage of all plugins.
+
+        :returns: 'resources': dict with the names of the plugins as keys and their cpu time, memory, threads, \
+            ipc bytes, command latency histograms and async queue depth as value.
+        :rtype: dict
+        """
+        return {'resources': self._plugin_controller.get_resource_stats()}
+
+    @openmotics_api(auth=True, check=types(duration=float), plugin_exposed=False)
+    def profile_plugin(self, name, duration=5.0):
+        """
+        Samples the stacks of all threads of a plugin during the given duration.
+
+        :param name: Name of the plugin to profile.
+        :type name: str
+        :param duration: Duration of the profiling in seconds, at most 60.
+        :type duration: float
+        :returns: 'samples': amount of samples taken, 'interval': sample interval in seconds, 'stacks': list of \
+            the most sampled stacks (thread name and functions, outermost first, separated by semicolons) and their count.
+        :rtype: dict
+        """
+        return self._plugin_controller.profile_plugin(name, min(max(duration, 0.1), 60.0))
+
     @openmotics_api(auth=True, plugin_exposed=False)
     def install_plugin(self, md5, package_data):
         """
@@ -2298,7 +2659,7 @@ class WebInterface(object):
         subprocess.Popen(constants.get_self_test_cmd(), close_fds=True)
         return {}
 
-    @openmotics_api(auth=True)
+    @openmotics_api(auth=True, cache_version=lambda self: self._metrics_controller.definitions_version)
     def get_metric_definitions(self, source=None, metric_type=None):
         sources = self._metrics_controller.get_filter('source', source)
         metric_types = self._metrics_controller.get_filter('metric_type', metric_type)
@@ -2311,6 +2672,46 @@ class WebInterface(object):
                         definitions[_source][_metric_type] = definition
         return {'definitions': definitions}
 
+    @openmotics_api(auth=True, check=types(mode=['always', 'change', 'deadband'], deadband=float, heartbeat=int))
+    def set_metrics_emission_policy(self, metric_type, mode, deadband=None, heartbeat=None):
+        """
+        Sets when the metrics of a given type are emitted.
+
+        :param metric_type: The metric type, e.g. sensor
+        :type metric_type: str
+        :param mode: always (every time they are collected), change (only when a value changed) or deadband (only when
+                     a numeric value changed more than `deadband`, or another value changed)
+        :type mode: str
+        :param deadband: The change of a numeric value that is emitted, for the deadband mode
+        :type deadband: float
+        :param heartbeat: Seconds after which an unchanged series is emitted anyway (default 900)
+        :type heartbeat: int
+        """
+        self._metrics_controller.set_emission_policy(metric_type, mode,
+                                                     deadband=deadband if deadband is not None else 0,
+                                                     heartbeat=heartbeat if heartbeat is not None else 900)
+        return {}
+
+    @cherrypy.expose
+    @cherrypy.tools.authenticated()
+    def metrics(self):
+        """
+        Exposes the latest value of all known metrics, together with the internal statistics of the gateway,
+        in the OpenMetrics (Prometheus) text format. Everything is served from memory, without touching
+        the serial busses or the databases.
+        """
+        families = [self._metrics_controller.get_openmetrics_families()]
+        statistics = self._gateway_api.get_communication_statistics()
+        for key, description in [('bytes_read', 'Bytes read from the serial bus'),
+                                 ('bytes_written', 'Bytes written to the serial bus')]:
+            families.append(format_family('gateway_serial_{0}'.format(key), 'counter', description,
+                                          [({'bus': bus}, bus_statistics[key]) for bus, bus_statistics in statistics.iteritems()]))
+        families.append(format_family('gateway_master_calls', 'gauge', 'Recent master calls',
+                                      [({'result': 'succeeded'}, statistics['master']['calls_succeeded']),
+                                       ({'result': 'timedout'}, statistics['master']['calls_timedout'])]))
+        cherrypy.response.headers['Content-Type'] = OPENMETRICS_CONTENT_TYPE
+        return self._metrics_controller.snapshot.render(u''.join(families))
+
     @openmotics_api(auth=True, plugin_exposed=False)
     def cleanup_eeprom(self):
         self._gateway_api.cleanup_eeprom()
@@ -2326,7 +2727,7 @@ class WebInterface(object):
         """ Requests the state of the various services and checks the returned value for the global state """
         health = {'openmotics': {'state': True}}
         try:
-            state = self._message_client.get_state('vpn_service', {})
+            state = self._message_client.get_state('vpn_service', {}, max_age=60)  # Published every heartbeat
             health['vpn_service'] = {'state': state.get('last_cycle', 0) > time.time() - 300}
         except Exception as ex:
             logger.error('Error loading vpn_service health: %s', ex)
@@ -2352,12 +2753,19 @@ class WebInterface(object):
     @cherrypy.expose
     @cherrypy.tools.cors()
     @cherrypy.tools.authenticated(pass_token=True)
-    def ws_metrics(self, token, source=None, metric_type=None, interval=None):
+    def ws_metrics(self, token, source=None, metric_type=None, interval=None, batch=None, delta=None):
+        """
+        Streams metrics over a websocket. By default every metric is sent in its own frame. When `batch` (in
+        seconds) is given, metrics are sent in batches (as a list of metrics) at most once every `batch`
+        seconds. When `delta` is set as well, repeated tags and values are delta-encoded (see `MetricsStream`).
+        """
         cherrypy.request.ws_handler.metadata = {'token': token,
                                                 'client_id': uuid.uuid4().hex,
                                                 'source': source,
                                                 'metric_type': metric_type,
                                                 'interval': None if interval is None else int(interval),
+                                                'batch': None if batch is None else max(WebInterface.METRICS_FLUSH_FREQUENCY, float(batch)),
+                                                'delta': delta is not None and str(delta).lower() not in ['false', '0', '0.0', 'no'],
                                                 'interface': self}
 
     @cherrypy.expose
@@ -2399,6 +2807,10 @@ class WebService(object):
         try:
             logger.info('Starting webserver...')
             OMPlugin(cherrypy.engine).subscribe()
+            Monitor(cherrypy.engine, self._webinterface.flush_metrics_websockets,
+                    frequency=WebInterface.METRICS_FLUSH_FREQUENCY, name='Metrics websocket flusher').subscribe()
+            Monitor(cherrypy.engine, self._webinterface.refresh_state_stream,
+                    frequency=WebInterface.STATE_REFRESH_FREQUENCY, name='State websocket refresher').subscribe()
             cherrypy.tools.websocket = OMSocketTool()
 
             config = {'/terms': {'tools.staticdir.on': True,
@@ -18,6 +18,9 @@
 import msgpack
 import cherrypy
 import logging
+import time
+from Queue import Queue, Full
+from threading import Lock, Thread
 from ws4py import WS_VERSION
 from ws4py.server.cherrypyserver import WebSocketPlugin, WebSocketTool
 from ws4py.websocket import WebSocket
@@ -30,6 +33,7 @@ class OMPlugin(WebSocketPlugin):
     def __init__(self, bus):
         WebSocketPlugin.__init__(self, bus)
         self.metrics_receivers = {}
+        self.metrics_subscriptions = ()
         self.events_receivers = {}
         self.maintenance_receivers = {}
 
@@ -37,6 +41,7 @@ class OMPlugin(WebSocketPlugin):
         WebSocketPlugin.start(self)
         self.bus.subscribe('add-metrics-receiver', self.add_metrics_receiver)
         self.bus.subscribe('get-metrics-receivers', self.get_metrics_receivers)
+        self.bus.subscribe('get-metrics-subscriptions', self.get_metrics_subscriptions)
         self.bus.subscribe('remove-metrics-receiver', self.remove_metrics_receiver)
         self.bus.subscribe('add-events-receiver', self.add_events_receiver)
         self.bus.subscribe('get-events-receivers', self.get_events_receivers)
@@ -50,6 +55,7 @@ class OMPlugin(WebSocketPlugin):
         WebSocketPlugin.stop(self)
         self.bus.unsubscribe('add-metrics-receiver', self.add_metrics_receiver)
         self.bus.unsubscribe('get-metrics-receivers', self.get_metrics_receivers)
+        self.bus.unsubscribe('get-metrics-subscriptions', self.get_metrics_subscriptions)
         self.bus.unsubscribe('remove-metrics-receiver', self.remove_metrics_receiver)
         self.bus.unsubscribe('add-events-receiver', self.add_events_receiver)
         self.bus.unsubscribe('get-events-receivers', self.get_events_receivers)
@@ -61,12 +67,21 @@ class OMPlugin(WebSocketPlugin):
 
     def add_metrics_receiver(self, client_id, receiver_info):
         self.metrics_receivers[client_id] = receiver_info
+        self._update_metrics_subscriptions()
 
     def get_metrics_receivers(self):
         return self.metrics_receivers
 
+    def get_metrics_subscriptions(self):
+        return self.metrics_subscriptions
+
     def remove_metrics_receiver(self, client_id):
         self.metrics_receivers.pop(client_id, None)
+        self._update_metrics_subscriptions()
+
+    def _update_metrics_subscriptions(self):
+        self.metrics_subscriptions = tuple((client_id, receiver_info['source'], receiver_info['metric_type'])
+                                           for client_id, receiver_info in self.metrics_receivers.items())
 
     def add_events_receiver(self, client_id, receiver_info):
         self.events_receivers[client_id] = receiver_info
@@ -90,6 +105,140 @@ class OMPlugin(WebSocketPlugin):
         self.maintenance_receivers.pop(client_id, None)
 
 
+class MetricsStream(object):
+    """
+    Buffers the metrics for a batched metrics websocket. Every flush, all buffered metrics are sent
+    as a single frame containing a msgpack array of metrics.
+    When delta encoding is enabled, the first metric of every series (source, type and tags) is sent
+    completely with an additional `series` id. Afterwards, only the `series` id, the `timestamp` and the
+    values that changed are sent for that series.
+    The series of sources that come and go would pile up, so after `MAX_SERIES` series the ids are reset: every
+    series is sent completely again, and a complete metric always (re)defines the series id it carries.
+    """
+
+    MAX_SERIES = 1000
+
+    def __init__(self, interval, delta=False):
+        self.interval = interval
+        self.delta = delta
+        self._lock = Lock()
+        self._buffer = []
+        self._series = {}
+        self._last_flush = time.time()
+
+    def add(self, metric, packed_metric):
+        """
+        Adds a metric to the buffer
+        :param metric: The metric
+        :param packed_metric: The metric, already serialized with msgpack
+        """
+        with self._lock:
+            if self.delta:
+                packed_metric = msgpack.dumps(self._encode_delta(metric))
+            self._buffer.append(packed_metric)
+
+    def _encode_delta(self, metric):
+        key = (metric['source'], metric['type'], tuple(sorted(metric['tags'].iteritems())))
+        series = self._series.get(key)
+        if series is None:
+            if len(self._series) >= MetricsStream.MAX_SERIES:
+                self._series = {}
+            series_id = len(self._series)
+            self._series[key] = (series_id, dict(metric['values']))
+            encoded_metric = dict(metric)
+            encoded_metric['series'] = series_id
+            return encoded_metric
+        series_id, last_values = series
+        changed_values = {}
+        for name, value in metric['values'].iteritems():
+            if name not in last_values or last_values[name] != value:
+                changed_values[name] = value
+        last_values.update(changed_values)
+        return {'series': series_id,
+                'timestamp': metric['timestamp'],
+                'values': changed_values}
+
+    def pop_frame(self, now=None):
+        """
+        Returns a frame with all buffered metrics if the flush interval has passed, None otherwise.
+        """
+        if now is None:
+            now = time.time()
+        if now < self._last_flush + self.interval:
+            return None
+        with self._lock:
+            buffer, self._buffer = self._buffer, []
+        self._last_flush = now
+        if not buffer:
+            return None
+        return msgpack.Packer().pack_array_header(len(buffer)) + ''.join(buffer)
+
+
+class SocketSender(object):
+    """
+    Sends the frames of a websocket from its own thread, so a slow client never blocks the thread handing out the
+    frames. A client that can't keep up, having more than `max_queue` frames waiting, is disconnected.
+    """
+
+    MAX_QUEUE = 500
+
+    def __init__(self, socket, max_queue=None):
+        self._socket = socket
+        self._queue = Queue(maxsize=max_queue or SocketSender.MAX_QUEUE)
+        self._thread = Thread(target=self._send, name='Websocket sender')
+        self._thread.daemon = True
+        self._stopped = False
+        self.dropped = False
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        try:
+            self._queue.put_nowait(None)
+        except Full:
+            pass  # The sender isn't waiting for frames, it stops after the current one
+
+    def send(self, payload):
+        """ Queues a binary frame, returns False when the client was dropped """
+        if self.dropped:
+            return False
+        try:
+            self._queue.put_nowait(payload)
+            return True
+        except Full:
+            self.dropped = True
+            logger.warning('Websocket client can\'t keep up, disconnecting')
+            self._socket.close_connection()  # Doesn't send a close frame, that could block as well
+            return False
+
+    def close(self, code, reason):
+        """ Closes the websocket after the queued frames, without blocking. No frames are accepted afterwards """
+        if self.dropped:
+            return
+        self.dropped = True
+        try:
+            self._queue.put_nowait((code, reason))
+        except Full:
+            self._socket.close_connection()
+
+    def _send(self):
+        while True:
+            payload = self._queue.get()
+            if payload is None or self._stopped:
+                return
+            try:
+                if isinstance(payload, tuple):
+                    self._socket.close(*payload)
+                    return
+                self._socket.send(payload, binary=True)
+            except Exception as ex:
+                logger.error('Error sending data: %s', ex)
+                self.dropped = True
+                return
+
+
 class OMSocketTool(WebSocketTool):
     def upgrade(self, protocols=None, extensions=None, version=WS_VERSION, handler_cls=WebSocket, heartbeat_freq=None):
         _ = protocols  # ws4py doesn't support protocols the way we like (using them for authentication)
@@ -138,16 +287,22 @@ class OMSocket(WebSocket):
 # noinspection PyUnresolvedReferences
 class MetricsSocket(OMSocket):
     """
-    Handles web socket communications for metrics
+    Handles web socket communications for metrics. By default, every metric is sent in a separate frame. If
+    a batch interval is requested, metrics are sent in batches through a `MetricsStream`.
     """
     def opened(self):
         if not hasattr(self, 'metadata'):
             return
+        stream = None
+        if self.metadata.get('batch') is not None:
+            stream = MetricsStream(interval=self.metadata['batch'],
+                                   delta=self.metadata.get('delta', False))
         cherrypy.engine.publish('add-metrics-receiver',
                                 self.metadata['client_id'],
                                 {'source': self.metadata['source'],
                                  'metric_type': self.metadata['metric_type'],
                                  'token': self.metadata['token'],
+                                 'stream': stream,
                                  'socket': self})
         self.metadata['interface']._metrics_collector.set_websocket_interval(self.metadata['client_id'],
                                                                              self.metadata['metric_type'],
@@ -165,16 +320,22 @@ class MetricsSocket(OMSocket):
 # noinspection PyUnresolvedReferences
 class EventsSocket(OMSocket):
     """
-    Handles web socket communications for events
+    Handles web socket communications for events. Next to the events of the subscribed types, a client can subscribe
+    to the state of domains (see `StateStream`) with a `subscribe_state` action: it gets a STATE_SNAPSHOT and
+    then STATE_DELTA events. When it passes the last `sequence` it received, only the missed changes are sent.
+    All frames go through a `SocketSender`.
     """
     def opened(self):
         if not hasattr(self, 'metadata'):
             return
+        self.sender = SocketSender(self)
+        self.sender.start()
         cherrypy.engine.publish('add-events-receiver',
                                 self.metadata['client_id'],
                                 {'token': self.metadata['token'],
                                  'subscribed_types': [],
-                                 'socket': self})
+                                 'socket': self,
+                                 'sender': self.sender})
 
     def closed(self, *args, **kwargs):
         _ = args, kwargs
@@ -182,6 +343,18 @@ class EventsSocket(OMSocket):
             return
         client_id = self.metadata['client_id']
         cherrypy.engine.publish('remove-events-receiver', client_id)
+        self.metadata['interface']._state_stream.unsubscribe(client_id)
+        if hasattr(self, 'sender'):
+            self.sender.stop()
+
+    def _send_event(self, event):
+        self.sender.send(msgpack.dumps(event.serialize()))
+
+    def _send_state(self, event):
+        if not self.metadata['interface']._check_receiver_token(self.metadata):
+            self.sender.close(401, 'invalid_token')  # Called by the state stream, which can't wait for the client
+            return
+        self._send_event(event)
 
     def received_message(self, message):
         if not hasattr(self, 'metadata'):
@@ -200,9 +373,15 @@ class EventsSocket(OMSocket):
                     cherrypy.engine.publish('update-events-receiver',
                                             self.metadata['client_id'],
                                             {'subscribed_types': subscribed_types})
+                elif event.data['action'] == 'subscribe_state':
+                    state_stream = self.metadata['interface']._state_stream
+                    if event.data.get('domains'):
+                        state_stream.subscribe(self.metadata['client_id'], event.data['domains'], self._send_state,
+                                               sequence=event.data.get('sequence'))
+                    else:
+                        state_stream.unsubscribe(self.metadata['client_id'])
             elif event.type == Event.Types.PING:
-                self.send(msgpack.dumps(Event(event_type=Event.Types.PONG,
-                                              data=None).serialize()), binary=True)
+                self._send_event(Event(event_type=Event.Types.PONG, data=None))
         except Exception as ex:
             logger.exception('Error receiving message: %s', ex)
             # Ignore malformed data processing; in that case there's nothing that will happen
@@ -89,7 +89,8 @@ class LedController(object):
         self._running = False
 
         self._message_client = MessageClient('led_service')
-        self._message_client.add_event_handler(self.event_receiver)
+        self._message_client.add_event_handler(self.event_receiver, [OMBusEvents.CLOUD_REACHABLE, OMBusEvents.VPN_OPEN,
+                                                                     OMBusEvents.SERIAL_ACTIVITY, OMBusEvents.INDICATE_GATEWAY])
         self._message_client.set_state_handler(self.get_state)
 
         self._gpio_led_config = Hardware.get_gpio_led_config()
@@ -203,6 +204,7 @@ class LedController(object):
             except Exception as exception:
                 logger.error('Error while checking states: {0}'.format(exception))
             self._last_state_check = time.time()
+            self._message_client.publish_state()
             time.sleep(0.5)
 
     def drive_leds(self):
@@ -246,6 +248,7 @@ class LedController(object):
                 if self._authorized_mode:
                     if time.time() > self._authorized_timeout or (button_pressed and self._input_button_released):
                         self._authorized_mode = False
+                        self._message_client.publish_state()
                 else:
                     if button_pressed:
                         self._ticks += 0.25
@@ -255,6 +258,7 @@ class LedController(object):
                         if self._ticks > 5.75:  # After 5.75 seconds + time to execute the code it should be pressed between 5.8 and 6.5 seconds.
                             self._authorized_mode = True
                             self._authorized_timeout = time.time() + 60
+                            self._message_client.publish_state()
                             self._input_button_pressed_since = None
                             self._ticks = 0
                     else:
@@ -19,6 +19,7 @@ Contains controller from reading and writing to the Master EEPROM.
 import inspect
 import types
 import logging
+import time
 from threading import Lock
 from ioc import Injectable, Inject, INJECTED, Singleton
 from master_api import eeprom_list, write_eeprom, activate_eeprom
@@ -43,10 +44,12 @@ class EepromController(object):
         self._eeprom_file = eeprom_file
         self._eeprom_extension = eeprom_extension
         self.dirty = True
+        self.generation = int(time.time() * 1000)  # Changes on every write, unique across restarts
 
     def invalidate_cache(self):
         """ Invalidate the cache, this should happen when maintenance mode was used. """
         self._eeprom_file.invalidate_cache()
+        self.generation += 1
 
     def read(self, eeprom_model, id=None, fields=None):
         """
@@ -119,6 +122,7 @@ class EepromController(object):
             if self._eeprom_file.write(eeprom_data):
                 self._eeprom_file.activate()
                 self.dirty = True
+                self.generation += 1
         # Write the extensions
         eext_data = []
         for eeprom_model in eeprom_models:
@@ -126,6 +130,7 @@ class EepromController(object):
         if len(eext_data) > 0:
             self._eeprom_extension.write_data(eext_data)
             self.dirty = True
+            self.generation += 1
 
 
 @Injectable.named('eeprom_file')
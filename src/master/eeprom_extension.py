@@ -17,10 +17,9 @@ Contains the EEPROM extensions. This is used to store data that does not fit int
 data is stored in a sqlite database on the gateways filesystem.
 """
 
-import sqlite3
 import os.path
-from threading import Lock
 from ioc import Injectable, Inject, INJECTED, Singleton
+from database_utils import Database
 
 
 @Injectable.named('eeprom_extension')
@@ -31,44 +30,36 @@ class EepromExtension(object):
 
     @Inject
     def __init__(self, eeprom_db=INJECTED):
-        self._lock = Lock()
         create_tables = not os.path.exists(eeprom_db)
-        self._connection = sqlite3.connect(eeprom_db,
-                                           detect_types=sqlite3.PARSE_DECLTYPES,
-                                           check_same_thread=False,
-                                           isolation_level=None)
-        self._cursor = self._connection.cursor()
+        self._database = Database(eeprom_db)
         if create_tables is True:
             self._create_tables()
 
     def _create_tables(self):
         """ Create the extensions table. """
-        with self._lock:
-            self._cursor.execute("CREATE TABLE extensions (id INTEGER PRIMARY KEY, model TEXT, "
-                                 "model_id INTEGER, field TEXT, value TEXT, "
-                                 "UNIQUE(model, model_id, field) ON CONFLICT REPLACE);")
+        self._database.write("CREATE TABLE extensions (id INTEGER PRIMARY KEY, model TEXT, "
+                             "model_id INTEGER, field TEXT, value TEXT, "
+                             "UNIQUE(model, model_id, field) ON CONFLICT REPLACE);")
 
     def read_data(self, eeprom_model_name, model_id, field_name):
         model_id = 0 if model_id is None else model_id
-        with self._lock:
-            for row in self._cursor.execute("SELECT value FROM extensions WHERE model=? AND model_id=? AND field=?",
-                                            (eeprom_model_name, model_id, field_name)):
-                return row[0]
+        for row in self._database.execute("SELECT value FROM extensions WHERE model=? AND model_id=? AND field=?",
+                                          (eeprom_model_name, model_id, field_name)):
+            return row[0]
         return None
 
     def write_data(self, data):
         """
         :type data: list of tuple[basestring, int, basestring, basestring]
         """
-        for data_entry in data:
-            model_name, model_id, field_name, value = data_entry
-            model_id = 0 if model_id is None else model_id
-            with self._lock:
-                self._cursor.execute("INSERT INTO extensions (model, model_id, field, value) VALUES (?, ?, ?, ?)",
-                                     (model_name, model_id, field_name, value))
+        def _write(cursor):
+            for data_entry in data:
+                model_name, model_id, field_name, value = data_entry
+                model_id = 0 if model_id is None else model_id
+                cursor.execute("INSERT INTO extensions (model, model_id, field, value) VALUES (?, ?, ?, ?)",
+                               (model_name, model_id, field_name, value))
+        self._database.transaction(_write)
 
     def close(self):
-        """ Commit the changes and close the database connection. """
-        with self._lock:
-            self._connection.commit()
-            self._connection.close()
+        """ Waits for the pending changes and closes the database connection. """
+        self._database.close()
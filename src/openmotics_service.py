@@ -24,10 +24,10 @@ import constants
 from ioc import Injectable, Inject, INJECTED
 from bus.om_bus_service import MessageService
 from bus.om_bus_client import MessageClient
+from bus.om_bus_events import OMBusEvents
 from serial import Serial
 from signal import signal, SIGTERM
 from ConfigParser import ConfigParser
-from threading import Lock
 from serial_utils import RS485
 from gateway.observer import Observer
 from urlparse import urlparse
@@ -54,10 +54,6 @@ class OpenmoticsService(object):
         config = ConfigParser()
         config.read(constants.get_config_file())
 
-        config_lock = Lock()
-        scheduling_lock = Lock()
-        metrics_lock = Lock()
-
         config_database_file = constants.get_config_database_file()
 
         # TODO: Clean up dependencies more to reduce complexity
@@ -99,14 +95,12 @@ class OpenmoticsService(object):
 
         # User Controller
         Injectable.value(user_db=config_database_file)
-        Injectable.value(user_db_lock=config_lock)
         Injectable.value(token_timeout=3600)
         Injectable.value(config={'username': config.get('OpenMotics', 'cloud_user'),
                                  'password': config.get('OpenMotics', 'cloud_pass')})
 
         # Configuration Controller
         Injectable.value(config_db=config_database_file)
-        Injectable.value(config_db_lock=config_lock)
 
         # Energy Controller
         power_serial_port = config.get('OpenMotics', 'power_serial')
@@ -123,7 +117,6 @@ class OpenmoticsService(object):
 
         # Scheduling Controller
         Injectable.value(scheduling_db=constants.get_scheduling_database_file())
-        Injectable.value(scheduling_db_lock=scheduling_lock)
 
         # Master Controller
         controller_serial_port = config.get('OpenMotics', 'controller_serial')
@@ -149,7 +142,6 @@ class OpenmoticsService(object):
 
         # Metrics Controller
         Injectable.value(metrics_db=constants.get_metrics_database_file())
-        Injectable.value(metrics_db_lock=metrics_lock)
 
         # Webserver / Presentation layer
         Injectable.value(ssl_private_key=constants.get_ssl_private_key_file())
@@ -162,7 +154,7 @@ class OpenmoticsService(object):
                          web_service=INJECTED, event_sender=INJECTED, maintenance_controller=INJECTED):
         # TODO: Fix circular dependencies
 
-        message_client.add_event_handler(metrics_controller.event_receiver)
+        message_client.add_event_handler(metrics_controller.event_receiver, [OMBusEvents.METRICS_INTERVAL_CHANGE])
         web_interface.set_plugin_controller(plugin_controller)
         web_interface.set_metrics_collector(metrics_collector)
         web_interface.set_metrics_controller(metrics_controller)
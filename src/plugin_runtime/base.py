@@ -21,6 +21,10 @@ class OMPluginBase(object):
     """
     Base class for an OpenMotics plugin. Every plugin package should contain a
     module with the name 'main' that contains a class that extends this class.
+
+    A plugin can set the `concurrency` class attribute to the number of commands (e.g. requests
+    to exposed methods, metric collection, events) that may be handled at the same time.
+    Defaults to 1; plugins that set it higher must be thread-safe.
     """
 
     def __init__(self, webinterface, logger):
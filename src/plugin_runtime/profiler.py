@@ -0,0 +1,34 @@
+import os
+import sys
+import threading
+import time
+
+
+def sample_stacks(duration, interval, limit=100):
+    """
+    Samples the stacks of all other threads during the given duration. Returns the amount of samples and the most
+    sampled stacks in the folded format (thread name and functions, outermost first, separated by semicolons).
+    """
+    own_ident = threading.current_thread().ident
+    stacks = {}
+    samples = 0
+    end = time.time() + duration
+    while time.time() < end:
+        thread_names = dict((thread.ident, thread.name) for thread in threading.enumerate())
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            functions = []
+            while frame is not None:
+                code = frame.f_code
+                functions.append('{0}:{1}'.format(os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            functions.append(thread_names.get(ident, str(ident)))
+            stack = ';'.join(reversed(functions))
+            stacks[stack] = stacks.get(stack, 0) + 1
+        samples += 1
+        time.sleep(interval)
+    most_sampled = sorted(stacks.iteritems(), key=lambda item: item[1], reverse=True)[:limit]
+    return {'samples': samples,
+            'interval': interval,
+            'stacks': [[stack, count] for stack, count in most_sampled]}
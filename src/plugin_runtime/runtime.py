@@ -1,24 +1,38 @@
+import copy
+import errno
 import os
+import socket
+import struct
 import sys
+import threading
 import traceback
 import time
-from threading import Thread
+import types
+from Queue import Queue
+from threading import Thread, Lock
 
 sys.path.insert(0, '/opt/openmotics/python')
 
 from platform_utils import System
 System.import_libs()
 
-from toolbox import PluginIPCStream
+from toolbox import PluginIPCStream, MetricsRing
 from gateway.observer import Event
 from plugin_runtime import base
-from plugin_runtime.utils import get_plugin_class, check_plugin, get_special_methods
+from plugin_runtime.utils import get_plugin_class, check_plugin, get_special_methods, \
+    get_package_hash, load_introspection, save_introspection, get_definitions_hash
 from plugin_runtime.interfaces import has_interface
+from plugin_runtime.profiler import sample_stacks
 from plugin_runtime.web import WebInterfaceDispatcher
 
 
 class PluginRuntime:
 
+    STREAM_CHUNK_SIZE = 65536
+
+    SPECIAL_METHODS = ['input_status', 'output_status', 'shutter_status', 'receive_events', 'om_expose',
+                       'om_metric_data', 'om_metric_receive', 'background_task', 'on_remove']
+
     def __init__(self, path):
         self._stopped = False
         self._path = path.rstrip('/')
@@ -38,6 +52,10 @@ class PluginRuntime:
         self._metric_receivers = []
 
         self._plugin = None
+        self._special_methods = dict((method_attribute, []) for method_attribute in PluginRuntime.SPECIAL_METHODS)
+        self._concurrency = 1
+        self._command_queue = None
+        self._metrics_ring = None
 
         self._webinterface = WebInterfaceDispatcher(IO._log)
 
@@ -55,18 +73,36 @@ class PluginRuntime:
         sys.modules['plugins'] = sys.modules['__main__']
         sys.modules["plugins.base"] = base
 
+        # The introspection of an unchanged plugin package is cached
+        package_hash = get_package_hash(self._path)
+        introspection = load_introspection(self._path, package_hash)
+        cached_methods = {} if introspection is None else introspection['methods']
+
         # Instanciate the plugin class
-        plugin_class = get_plugin_class(plugin_dir)
-        check_plugin(plugin_class)
+        if introspection is None:
+            plugin_class = get_plugin_class(plugin_dir)
+            check_plugin(plugin_class)
+        else:
+            plugin_class = get_plugin_class(plugin_dir, introspection['class'])
 
         # Set the name, version, interfaces
         self._name = plugin_class.name
         self._version = plugin_class.version
         self._interfaces = plugin_class.interfaces
+        self._concurrency = max(1, int(getattr(plugin_class, 'concurrency', 1)))
 
         # Initialze the plugin
         self._plugin = plugin_class(self._webinterface, IO._log)
 
+        for method_attribute in PluginRuntime.SPECIAL_METHODS:
+            self._special_methods[method_attribute] = get_special_methods(self._plugin, method_attribute,
+                                                                          cached_methods.get(method_attribute))
+        if introspection is None:
+            save_introspection(self._path, {'hash': package_hash,
+                                            'class': plugin_class.__name__,
+                                            'methods': dict((method_attribute, [method.__name__ for method in methods])
+                                                            for method_attribute, methods in self._special_methods.iteritems())})
+
         # Set the receivers
         receiver_mapping = {'input_status': self._input_status_receivers,
                             'output_status': self._output_status_receivers,
@@ -74,14 +110,14 @@ class PluginRuntime:
                             'receive_events': self._event_receivers}
 
         for method_attribute, target in receiver_mapping.iteritems():
-            for method in get_special_methods(self._plugin, method_attribute):
+            for method in self._special_methods[method_attribute]:
                 target.append(method)
 
             if len(target) > 0:
                 self._receivers.append(method_attribute)
 
         # Set the exposed methods
-        for method in get_special_methods(self._plugin, 'om_expose'):
+        for method in self._special_methods['om_expose']:
             self._exposes.append({'name': method.__name__,
                                   'auth': method.om_expose['auth'],
                                   'content_type': method.om_expose['content_type']})
@@ -92,12 +128,12 @@ class PluginRuntime:
                 self._metric_definitions = plugin_class.metric_definitions
 
         # Set the metric collectors
-        for method in get_special_methods(self._plugin, 'om_metric_data'):
+        for method in self._special_methods['om_metric_data']:
             self._metric_collectors.append({'name': method.__name__,
                                             'interval': method.om_metric_data['interval']})
 
         # Set the metric receivers
-        for method in get_special_methods(self._plugin, 'om_metric_receive'):
+        for method in self._special_methods['om_metric_receive']:
             self._metric_receivers.append({'name': method.__name__,
                                            'source': method.om_metric_receive['source'],
                                            'metric_type': method.om_metric_receive['metric_type'],
@@ -105,7 +141,7 @@ class PluginRuntime:
 
     def _start_background_tasks(self):
         """ Start all background tasks. """
-        tasks = get_special_methods(self._plugin, 'background_task')
+        tasks = self._special_methods['background_task']
         for task in tasks:
             thread = Thread(target=PluginRuntime._run_background_task, args=(task,))
             thread.name = 'Background thread ({0})'.format(task.__name__)
@@ -129,40 +165,88 @@ class PluginRuntime:
             if command is None:
                 continue
 
-            action = command['action']
-            response = {'cid': command['cid'], 'action': action}
-            try:
-                ret = None
-                if action == 'start':
-                    ret = self._handle_start()
-                elif action == 'stop':
-                    ret = self._handle_stop()
-                elif action == 'input_status':
-                    ret = self._handle_input_status(command['event'])
-                elif action == 'output_status':
-                    ret = self._handle_output_status(command['status'])
-                elif action == 'shutter_status':
-                    ret = self._handle_shutter_status(command)
-                elif action == 'receive_events':
-                    ret = self._handle_receive_events(command['code'])
-                elif action == 'get_metric_definitions':
-                    ret = self._handle_get_metric_definitions()
-                elif action == 'collect_metrics':
-                    ret = self._handle_collect_metrics(command['name'])
-                elif action == 'distribute_metrics':
-                    ret = self._handle_distribute_metrics(command['name'], command['metrics'])
-                elif action == 'request':
-                    ret = self._handle_request(command['method'], command['args'], command['kwargs'])
-                elif action == 'remove_callback':
-                    ret = self._handle_remove_callback()
-                else:
-                    raise RuntimeError('Unknown action: {0}'.format(action))
-
-                if ret is not None:
-                    response.update(ret)
-            except Exception as exception:
-                response['_exception'] = str(exception)
-            IO._write(response)
+            if command['action'] == 'web_response':
+                # Handled right away, the worker that made the API call is waiting for it
+                self._webinterface.handle_ipc_response(command)
+            elif command['action'] == 'profile':
+                # Runs next to the workers, so it can sample them while they are busy
+                thread = Thread(target=self._process_command, args=(command,), name='Profiler')
+                thread.daemon = True
+                thread.start()
+            elif command['action'] in ['start', 'stop'] or self._command_queue is None:
+                self._process_command(command)
+            else:
+                self._command_queue.put(command)
+
+    def _start_workers(self):
+        """ Starts the workers that process the commands, so a slow command doesn't block the others """
+        self._command_queue = Queue()
+        for i in xrange(self._concurrency):
+            thread = Thread(target=self._work, name='Command worker {0}'.format(i))
+            thread.daemon = True
+            thread.start()
+
+    def _work(self):
+        while True:
+            self._process_command(self._command_queue.get())
+
+    def _process_command(self, command):
+        response, protocol = self._handle_command(command)
+        IO._write(response, protocol=protocol)
+        if response.get('web_ipc', False):
+            # Only after the start response, so the runner already switched protocol
+            self._webinterface.set_ipc(IO._write)
+
+    def _handle_command(self, command):
+        action = command['action']
+        response = {'cid': command.get('cid'), 'action': action}
+        protocol = None
+        try:
+            ret = None
+            if action == 'start':
+                ret = self._handle_start()
+                if 'msgpack' in command.get('protocols', []) and 'msgpack' in PluginIPCStream.get_protocols():
+                    protocol = 'msgpack'
+                    ret['protocol'] = protocol
+                if 'metrics_ring' in command:
+                    ret['metrics_ring'] = self._open_metrics_ring(command['metrics_ring'])
+                ret['web_ipc'] = command.get('web_ipc', False)
+                ret['batch'] = True
+            elif action == 'stop':
+                ret = self._handle_stop()
+            elif action == 'input_status':
+                ret = self._handle_input_status(command['event'])
+            elif action == 'output_status':
+                ret = self._handle_output_status(command['status'])
+            elif action == 'shutter_status':
+                ret = self._handle_shutter_status(command)
+            elif action == 'receive_events':
+                ret = self._handle_receive_events(command['code'])
+            elif action == 'get_metric_definitions':
+                ret = self._handle_get_metric_definitions()
+            elif action == 'collect_metrics':
+                ret = self._handle_collect_metrics(command['name'])
+            elif action == 'distribute_metrics':
+                ret = self._handle_distribute_metrics(command['name'], command['metrics'])
+            elif action == 'read_metrics_ring':
+                ret = self._handle_read_metrics_ring()
+            elif action == 'request':
+                ret = self._handle_request(command['method'], command['args'], command['kwargs'],
+                                           stream_cid=command['cid'] if command.get('stream', False) else None)
+            elif action == 'remove_callback':
+                ret = self._handle_remove_callback()
+            elif action == 'profile':
+                ret = sample_stacks(command['duration'], command['interval'])
+            elif action == 'batch':
+                ret = {'responses': [self._handle_command(batch_command)[0] for batch_command in command['commands']]}
+            else:
+                raise RuntimeError('Unknown action: {0}'.format(action))
+
+            if ret is not None:
+                response.update(ret)
+        except Exception as exception:
+            response['_exception'] = str(exception)
+        return response, protocol
 
     def _handle_start(self):
         """ Handles the start command. Cover exceptions manually to make sure as much metadata is returned as possible. """
@@ -172,13 +256,17 @@ class PluginRuntime:
             self._start_background_tasks()
         except Exception as exception:
             data['exception'] = str(exception)
+        self._start_workers()
         data.update({'name': self._name,
                      'version': self._version,
+                     'concurrency': self._concurrency,
                      'receivers': self._receivers,
                      'exposes': self._exposes,
                      'interfaces': self._interfaces,
                      'metric_collectors': self._metric_collectors,
-                     'metric_receivers': self._metric_receivers})
+                     'metric_receivers': self._metric_receivers,
+                     'metric_definitions': self._metric_definitions,
+                     'metric_definitions_version': get_definitions_hash(self._metric_definitions)})
         return data
 
     def _handle_stop(self):
@@ -243,15 +331,53 @@ class PluginRuntime:
         for metric in metrics:
             IO._with_catch('distribute metric', receive, [metric])
 
-    def _handle_request(self, method, args, kwargs):
+    def _open_metrics_ring(self, path):
+        if not PluginIPCStream.get_protocols():
+            return False  # Records in the ring are msgpack encoded
+        try:
+            self._metrics_ring = MetricsRing(path)
+            return True
+        except Exception as exception:
+            IO._log_exception('open metrics ring', exception)
+            return False
+
+    def _handle_read_metrics_ring(self):
+        records, lag = self._metrics_ring.read()
+        receiver_metrics = {}
+        for subscribers, metric in records:
+            receiver_names = [receiver_name for runner_name, receiver_name in subscribers if runner_name == self._name]
+            for index, receiver_name in enumerate(receiver_names):
+                # Every receiver gets its own instance, as they would over stdin
+                receiver_metrics.setdefault(receiver_name, []).append(metric if index == 0 else copy.deepcopy(metric))
+        for receiver_name, metrics in receiver_metrics.iteritems():
+            self._handle_distribute_metrics(receiver_name, metrics)
+        return {'lag': lag, 'dropped': self._metrics_ring.dropped}
+
+    def _handle_request(self, method, args, kwargs, stream_cid=None):
+        """
+        Performs a request. When the runner accepts a streamed response (e.g. for the webserver), generators and large
+        strings are sent in chunks, so the response can be sent while it's generated and other responses can be sent
+        in between.
+        """
         func = getattr(self._plugin, method)
         try:
-            return {'success': True, 'response': func(*args, **kwargs)}
+            response = func(*args, **kwargs)
+            if stream_cid is None:
+                return {'success': True, 'response': response}
+            if isinstance(response, types.GeneratorType):
+                chunks = response
+            elif isinstance(response, basestring) and len(response) > PluginRuntime.STREAM_CHUNK_SIZE:
+                chunks = (response[i:i + PluginRuntime.STREAM_CHUNK_SIZE] for i in xrange(0, len(response), PluginRuntime.STREAM_CHUNK_SIZE))
+            else:
+                return {'success': True, 'response': response}
+            for chunk in chunks:
+                IO._write({'cid': stream_cid, 'action': 'response_chunk', 'data': chunk})
+            return {'success': True, 'streamed': True}
         except Exception as exception:
             return {'success': False, 'exception': str(exception), 'stacktrace': traceback.format_exc()}
 
     def _handle_remove_callback(self):
-        for method in get_special_methods(self._plugin, 'on_remove'):
+        for method in self._special_methods['on_remove']:
             try:
                 method()
             except Exception as exception:
@@ -259,6 +385,9 @@ class PluginRuntime:
 
 
 class IO(object):
+    _stream = PluginIPCStream(sys.stdin.fileno())
+    _write_lock = Lock()
+
     @staticmethod
     def _log(msg):
         IO._write({'cid': 0, 'action': 'logs', 'logs': str(msg)})
@@ -277,38 +406,158 @@ class IO(object):
 
     @staticmethod
     def _wait_and_read_command():
-        stream = PluginIPCStream()
-        line = ''
-        while line == '':
-            line = sys.stdin.readline().strip()
         try:
-            response = stream.feed(line)
-            if response is not None:
-                return response
+            return IO._stream.read()
+        except EOFError:
+            os._exit(1)
         except Exception as ex:
             IO._log('Exception in _wait_and_read_command: Could not decode stdin: {0}'.format(ex))
 
     @staticmethod
-    def _write(msg):
-        sys.stdout.write(PluginIPCStream.encode(msg))
+    def _write(msg, protocol=None):
+        """ Writes a message, and switches to the given protocol afterwards (e.g. after the start response) """
+        with IO._write_lock:
+            sys.stdout.write(PluginIPCStream.encode(msg, binary=IO._stream.binary))
+            sys.stdout.flush()
+            if protocol == 'msgpack':
+                IO._stream.binary = True
+
+
+class Zygote(object):
+    """
+    Forks a plugin runtime for every spawn request on its socket. As the zygote already loaded the interpreter and the
+    common modules, a forked runtime only has to load the plugin itself. The zygote reaps the runtimes and reports
+    their exit code to whoever waits for it.
+    """
+
+    PRELOAD = ['json', 'urllib', 'urllib2', 'hashlib', 'datetime', 'random', 'requests']
+    MAX_EXIT_CODES = 100  # Exit codes of runtimes nobody waits for (yet) that are kept
+
+    def __init__(self, socket_path):
+        self._socket_path = socket_path
+        self._lock = Lock()
+        self._forked = threading.Event()
+        self._exit_codes = {}  # Pid -> exit code
+        self._waiting = {}  # Pid -> connection waiting for the exit code
+
+    def serve(self):
+        for module in Zygote.PRELOAD:
+            try:
+                __import__(module)
+            except ImportError:
+                pass
+        reaper = Thread(target=self._reap)
+        reaper.daemon = True
+        reaper.start()
+        server = self._listen()
+        sys.stdout.write('ready\n')
         sys.stdout.flush()
 
+        while True:
+            connection, _ = server.accept()
+            try:
+                command, _, argument = Zygote._read_line(connection).partition(' ')
+                if command == 'wait':
+                    if self._wait(int(argument), connection):
+                        continue  # Answered when the runtime exits
+                elif command == 'spawn':
+                    pid = os.fork()
+                    if pid == 0:
+                        server.close()
+                        for waiting in self._waiting.values():
+                            waiting.close()
+                        Zygote._run_forked(connection, argument)
+                    self._forked.set()
+                    connection.sendall(struct.pack('>I', pid))
+            except Exception as ex:
+                sys.stderr.write('Could not handle zygote request: {0}\n'.format(ex))
+            connection.close()
+
+    def _listen(self):
+        """ Only the user running the zygote (root) can spawn runtimes: the socket is in a private directory """
+        directory = os.path.dirname(self._socket_path)
+        if not os.path.exists(directory):
+            os.makedirs(directory, 0o700)
+        stat = os.stat(directory)
+        if stat.st_uid != os.getuid() or stat.st_mode & 0o022:
+            raise RuntimeError('Socket directory {0} is not private'.format(directory))
+        if os.path.exists(self._socket_path):
+            os.remove(self._socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o177)
+        try:
+            server.bind(self._socket_path)
+        finally:
+            os.umask(umask)
+        os.chmod(self._socket_path, 0o600)
+        server.listen(16)
+        return server
+
+    def _wait(self, pid, connection):
+        """ Sends the exit code of the runtime once it exits, returns whether it's still running """
+        with self._lock:
+            if pid not in self._exit_codes:
+                self._waiting[pid] = connection
+                return True
+            exit_code = self._exit_codes.pop(pid)
+        connection.sendall(struct.pack('>i', exit_code))
+        return False
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, 0)
+            except OSError as ex:
+                if ex.errno != errno.ECHILD:
+                    raise
+                self._forked.wait(1)  # No runtimes yet
+                self._forked.clear()
+                continue
+            exit_code = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+            with self._lock:
+                connection = self._waiting.pop(pid, None)
+                if connection is None:
+                    if len(self._exit_codes) >= Zygote.MAX_EXIT_CODES:
+                        self._exit_codes.clear()
+                    self._exit_codes[pid] = exit_code
+                    continue
+            try:
+                connection.sendall(struct.pack('>i', exit_code))
+            except socket.error:
+                pass
+            finally:
+                connection.close()
 
-if __name__ == '__main__':
-    if len(sys.argv) < 3 or sys.argv[1] != 'start':
-        sys.stderr.write('Usage: python {0} start <path>\n'.format(sys.argv[0]))
-        sys.stderr.flush()
-        sys.exit(1)
+    @staticmethod
+    def _read_line(connection):
+        data = ''
+        while not data.endswith('\n'):
+            chunk = connection.recv(1024)
+            if not chunk:
+                raise EOFError('Connection closed')
+            data += chunk
+        return data.strip()
 
-    def watch_parent():
-        parent = os.getppid()
-        # If the parent process gets kills, this process will be attached to init.
-        # In that case the plugin should stop running.
-        while True:
-            if os.getppid() != parent:
-                os._exit(1)
-            time.sleep(1)
+    @staticmethod
+    def _run_forked(connection, plugin_path):
+        """ Runs in the forked process: the connection becomes stdin and stdout of the runtime """
+        os.dup2(connection.fileno(), 0)
+        os.dup2(connection.fileno(), 1)
+        connection.close()
+        run(plugin_path)
+
+
+def watch_parent():
+    parent = os.getppid()
+    # If the parent process gets kills, this process will be attached to init.
+    # In that case the plugin should stop running.
+    while True:
+        if os.getppid() != parent:
+            os._exit(1)
+        time.sleep(1)
 
+
+def run(path):
     # Keep an eye on our parent process
     watcher = Thread(target=watch_parent)
     watcher.daemon = True
@@ -316,10 +565,26 @@ if __name__ == '__main__':
 
     # Start the runtime
     try:
-        runtime = PluginRuntime(path=sys.argv[2])
+        runtime = PluginRuntime(path=path)
         runtime.process_stdin()
     except BaseException as ex:
         IO._log_exception('__main__', ex)
         os._exit(1)
 
     os._exit(0)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] not in ['start', 'zygote']:
+        sys.stderr.write('Usage: python {0} start <path>\n'.format(sys.argv[0]))
+        sys.stderr.write('       python {0} zygote <socket path>\n'.format(sys.argv[0]))
+        sys.stderr.flush()
+        sys.exit(1)
+
+    if sys.argv[1] == 'zygote':
+        zygote_watcher = Thread(target=watch_parent)
+        zygote_watcher.daemon = True
+        zygote_watcher.start()
+        Zygote(sys.argv[2]).serve()
+    else:
+        run(sys.argv[2])
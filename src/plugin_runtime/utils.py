@@ -1,18 +1,34 @@
+import hashlib
 import inspect
+import os
 import re
+try:
+    import ujson as json
+except ImportError:
+    # This is the case when the plugin runtime is unittested
+    import json
 
 from plugin_runtime.base import PluginException, OMPluginBase
 from plugin_runtime.interfaces import check_interfaces
 
 
-def get_plugin_class(package_name):
-    """ Get the plugin class using the name of the plugin package. """
+INTROSPECTION_CACHE = '.introspection_cache'
+
+
+def get_plugin_class(package_name, class_name=None):
+    """
+    Get the plugin class using the name of the plugin package.
+    :param class_name: The name of the class, if it is already known (e.g. from the introspection cache)
+    """
     plugin = __import__(package_name, globals(), locals(), ['main'])
     plugin_classes = {}
 
     if not hasattr(plugin, 'main'):
         raise PluginException('Module main was not found in plugin {0}'.format(package_name))
 
+    if class_name is not None:
+        return getattr(plugin.main, class_name)
+
     for _, obj in inspect.getmembers(plugin.main):
         if not inspect.isclass(obj):
             continue
@@ -61,9 +77,56 @@ def check_plugin(plugin_class):
     check_interfaces(plugin_class)
 
 
-def get_special_methods(plugin_object, method_attribute):
-    """ Get all methods of a plugin object that have the given attribute. """
+def get_special_methods(plugin_object, method_attribute, method_names=None):
+    """
+    Get all methods of a plugin object that have the given attribute.
+    :param method_names: The names of the methods, if they are already known (e.g. from the introspection cache)
+    """
+    if method_names is not None:
+        return [getattr(plugin_object, name) for name in method_names]
+
     def __check(member):
         """ Check if a member is a method and has the given attribute. """
         return inspect.ismethod(member) and hasattr(member, method_attribute)
     return [m[1] for m in inspect.getmembers(plugin_object, predicate=__check)]
+
+
+def get_definitions_hash(definitions):
+    """ Hashes metric definitions, so changes can be detected without comparing them. """
+    return hashlib.md5(json.dumps(definitions, sort_keys=True)).hexdigest()
+
+
+def get_package_hash(path):
+    """ Hashes the names, sizes and modification times of the code files in a plugin package. """
+    hasher = hashlib.md5()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.endswith('.py') or filename.endswith('.egg'):
+                file_path = os.path.join(root, filename)
+                stat = os.stat(file_path)
+                hasher.update('{0}:{1}:{2}\n'.format(os.path.relpath(file_path, path), stat.st_size, stat.st_mtime))
+    return hasher.hexdigest()
+
+
+def load_introspection(path, package_hash):
+    """ Loads the cached introspection of a plugin package, returns None if there is none for the given package hash. """
+    try:
+        with open(os.path.join(path, INTROSPECTION_CACHE), 'r') as cache_file:
+            introspection = json.load(cache_file)
+        if introspection.get('hash') == package_hash:
+            return introspection
+    except (IOError, ValueError):
+        pass
+    return None
+
+
+def save_introspection(path, introspection):
+    """ Saves the introspection of a plugin package, failing to do so only makes the next start slower. """
+    cache_path = os.path.join(path, INTROSPECTION_CACHE)
+    try:
+        with open('{0}.tmp'.format(cache_path), 'w') as cache_file:
+            json.dump(introspection, cache_file)
+        os.rename('{0}.tmp'.format(cache_path), cache_path)
+    except (IOError, OSError):
+        pass
@@ -1,5 +1,6 @@
 import re
 import requests
+from threading import Event, Lock, local
 
 try:
     import ujson as json
@@ -34,6 +35,15 @@ def _load_webinterface():
     return calls
 
 
+def _to_query_value(value):
+    """ Converts a value the way it would be received as query parameter """
+    if isinstance(value, (list, tuple)):
+        return [_to_query_value(item) for item in value]
+    if isinstance(value, basestring):
+        return value
+    return str(value)
+
+
 class WebInterfaceDispatcher(object):
     # TODO: Use SDK in the future
 
@@ -43,6 +53,46 @@ class WebInterfaceDispatcher(object):
         self.__port = port
         self.__warned = False
         self.__available_calls = _load_webinterface()
+        # Keep-alive connections are reused for consecutive calls. A session isn't thread-safe and the plugin
+        # threads call the API concurrently, so every thread has its own session (and connection)
+        self.__sessions = local()
+        self.__ipc_send = None
+        self.__ipc_lock = Lock()
+        self.__ipc_rid = 0
+        self.__ipc_pending = {}
+
+    def set_ipc(self, send):
+        """
+        Sends the API calls over the plugin runner pipe instead of HTTP
+        :param send: Function that sends a message to the runner
+        """
+        self.__ipc_send = send
+
+    def handle_ipc_response(self, message):
+        """ Handles the response the runner sent for an API call """
+        pending = self.__ipc_pending.pop(message['rid'], None)
+        if pending is not None:
+            pending[1] = message['response']
+            pending[0].set()
+
+    def __ipc_call(self, name, params):
+        with self.__ipc_lock:
+            self.__ipc_rid += 1
+            rid = self.__ipc_rid
+        pending = [Event(), None]
+        self.__ipc_pending[rid] = pending
+        self.__ipc_send({'cid': 0, 'action': 'web_call', 'rid': rid, 'name': name, 'params': params})
+        if not pending[0].wait(30.0):
+            self.__ipc_pending.pop(rid, None)
+            raise RuntimeError('No response within 30s')
+        return pending[1]
+
+    def __get_session(self):
+        session = getattr(self.__sessions, 'session', None)
+        if session is None:
+            session = requests.Session()
+            self.__sessions.session = session
+        return session
 
     def __getattr__(self, attribute):
         if attribute in self.__available_calls:
@@ -78,11 +128,13 @@ class WebInterfaceDispatcher(object):
             for arg in kwargs:
                 if kwargs[arg] is None:
                     kwargs[arg] = 'None'
-            # 4. Perform the http call
+            # 4. Perform the call
             try:
-                response = requests.get('http://{0}:{1}/{2}'.format(self.__hostname, self.__port, name),
-                                        params=kwargs,
-                                        timeout=30.0)
+                if self.__ipc_send is not None:
+                    return self.__ipc_call(name, dict((key, _to_query_value(value)) for key, value in kwargs.iteritems()))
+                response = self.__get_session().get('http://{0}:{1}/{2}'.format(self.__hostname, self.__port, name),
+                                                    params=kwargs,
+                                                    timeout=30.0)
                 return response.text
             except Exception:
                 return json.dumps({'success': False,
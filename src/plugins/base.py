@@ -15,13 +15,18 @@
 """ The OpenMotics plugin controller. """
 
 import logging
+import msgpack
 import os
 import pkgutil
+import time
 import traceback
+from Queue import Queue, Empty
+from threading import Thread
 from gateway.observer import Event
 from datetime import datetime
 from ioc import Injectable, Inject, INJECTED, Singleton
-from plugins.runner import PluginRunner
+from plugins.runner import PluginRunner, RuntimeZygote, HttpProxyPool
+from toolbox import MetricsRing
 
 logger = logging.getLogger("openmotics")
 
@@ -31,12 +36,16 @@ logger = logging.getLogger("openmotics")
 class PluginController(object):
     """ The controller keeps track of all plugins in the system. """
 
+    METRIC_COLLECTOR_WORKERS = 4  # Threads running the plugin metric collectors
+
     @Inject
     def __init__(self,
                  web_interface=INJECTED, configuration_controller=INJECTED, observer=INJECTED,
                  runtime_path='/opt/openmotics/python/plugin_runtime',
                  plugins_path='/opt/openmotics/python/plugins',
-                 plugin_config_path='/opt/openmotics/etc'):
+                 plugin_config_path='/opt/openmotics/etc',
+                 metrics_ring_path='/dev/shm/openmotics_plugin_metrics',
+                 zygote_socket_path='/var/run/openmotics/plugin_zygote.sock'):
         """
         :type observer: gateway.observer.Observer
         """
@@ -45,11 +54,20 @@ class PluginController(object):
         self.__runtime_path = runtime_path
         self.__plugins_path = plugins_path
         self.__plugin_config_path = plugin_config_path
+        self.__metrics_ring_path = metrics_ring_path
         self.__observer = observer
+        self.__zygote = RuntimeZygote(runtime_path, zygote_socket_path) if zygote_socket_path is not None else None
+        self.__http_pool = HttpProxyPool()  # Shared by all plugins
 
         self.__stopped = True
         self.__logs = {}
         self.__runners = {}
+        self.__definition_versions = {}
+        self.__metrics_ring = None
+        self.__collected_metrics = Queue()
+        self.__running_collectors = set()
+        self.__collector_queue = Queue()
+        self.__collector_workers = []
 
         self.__metrics_controller = None
         self.__metrics_collector = None
@@ -58,6 +76,8 @@ class PluginController(object):
     def start(self):
         """ Start the plugins and expose them via the webinterface. """
         if self.__stopped:
+            self.__init_metrics_ring()
+            self.__start_collector_workers()
             self.__init_runners()
             self.__update_dependencies()
         else:
@@ -66,11 +86,20 @@ class PluginController(object):
     def stop(self):
         for runner_name in self.__runners.keys():
             self.__destroy_plugin_runner(runner_name)
+        if self.__metrics_ring is not None:
+            self.__metrics_ring.close()
+            self.__metrics_ring = None
+        if self.__zygote is not None:
+            self.__zygote.stop()
+        for _ in self.__collector_workers:
+            self.__collector_queue.put(None)
+        self.__collector_workers = []
         self.__stopped = True
 
     def set_metrics_controller(self, metrics_controller):
         """ Sets the metrics controller """
         self.__metrics_controller = metrics_controller
+        self.__definition_versions = {}  # The new metrics controller doesn't know any plugin definitions yet
 
     def set_metrics_collector(self, metrics_collector):
         """ Sets the metrics collector """
@@ -94,6 +123,14 @@ class PluginController(object):
             if runner is not None:
                 self.__start_plugin_runner(runner, package_name)
 
+    def __init_metrics_ring(self):
+        """ Creates the shared ring through which the metrics are distributed to the plugin runtimes """
+        try:
+            self.__metrics_ring = MetricsRing(self.__metrics_ring_path, size=MetricsRing.DEFAULT_SIZE)
+        except Exception as exception:
+            logger.warning('Could not create the plugin metrics ring, metrics will be sent over stdin: {0}'.format(exception))
+            self.__metrics_ring = None
+
     def __init_plugin_runner(self, plugin_name):
         """ Initializes a single plugin runner """
         try:
@@ -102,7 +139,11 @@ class PluginController(object):
                 return
             logger = self.get_logger(plugin_name)
             plugin_path = os.path.join(self.__plugins_path, plugin_name)
-            runner = PluginRunner(plugin_name, self.__runtime_path, plugin_path, logger)
+            runner = PluginRunner(plugin_name, self.__runtime_path, plugin_path, logger,
+                                  metrics_ring_path=self.__metrics_ring_path if self.__metrics_ring is not None else None,
+                                  web_interface=self.__webinterface,
+                                  zygote=self.__zygote,
+                                  http_pool=self.__http_pool)
             self.__runners[runner.name] = runner
             return runner
         except Exception as exception:
@@ -163,7 +204,9 @@ class PluginController(object):
         if self.__metrics_collector is not None:
             self.__metrics_collector.set_plugin_intervals(self.__get_metric_receivers())
         if self.__metrics_controller is not None:
-            self.__metrics_controller.set_plugin_definitions(self.__get_metric_definitions())
+            definitions, removed = self.__get_changed_metric_definitions()
+            if definitions or removed:
+                self.__metrics_controller.update_plugin_definitions(definitions, removed)
 
     def get_plugins(self):
         """
@@ -173,6 +216,17 @@ class PluginController(object):
         """
         return self.__runners.values()
 
+    def get_resource_stats(self):
+        """ Returns the resource usage per plugin, see PluginRunner.get_resource_stats """
+        return dict((runner.name, runner.get_resource_stats()) for runner in self.__runners.values())
+
+    def profile_plugin(self, name, duration):
+        """ Samples the stacks of a running plugin during the given duration (in seconds) """
+        runner = self.__get_plugin(name)
+        if runner is None or not runner.is_running():
+            raise Exception('Plugin \'{0}\' is not running.'.format(name))
+        return runner.profile(duration=duration)
+
     def __get_plugin(self, name):
         """
         Get a plugin by name, None if it the plugin is not installed.
@@ -216,7 +270,8 @@ class PluginController(object):
 
             # Check if the package contains a valid plugin
             logger = self.get_logger('new_package')
-            runner = PluginRunner(None, self.__runtime_path, '{0}/new_package'.format(tmp_dir), logger)
+            runner = PluginRunner(None, self.__runtime_path, '{0}/new_package'.format(tmp_dir), logger,
+                                  zygote=self.__zygote)
             runner.start()
             runner.stop()
             name, version = runner.name, runner.version
@@ -338,40 +393,96 @@ class PluginController(object):
         if runner is not None:
             return runner.request(method, args=args, kwargs=kwargs)
 
-    def collect_metrics(self):
-        """ Collects all metrics from all plugins """
+    def collect_metrics(self, timeout=1.0):
+        """
+        Hands the plugin metric collectors that are due to the collector workers, so a slow plugin can't delay
+        the others. Yields the collected metrics as they arrive, until the next collector is due (or the timeout passed).
+        """
+        now = time.time()
+        next_collection = now + timeout
         for runner in self.__iter_running_runners():
-            for metric in runner.collect_metrics():
-                if metric is None:
-                    continue
-                else:
-                    yield metric
+            for name in runner.get_due_metric_collectors(now):
+                key = (runner.name, name)
+                if key in self.__running_collectors:
+                    continue  # The previous run didn't finish yet
+                self.__running_collectors.add(key)
+                self.__collector_queue.put((runner, name))
+            runner_next_collection = runner.get_next_metric_collection()
+            if runner_next_collection is not None:
+                next_collection = min(next_collection, runner_next_collection)
+        while True:
+            try:
+                metrics = self.__collected_metrics.get(timeout=max(0.0, next_collection - time.time()))
+            except Empty:
+                return
+            for metric in metrics:
+                yield metric
+
+    def __start_collector_workers(self):
+        self.__collector_queue = Queue()
+        for i in xrange(PluginController.METRIC_COLLECTOR_WORKERS):
+            worker = Thread(target=self.__run_collectors, args=(self.__collector_queue,),
+                            name='PluginController metric collector {0}'.format(i))
+            worker.daemon = True
+            worker.start()
+            self.__collector_workers.append(worker)
+
+    def __run_collectors(self, collector_queue):
+        while True:
+            collector = collector_queue.get()
+            if collector is None:
+                return
+            runner, name = collector
+            try:
+                self.__collected_metrics.put(runner.collect_metrics(name))
+            except Exception as ex:
+                logger.error('Could not collect metrics of {0}.{1}: {2}'.format(runner.name, name, ex))
+            finally:
+                self.__running_collectors.discard((runner.name, name))
 
     def distribute_metrics(self, metrics):
-        """ Enqueues all metrics in a separate queue per plugin """
+        """
+        Writes the metrics once in the shared metrics ring for the plugins that read from it, and
+        enqueues the metrics in a separate queue per plugin for the others
+        """
         rates = {'total': 0}
-        rate_keys = []
-        # Preprocess rate keys
-        for metric in metrics:
-            rate_key = '{0}.{1}'.format(metric['source'].lower(), metric['type'].lower())
-            if rate_key not in rates:
-                rates[rate_key] = 0
-            rate_keys.append(rate_key)
-        # Distribute
+        runners = {}
+        subscriptions = []
         for runner in self.__iter_running_runners():
+            runners[runner.name] = runner
             for receiver in runner.get_metric_receivers():
-                receiver_metrics = []
-                try:
-                    sources = self.__metrics_controller.get_filter('source', receiver['source'])
-                    metric_types = self.__metrics_controller.get_filter('metric_type', receiver['metric_type'])
-                    for index, metric in enumerate(metrics):
-                        if metric['source'] in sources and metric['type'] in metric_types:
-                            receiver_metrics.append(metric)
-                            rates[rate_keys[index]] += 1
-                            rates['total'] += 1
-                    runner.distribute_metrics(receiver['name'], receiver_metrics)
-                except Exception as ex:
-                    self.log(runner.name, 'Exception while distributing metrics', ex, traceback.format_exc())
+                subscriptions.append(((runner.name, receiver['name']), receiver['source'], receiver['metric_type']))
+        routing_table = self.__metrics_controller.get_routing_table(tuple(subscriptions))
+        ring_runners = set(runner_name for runner_name, runner in runners.iteritems()
+                           if self.__metrics_ring is not None and runner.uses_metrics_ring())
+        # Route
+        receiver_metrics = {}
+        ring_records = []
+        notified_runners = set()
+        for metric in metrics:
+            rate_key, subscribers = routing_table.get(metric['source'], metric['type'])
+            rates[rate_key] = rates.get(rate_key, 0) + len(subscribers)
+            rates['total'] += len(subscribers)
+            ring_subscribers = []
+            for subscriber in subscribers:
+                if subscriber[0] in ring_runners:
+                    ring_subscribers.append(subscriber)
+                    notified_runners.add(subscriber[0])
+                else:
+                    receiver_metrics.setdefault(subscriber, []).append(metric)
+            if ring_subscribers:
+                ring_records.append(msgpack.packb([ring_subscribers, metric], use_bin_type=True))
+        # Distribute
+        if ring_records:
+            self.__metrics_ring.write(ring_records)
+            for runner_name in notified_runners:
+                runners[runner_name].notify_metrics_ring()
+        for (runner_name, receiver_name), subscriber_metrics in receiver_metrics.iteritems():
+            runner = runners[runner_name]
+            try:
+                runner.distribute_metrics(receiver_name, subscriber_metrics)
+            except Exception as ex:
+                self.log(runner.name, 'Exception while distributing metrics', ex, traceback.format_exc())
         return rates
 
     def __get_cherrypy_mounts(self):
@@ -391,12 +502,18 @@ class PluginController(object):
             receivers.extend(runner.get_metric_receivers())
         return receivers
 
-    def __get_metric_definitions(self):
-        """ Loads all metric definitions of all plugins """
+    def __get_changed_metric_definitions(self):
+        """ Returns the metric definitions of the plugins of which they changed, and the plugins that are gone """
+        versions = {}
         definitions = {}
         for runner in self.__iter_running_runners():
-            definitions[runner.name] = runner.get_metric_definitions()
-        return definitions
+            version = runner.get_metric_definitions_version()
+            versions[runner.name] = version
+            if version is None or self.__definition_versions.get(runner.name) != version:
+                definitions[runner.name] = runner.get_metric_definitions()
+        removed = [name for name in self.__definition_versions if name not in versions]
+        self.__definition_versions = versions
+        return definitions, removed
 
     def log(self, plugin, msg, exception, stacktrace=None):
         """ Append an exception to the log for the plugins. This log can be retrieved using get_logs. """
@@ -418,9 +535,12 @@ class PluginController(object):
 
         def log(msg):
             """ Log function for the given plugin."""
-            self.__logs[plugin_name].append('{0} - {1}'.format(datetime.now(), msg))
-            if len(self.__logs[plugin_name]) > 100:
-                self.__logs[plugin_name].pop(0)
+            logs = self.__logs.get(plugin_name)
+            if logs is None:
+                return  # The plugin was removed, e.g. while one of its metric collectors was still running
+            logs.append('{0} - {1}'.format(datetime.now(), msg))
+            if len(logs) > 100:
+                logs.pop(0)
 
         return log
 
@@ -1,21 +1,57 @@
 import cherrypy
+import itertools
 import logging
+import os
+import resource
+import select
+import signal
+import socket
+import struct
 import subprocess
 import sys
 import time
 import traceback
-from threading import Thread, Lock
-from toolbox import Queue, Empty, Full, PluginIPCStream
+import ujson as json
+from collections import deque
+from Queue import Queue, Empty, Full
+from threading import Thread, Lock, Event, Condition
+from toolbox import PluginIPCStream
 
 logger = logging.getLogger("openmotics")
 
 
+def _get_python_executable():
+    python_executable = sys.executable
+    if python_executable is None or len(python_executable) == 0:
+        python_executable = '/usr/bin/python'
+    return python_executable
+
+
 class PluginRunner:
 
-    def __init__(self, name, runtime_path, plugin_path, logger, command_timeout=5):
+    ASYNC_QUEUE_SIZE = 1000
+    ASYNC_BATCH_SIZE = 50
+    COALESCED_ACTIONS = ['output_status', 'shutter_status', 'read_metrics_ring']  # Actions of which only the latest matters
+    LATENCY_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0]  # Upper bounds (in seconds) of the command latency histograms
+    QUEUE_SAMPLES = 300  # Async queue depth samples that are kept, at most one per second
+    HTTP_QUEUE_SIZE = 4  # HTTP requests that can wait for a busy plugin, on top of its concurrency
+    WEB_CALL_WORKERS = 2  # Threads executing the API calls of a plugin
+    WEB_CALL_QUEUE_SIZE = 50  # API calls of a plugin that can wait for a worker
+
+    def __init__(self, name, runtime_path, plugin_path, logger, command_timeout=5, metrics_ring_path=None, web_interface=None,
+                 zygote=None, http_pool=None):
+        """
+        :type zygote: plugins.runner.RuntimeZygote
+        :param http_pool: The pool that limits the webserver threads that can be waiting for plugins
+        :type http_pool: plugins.runner.HttpProxyPool
+        """
         self.runtime_path = runtime_path
         self.plugin_path = plugin_path
         self.command_timeout = command_timeout
+        self.metrics_ring_path = metrics_ring_path
+        self.web_interface = web_interface
+        self.zygote = zygote
+        self.http_pool = http_pool if http_pool is not None else HttpProxyPool()
 
         self._logger = logger
         self._cid = 0
@@ -23,8 +59,12 @@ class PluginRunner:
         self._running = False
         self._process_running = False
         self._out_thread = None
-        self._command_lock = Lock()
-        self._response_queue = None
+        self._web_calls = Queue(maxsize=PluginRunner.WEB_CALL_QUEUE_SIZE)
+        self._web_call_workers = []
+        self._write_lock = Lock()
+        self._pending_commands = {}
+        self._protocols = PluginIPCStream.get_protocols()
+        self._binary = False
 
         self.name = name
         self.version = None
@@ -34,13 +74,30 @@ class PluginRunner:
         self._exposes = []
         self._metric_collectors = []
         self._metric_receivers = []
+        self._metric_definitions = None
+        self._metric_definitions_version = None
 
         self._async_command_thread = None
-        self._async_command_queue = None
+        self._async_commands = deque()
+        self._async_coalesced = {}
+        self._async_condition = Condition()
+        self._async_queue_full = False
+        self._async_stats = {'delivered': 0, 'dropped': 0, 'coalesced': 0, 'latency': 0.0}
+        self._batch = False
+
+        self._metrics_ring = False
+        self._metrics_ring_stats = {'lag': 0, 'dropped': 0}
+        self._concurrency = 1
 
         self._commands_executed = 0
         self._commands_failed = 0
 
+        self._stats_lock = Lock()
+        self._ipc_stats = {'bytes_in': 0, 'bytes_out': 0}
+        self._command_latencies = {}
+        self._queue_samples = deque(maxlen=PluginRunner.QUEUE_SAMPLES)
+        self._cpu_sample = None
+
         self.__collector_runs = {}
 
     def start(self):
@@ -49,25 +106,39 @@ class PluginRunner:
 
         self.logger('[Runner] Starting')
 
-        python_executable = sys.executable
-        if python_executable is None or len(python_executable) == 0:
-            python_executable = '/usr/bin/python'
-
-        self._proc = subprocess.Popen([python_executable, "runtime.py", "start", self.plugin_path],
-                                      stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=None,
-                                      cwd=self.runtime_path, universal_newlines=True, bufsize=1)
+        self._proc = None
+        if self.zygote is not None:
+            try:
+                self._proc = self.zygote.spawn(self.plugin_path)
+            except Exception as exception:
+                self.logger('[Runner] Could not fork runtime, starting a new one: {0}'.format(exception))
+        if self._proc is None:
+            self._proc = subprocess.Popen([_get_python_executable(), "runtime.py", "start", self.plugin_path],
+                                          stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=None,
+                                          cwd=self.runtime_path, bufsize=1)
         self._process_running = True
+        self._binary = False
 
         self._commands_executed = 0
         self._commands_failed = 0
 
-        self._response_queue = Queue()
+        self._pending_commands = {}
+        self._start_web_call_workers()
         self._out_thread = Thread(target=self._read_out,
                                   name='PluginRunner {0} stdout reader'.format(self.plugin_path))
         self._out_thread.daemon = True
         self._out_thread.start()
 
-        start_out = self._do_command('start', timeout=120)
+        start_fields = {'protocols': self._protocols}
+        if self.metrics_ring_path is not None:
+            start_fields['metrics_ring'] = self.metrics_ring_path
+        if self.web_interface is not None:
+            start_fields['web_ipc'] = True
+        start_out = self._do_command('start', start_fields, timeout=120)
+        # An older runtime doesn't answer with a protocol or metrics ring and keeps using json
+        self._metrics_ring = start_out.get('metrics_ring', False)
+        self._batch = start_out.get('batch', False)
+        self._concurrency = start_out.get('concurrency', 1)
         self.name = start_out['name']
         self.version = start_out['version']
         self.interfaces = start_out['interfaces']
@@ -76,12 +147,17 @@ class PluginRunner:
         self._exposes = start_out['exposes']
         self._metric_collectors = start_out['metric_collectors']
         self._metric_receivers = start_out['metric_receivers']
+        # An older runtime doesn't send its definitions at start, they're requested when needed
+        self._metric_definitions = start_out.get('metric_definitions')
+        self._metric_definitions_version = start_out.get('metric_definitions_version')
 
         exception = start_out.get('exception')
         if exception is not None:
             raise RuntimeError(exception)
 
-        self._async_command_queue = Queue(1000)
+        with self._async_condition:
+            self._async_commands.clear()
+            self._async_coalesced = {}
         self._async_command_thread = Thread(target=self._perform_async_commands,
                                             name='PluginRunner {0} async thread'.format(self.plugin_path))
         self._async_command_thread.daemon = True
@@ -115,7 +191,7 @@ class PluginRunner:
 
             @cherrypy.expose
             def index(self, method, *args, **kwargs):
-                return self.runner.request(method, args=args, kwargs=kwargs)
+                return self.runner.http_request(method, args=args, kwargs=kwargs)
 
         return Service(self)
 
@@ -134,6 +210,8 @@ class PluginRunner:
             time.sleep(0.1)
 
             self._process_running = False
+            self._wake_async_thread()
+            self._stop_web_call_workers()
 
             if self._proc.poll() is None:
                 self.logger('[Runner] Terminating process')
@@ -163,22 +241,35 @@ class PluginRunner:
     def process_event(self, code):
         self._do_async('receive_events', {'code': code}, should_filter=True)
 
-    def collect_metrics(self):
+    def get_due_metric_collectors(self, now):
+        """ Returns the names of the metric collectors that are due, and marks them as started """
+        due = []
         for mc in self._metric_collectors:
-            try:
-                now = time.time()
-                (name, interval) = (mc['name'], mc['interval'])
-
-                if self.__collector_runs.get(name, 0) < now - interval:
-                    self.__collector_runs[name] = now
-                    metrics = self._do_command('collect_metrics', {'name': name})['metrics']
-                    for metric in metrics:
-                        if metric is None:
-                            continue
-                        metric['source'] = self.name
-                        yield metric
-            except Exception as exception:
-                self.logger('[Runner] Exception while collecting metrics {0}: {1}'.format(exception, traceback.format_exc()))
+            (name, interval) = (mc['name'], mc['interval'])
+            if self.__collector_runs.get(name, 0) <= now - interval:
+                self.__collector_runs[name] = now
+                due.append(name)
+        return due
+
+    def get_next_metric_collection(self):
+        """ Returns the timestamp at which the next metric collector is due, None if there are no collectors """
+        next_runs = [self.__collector_runs.get(mc['name'], 0) + mc['interval'] for mc in self._metric_collectors]
+        return min(next_runs) if next_runs else None
+
+    def collect_metrics(self, name):
+        """ Runs a single metric collector. It should finish within its interval (and the command timeout) """
+        interval = next(mc['interval'] for mc in self._metric_collectors if mc['name'] == name)
+        metrics = []
+        try:
+            for metric in self._do_command('collect_metrics', {'name': name},
+                                           timeout=min(self.command_timeout, max(1, interval)))['metrics']:
+                if metric is None:
+                    continue
+                metric['source'] = self.name
+                metrics.append(metric)
+        except Exception as exception:
+            self.logger('[Runner] Exception while collecting metrics {0}: {1}'.format(exception, traceback.format_exc()))
+        return metrics
 
     def get_metric_receivers(self):
         return self._metric_receivers
@@ -187,56 +278,136 @@ class PluginRunner:
         self._do_async('distribute_metrics', {'name': method,
                                               'metrics': metrics})
 
+    def uses_metrics_ring(self):
+        """ Whether the runtime reads the metrics to distribute from the shared metrics ring """
+        return self._metrics_ring
+
+    def notify_metrics_ring(self):
+        """ Lets the runtime know new metrics were written to the metrics ring """
+        self._do_async('read_metrics_ring', {})
+
+    def get_metrics_ring_stats(self):
+        """ Returns the amount of records the runtime lagged behind on its last read, and the total records it lost """
+        return self._metrics_ring_stats
+
     def get_metric_definitions(self):
+        if self._metric_definitions is not None:
+            return self._metric_definitions
         return self._do_command('get_metric_definitions')['metric_definitions']
 
+    def get_metric_definitions_version(self):
+        """ Returns the hash of the metric definitions the plugin announced at start, None if unknown """
+        return self._metric_definitions_version
+
     def request(self, method, args=None, kwargs=None):
         if args is None:
             args = []
         if kwargs is None:
             kwargs = {}
-        ret = self._do_command('request', {'method': method,
-                                           'args': args,
-                                           'kwargs': kwargs})
+        return self._get_request_response(self._do_command('request', {'method': method,
+                                                                       'args': args,
+                                                                       'kwargs': kwargs}))
+
+    @staticmethod
+    def _get_request_response(ret):
         if ret['success']:
-            return ret['response']
+            return ret.get('response')
         else:
             raise Exception('{0}: {1}'.format(ret['exception'], ret['stacktrace']))
 
+    def http_request(self, method, args=None, kwargs=None):
+        """
+        Performs a request on behalf of the webserver. A request is refused with a 503 right away when the plugin
+        (or all plugins together) already keep too many webserver threads waiting. Large responses, and responses
+        of exposed methods that return a generator, are streamed to the client while they are received.
+        """
+        if not self.http_pool.acquire(self.name, self._concurrency + PluginRunner.HTTP_QUEUE_SIZE):
+            raise cherrypy.HTTPError(503, 'Plugin {0} is busy'.format(self.name))
+        streaming = False
+        try:
+            command, pending_command = self._send_command('request', {'method': method,
+                                                                      'args': args or [],
+                                                                      'kwargs': kwargs or {},
+                                                                      'stream': True})
+            start = time.time()
+            self._wait_command(command, pending_command, self.command_timeout, start, chunks=True)
+            if pending_command.response is not None and not pending_command.has_chunks():
+                return self._get_request_response(self._get_command_response(command, pending_command, start))
+            cherrypy.response.stream = True
+            chunks = self._stream_response(command, pending_command, start)  # Releases the pool when done
+            streaming = True
+            first_chunk = next(chunks)  # Started, so the pool is also released when the response is dropped unread
+            return itertools.chain([first_chunk], chunks)
+        finally:
+            if not streaming:
+                self.http_pool.release(self.name)
+
+    def _stream_response(self, command, pending_command, start):
+        try:
+            while True:
+                for chunk in pending_command.pop_chunks():
+                    yield chunk.encode('utf-8') if isinstance(chunk, unicode) else str(chunk)
+                if pending_command.response is not None and not pending_command.has_chunks():
+                    break
+                self._wait_command(command, pending_command, self.command_timeout, start, chunks=True)
+            self._get_request_response(self._get_command_response(command, pending_command, start))
+        finally:
+            self.http_pool.release(self.name)
+
     def remove_callback(self):
         self._do_command('remove_callback')
 
     def _read_out(self):
-        stream = PluginIPCStream()
+        stream = PluginIPCStream(self._proc.stdout.fileno())
         while self._process_running:
             exit_code = self._proc.poll()
             if exit_code is not None:
                 self.logger('[Runner] Stopped with exit code {0}'.format(exit_code))
                 self._process_running = False
+                self._wake_async_thread()
                 break
 
-            line = ''
-            while line == '':
-                line = self._proc.stdout.readline().strip()
-
+            bytes_read = stream.bytes_read
             try:
-                response = stream.feed(line)
-                if response is None:
-                    continue
+                response = stream.read()
+            except EOFError:
+                time.sleep(0.1)  # Wait for the process to exit
+                continue
             except Exception as ex:
                 self.logger('[Runner] Exception while parsing output: {0}'.format(ex))
                 continue
+            finally:
+                self._ipc_stats['bytes_in'] += stream.bytes_read - bytes_read
+
+            if response.get('action') == 'start' and response.get('protocol') == 'msgpack':
+                # The runtime switches protocol right after the start response
+                stream.binary = True
+                self._binary = True
 
             if response['cid'] == 0:
                 self._handle_async_response(response)
-            elif response['cid'] == self._cid:
-                self._response_queue.put(response)
+                continue
+            if response.get('action') == 'response_chunk':
+                pending_command = self._pending_commands.get(response['cid'])
+                if pending_command is not None:
+                    pending_command.add_chunk(response['data'])
+                continue
+            pending_command = self._pending_commands.pop(response['cid'], None)
+            if pending_command is not None:
+                pending_command.set_response(response)
             else:
-                self.logger('[Runner] Received message with unknown cid: {0}'.format(response))
+                self.logger('[Runner] Received response for unknown or timed out command: {0}'.format(response))
 
     def _handle_async_response(self, response):
         if response['action'] == 'logs':
             self.logger(response['logs'])
+        elif response['action'] == 'web_call':
+            try:
+                self._web_calls.put_nowait(response)
+            except Full:
+                self.logger('[Runner] Too many API calls waiting, dropping {0}'.format(response['name']))
+                self._write({'action': 'web_response', 'rid': response['rid'],
+                             'response': json.dumps({'success': False, 'msg': 'too_many_calls'})})
         else:
             self.logger('[Runner] Unkown async message: {0}'.format(response))
 
@@ -244,49 +415,180 @@ class PluginRunner:
         if (should_filter and action not in self._receivers) or not self._process_running:
             return
 
-        try:
-            self._async_command_queue.put({'action': action, 'fields': fields}, block=False)
-        except Full:
-            self.logger('Async action cannot be queued, queue is full')
+        with self._async_condition:
+            entry = self._async_coalesced.get(action)
+            if entry is not None:
+                # A newer state supersedes the one that is still queued
+                entry['fields'] = fields
+                self._async_stats['coalesced'] += 1
+                return
+            if len(self._async_commands) >= PluginRunner.ASYNC_QUEUE_SIZE:
+                self._async_stats['dropped'] += 1
+                if not self._async_queue_full:
+                    self._async_queue_full = True
+                    self.logger('Async action cannot be queued, queue is full')
+                return
+            entry = {'action': action, 'fields': fields, 'queued': time.time()}
+            if action in PluginRunner.COALESCED_ACTIONS:
+                self._async_coalesced[action] = entry
+            self._async_commands.append(entry)
+            self._async_condition.notify()
+
+    def _wake_async_thread(self):
+        with self._async_condition:
+            self._async_condition.notify_all()
 
     def _perform_async_commands(self):
         while self._process_running:
+            with self._async_condition:
+                while self._process_running and not self._async_commands:
+                    self._async_condition.wait()
+                self._sample_queue_depth()
+                entries = []
+                while self._async_commands and len(entries) < PluginRunner.ASYNC_BATCH_SIZE:
+                    entry = self._async_commands.popleft()
+                    if self._async_coalesced.get(entry['action']) is entry:
+                        del self._async_coalesced[entry['action']]
+                    entries.append(entry)
+                self._async_queue_full = False
+            if not entries:
+                continue
             try:
-                # Give it a timeout in order to check whether the plugin is not stopped.
-                command = self._async_command_queue.get(block=True, timeout=10)
-                self._do_command(command['action'], command['fields'])
-            except Empty:
-                pass
+                commands = [dict(entry['fields'], action=entry['action']) for entry in entries]
+                if self._batch and len(commands) > 1:
+                    # Same time budget as when the commands would be sent one by one
+                    responses = self._do_command('batch', {'commands': commands},
+                                                 timeout=self.command_timeout * len(commands))['responses']
+                else:
+                    responses = []
+                    for command in commands:
+                        try:
+                            responses.append(self._do_command(command.pop('action'), command))
+                        except Exception as exception:
+                            responses.append({'_exception': str(exception)})
+                self._process_async_responses(entries, responses)
             except Exception as exception:
                 self.logger('[Runner] Failed to perform async command: {0}'.format(exception))
 
+    def _process_async_responses(self, entries, responses):
+        now = time.time()
+        latency = self._async_stats['latency']
+        delivered = 0
+        for entry, response in zip(entries, responses):
+            exception = response.get('_exception')
+            if exception is not None:
+                self.logger('[Runner] Failed to perform async command: {0}'.format(exception))
+                continue
+            if entry['action'] == 'read_metrics_ring':
+                self._metrics_ring_stats = {'lag': response['lag'], 'dropped': response['dropped']}
+            latency += 0.1 * ((now - entry['queued']) - latency)  # Exponentially weighted moving average
+            delivered += 1
+        self._async_stats['latency'] = latency
+        self._async_stats['delivered'] += delivered
+
+    def get_async_stats(self):
+        """
+        Returns the async command (event and metric) delivery statistics: the amount of commands that were
+        delivered, dropped because the queue was full and coalesced into a newer state, and the average delivery
+        latency (in seconds)
+        """
+        return self._async_stats
+
+    def _start_web_call_workers(self):
+        self._stop_web_call_workers()  # Of a previous run that stopped by itself
+        self._web_calls = Queue(maxsize=PluginRunner.WEB_CALL_QUEUE_SIZE)
+        self._web_call_workers = []
+        for i in xrange(PluginRunner.WEB_CALL_WORKERS):
+            worker = Thread(target=self._execute_web_calls, args=(self._web_calls,),
+                            name='PluginRunner {0} web call worker {1}'.format(self.plugin_path, i))
+            worker.daemon = True
+            worker.start()
+            self._web_call_workers.append(worker)
+
+    def _stop_web_call_workers(self):
+        try:
+            while True:
+                self._web_calls.get_nowait()  # The plugin is gone, nobody waits for the responses
+        except Empty:
+            pass
+        for _ in self._web_call_workers:
+            try:
+                self._web_calls.put_nowait(None)
+            except Full:
+                break
+        self._web_call_workers = []
+
+    def _execute_web_calls(self, web_calls):
+        while True:
+            call = web_calls.get()
+            if call is None:
+                return
+            self._handle_web_call(call)
+
+    def _handle_web_call(self, call):
+        """ Executes an API call the plugin made over the pipe, in-process """
+        try:
+            response = self.web_interface.plugin_api_call(call['name'], call['params'])
+        except Exception as exception:
+            self.logger('[Runner] Exception during API call {0}: {1}'.format(call['name'], exception))
+            response = json.dumps({'success': False, 'msg': str(exception)})
+        try:
+            self._write({'action': 'web_response', 'rid': call['rid'], 'response': response})
+        except Exception as exception:
+            self.logger('[Runner] Could not send API call response: {0}'.format(exception))
+
+    def _write(self, command):
+        with self._write_lock:
+            self._send(command)
+
+    def _send(self, command):
+        """ Sends a command to the runtime, the write lock must be held """
+        data = PluginIPCStream.encode(command, binary=self._binary)
+        self._proc.stdin.write(data)
+        self._proc.stdin.flush()
+        self._ipc_stats['bytes_out'] += len(data)
+
     def _do_command(self, action, fields=None, timeout=None):
+        if timeout is None:
+            timeout = self.command_timeout
+        command, pending_command = self._send_command(action, fields)
+        start = time.time()
+        # Other commands can be sent while waiting, their responses are matched on cid
+        self._wait_command(command, pending_command, timeout, start)
+        return self._get_command_response(command, pending_command, start)
+
+    def _send_command(self, action, fields=None):
         if fields is None:
             fields = {}
         self._commands_executed += 1
-        if timeout is None:
-            timeout = self.command_timeout
 
         if not self._process_running:
             raise Exception('Plugin was stopped')
 
-        with self._command_lock:
+        pending_command = PendingCommand()
+        with self._write_lock:
             command = self._create_command(action, fields)
-            self._proc.stdin.write(PluginIPCStream.encode(command))
-            self._proc.stdin.flush()
-
-            try:
-                response = self._response_queue.get(block=True, timeout=timeout)
-                while response['cid'] != self._cid:
-                    response = self._response_queue.get(block=False)
-                exception = response.get('_exception')
-                if exception is not None:
-                    raise RuntimeError(exception)
-                return response
-            except Empty:
-                self.logger('[Runner] No response within {0}s (action={1}, fields={2})'.format(timeout, action, fields))
-                self._commands_failed += 1
-                raise Exception('Plugin did not respond')
+            self._pending_commands[command['cid']] = pending_command
+            self._send(command)
+        return command, pending_command
+
+    def _wait_command(self, command, pending_command, timeout, start, chunks=False):
+        """ Waits for the response, or for the next response chunk if chunks are expected """
+        if not pending_command.wait(timeout, chunks=chunks):
+            self._pending_commands.pop(command['cid'], None)
+            self.logger('[Runner] No response within {0}s (action={1}, fields={2})'.format(
+                timeout, command['action'], dict((key, value) for key, value in command.iteritems() if key not in ['cid', 'action'])
+            ))
+            self._commands_failed += 1
+            self._record_latency(command['action'], None)
+            raise Exception('Plugin did not respond')
+
+    def _get_command_response(self, command, pending_command, start):
+        self._record_latency(command['action'], time.time() - start)
+        exception = pending_command.response.get('_exception')
+        if exception is not None:
+            raise RuntimeError(exception)
+        return pending_command.response
 
     def _create_command(self, action, fields=None):
         if fields is None:
@@ -306,10 +608,269 @@ class PluginRunner:
             self._commands_executed = 0
             return score
 
+    def _record_latency(self, action, duration):
+        """ Adds a command duration to the latency histogram of its action, a duration of None is a timeout """
+        with self._stats_lock:
+            latencies = self._command_latencies.get(action)
+            if latencies is None:
+                latencies = {'buckets': [0] * len(PluginRunner.LATENCY_BUCKETS), 'count': 0, 'sum': 0.0, 'timeouts': 0}
+                self._command_latencies[action] = latencies
+            if duration is None:
+                latencies['timeouts'] += 1
+                return
+            latencies['count'] += 1
+            latencies['sum'] += duration
+            for index, upper_bound in enumerate(PluginRunner.LATENCY_BUCKETS):
+                if duration <= upper_bound:
+                    latencies['buckets'][index] += 1
+                    break
+
+    def _sample_queue_depth(self):
+        now = time.time()
+        if not self._queue_samples or now - self._queue_samples[-1][0] >= 1:
+            self._queue_samples.append((now, len(self._async_commands)))
+
+    def get_resource_stats(self):
+        """
+        Returns the resource usage of the plugin: cpu time (in seconds), resident memory (in bytes) and threads of the
+        runtime process, bytes sent to and received from the runtime, the command latency histograms per action
+        (cumulative counts per upper bound, in seconds), the async queue depth samples taken while events
+        were delivered and the async delivery statistics
+        """
+        stats = {'pid': None, 'cpu': None, 'rss': None, 'threads': None}
+        if self._process_running:
+            stats['pid'] = self._proc.pid
+            try:
+                stats.update(self._read_process_stats(self._proc.pid))
+            except (IOError, OSError, IndexError, ValueError):
+                pass  # The process just stopped, or there is no procfs
+        with self._stats_lock:
+            commands = {}
+            for action, latencies in self._command_latencies.iteritems():
+                buckets, total = [], 0
+                for upper_bound, count in zip(PluginRunner.LATENCY_BUCKETS, latencies['buckets']):
+                    total += count
+                    buckets.append([upper_bound, total])
+                commands[action] = {'buckets': buckets,
+                                    'count': latencies['count'],
+                                    'sum': latencies['sum'],
+                                    'timeouts': latencies['timeouts']}
+        stats.update({'ipc': dict(self._ipc_stats),
+                      'commands': commands,
+                      'queue': {'length': self.get_queue_length(),
+                                'samples': [list(sample) for sample in self._queue_samples]},
+                      'async': dict(self._async_stats),
+                      'http': self.http_pool.get_stats(self.name)})
+        return stats
+
+    def _read_process_stats(self, pid):
+        with open('/proc/{0}/stat'.format(pid), 'r') as stat_file:
+            fields = stat_file.read().rsplit(')', 1)[1].split()  # The fields after the command name, starting at the state
+        clock_ticks = float(os.sysconf('SC_CLK_TCK'))
+        user, system = int(fields[11]) / clock_ticks, int(fields[12]) / clock_ticks
+        now = time.time()
+        percent = None
+        previous = self._cpu_sample
+        if previous is not None and previous[0] == pid and now > previous[1]:
+            percent = round(100 * (user + system - previous[2]) / (now - previous[1]), 1)
+        self._cpu_sample = (pid, now, user + system)
+        return {'cpu': {'user': user, 'system': system, 'percent': percent},
+                'rss': int(fields[21]) * resource.getpagesize(),
+                'threads': int(fields[17])}
+
+    def profile(self, duration=5.0, interval=0.01):
+        """
+        Samples the stacks of all threads in the plugin runtime during the given duration (in seconds). Returns the
+        amount of samples and the sampled stacks (thread name and functions, outermost first) with their count.
+        """
+        response = self._do_command('profile', {'duration': duration, 'interval': interval},
+                                    timeout=duration + self.command_timeout)
+        return {'samples': response['samples'],
+                'interval': response['interval'],
+                'stacks': response['stacks']}
+
     def get_queue_length(self):
-        if self._async_command_queue is None:
-            return 0
-        return self._async_command_queue.qsize()
+        return len(self._async_commands)
+
+
+class RuntimeZygote(object):
+    """
+    Starts plugin runtimes by forking them from a single pre-started runtime (the zygote), so the interpreter
+    and the common modules don't have to be loaded for every plugin (re)start.
+    """
+
+    def __init__(self, runtime_path, socket_path, timeout=10):
+        self.runtime_path = runtime_path
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._proc = None
+        self._lock = Lock()
+
+    def _ensure_running(self):
+        if self._proc is not None and self._proc.poll() is None:
+            return
+        logger.info('Starting plugin runtime zygote')
+        self._proc = subprocess.Popen([_get_python_executable(), 'runtime.py', 'zygote', self.socket_path],
+                                      stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=None,
+                                      cwd=self.runtime_path)
+        if self._proc.stdout.readline().strip() != 'ready':
+            self._proc = None
+            raise RuntimeError('The plugin runtime zygote could not be started')
+
+    def spawn(self, plugin_path):
+        """
+        Forks a new plugin runtime for the given plugin
+        :rtype: plugins.runner.ForkedRuntime
+        """
+        with self._lock:
+            self._ensure_running()
+        connection = self._request('spawn {0}'.format(plugin_path))
+        try:
+            pid = struct.unpack('>I', RuntimeZygote._receive(connection, 4))[0]
+            status_connection = self._request('wait {0}'.format(pid))
+        except Exception:
+            connection.close()
+            raise
+        connection.settimeout(None)
+        status_connection.settimeout(None)
+        return ForkedRuntime(pid, connection, status_connection)
+
+    def _request(self, request):
+        # Only the zygote's user (root) can create the socket in its private directory, so it's the zygote that answers
+        stat = os.stat(os.path.dirname(self.socket_path))
+        if stat.st_uid != os.getuid() or stat.st_mode & 0o022 or os.stat(self.socket_path).st_uid != os.getuid():
+            raise RuntimeError('The plugin runtime zygote socket is not private')
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            connection.settimeout(self.timeout)
+            connection.connect(self.socket_path)
+            connection.sendall('{0}\n'.format(request))
+        except Exception:
+            connection.close()
+            raise
+        return connection
+
+    @staticmethod
+    def _receive(connection, size):
+        data = ''
+        while len(data) < size:
+            chunk = connection.recv(size - len(data))
+            if not chunk:
+                raise RuntimeError('The plugin runtime zygote could not fork a runtime')
+            data += chunk
+        return data
+
+    def stop(self):
+        with self._lock:
+            if self._proc is not None and self._proc.poll() is None:
+                self._proc.terminate()
+                self._proc.wait()
+            self._proc = None
+
+
+class ForkedRuntime(object):
+    """ A runtime forked by the zygote, with the subset of the subprocess.Popen interface used by the PluginRunner """
+
+    def __init__(self, pid, connection, status_connection):
+        """
+        :param status_connection: Connection on which the zygote sends the exit code of the runtime
+        """
+        self.pid = pid
+        self.returncode = None
+        self.stdin = connection.makefile('wb')
+        self.stdout = connection.makefile('rb', 0)
+        self._status_connection = status_connection
+
+    def poll(self):
+        if self.returncode is None:
+            readable, _, _ = select.select([self._status_connection], [], [], 0)
+            if readable:
+                data = ''
+                while len(data) < 4:
+                    chunk = self._status_connection.recv(4 - len(data))
+                    if not chunk:
+                        break
+                    data += chunk
+                # Without an exit code the zygote stopped, which stops its runtimes as well
+                self.returncode = struct.unpack('>i', data)[0] if len(data) == 4 else -1
+                self._status_connection.close()
+        return self.returncode
+
+    def terminate(self):
+        if self.poll() is None:  # Once exited, the pid can be reused
+            os.kill(self.pid, signal.SIGTERM)
+
+    def kill(self):
+        if self.poll() is None:
+            os.kill(self.pid, signal.SIGKILL)
+
+
+class PendingCommand(object):
+    """ Holds the response (and the response chunks of a streamed response) of a command that is in flight """
+
+    def __init__(self):
+        self._event = Event()
+        self._chunks = deque()
+        self.response = None
+
+    def set_response(self, response):
+        self.response = response
+        self._event.set()
+
+    def add_chunk(self, chunk):
+        self._chunks.append(chunk)
+        self._event.set()
+
+    def has_chunks(self):
+        return len(self._chunks) > 0
+
+    def pop_chunks(self):
+        while self._chunks:
+            yield self._chunks.popleft()
+
+    def wait(self, timeout, chunks=False):
+        """ Waits for the response, or also for a new chunk when chunks are expected """
+        if not chunks:
+            return self._event.wait(timeout)
+        if self.response is not None or self._chunks:
+            return True
+        self._event.clear()
+        if self.response is not None or self._chunks:
+            return True
+        return self._event.wait(timeout)
+
+
+class HttpProxyPool(object):
+    """
+    Limits the webserver threads that can be waiting for plugins, for all plugins together and per plugin, so slow
+    plugin endpoints can't exhaust the thread pool that also serves the core API.
+    """
+
+    def __init__(self, size=6):
+        self.size = size
+        self._lock = Lock()
+        self._active = {}
+        self._rejected = {}
+
+    def acquire(self, name, limit):
+        """ Returns whether a thread can wait for the given plugin, without blocking """
+        with self._lock:
+            active = self._active.get(name, 0)
+            if active >= limit or sum(self._active.itervalues()) >= self.size:
+                self._rejected[name] = self._rejected.get(name, 0) + 1
+                return False
+            self._active[name] = active + 1
+            return True
+
+    def release(self, name):
+        with self._lock:
+            self._active[name] -= 1
+
+    def get_stats(self, name):
+        """ Returns the amount of active and rejected requests for the given plugin """
+        with self._lock:
+            return {'active': self._active.get(name, 0),
+                    'rejected': self._rejected.get(name, 0)}
 
 
 class RunnerWatchdog:
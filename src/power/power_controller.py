@@ -17,9 +17,8 @@ The power controller module contains the PowerController class, which keeps trac
 power modules and their address.
 """
 
-import sqlite3
-from threading import Lock
 from ioc import Injectable, Inject, INJECTED, Singleton
+from database_utils import Database
 from power_api import POWER_MODULE, ENERGY_MODULE, P1_CONCENTRATOR, NUM_PORTS, LARGEST_MODULE_TYPE
 
 
@@ -45,12 +44,7 @@ class PowerController(object):
                                        'times{0}'.format(i): 'TEXT',
                                        'inverted{0}'.format(i): 'INT default 0'})
 
-        self.__connection = sqlite3.connect(power_db,
-                                            detect_types=sqlite3.PARSE_DECLTYPES,
-                                            check_same_thread=False,
-                                            isolation_level=None)
-        self.__cursor = self.__connection.cursor()
-        self.__lock = Lock()
+        self.__database = Database(power_db)
 
         self.__update_schema_if_needed()  # Table creations and/or migrations
 
@@ -70,19 +64,20 @@ class PowerController(object):
         12-port power module version. The __create_tables above generates the 12-port version, so
         the update is only performed for legacy users that still have the old schema.
         """
-        with self.__lock:
+        def _update_schema(cursor):
             for table, schema in {'power_modules': self._power_schema}.iteritems():
                 fields = []
-                for row in self.__cursor.execute('PRAGMA table_info(\'{0}\');'.format(table)):
+                for row in cursor.execute('PRAGMA table_info(\'{0}\');'.format(table)).fetchall():
                     fields.append(row[1])
                 if len(fields) == 0:
-                    self.__cursor.execute('CREATE TABLE {0} (id INTEGER PRIMARY KEY, {1});'.format(
+                    cursor.execute('CREATE TABLE {0} (id INTEGER PRIMARY KEY, {1});'.format(
                         table, ', '.join(['{0} {1}'.format(key, value) for key, value in schema.iteritems()])
                     ))
                 else:
                     for field, default in schema.iteritems():
                         if field not in fields:
-                            self.__cursor.execute('ALTER TABLE {0} ADD COLUMN {1} {2};'.format(table, field, default))
+                            cursor.execute('ALTER TABLE {0} ADD COLUMN {1} {2};'.format(table, field, default))
+        self.__database.transaction(_update_schema)
 
     def get_power_modules(self):
         """
@@ -99,32 +94,28 @@ class PowerController(object):
         for version in [POWER_MODULE, ENERGY_MODULE, P1_CONCENTRATOR]:
             amount = NUM_PORTS[version]
             fields[version] = ['id', 'name', 'address', 'version'] + PowerController._power_setting_fields(amount)
-        with self.__lock:
-            for row in self.__cursor.execute('SELECT {0} FROM power_modules;'.format(', '.join(fields[LARGEST_MODULE_TYPE]))):
-                version = row[3]
-                if version not in [POWER_MODULE, ENERGY_MODULE, P1_CONCENTRATOR]:
-                    raise ValueError('Unknown power api version')
-                power_modules[row[0]] = dict([(field, row[fields[version].index(field)])
-                                              for field in fields[version]])
-            return power_modules
+        for row in self.__database.execute('SELECT {0} FROM power_modules;'.format(', '.join(fields[LARGEST_MODULE_TYPE]))):
+            version = row[3]
+            if version not in [POWER_MODULE, ENERGY_MODULE, P1_CONCENTRATOR]:
+                raise ValueError('Unknown power api version')
+            power_modules[row[0]] = dict([(field, row[fields[version].index(field)])
+                                          for field in fields[version]])
+        return power_modules
 
     def get_address(self, id):
         """ Get the address of a module when the module id is provided. """
-        with self.__lock:
-            for row in self.__cursor.execute('SELECT address FROM power_modules WHERE id=?;', (id,)):
-                return row[0]
+        for row in self.__database.execute('SELECT address FROM power_modules WHERE id=?;', (id,)):
+            return row[0]
 
     def get_version(self, id):
         """ Get the version of a module when the module id is provided. """
-        with self.__lock:
-            for row in self.__cursor.execute('SELECT version FROM power_modules WHERE id=?;', (id,)):
-                return row[0]
+        for row in self.__database.execute('SELECT version FROM power_modules WHERE id=?;', (id,)):
+            return row[0]
 
     def module_exists(self, address):
         """ Check if a module with a certain address exists. """
-        with self.__lock:
-            for row in self.__cursor.execute('SELECT count(id) FROM power_modules WHERE address=?;', (address,)):
-                return row[0] > 0
+        for row in self.__database.execute('SELECT count(id) FROM power_modules WHERE address=?;', (address,)):
+            return row[0] > 0
 
     def update_power_module(self, module):
         """
@@ -142,29 +133,25 @@ class PowerController(object):
             raise ValueError('Unknown power api version')
         amount = NUM_PORTS[version]
         fields = ['name'] + PowerController._power_setting_fields(amount)
-        with self.__lock:
-            self.__cursor.execute('UPDATE power_modules SET {0} WHERE id=?'.format(
-                ', '.join(['{0}=?'.format(field) for field in fields])
-            ), tuple([module[field] for field in fields] + [module['id']]))
+        self.__database.write('UPDATE power_modules SET {0} WHERE id=?'.format(
+            ', '.join(['{0}=?'.format(field) for field in fields])
+        ), tuple([module[field] for field in fields] + [module['id']]))
 
     def register_power_module(self, address, version):
         """ Register a new power module using an address. """
-        with self.__lock:
-            self.__cursor.execute('INSERT INTO power_modules(address, version) VALUES (?, ?);', (address, version))
+        self.__database.write('INSERT INTO power_modules(address, version) VALUES (?, ?);', (address, version))
 
     def readdress_power_module(self, old_address, new_address):
         """ Change the address of a power module. """
-        with self.__lock:
-            self.__cursor.execute('UPDATE power_modules SET address=? WHERE address=?;', (new_address, old_address))
+        self.__database.write('UPDATE power_modules SET address=? WHERE address=?;', (new_address, old_address))
 
     def get_free_address(self):
         """ Get a free address for a power module. """
         max_address = 0
-        with self.__lock:
-            for row in self.__cursor.execute('SELECT address FROM power_modules;'):
-                max_address = max(max_address, row[0])
-            return max_address + 1 if max_address < 255 else 1
+        for row in self.__database.execute('SELECT address FROM power_modules;'):
+            max_address = max(max_address, row[0])
+        return max_address + 1 if max_address < 255 else 1
 
     def close(self):
         """ Close the database connection. """
-        self.__connection.close()
+        self.__database.close()
@@ -16,6 +16,9 @@
 A few helper classes
 """
 
+import mmap
+import os
+import struct
 import time
 from collections import deque
 
@@ -26,6 +29,12 @@ except ImportError:
     # This is the case when the plugin runtime is unittested
     import json
 
+try:
+    import msgpack
+except ImportError:
+    # The plugin runtime falls back to json
+    msgpack = None
+
 
 class Full(Exception):
     pass
@@ -66,37 +75,182 @@ class Queue(object):
 
 
 class PluginIPCStream(object):
+    """
+    Reads messages from a pipe. Messages are either newline delimited json (the default protocol) or,
+    once negotiated, length-prefixed msgpack frames that are decoded without copying them out of the read buffer.
+    """
+
+    FRAME_HEADER = struct.Struct('>I')
+    READ_SIZE = 65536
 
-    def __init__(self):
+    def __init__(self, fd):
+        self._fd = fd
         self._buffer = ''
+        self._offset = 0
+        self.binary = False
+        self.bytes_read = 0
+
+    @staticmethod
+    def get_protocols():
+        """ Returns the protocols that can be used, besides json """
+        return ['msgpack'] if msgpack is not None else []
+
+    def read(self):
+        """
+        Blocks until a complete message is available and returns it
+        :raises EOFError: When the other end closed the pipe
+        """
+        while True:
+            if self.binary:
+                message = self._parse_frame()
+            else:
+                message = self._parse_line()
+            if message is not None:
+                return message
+            data = os.read(self._fd, PluginIPCStream.READ_SIZE)
+            if not data:
+                raise EOFError('Pipe closed')
+            self.bytes_read += len(data)
+            if self._offset == len(self._buffer):
+                self._buffer = data
+            else:
+                self._buffer = self._buffer[self._offset:] + data
+            self._offset = 0
+
+    def _parse_frame(self):
+        header_size = PluginIPCStream.FRAME_HEADER.size
+        if len(self._buffer) - self._offset < header_size:
+            return None
+        length, = PluginIPCStream.FRAME_HEADER.unpack_from(self._buffer, self._offset)
+        start = self._offset + header_size
+        end = start + length
+        if len(self._buffer) < end:
+            return None
+        self._offset = end
+        return msgpack.unpackb(memoryview(self._buffer)[start:end], raw=False)
 
-    def feed(self, stream):
-        return json.loads(stream.strip())
-
-        # Netstring format for binary data
-        # self._buffer += stream
-        # if ':' not in self._buffer or not self._buffer.endswith(',\n'):
-        #     return
-        # length, encoded_data = self._buffer.split(':', 1)
-        # try:
-        #     length = int(length)
-        # except ValueError:
-        #     self._buffer = ''
-        #     raise
-        # if len(encoded_data) < length + 2:
-        #     return
-        # try:
-        #     data = cPickle.loads(encoded_data.replace(',\n', ''))
-        #     self._buffer = ''
-        #     return data
-        # except ValueError:
-        #     self._buffer = ''
-        #     raise
+    def _parse_line(self):
+        while True:
+            end = self._buffer.find('\n', self._offset)
+            if end == -1:
+                return None
+            line = self._buffer[self._offset:end].strip()
+            self._offset = end + 1
+            if line:
+                return json.loads(line)
 
     @staticmethod
-    def encode(data):
+    def encode(data, binary=False):
+        if binary:
+            encoded_data = msgpack.packb(data, use_bin_type=True)
+            return PluginIPCStream.FRAME_HEADER.pack(len(encoded_data)) + encoded_data
         return '{0}\n'.format(json.dumps(data))
 
-        # Netstring format for binary data:
-        # encoded_data = cPickle.dumps(data)
-        # return '{0}:{1},\n'.format(len(encoded_data), encoded_data)
+
+class MetricsRing(object):
+    """
+    A ring of msgpack encoded records in a memory mapped file. A single writer (the gateway) writes every record
+    once, every reader (a plugin runtime) keeps its own cursor. Readers that lag more than the size of the ring
+    lose the overwritten records, and count them as dropped.
+    """
+
+    GENERATION = struct.Struct('>Q')  # Odd while the header is being updated
+    HEADER = struct.Struct('>QQQQ')  # generation, head (byte position), sequence (record count), reserved (byte position)
+    RECORD_HEADER = struct.Struct('>I')
+    WRAP_MARKER = 0xFFFFFFFF
+    DEFAULT_SIZE = 4 * 1024 * 1024
+
+    def __init__(self, path, size=None):
+        """
+        :param path: Path of the ring file
+        :param size: When given, the ring file is (re)created with the given data size. Otherwise an existing
+                     ring is opened as reader, positioned at the current head.
+        """
+        if size is not None:
+            if os.path.exists(path):
+                os.unlink(path)  # Readers that still map the old ring keep their (orphaned) copy
+            with open(path, 'wb') as ring_file:
+                ring_file.truncate(MetricsRing.HEADER.size + size)
+        with open(path, 'r+b') as ring_file:
+            self._mmap = mmap.mmap(ring_file.fileno(), 0)
+        self._size = len(self._mmap) - MetricsRing.HEADER.size
+        self._generation, self._head, self._sequence, self._reserved = self._read_header()
+        self.dropped = 0
+
+    def close(self):
+        self._mmap.close()
+
+    def _read_header(self):
+        while True:
+            generation, = MetricsRing.GENERATION.unpack_from(self._mmap, 0)
+            header = MetricsRing.HEADER.unpack_from(self._mmap, 0)
+            if generation % 2 == 0 and MetricsRing.GENERATION.unpack_from(self._mmap, 0)[0] == generation:
+                return header
+            time.sleep(0)
+
+    def _write_header(self):
+        self._generation += 1
+        MetricsRing.GENERATION.pack_into(self._mmap, 0, self._generation)
+        self._mmap[0:MetricsRing.HEADER.size] = MetricsRing.HEADER.pack(self._generation, self._head, self._sequence, self._reserved)
+        self._generation += 1
+        MetricsRing.GENERATION.pack_into(self._mmap, 0, self._generation)
+
+    def write(self, records):
+        """ Writes a list of already encoded records """
+        header_size = MetricsRing.HEADER.size
+        for record in records:
+            needed = MetricsRing.RECORD_HEADER.size + len(record)
+            if needed > self._size:
+                continue
+            offset = self._head % self._size
+            wrap = 0
+            if offset + needed > self._size:
+                wrap = self._size - offset
+            # Announce the region that will be overwritten before touching it
+            self._reserved = self._head + wrap + needed
+            self._write_header()
+            if wrap:
+                if wrap >= MetricsRing.RECORD_HEADER.size:
+                    MetricsRing.RECORD_HEADER.pack_into(self._mmap, header_size + offset, MetricsRing.WRAP_MARKER)
+                self._head += wrap
+                offset = 0
+            start = header_size + offset
+            MetricsRing.RECORD_HEADER.pack_into(self._mmap, start, len(record))
+            self._mmap[start + MetricsRing.RECORD_HEADER.size:start + needed] = record
+            self._head += needed
+            self._sequence += 1
+            self._write_header()
+
+    def read(self):
+        """
+        Returns all records written since the previous read, together with the number of records
+        the reader was behind when the read started.
+        """
+        _, head, sequence, reserved = self._read_header()
+        lag = sequence - self._sequence
+        if reserved - self._head > self._size:
+            # The writer already overwrote (part of) the unread records
+            self.dropped += lag
+            self._head, self._sequence = head, sequence
+            return [], lag
+        header_size = MetricsRing.HEADER.size
+        records = []
+        position = self._head
+        while position < head:
+            offset = position % self._size
+            if self._size - offset < MetricsRing.RECORD_HEADER.size:
+                position += self._size - offset
+                continue
+            length, = MetricsRing.RECORD_HEADER.unpack_from(self._mmap, header_size + offset)
+            if length == MetricsRing.WRAP_MARKER:
+                position += self._size - offset
+                continue
+            start = header_size + offset + MetricsRing.RECORD_HEADER.size
+            records.append((position, self._mmap[start:start + length]))
+            position += MetricsRing.RECORD_HEADER.size + length
+        # Records that were overwritten while reading them are invalid
+        _, _, _, reserved = self._read_header()
+        valid_records = [data for position, data in records if position >= reserved - self._size]
+        self.dropped += len(records) - len(valid_records)
+        self._head, self._sequence = head, sequence
+        return [msgpack.unpackb(data, raw=False) for data in valid_records], lag
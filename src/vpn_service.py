@@ -31,7 +31,7 @@ import traceback
 import constants
 import ujson as json
 
-from threading import Thread, Lock
+from threading import Thread
 from collections import deque
 from ConfigParser import ConfigParser
 from ioc import Injectable, INJECTED, Inject
@@ -320,7 +320,7 @@ class VPNService(object):
         config.read(constants.get_config_file())
 
         self._message_client = MessageClient('vpn_service')
-        self._message_client.add_event_handler(self._event_receiver)
+        self._message_client.add_event_handler(self._event_receiver, [OMBusEvents.DIRTY_EEPROM])
         self._message_client.set_state_handler(self._check_state)
 
         self._iterations = 0
@@ -475,6 +475,7 @@ class VPNService(object):
     def _check_vpn(self):
         while True:
             self._last_cycle = time.time()
+            self._message_client.publish_state()
             try:
                 start_time = time.time()
 
@@ -538,7 +539,6 @@ if __name__ == '__main__':
     logger.info("Starting VPN service")
 
     Injectable.value(config_db=constants.get_config_database_file())
-    Injectable.value(config_db_lock=Lock())
 
     vpn_service = VPNService()
     vpn_service.start()
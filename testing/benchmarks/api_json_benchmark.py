@@ -0,0 +1,112 @@
+# Copyright (C) 2019 OpenMotics BV
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Measures the serialization of large API responses: the previous limit_floats() copy of the response versus
+limiting the floats in the encoder. The peak memory is the maximum RSS of a forked process serializing the
+response, minus the one of a process that only builds it.
+
+Usage: PYTHONPATH=src python2 testing/benchmarks/api_json_benchmark.py [iterations]
+"""
+import os
+import random
+import sys
+import time
+import ujson as json
+from gateway.webservice import dumps_limited
+
+
+class FloatWrapper(float):
+    """ The previous float wrapper """
+
+    def __repr__(self):
+        return '%.2f' % self
+
+
+def limit_floats(struct):
+    """ The previous float limiting """
+    if isinstance(struct, (list, tuple)):
+        return [limit_floats(element) for element in struct]
+    elif isinstance(struct, dict):
+        return dict((key, limit_floats(value)) for key, value in struct.items())
+    elif isinstance(struct, float):
+        return FloatWrapper(struct)
+    else:
+        return struct
+
+
+def previous(return_data):
+    return json.dumps(limit_floats(dict({'success': True}.items() + return_data.items())))
+
+
+def current(return_data):
+    data = {'success': True}
+    data.update(return_data)
+    return dumps_limited(data)
+
+
+def output_configurations():
+    return {'config': [{'id': i, 'name': 'Output {0}'.format(i), 'module_type': 'O', 'type': 255, 'timer': 65535,
+                        'floor': 255, 'can_led_1_id': 255, 'can_led_1_function': 'UNKNOWN', 'can_led_2_id': 255,
+                        'can_led_2_function': 'UNKNOWN', 'can_led_3_id': 255, 'can_led_3_function': 'UNKNOWN',
+                        'can_led_4_id': 255, 'can_led_4_function': 'UNKNOWN', 'room': 255} for i in xrange(240)]}
+
+
+def power_analytics():
+    return {'current': {str(module): [[random.random() * 230 for _ in xrange(80)] for _ in xrange(12)] for module in xrange(20)},
+            'phase': {str(module): [[random.random() * 360 for _ in xrange(80)] for _ in xrange(12)] for module in xrange(20)}}
+
+
+def realtime_power():
+    return {str(module): [[random.random() * 230, 50.0 + random.random(), random.random() * 16, random.random() * 3680]
+                          for _ in xrange(12)] for module in xrange(80)}
+
+
+def error_list():
+    return {'errors': [['O{0}'.format(i), random.randint(0, 255)] for i in xrange(2000)]}
+
+
+def _peak_rss(build, serialize, iterations):
+    pid = os.fork()
+    if pid == 0:
+        data = build()
+        if serialize is not None:
+            for _ in xrange(iterations):
+                serialize(data)
+        os._exit(0)
+    _, _, usage = os.wait4(pid, 0)
+    return usage.ru_maxrss
+
+
+def main(iterations):
+    random.seed(0)
+    for build in [output_configurations, power_analytics, realtime_power, error_list]:
+        data = build()
+        baseline = _peak_rss(build, None, iterations)
+        for name, serialize in [('previous', previous), ('current', current)]:
+            size = len(serialize(data))
+            durations = []
+            for _ in xrange(iterations):
+                start = time.time()
+                serialize(data)
+                durations.append(time.time() - start)
+            durations.sort()
+            print('{0:22} {1:8}: {2:7.0f} bytes, median {3:7.3f}ms, p99 {4:7.3f}ms, peak memory +{5:5}kB'.format(
+                build.__name__, name, size, durations[len(durations) // 2] * 1000, durations[int(len(durations) * 0.99)] * 1000,
+                _peak_rss(build, serialize, iterations) - baseline
+            ))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
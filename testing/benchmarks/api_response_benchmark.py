@@ -0,0 +1,133 @@
+# Copyright (C) 2019 OpenMotics BV
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Measures the bytes on the wire and the server CPU time of the configuration calls a dashboard loads (outputs,
+inputs, sensors, thermostats and rooms of a 48 output/48 input installation, read from an emulated eeprom): as
+before (uncompressed, always loaded), gzip encoded on a first load, from the response cache, and revalidated with
+If-None-Match.
+
+Usage: PYTHONPATH=src python2 testing/benchmarks/api_response_benchmark.py [dashboard loads]
+"""
+import os
+import sys
+import tempfile
+import time
+import cherrypy
+from cherrypy.lib.httputil import HeaderMap
+from ioc import SetTestMode, SetUpTestInjections
+import master.master_api as master_api
+from master.eeprom_controller import EepromController, EepromFile
+from master.eeprom_extension import EepromExtension
+from master.eeprom_models import OutputConfiguration, InputConfiguration, SensorConfiguration, \
+                                 ThermostatConfiguration, RoomConfiguration
+from gateway import webservice
+from gateway.webservice import openmotics_api
+
+MODULES = 6
+MODELS = [OutputConfiguration, InputConfiguration, SensorConfiguration, ThermostatConfiguration, RoomConfiguration]
+
+
+class MasterCommunicator(object):
+    """ Emulates the eeprom of a master """
+
+    def __init__(self):
+        self.banks = ['\xff' * 256 for _ in xrange(256)]
+        self.banks[0] = '\xff' + chr(MODULES) + chr(MODULES) + '\xff' * 253  # Input and output modules
+
+    def do_command(self, cmd, data):
+        if cmd == master_api.eeprom_list():
+            return {'data': self.banks[data['bank']]}
+        if cmd == master_api.read_eeprom():
+            return {'data': self.banks[data['bank']][data['addr']:data['addr'] + data['num']]}
+        if cmd == master_api.write_eeprom():
+            bank = self.banks[data['bank']]
+            self.banks[data['bank']] = bank[:data['address']] + data['data'] + bank[data['address'] + len(data['data']):]
+            return
+        if cmd == master_api.activate_eeprom():
+            return {'eep': 0, 'resp': 'OK'}
+        raise Exception('Command {0} not found'.format(cmd))
+
+
+def _create_call(eeprom_controller, model, versioned):
+    def _call(self, fields=None):
+        _ = self
+        return {'config': [o.serialize() for o in eeprom_controller.read_all(model, fields)]}
+    _call.__name__ = 'get_{0}s'.format(model.get_name())
+    cache_version = (lambda self: eeprom_controller.generation) if versioned else None
+    return openmotics_api(cache_version=cache_version)(_call)
+
+
+def _load(calls, headers):
+    """ Loads the dashboard, returns the number of body bytes and the ETags """
+    size = 0
+    etags = []
+    for call in calls:
+        cherrypy.request.headers = HeaderMap(headers)
+        cherrypy.response.headers = HeaderMap()
+        try:
+            size += len(call(None))
+        except cherrypy.HTTPRedirect:
+            pass  # 304 Not Modified, no body
+        etags.append(cherrypy.response.headers.get('ETag'))
+    return size, etags
+
+
+def _measure(name, calls, headers, loads, clear_cache=False):
+    cpu = 0.0
+    size = 0
+    for _ in xrange(loads):
+        if clear_cache:
+            webservice._response_cache.clear()
+        start = time.clock()
+        size, _ = _load(calls, headers)
+        cpu += time.clock() - start
+    print('{0:22}: {1:7} bytes, {2:7.2f}ms CPU per dashboard load'.format(name, size, cpu / loads * 1000))
+
+
+def main(loads):
+    SetTestMode()
+    _, eeprom_db = tempfile.mkstemp()
+    os.remove(eeprom_db)
+    try:
+        SetUpTestInjections(master_communicator=MasterCommunicator())
+        SetUpTestInjections(eeprom_file=EepromFile(), eeprom_db=eeprom_db)
+        SetUpTestInjections(eeprom_extension=EepromExtension())
+        eeprom_controller = EepromController()
+        eeprom_controller.write_batch(
+            [OutputConfiguration.deserialize({'id': i, 'name': 'Output {0}'.format(i), 'timer': 0, 'floor': 0,
+                                              'type': 0, 'room': i % 10}) for i in xrange(MODULES * 8)] +
+            [InputConfiguration.deserialize({'id': i, 'name': 'Input{0}'.format(i), 'action': 255,
+                                             'room': i % 10}) for i in xrange(MODULES * 8)] +
+            [SensorConfiguration.deserialize({'id': i, 'name': 'Sensor {0}'.format(i), 'room': i}) for i in xrange(10)] +
+            [ThermostatConfiguration.deserialize({'id': i, 'name': 'Thermostat {0}'.format(i), 'sensor': i,
+                                                  'output0': i, 'room': i}) for i in xrange(10)] +
+            [RoomConfiguration.deserialize({'id': i, 'name': 'Room {0}'.format(i), 'floor': 0}) for i in xrange(10)]
+        )
+
+        _measure('previous', [_create_call(eeprom_controller, model, False) for model in MODELS], {}, loads)
+        calls = [_create_call(eeprom_controller, model, True) for model in MODELS]
+        _measure('identity, first load', calls, {}, loads, clear_cache=True)
+        _measure('gzip, first load', calls, {'Accept-Encoding': 'gzip, deflate'}, loads, clear_cache=True)
+        _measure('gzip, cached', calls, {'Accept-Encoding': 'gzip, deflate'}, loads)
+        _, etags = _load(calls, {'Accept-Encoding': 'gzip, deflate'})
+        _measure('gzip, revalidated', calls, {'Accept-Encoding': 'gzip, deflate', 'If-None-Match': ', '.join(etags)}, loads)
+    finally:
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(eeprom_db + suffix):
+                os.remove(eeprom_db + suffix)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
@@ -0,0 +1,103 @@
+# Copyright (C) 2019 OpenMotics BV
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Measures the event throughput and latency of the message bus, with one sender and 4 receiving clients. A fifth
+client (like the led service) only handles other events.
+
+Usage: PYTHONPATH=src python2 testing/benchmarks/bus_benchmark.py [events]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+from threading import Event
+from bus.om_bus_client import MessageClient
+from bus.om_bus_service import MessageService
+
+RECEIVERS = 4
+
+
+class Receiver(object):
+    def __init__(self, name, socket_path, event_types):
+        self.received = 0
+        self.latencies = []
+        self.expected = None
+        self.done = Event()
+        self.client = MessageClient(name, socket_path=socket_path)
+        self.client.add_event_handler(self._receive, event_types)
+        while not self.client._connected:
+            time.sleep(0.01)
+
+    def _receive(self, event, payload):
+        if event != 'BENCHMARK':
+            return
+        self.received += 1
+        if 'sent' in payload:
+            self.latencies.append(time.time() - payload['sent'])
+        if self.received == self.expected:
+            self.done.set()
+
+    def expect(self, count):
+        self.received = 0
+        self.expected = count
+        self.done.clear()
+
+
+def main(count):
+    path = tempfile.mkdtemp()
+    try:
+        socket_path = os.path.join(path, 'bus.sock')
+        MessageService(socket_path=socket_path).start()
+        receivers = [Receiver('receiver_{0}'.format(i), socket_path, ['BENCHMARK']) for i in xrange(RECEIVERS)]
+        other = Receiver('led_service', socket_path, ['VPN_OPEN'])
+        sender = Receiver('sender', socket_path, [])
+        time.sleep(0.5)  # Let the subscriptions settle
+
+        payload = {'id': 0, 'values': {'power': 123.4, 'counter': 45678, 'voltage': 230.1}, 'tags': {'id': 'E1.0'}}
+        for receiver in receivers + [other]:
+            receiver.expect(count)
+        start = time.time()
+        for i in xrange(count):
+            payload['id'] = i
+            sender.client.send_event('BENCHMARK', payload)
+        for receiver in receivers:
+            receiver.done.wait(60)
+        duration = time.time() - start
+        print('throughput: {0} events to {1} clients in {2:.2f}s, {3:.0f} events/s per client'.format(
+            count, RECEIVERS, duration, count / duration
+        ))
+        time.sleep(0.5)
+        print('events received by a client not handling them: {0}'.format(other.received))
+
+        samples = min(count, 1000)
+        for receiver in receivers:
+            receiver.latencies = []
+        for i in xrange(samples):
+            for receiver in receivers:
+                receiver.expect(1)
+            sender.client.send_event('BENCHMARK', {'id': i, 'sent': time.time()})
+            for receiver in receivers:
+                receiver.done.wait(5)
+        latencies = sorted(latency for receiver in receivers for latency in receiver.latencies)
+        print('latency: median {0:.3f}ms, p99 {1:.3f}ms'.format(
+            latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000
+        ))
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,86 @@
+# Copyright (C) 2019 OpenMotics BV
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Measures ConfigurationController.get_setting: the previous query per call versus the in-memory snapshot, from a
+single thread and from 4 threads at once.
+
+Usage: PYTHONPATH=src python2 testing/benchmarks/config_benchmark.py [calls]
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import ujson as json
+from threading import Lock, Thread
+from ioc import SetTestMode, SetUpTestInjections
+from gateway.config import ConfigurationController
+
+THREADS = 4
+
+
+class PreviousConfigurationController(object):
+    """ The previous get_setting, reading the result under the lock as it failed when used by several threads """
+
+    def __init__(self, config_db, config_db_lock):
+        self.__lock = config_db_lock
+        self.__connection = sqlite3.connect(config_db, detect_types=sqlite3.PARSE_DECLTYPES,
+                                            check_same_thread=False, isolation_level=None)
+        self.__cursor = self.__connection.cursor()
+
+    def get_setting(self, setting, fallback=None):
+        with self.__lock:
+            for setting in self.__cursor.execute('SELECT data FROM settings WHERE setting=?;', (setting.lower(),)):
+                return json.loads(setting[0])
+        return fallback
+
+
+def _measure(controller, setting, calls):
+    start = time.time()
+    for _ in xrange(calls):
+        controller.get_setting(setting)
+    return time.time() - start
+
+
+def _measure_threads(controller, setting, calls):
+    threads = [Thread(target=_measure, args=(controller, setting, calls // THREADS)) for _ in xrange(THREADS)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.time() - start
+
+
+def main(calls):
+    SetTestMode()
+    _, config_file = tempfile.mkstemp()
+    try:
+        SetUpTestInjections(config_db=config_file)
+        controllers = [('previous', PreviousConfigurationController(config_file, Lock())),
+                       ('current', ConfigurationController())]
+        for setting in ['cloud_enabled', 'cloud_metrics_types', 'cloud_metrics_interval|energy']:
+            for name, controller in controllers:
+                print('{0:30} {1:8}: {2:6.2f}us/call, {3} threads: {4:6.2f}us/call'.format(
+                    setting, name,
+                    _measure(controller, setting, calls) / calls * 1000000,
+                    THREADS, _measure_threads(controller, setting, calls) / calls * 1000000
+                ))
+    finally:
+        os.remove(config_file)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
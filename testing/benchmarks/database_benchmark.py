@@ -0,0 +1,137 @@
+# Copyright (C) 2019 OpenMotics BV
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Measures concurrent database access: 4 threads updating metric counters (MetricsCacheController.process_counter)
+while 4 threads serve API reads (UserController.get_usernames), for the previous autocommit connections behind a
+lock versus the shared access layer.
+
+Usage: PYTHONPATH=src python2 testing/benchmarks/database_benchmark.py [counter updates] [directory]
+"""
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import ujson as json
+from threading import Lock, Thread
+from ioc import SetTestMode, SetUpTestInjections
+from gateway.metrics_caching import MetricsCacheController
+from gateway.users import UserController
+
+THREADS = 4
+
+
+class PreviousMetricsCacheController(object):
+    """ The previous process_counter: one autocommit connection, serialized by a lock """
+
+    def __init__(self, metrics_db, metrics_db_lock):
+        self._lock = metrics_db_lock
+        self._connection = sqlite3.connect(metrics_db, detect_types=sqlite3.PARSE_DECLTYPES,
+                                           check_same_thread=False, isolation_level=None)
+        self._cursor = self._connection.cursor()
+        self._cursor.execute("CREATE TABLE IF NOT EXISTS counter_sources (id INTEGER PRIMARY KEY, source TEXT, type TEXT, identifier TEXT);")
+        self._cursor.execute("CREATE TABLE IF NOT EXISTS counters (id INTEGER PRIMARY KEY, source_id INTEGER , name TEXT, last_value REAL, counter REAL, timestamp INTEGER);")
+
+    def process_counter(self, source, mtype, tags, name, value, timestamp):
+        with self._lock:
+            identifier = json.dumps(tags, sort_keys=True)
+            data = self._cursor.execute("SELECT id FROM counter_sources WHERE source=? AND type=? AND identifier=?;", (source, mtype, identifier)).fetchone()
+            id = data[0] if data is not None else self._cursor.execute("INSERT INTO counter_sources (source, type, identifier) VALUES (?, ?, ?);", (source, mtype, identifier)).lastrowid
+            for entry in self._cursor.execute("SELECT last_value, counter FROM counters WHERE source_id=? AND name=?;", (id, name)).fetchall():
+                last_value, counter = entry
+                counter += (value - last_value) if last_value < value else value
+                self._cursor.execute("UPDATE counters SET last_value=?, counter=?, timestamp=? WHERE source_id=? AND name=?;", (value, counter, timestamp, id, name))
+                return counter
+            self._cursor.execute("INSERT INTO counters (source_id, name, last_value, counter, timestamp) VALUES (?, ?, ?, ?, ?);", (id, name, value, value, timestamp))
+            return value
+
+
+class PreviousUserController(object):
+    """ The previous get_usernames, on a connection shared with the configuration behind a lock """
+
+    def __init__(self, user_db, user_db_lock):
+        self._lock = user_db_lock
+        self._connection = sqlite3.connect(user_db, detect_types=sqlite3.PARSE_DECLTYPES,
+                                           check_same_thread=False, isolation_level=None)
+        self._cursor = self._connection.cursor()
+        self._cursor.execute("CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, username TEXT UNIQUE, password TEXT, role TEXT, enabled INT);")
+        for i in xrange(10):
+            self._cursor.execute("INSERT OR REPLACE INTO users (username, password, role, enabled) VALUES (?, ?, ?, ?);",
+                                 ('user{0}'.format(i), 'password', 'admin', 1))
+
+    def get_usernames(self):
+        with self._lock:
+            return [row[0] for row in self._cursor.execute("SELECT username FROM users;").fetchall()]
+
+
+def _write(controller, thread, updates):
+    for i in xrange(updates):
+        controller.process_counter('OpenMotics', 'energy', {'id': '{0}.{1}'.format(thread, i % 10)}, 'counter', i, int(time.time()))
+
+
+def _read(controller, latencies, done):
+    while not done:
+        start = time.time()
+        controller.get_usernames()
+        latencies.append(time.time() - start)
+
+
+def _measure(name, metrics_cache, users, updates):
+    latencies = []
+    done = []
+    readers = [Thread(target=_read, args=(users, latencies, done)) for _ in xrange(THREADS)]
+    writers = [Thread(target=_write, args=(metrics_cache, i, updates // THREADS)) for i in xrange(THREADS)]
+    for reader in readers:
+        reader.start()
+    start = time.time()
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+    duration = time.time() - start
+    done.append(True)
+    for reader in readers:
+        reader.join()
+    latencies.sort()
+    print('{0:8}: {1:6.0f} counter updates/s, {2:6.0f} reads/s, read latency median {3:.3f}ms, p99 {4:.3f}ms'.format(
+        name, updates / duration, len(latencies) / duration,
+        latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000
+    ))
+
+
+def main(updates, directory=None):
+    SetTestMode()
+    path = tempfile.mkdtemp(dir=directory)
+    try:
+        _measure('previous',
+                 PreviousMetricsCacheController(os.path.join(path, 'previous_metrics.db'), Lock()),
+                 PreviousUserController(os.path.join(path, 'previous_config.db'), Lock()),
+                 updates)
+
+        SetUpTestInjections(metrics_db=os.path.join(path, 'metrics.db'),
+                            user_db=os.path.join(path, 'config.db'),
+                            config={'username': 'cloud', 'password': 'cloud'},
+                            token_timeout=3600)
+        users = UserController()
+        for i in xrange(10):
+            users.create_user('user{0}'.format(i), 'password', 'admin', True)
+        _measure('current', MetricsCacheController(), users, updates)
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 4000, sys.argv[2] if len(sys.argv) > 2 else None)
@@ -0,0 +1,57 @@
+# Copyright (C) 2019 OpenMotics BV
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Measures the update and scrape (render) latency of the OpenMetrics snapshot.
+
+Usage: PYTHONPATH=src python2 testing/benchmarks/metrics_exporter_benchmark.py [series]
+"""
+import sys
+import time
+from gateway.metrics_exporter import MetricsSnapshot
+
+DEFINITIONS = {'OpenMotics': {'energy': {'type': 'energy',
+                                         'tags': ['device', 'id'],
+                                         'metrics': [{'name': 'power', 'description': 'Power', 'type': 'gauge', 'unit': 'W'},
+                                                     {'name': 'counter', 'description': 'Counter', 'type': 'counter', 'unit': 'Wh'}]}}}
+
+
+def main(series):
+    snapshot = MetricsSnapshot()
+    snapshot.set_definitions(DEFINITIONS)
+    metrics = [{'source': 'OpenMotics',
+                'type': 'energy',
+                'timestamp': time.time(),
+                'tags': {'device': 'energy module {0}'.format(i // 12), 'id': 'E{0}.{1}'.format(i // 12, i % 12)},
+                'values': {'power': 123.4 + i, 'counter': 1000 + i}} for i in xrange(series // 2)]
+
+    start = time.time()
+    for metric in metrics:
+        snapshot.update(metric)
+    update_duration = time.time() - start
+
+    durations = []
+    size = 0
+    for _ in xrange(20):
+        start = time.time()
+        size = len(snapshot.render())
+        durations.append(time.time() - start)
+    durations.sort()
+    print('{0} series, {1} bytes'.format(series, size))
+    print('update: {0:.2f}us/metric'.format(update_duration / len(metrics) * 1000000))
+    print('render: median {0:.2f}ms, max {1:.2f}ms'.format(durations[len(durations) // 2] * 1000, durations[-1] * 1000))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,131 @@
+# Copyright (C) 2019 OpenMotics BV
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Measures the time to start N dummy plugins, the way the PluginController starts them at boot: a new
+interpreter per plugin or forked from the runtime zygote, with and without the introspection cache.
+
+Usage: PYTHONPATH=$PWD/src python2 testing/benchmarks/plugin_boot_benchmark.py [plugins]
+"""
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import plugin_runtime
+from plugins.runner import PluginRunner, RuntimeZygote
+from plugin_runtime.utils import INTROSPECTION_CACHE
+
+PLUGIN_CODE = """
+from plugins.base import *
+
+class Dummy{0}(OMPluginBase):
+    name = 'Dummy{0}'
+    version = '1.0.0'
+    interfaces = [('webui', '1.0'), ('metrics', '1.0')]
+
+    metric_definitions = [{{'type': 'dummy', 'tags': ['id'], 'metrics': [{{'name': 'value', 'description': 'Value', 'type': 'gauge', 'unit': ''}}]}}]
+
+    @om_expose
+    def html_index(self):
+        return 'index'
+
+    @om_expose(auth=False)
+    def get_state(self):
+        return {{}}
+
+    @input_status
+    def input(self, status):
+        pass
+
+    @output_status
+    def output(self, status):
+        pass
+
+    @receive_events
+    def event(self, code):
+        pass
+
+    @om_metric_data(interval=5)
+    def collect(self):
+        return []
+
+    @om_metric_receive(source='OpenMotics', metric_type='energy')
+    def receive(self, metric):
+        pass
+""" + ''.join("""
+    def helper_{0}(self):
+        pass
+""".format(i) for i in xrange(50))
+
+
+def _log(*args, **kwargs):
+    _ = args, kwargs
+
+
+def _boot(runtime_path, plugin_paths, zygote):
+    """ Starts all plugins, returns the duration """
+    start = time.time()
+    if zygote is not None:
+        zygote.spawn(plugin_paths[0]).kill()  # Starting the zygote itself is part of the boot
+    runners = []
+    for path in plugin_paths:
+        runner = PluginRunner(None, runtime_path, path, _log, zygote=zygote)
+        runner.start()
+        runners.append(runner)
+    duration = time.time() - start
+    for runner in runners:
+        runner.stop()
+    return duration
+
+
+def main(count):
+    logging.disable(logging.INFO)
+    runtime_path = os.path.dirname(plugin_runtime.__file__)
+    plugins_path = tempfile.mkdtemp()
+    zygote = RuntimeZygote(runtime_path, os.path.join(plugins_path, 'zygote.sock'))
+    try:
+        plugin_paths = []
+        for i in xrange(count):
+            path = os.path.join(plugins_path, 'Dummy{0}'.format(i))
+            os.makedirs(path)
+            with open(os.path.join(path, 'main.py'), 'w') as code_file:
+                code_file.write(PLUGIN_CODE.format(i))
+            with open(os.path.join(path, '__init__.py'), 'w'):
+                pass
+            plugin_paths.append(path)
+
+        for name, use_zygote, cached in [('interpreter per plugin', False, False),
+                                         ('interpreter per plugin, cached', False, True),
+                                         ('zygote', True, False),
+                                         ('zygote, cached', True, True)]:
+            durations = []
+            for _ in xrange(3):
+                if not cached:
+                    for path in plugin_paths:
+                        if os.path.exists(os.path.join(path, INTROSPECTION_CACHE)):
+                            os.remove(os.path.join(path, INTROSPECTION_CACHE))
+                durations.append(_boot(runtime_path, plugin_paths, zygote if use_zygote else None))
+                zygote.stop()
+            print('{0:32}: {1} plugins in {2:7.1f}ms ({3:.1f}ms per plugin)'.format(
+                name, count, min(durations) * 1000, min(durations) * 1000 / count
+            ))
+    finally:
+        zygote.stop()
+        shutil.rmtree(plugins_path)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
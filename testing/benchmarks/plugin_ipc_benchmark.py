@@ -0,0 +1,99 @@
+# Copyright (C) 2019 OpenMotics BV
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Measures the distribute_metrics throughput and the request round-trip latency between
+the PluginRunner and the plugin runtime, for the json and the msgpack protocol.
+
+Usage: PYTHONPATH=src python2 testing/benchmarks/plugin_ipc_benchmark.py
+"""
+import os
+import shutil
+import tempfile
+import time
+import plugin_runtime
+from plugins.runner import PluginRunner
+
+PLUGIN_CODE = """
+from plugins.base import OMPluginBase, om_expose, om_metric_receive
+
+class Benchmark(OMPluginBase):
+    name = 'Benchmark'
+    version = '1.0.0'
+    interfaces = []
+
+    def __init__(self, webservice, logger):
+        super(Benchmark, self).__init__(webservice, logger)
+        self.received = 0
+
+    @om_expose(auth=False)
+    def echo(self, value):
+        return value
+
+    @om_metric_receive(interval=5)
+    def receive(self, metric):
+        self.received += 1
+"""
+
+
+def _log(*args, **kwargs):
+    _ = args, kwargs
+
+
+def benchmark(plugin_path, protocols, batches=100, batch_size=500, requests=1000):
+    runner = PluginRunner('benchmark', os.path.dirname(plugin_runtime.__file__), plugin_path, _log)
+    runner._protocols = protocols
+    runner.start()
+    try:
+        metrics = [{'source': 'OpenMotics',
+                    'type': 'energy',
+                    'timestamp': time.time(),
+                    'tags': {'device': 'OpenMotics energy ID{0}'.format(i), 'id': 'E{0}.0'.format(i)},
+                    'values': {'power': 123.4 + i, 'counter': 1000 + i}} for i in xrange(batch_size)]
+        start = time.time()
+        for _ in xrange(batches):
+            runner._do_command('distribute_metrics', {'name': 'receive', 'metrics': metrics})
+        metrics_per_second = batches * batch_size / (time.time() - start)
+
+        durations = []
+        for i in xrange(requests):
+            start = time.time()
+            runner.request('echo', kwargs={'value': 'x' * (i % 100)})
+            durations.append(time.time() - start)
+        durations.sort()
+        print('{0:8}: distribute_metrics {1:8.0f} metrics/s, request median {2:.3f}ms, p99 {3:.3f}ms'.format(
+            protocols[0] if protocols else 'json', metrics_per_second,
+            durations[len(durations) // 2] * 1000, durations[int(len(durations) * 0.99)] * 1000
+        ))
+    finally:
+        runner.stop()
+
+
+def main():
+    plugins_path = tempfile.mkdtemp()
+    try:
+        plugin_path = os.path.join(plugins_path, 'Benchmark')
+        os.makedirs(plugin_path)
+        with open(os.path.join(plugin_path, 'main.py'), 'w') as code_file:
+            code_file.write(PLUGIN_CODE)
+        with open(os.path.join(plugin_path, '__init__.py'), 'w'):
+            pass
+        for protocols in [[], ['msgpack']]:
+            benchmark(plugin_path, protocols)
+    finally:
+        shutil.rmtree(plugins_path)
+
+
+if __name__ == '__main__':
+    main()
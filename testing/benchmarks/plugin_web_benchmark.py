@@ -0,0 +1,121 @@
+# Copyright (C) 2019 OpenMotics BV
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Measures the latency of plugin API calls (get_output_status): a new connection per call,
+a keep-alive session and the in-process call over the plugin runner pipe.
+
+Usage: PYTHONPATH=src python2 testing/benchmarks/plugin_web_benchmark.py [calls]
+"""
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import cherrypy
+import requests
+import plugin_runtime
+from ioc import SetTestMode, SetUpTestInjections
+from plugins.runner import PluginRunner
+from plugin_runtime.web import WebInterfaceDispatcher
+
+PORT = 18080
+
+PLUGIN_CODE = """
+import time
+from plugins.base import OMPluginBase, om_expose
+
+class Benchmark(OMPluginBase):
+    name = 'Benchmark'
+    version = '1.0.0'
+    interfaces = []
+
+    @om_expose(auth=False)
+    def bench(self, calls):
+        durations = []
+        for _ in xrange(int(calls)):
+            start = time.time()
+            self.webinterface.get_output_status()
+            durations.append(time.time() - start)
+        return {'durations': durations}
+"""
+
+
+class GatewayApi(object):
+    def get_output_status(self):
+        return [{'id': i, 'status': i % 2, 'dimmer': 100, 'ctimer': 0} for i in xrange(48)]
+
+
+def _log(*args, **kwargs):
+    _ = args, kwargs
+
+
+def _report(name, durations):
+    durations = sorted(durations)
+    print('{0:20}: total {1:7.1f}ms, median {2:.3f}ms, p99 {3:.3f}ms'.format(
+        name, sum(durations) * 1000, durations[len(durations) // 2] * 1000, durations[int(len(durations) * 0.99)] * 1000
+    ))
+
+
+def _measure(call, calls):
+    durations = []
+    for _ in xrange(calls):
+        start = time.time()
+        call()
+        durations.append(time.time() - start)
+    return durations
+
+
+def main(calls):
+    logging.disable(logging.INFO)
+    SetTestMode()
+    SetUpTestInjections(gateway_api=GatewayApi(),
+                        user_controller=None,
+                        maintenance_controller=None,
+                        message_client=None,
+                        configuration_controller=None,
+                        scheduling_controller=None)
+    from gateway.webservice import WebInterface
+    web_interface = WebInterface()
+    cherrypy.config.update({'server.socket_port': PORT, 'log.screen': False, 'engine.autoreload.on': False})
+    cherrypy.tree.mount(web_interface, '/', config={'/': {'tools.sessions.on': False}})
+    cherrypy.engine.start()
+    plugins_path = tempfile.mkdtemp()
+    try:
+        url = 'http://localhost:{0}/get_output_status'.format(PORT)
+        _report('connection per call', _measure(lambda: requests.get(url, timeout=30.0).text, calls))
+        dispatcher = WebInterfaceDispatcher(_log, port=PORT)
+        _report('keep-alive session', _measure(dispatcher.get_output_status, calls))
+
+        plugin_path = os.path.join(plugins_path, 'Benchmark')
+        os.makedirs(plugin_path)
+        with open(os.path.join(plugin_path, 'main.py'), 'w') as code_file:
+            code_file.write(PLUGIN_CODE)
+        with open(os.path.join(plugin_path, '__init__.py'), 'w'):
+            pass
+        runner = PluginRunner('Benchmark', os.path.dirname(plugin_runtime.__file__), plugin_path, _log,
+                              command_timeout=60, web_interface=web_interface)
+        runner.start()
+        try:
+            _report('runner pipe (ipc)', runner.request('bench', kwargs={'calls': calls})['durations'])
+        finally:
+            runner.stop()
+    finally:
+        shutil.rmtree(plugins_path)
+        cherrypy.engine.exit()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -0,0 +1,146 @@
+# Copyright (C) 2019 OpenMotics BV
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the message client.
+"""
+import os
+import shutil
+import socket
+import struct
+import tempfile
+import time
+import unittest
+import xmlrunner
+from threading import Thread
+from bus.om_bus_client import MessageClient
+from bus.om_bus_service import MessageService
+
+
+class MessageClientTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.path = tempfile.mkdtemp()
+        cls.socket_path = os.path.join(cls.path, 'bus.sock')
+        MessageService(socket_path=cls.socket_path).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.path)
+
+    @staticmethod
+    def _client(name):
+        client = MessageClient(name, socket_path=MessageClientTest.socket_path)
+        while not client._connected:
+            time.sleep(0.05)
+        return client
+
+    @staticmethod
+    def _wait(condition):
+        start = time.time()
+        while not condition() and time.time() - start < 2:
+            time.sleep(0.01)
+
+    def test_get_state(self):
+        requests = []
+
+        def get_state():
+            requests.append(1)
+            time.sleep(0.1)
+            return {'authorized_mode': len(requests) > 1}
+
+        client = MessageClientTest._client('test_client')
+        service = MessageClientTest._client('test_service')
+        service.set_state_handler(get_state)
+
+        # Concurrent requests share a single request
+        results = []
+        threads = [Thread(target=lambda: results.append(client.get_state('test_service', {}))) for _ in xrange(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([{'authorized_mode': False}] * 5, results)
+        self.assertEqual(1, len(requests))
+
+        # The received state is used while it's fresh
+        self.assertEqual({'authorized_mode': False}, client.get_state('test_service', {}))
+        self.assertEqual(1, len(requests))
+
+        # A published state is used without requesting it
+        service.publish_state()
+        MessageClientTest._wait(lambda: client._states['test_service'][0] == {'authorized_mode': True})
+        self.assertEqual({'authorized_mode': True}, client.get_state('test_service', {}))
+        self.assertEqual(2, len(requests))
+
+        # An outdated state is requested again
+        self.assertEqual({'authorized_mode': True}, client.get_state('test_service', {}, max_age=0))
+        self.assertEqual(3, len(requests))
+
+    def test_state_sources(self):
+        client = MessageClientTest._client('test_sources_client')
+        services = {}
+        for name in ['test_led_service', 'test_vpn_service']:
+            services[name] = MessageClientTest._client(name)
+            services[name].set_state_handler(lambda name=name: {'name': name, 'time': time.time()})
+        time.sleep(0.1)  # Wait for the connections to be processed
+        for name in ['test_led_service', 'test_vpn_service']:  # The led service isn't the last one requested
+            self.assertEqual(name, client.get_state(name, {}).get('name'))
+        # The states of all requested clients keep being received, not only of the last one
+        self.assertEqual(['state.test_led_service', 'state.test_vpn_service'],
+                         [topic for topic in client._get_topics() if topic.startswith('state.')])
+        time.sleep(0.1)  # Wait for the subscriptions to be processed
+        received = client._states['test_led_service'][1]
+        services['test_led_service'].publish_state()
+        MessageClientTest._wait(lambda: client._states['test_led_service'][1] > received)
+        self.assertGreater(client._states['test_led_service'][1], received)
+
+    def test_get_state_timeout(self):
+        client = MessageClientTest._client('test_timeout_client')
+        start = time.time()
+        self.assertEqual({}, client.get_state('unknown_service', {}, timeout=0.5))
+        self.assertTrue(time.time() - start < 1)
+        self.assertEqual([], client._state_waiters['unknown_service'])
+
+    def test_topics(self):
+        events = {'all': [], 'leds': [], 'none': []}
+        all_client = MessageClientTest._client('test_all')
+        all_client.add_event_handler(lambda event, payload: events['all'].append((event, payload)))
+        led_client = MessageClientTest._client('test_leds')
+        led_client.add_event_handler(lambda event, payload: events['leds'].append((event, payload)), ['VPN_OPEN', 'INDICATE_GATEWAY'])
+        led_client.add_event_handler(lambda event, payload: events['none'].append((event, payload)), [])
+        sender = MessageClientTest._client('test_sender')
+        time.sleep(0.1)  # Wait for the subscriptions to be processed
+        events['all'] = []
+        sender.send_event('VPN_OPEN', True)
+        sender.send_event('METRICS_INTERVAL_CHANGE', {'energy': 5})
+        sender.send_event('INDICATE_GATEWAY', None)
+        MessageClientTest._wait(lambda: len(events['all']) == 3 and len(events['leds']) == 2)
+        self.assertEqual([('VPN_OPEN', True), ('METRICS_INTERVAL_CHANGE', {'energy': 5}), ('INDICATE_GATEWAY', None)], events['all'])
+        self.assertEqual([('VPN_OPEN', True), ('INDICATE_GATEWAY', None)], events['leds'])
+        self.assertEqual([], events['none'])
+        self.assertEqual(['INDICATE_GATEWAY', 'VPN_OPEN'], led_client._get_topics())
+
+    def test_invalid_frame(self):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(5)
+        connection.connect(MessageClientTest.socket_path)
+        connection.sendall(struct.pack('>I', 0xffffffff))  # Not a length of an actual message
+        self.assertEqual('', connection.recv(1))  # Closed instead of waiting for 4GB
+        connection.close()
+
+
+if __name__ == "__main__":
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='../gw-unit-reports'))
@@ -0,0 +1,168 @@
+# Copyright (C) 2019 OpenMotics BV
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the shared database access layer.
+"""
+import os
+import tempfile
+import time
+import unittest
+import xmlrunner
+from threading import Event, Thread
+from database_utils import Database
+
+
+class DatabaseTest(unittest.TestCase):
+
+    def setUp(self):
+        _, self.filename = tempfile.mkstemp()
+        self.database = Database(self.filename)
+        self.database.write('CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT UNIQUE);')
+
+    def tearDown(self):
+        self.database.close()
+        for suffix in ['', '-wal', '-shm']:  # The database runs in WAL mode
+            if os.path.exists(self.filename + suffix):
+                os.remove(self.filename + suffix)
+
+    def _block_writer(self):
+        """ Keeps the writer busy until the returned event is set """
+        started, release = Event(), Event()
+
+        def _block(cursor):
+            _ = cursor
+            started.set()
+            release.wait(5)
+        thread = Thread(target=self.database.transaction, args=(_block,))
+        thread.start()
+        started.wait(5)
+        return thread, release
+
+    def test_read_write(self):
+        self.assertEqual('wal', self.database.execute_one('PRAGMA journal_mode;')[0])
+        result = self.database.write('INSERT INTO items (name) VALUES (?);', ('a',))
+        self.assertEqual(1, result.rowcount)
+        self.assertEqual([(result.lastrowid, u'a')], self.database.execute('SELECT id, name FROM items;'))
+        self.assertIsNone(self.database.execute_one('SELECT id FROM items WHERE name=?;', ('b',)))
+        self.assertEqual(0, self.database.write('DELETE FROM items WHERE name=?;', ('b',)).rowcount)
+
+    def test_group_commit(self):
+        commits = self.database.get_statistics()['commits']
+        blocker, release = self._block_writer()
+        writers = [Thread(target=self.database.write, args=('INSERT INTO items (name) VALUES (?);', (str(i),)))
+                   for i in xrange(10)]
+        for writer in writers:
+            writer.start()
+        # Reads don't wait for the writer
+        self.assertEqual(0, self.database.execute_one('SELECT count(*) FROM items;')[0])
+        time.sleep(0.2)
+        release.set()
+        for thread in [blocker] + writers:
+            thread.join()
+        self.assertEqual(10, self.database.execute_one('SELECT count(*) FROM items;')[0])
+        statistics = self.database.get_statistics()
+        self.assertEqual(commits + 2, statistics['commits'])
+
+    def test_stop_writer(self):
+        blocker, release = self._block_writer()
+        writer = self.database._writer
+        first = Thread(target=self.database.write, args=('INSERT INTO items (name) VALUES (?);', ('a',)))
+        first.start()
+        time.sleep(0.1)
+        self.database._queue.put(None)  # Stop, as `_stop_writer` does
+        second = Thread(target=self.database.write, args=('INSERT INTO items (name) VALUES (?);', ('b',)))
+        second.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in [blocker, first, writer]:
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+        # The write queued after the stop is left for the next writer
+        self.assertEqual([(u'a',)], self.database.execute('SELECT name FROM items;'))
+        self.database._writer = None
+        self.database._ensure_writer()
+        second.join(5)
+        self.assertEqual([(u'a',), (u'b',)], self.database.execute('SELECT name FROM items ORDER BY id;'))
+
+    def test_transaction(self):
+        blocker, release = self._block_writer()
+        results = {}
+
+        def _insert(name, fail):
+            def _transaction(cursor):
+                cursor.execute('INSERT INTO items (name) VALUES (?);', (name,))
+                if fail:
+                    raise ValueError('Failed')
+                return cursor.execute('SELECT count(*) FROM items;').fetchone()[0]
+            try:
+                results[name] = self.database.transaction(_transaction)
+            except ValueError as ex:
+                results[name] = ex
+        threads = [Thread(target=_insert, args=('a', False))]
+        threads[0].start()
+        time.sleep(0.1)
+        threads.append(Thread(target=_insert, args=('b', True)))
+        threads[1].start()
+        time.sleep(0.1)
+        threads.append(Thread(target=_insert, args=('c', False)))
+        threads[2].start()
+        time.sleep(0.1)
+        release.set()
+        for thread in [blocker] + threads:
+            thread.join()
+        # Only the failing transaction is rolled back, the others of the same commit are stored
+        self.assertEqual(1, results['a'])
+        self.assertIsInstance(results['b'], ValueError)
+        self.assertEqual(2, results['c'])
+        self.assertEqual([(u'a',), (u'c',)], self.database.execute('SELECT name FROM items ORDER BY name;'))
+        # Errors of the statements themselves are raised to the caller as well
+        with self.assertRaises(Exception):
+            self.database.write('INSERT INTO items (name) VALUES (?);', ('a',))
+        # Transactions can be nested
+        self.assertEqual(3, self.database.transaction(
+            lambda cursor: self.database.write('INSERT INTO items (name) VALUES (?);', ('d',)).lastrowid
+        ))
+
+    def test_connection_pool(self):
+        self.database.write('INSERT INTO items (name) VALUES (?);', ('a',))
+        results = []
+        for _ in xrange(5):
+            readers = [Thread(target=lambda: results.append(self.database.execute('SELECT name FROM items;')))
+                       for _ in xrange(40)]
+            for reader in readers:
+                reader.start()
+            for reader in readers:
+                reader.join()
+        self.assertEqual([[(u'a',)]] * 200, results)
+        # Short-lived readers don't leave their connections behind, only the writer's and the idle ones are kept
+        self.assertLessEqual(len(self.database._connections), 1 + Database.POOL_SIZE)
+        self.assertLessEqual(self.database._pool.qsize(), Database.POOL_SIZE)
+
+    def test_statistics(self):
+        for _ in xrange(3):
+            self.database.execute('SELECT name FROM items;')
+        self.database.write('INSERT INTO items (name) VALUES (?);', ('a',))
+        statistics = self.database.get_statistics()
+        self.assertEqual(3, statistics['statements']['SELECT name FROM items;']['count'])
+        self.assertEqual(1, statistics['statements']['INSERT INTO items (name) VALUES (?);']['count'])
+        self.assertGreaterEqual(statistics['statements']['SELECT name FROM items;']['duration'],
+                                statistics['statements']['SELECT name FROM items;']['max'])
+        self.assertEqual(2, statistics['writes'])
+        self.assertIn(self.database, Database.get_instances())
+        self.assertEqual(os.path.basename(self.filename), self.database.get_name())
+
+
+if __name__ == '__main__':
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='../gw-unit-reports'))
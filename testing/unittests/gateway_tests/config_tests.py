@@ -0,0 +1,82 @@
+# Copyright (C) 2019 OpenMotics BV
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the configuration controller.
+"""
+import os
+import tempfile
+import unittest
+import xmlrunner
+from ioc import SetTestMode, SetUpTestInjections
+from gateway.config import ConfigurationController
+
+
+class ConfigurationControllerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        SetTestMode()
+
+    def setUp(self):
+        _, self.config_file = tempfile.mkstemp()
+
+    def tearDown(self):
+        for suffix in ['', '-wal', '-shm']:  # The database runs in WAL mode
+            if os.path.exists(self.config_file + suffix):
+                os.remove(self.config_file + suffix)
+
+    def _get_controller(self):
+        SetUpTestInjections(config_db=self.config_file)
+        return ConfigurationController()
+
+    def test_settings(self):
+        controller = self._get_controller()
+        self.assertTrue(controller.get_setting('cloud_enabled'))
+        self.assertEqual('fallback', controller.get_setting('unknown', 'fallback'))
+        controller.set_setting('Communication_Recovery', {'service_restart': {'backoff': 60}})
+        recovery = controller.get_setting('communication_recovery')
+        recovery['service_restart']['backoff'] = 120
+        self.assertEqual({'service_restart': {'backoff': 60}}, controller.get_setting('communication_recovery'))
+        controller.remove_setting('communication_recovery')
+        self.assertIsNone(controller.get_setting('communication_recovery'))
+        # Everything is stored
+        controller = self._get_controller()
+        self.assertTrue(controller.get_setting('cloud_enabled'))
+        self.assertIsNone(controller.get_setting('communication_recovery'))
+
+    def test_subscriptions(self):
+        changes = []
+        controller = self._get_controller()
+        controller.subscribe('cloud_metrics_', lambda setting, value: changes.append((setting, value)))
+        controller.set_setting('cloud_metrics_batch_size', 100)
+        controller.set_setting('cloud_metrics_batch_size', 100)  # Not changed
+        controller.set_setting('cloud_enabled', False)
+        controller.remove_setting('cloud_metrics_sources')
+        self.assertEqual([('cloud_metrics_batch_size', 100), ('cloud_metrics_sources', None)], changes)
+
+        # Changes by another process (which also restores the removed default setting)
+        other_controller = self._get_controller()
+        other_controller.set_setting('cloud_metrics_types', ['energy'])
+        other_controller.remove_setting('cloud_metrics_batch_size')
+        self.assertEqual([], controller.get_setting('cloud_metrics_types'))
+        controller._ConfigurationController__next_refresh = 0
+        self.assertEqual(['energy'], controller.get_setting('cloud_metrics_types'))
+        self.assertIsNone(controller.get_setting('cloud_metrics_batch_size'))
+        self.assertEqual([('cloud_metrics_batch_size', None), ('cloud_metrics_sources', []), ('cloud_metrics_types', ['energy'])],
+                         sorted(changes[2:]))
+
+
+if __name__ == "__main__":
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='../gw-unit-reports'))
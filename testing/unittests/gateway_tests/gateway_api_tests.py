@@ -0,0 +1,117 @@
+# Copyright (C) 2019 OpenMotics BV
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the gateway api module.
+"""
+import unittest
+import xmlrunner
+from ioc import SetTestMode, SetUpTestInjections
+from gateway.gateway_api import GatewayApi
+from gateway.status_snapshot import StatusSnapshot
+from gateway.webservice import WebInterface
+
+
+class MasterCommunicator(object):
+    def __init__(self):
+        self.consumers = []
+
+    def register_consumer(self, consumer):
+        self.consumers.append(consumer)
+
+
+class MasterController(object):
+    def __init__(self):
+        self.calls = []
+
+    def get_sensors_temperature(self):
+        self.calls.append('temperature')
+        return [20.5, None]
+
+    def get_sensors_humidity(self):
+        self.calls.append('humidity')
+        return [None, 60.0]
+
+    def get_sensors_brightness(self):
+        self.calls.append('brightness')
+        return [None, None]
+
+
+class Observer(object):
+    def __init__(self):
+        self.status_snapshot = StatusSnapshot()
+
+    def get_status_snapshot(self):
+        return self.status_snapshot
+
+    @staticmethod
+    def get_outputs():
+        return [{'id': 1, 'status': 1, 'ctimer': 0, 'dimmer': 100, 'type': 'light'}]
+
+    @staticmethod
+    def get_thermostats():
+        return {'thermostats_on': True, 'status': [{'id': 0, 'act': 21.0}]}
+
+
+class GatewayApiTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        SetTestMode()
+
+    def setUp(self):
+        self.master_controller = MasterController()
+        SetUpTestInjections(master_communicator=MasterCommunicator(),
+                            master_controller=self.master_controller,
+                            power_communicator=None,
+                            power_controller=None,
+                            eeprom_controller=None,
+                            pulse_controller=None,
+                            message_client=None,
+                            observer=Observer(),
+                            configuration_controller=None,
+                            shutter_controller=None)
+        self.gateway_api = GatewayApi()
+
+    def test_status(self):
+        self.assertEqual([{'id': 1, 'status': 1, 'ctimer': 0, 'dimmer': 100}], self.gateway_api.get_output_status())
+        self.assertEqual({'thermostats_on': True, 'status': [{'id': 0, 'act': 21.0}]},
+                         self.gateway_api.get_thermostat_status())
+        self.assertEqual([20.5] + [None] * 31, self.gateway_api.get_sensor_temperature_status())
+        self.assertEqual([None, 60.0] + [None] * 30, self.gateway_api.get_sensor_humidity_status())
+        self.assertEqual([None] * 32, self.gateway_api.get_sensor_brightness_status())
+        self.assertEqual({}, self.gateway_api.get_realtime_power())
+        self.assertEqual({}, self.gateway_api.get_total_energy())
+        # Statuses are served from the snapshot until they're outdated
+        self.gateway_api.get_sensor_temperature_status()
+        self.assertEqual(['temperature', 'humidity', 'brightness'], self.master_controller.calls)
+
+    def test_state_stream(self):
+        SetUpTestInjections(gateway_api=self.gateway_api,
+                            user_controller=None,
+                            maintenance_controller=None,
+                            scheduling_controller=None)
+        web_interface = WebInterface()
+        frames = []
+        web_interface._state_stream.subscribe('a', ['outputs', 'thermostats', 'sensors', 'power'], frames.append)
+        self.assertEqual({'outputs': {1: {'status': 1, 'ctimer': 0, 'dimmer': 100}},
+                          'thermostats': {0: {'act': 21.0}, 'group': {'thermostats_on': True}},
+                          'sensors': {0: {'temperature': 20.5, 'humidity': None, 'brightness': None},
+                                      1: {'temperature': None, 'humidity': 60.0, 'brightness': None}},
+                          'power': {}},
+                         frames[0].data['state'])
+
+
+if __name__ == "__main__":
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='../gw-unit-reports'))
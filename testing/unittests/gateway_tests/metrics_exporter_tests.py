@@ -0,0 +1,85 @@
+# Copyright (C) 2019 OpenMotics BV
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the metrics exporter module.
+"""
+import unittest
+import xmlrunner
+from gateway.metrics_exporter import MetricsSnapshot, format_family, format_histogram, format_name
+
+
+class MetricsExporterTest(unittest.TestCase):
+
+    DEFINITIONS = {'OpenMotics': {'energy': {'type': 'energy',
+                                             'tags': ['device', 'id'],
+                                             'metrics': [{'name': 'power',
+                                                          'description': 'Total energy consumed',
+                                                          'type': 'gauge',
+                                                          'unit': 'W'},
+                                                         {'name': 'counter',
+                                                          'description': 'Total energy consumed',
+                                                          'type': 'counter',
+                                                          'unit': 'Wh'}]}}}
+
+    def test_format(self):
+        self.assertEqual('openmotics_energy_power', format_name('OpenMotics.energy power'))
+        self.assertEqual('_1_wire', format_name('1-wire'))
+        self.assertEqual(u'# TYPE gateway_test counter\n'
+                         u'# HELP gateway_test Test\n'
+                         u'gateway_test_total{key="a\\"b"} 2\n'
+                         u'gateway_test_total{key="c"} 1.5\n',
+                         format_family('gateway_test', 'counter', 'Test', [({'key': 'a"b'}, 2),
+                                                                           ({'key': 'c'}, 1.5),
+                                                                           ({'key': 'd'}, 'foo')]))
+        self.assertEqual(u'# TYPE gateway_latency histogram\n'
+                         u'# HELP gateway_latency Latency\n'
+                         u'gateway_latency_bucket{action="a",le="0.1"} 2\n'
+                         u'gateway_latency_bucket{action="a",le="1.0"} 3\n'
+                         u'gateway_latency_bucket{action="a",le="+Inf"} 4\n'
+                         u'gateway_latency_count{action="a"} 4\n'
+                         u'gateway_latency_sum{action="a"} 2.5\n',
+                         format_histogram('gateway_latency', 'Latency', [({'action': 'a'}, [(0.1, 2), (1, 3)], 4, 2.5)]))
+
+    def test_snapshot(self):
+        snapshot = MetricsSnapshot()
+        snapshot.set_definitions(MetricsExporterTest.DEFINITIONS)
+        self.assertEqual('# EOF\n', snapshot.render())
+        for timestamp, power in [(1, 10), (2, 11.5)]:
+            snapshot.update({'source': 'OpenMotics',
+                             'type': 'energy',
+                             'timestamp': timestamp,
+                             'tags': {'device': 'OpenMotics energy ID1', 'id': 'E7.3'},
+                             'values': {'power': power, 'counter': 100, 'unknown': 1}})
+        snapshot.update({'source': 'Unknown', 'type': 'energy', 'timestamp': 1, 'tags': {}, 'values': {'power': 1}})
+        self.assertEqual('# TYPE openmotics_energy_counter counter\n'
+                         '# HELP openmotics_energy_counter Total energy consumed (Wh)\n'
+                         'openmotics_energy_counter_total{device="OpenMotics energy ID1",id="E7.3"} 100 2.0\n'
+                         '# TYPE openmotics_energy_power gauge\n'
+                         '# HELP openmotics_energy_power Total energy consumed (W)\n'
+                         'openmotics_energy_power{device="OpenMotics energy ID1",id="E7.3"} 11.5 2.0\n'
+                         'extra\n'
+                         '# EOF\n', snapshot.render(u'extra\n'))
+        # Families of which the definition is removed are no longer exported
+        snapshot.set_definitions({'OpenMotics': {'energy': {'type': 'energy',
+                                                            'tags': ['device', 'id'],
+                                                            'metrics': [MetricsExporterTest.DEFINITIONS['OpenMotics']['energy']['metrics'][0]]}}})
+        self.assertEqual('# TYPE openmotics_energy_power gauge\n'
+                         '# HELP openmotics_energy_power Total energy consumed (W)\n'
+                         'openmotics_energy_power{device="OpenMotics energy ID1",id="E7.3"} 11.5 2.0\n'
+                         '# EOF\n', snapshot.render())
+
+
+if __name__ == "__main__":
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='../gw-unit-reports'))
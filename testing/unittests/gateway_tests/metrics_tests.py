@@ -23,16 +23,17 @@ import ujson as json
 import fakesleep
 import xmlrunner
 import time
-from threading import Lock
 from mock import Mock
 from ioc import SetTestMode, SetUpTestInjections
 from gateway.config import ConfigurationController
 from gateway.metrics_controller import MetricsController
+from gateway.metrics_collector import MetricsCollector
 from gateway.metrics_caching import MetricsCacheController
 
 
 class MetricsTest(unittest.TestCase):
     intervals = {}
+    emission_policies = {}
 
     BUFFER_FILE = 'buffer_test.db'
     CONFIG_FILE = 'config_test.db'
@@ -48,17 +49,17 @@ class MetricsTest(unittest.TestCase):
         fakesleep.monkey_restore()
 
     def setUp(self):
-        if os.path.exists(MetricsTest.CONFIG_FILE):
-            os.remove(MetricsTest.CONFIG_FILE)
-        if os.path.exists(MetricsTest.BUFFER_FILE):
-            os.remove(MetricsTest.BUFFER_FILE)
+        for suffix in ['', '-wal', '-shm']:  # The databases run in WAL mode
+            for filename in [MetricsTest.CONFIG_FILE, MetricsTest.BUFFER_FILE]:
+                if os.path.exists(filename + suffix):
+                    os.remove(filename + suffix)
         self.maxDiff = None
 
     def tearDown(self):
-        if os.path.exists(MetricsTest.CONFIG_FILE):
-            os.remove(MetricsTest.CONFIG_FILE)
-        if os.path.exists(MetricsTest.BUFFER_FILE):
-            os.remove(MetricsTest.BUFFER_FILE)
+        for suffix in ['', '-wal', '-shm']:
+            for filename in [MetricsTest.CONFIG_FILE, MetricsTest.BUFFER_FILE]:
+                if os.path.exists(filename + suffix):
+                    os.remove(filename + suffix)
 
     @staticmethod
     def _set_cloud_interval(self, metric_type, interval):
@@ -66,16 +67,25 @@ class MetricsTest(unittest.TestCase):
         MetricsTest.intervals[metric_type] = interval
 
     @staticmethod
-    def _get_controller(intervals):
+    def _set_emission_policy(self, metric_type, mode='always', deadband=0, heartbeat=900):
+        _ = self
+        if mode not in ['always', 'change', 'deadband']:
+            raise ValueError('Unknown emission policy mode: {0}'.format(mode))
+        MetricsTest.emission_policies[metric_type] = (mode, float(deadband), float(heartbeat))
+
+    @staticmethod
+    def _get_controller(intervals, settings=None):
         metrics_collector = type('MetricsCollector', (), {'intervals': intervals,
                                                           'get_metric_definitions': lambda: [],
                                                           'get_definitions': lambda *args, **kwargs: {},
-                                                          'set_cloud_interval': MetricsTest._set_cloud_interval})()
+                                                          'set_cloud_interval': MetricsTest._set_cloud_interval,
+                                                          'set_emission_policy': MetricsTest._set_emission_policy})()
         metrics_cache_controller = type('MetricsCacheController', (), {'load_buffer': lambda *args, **kwargs: []})()
         plugin_controller = type('PluginController', (), {'get_metric_definitions': lambda *args, **kwargs: {}})()
-        SetUpTestInjections(config_db=MetricsTest.CONFIG_FILE,
-                            config_db_lock=Lock())
+        SetUpTestInjections(config_db=MetricsTest.CONFIG_FILE)
         config_controller = ConfigurationController()
+        for setting, value in (settings or {}).iteritems():
+            config_controller.set_setting(setting, value)
         SetUpTestInjections(plugin_controller=plugin_controller,
                             metrics_collector=metrics_collector,
                             metrics_cache_controller=metrics_cache_controller,
@@ -97,6 +107,93 @@ class MetricsTest(unittest.TestCase):
         self.assertEqual(MetricsTest.intervals.get('energy'), 900)
         self.assertEqual(config_controller.get_setting('cloud_metrics_interval|energy'), 900)
 
+    def test_emission_policy_setting(self):
+        MetricsTest.emission_policies = {}
+        config_controller, metrics_controller = MetricsTest._get_controller(
+            intervals=['energy', 'sensor', 'output'],
+            settings={'metrics_emission_policy|energy': {'mode': 'change', 'heartbeat': 60},
+                      'metrics_emission_policy|sensor': {'mode': 'foo'},
+                      'metrics_emission_policy|output': 'change'}
+        )
+        # Malformed stored policies fall back to always
+        self.assertEqual({'energy': ('change', 0, 60),
+                          'sensor': ('always', 0, 900),
+                          'output': ('always', 0, 900)}, MetricsTest.emission_policies)
+        metrics_controller.set_emission_policy('sensor', 'deadband', deadband=0.5)
+        self.assertEqual(('deadband', 0.5, 900), MetricsTest.emission_policies['sensor'])
+        self.assertEqual({'mode': 'deadband', 'deadband': 0.5, 'heartbeat': 900},
+                         config_controller.get_setting('metrics_emission_policy|sensor'))
+        # Only the collected metric types have an emission policy
+        with self.assertRaises(ValueError):
+            metrics_controller.set_emission_policy('foo', 'change')
+        self.assertNotIn('foo', MetricsTest.emission_policies)
+        self.assertIsNone(config_controller.get_setting('metrics_emission_policy|foo'))
+
+    def test_openmetrics_rates(self):
+        _, metrics_controller = MetricsTest._get_controller(intervals=['energy'])
+        metrics_controller._plugin_controller = type('PluginController', (), {'get_plugins': lambda *args, **kwargs: []})()
+        metrics_controller.inbound_rates = {'total': 3, 'openmotics.energy': 2, 'mbus.energy': 1}
+        families = metrics_controller.get_openmetrics_families()
+        self.assertIn('gateway_metrics_in_total{key="openmotics.energy"} 2', families)
+        self.assertIn('gateway_metrics_in_total{key="mbus.energy"} 1', families)
+        self.assertNotIn('key="total"', families)  # Summing the series gives the total
+
+    def test_routing_table(self):
+        _, metrics_controller = MetricsTest._get_controller(intervals=['energy'])
+        metrics_controller.definitions = {'OpenMotics': {'energy': {}, 'output': {}},
+                                          'MBus': {'energy': {}}}
+        subscriptions = (('a', None, None),
+                         ('b', 'OpenMotics', 'energy'),
+                         ('c', 'MBus', None),
+                         ('d', None, 'out.*'))
+        routing_table = metrics_controller.get_routing_table(subscriptions)
+        self.assertEqual(('openmotics.energy', ['a', 'b']), routing_table.get('OpenMotics', 'energy'))
+        self.assertEqual(('openmotics.output', ['a', 'd']), routing_table.get('OpenMotics', 'output'))
+        self.assertEqual(('mbus.energy', ['a', 'c']), routing_table.get('MBus', 'energy'))
+        self.assertEqual(('foo.bar', []), routing_table.get('Foo', 'bar'))
+        # Tables are cached, and rebuilt when the subscriptions or definitions change
+        self.assertIs(routing_table, metrics_controller.get_routing_table(subscriptions))
+        self.assertIsNot(routing_table, metrics_controller.get_routing_table(subscriptions[1:]))
+        metrics_controller.set_plugin_definitions({})
+        self.assertIsNot(routing_table, metrics_controller.get_routing_table(subscriptions))
+        self.assertIs(metrics_controller.get_rate_key('MBus', 'energy'), metrics_controller.get_rate_key('MBus', 'energy'))
+
+    def test_update_plugin_definitions(self):
+        _, metrics_controller = MetricsTest._get_controller(intervals=['energy'])
+        logs = []
+        metrics_controller._plugin_controller = type('PluginController', (), {'get_logger': lambda _self, name: logs.append})()
+        definition = {'type': 'energy', 'tags': ['id'], 'metrics': [{'name': 'power', 'description': 'Power', 'type': 'gauge', 'unit': 'W'}]}
+        metrics_controller.set_plugin_definitions({'MBus': [definition],
+                                                   'Solar': [dict(definition, type='solar')]})
+        subscriptions = (('a', None, None),
+                         ('b', 'M.*', None),
+                         ('c', None, 'sol.*'))
+        routing_table = metrics_controller.get_routing_table(subscriptions)
+        mbus_route = routing_table.get('MBus', 'energy')
+        solar_route = routing_table.get('Solar', 'solar')
+        self.assertEqual(('mbus.energy', ['a', 'b']), mbus_route)
+        self.assertEqual(('solar.solar', ['a', 'c']), solar_route)
+
+        # Only the routes of the changed plugin are resolved again
+        metrics_controller.update_plugin_definitions({'Meter': [definition, {'type': 'invalid'}]})
+        self.assertEqual(1, len(logs))
+        self.assertEqual({'energy': definition}, metrics_controller.definitions['Meter'])
+        self.assertIs(routing_table, metrics_controller.get_routing_table(subscriptions))
+        self.assertIs(mbus_route, routing_table.get('MBus', 'energy'))
+        self.assertIs(solar_route, routing_table.get('Solar', 'solar'))
+        self.assertEqual(('meter.energy', ['a', 'b']), routing_table.get('Meter', 'energy'))
+
+        # Unchanged definitions don't affect anything
+        version = metrics_controller.definitions_version
+        self.assertEqual(set(), metrics_controller._update_definitions({'MBus': [definition]}, []))
+        self.assertEqual(version, metrics_controller.definitions_version)
+
+        # Routes of a metric type that disappeared are resolved again as well
+        metrics_controller.update_plugin_definitions({}, removed=['Solar'])
+        self.assertNotIn('Solar', metrics_controller.definitions)
+        self.assertIs(mbus_route, routing_table.get('MBus', 'energy'))
+        self.assertEqual(('solar.solar', []), routing_table.get('Solar', 'solar'))
+
     def test_needs_upload(self):
         # 0. the boring stuff
         def get_setting(setting, fallback=None):
@@ -211,7 +308,7 @@ class MetricsTest(unittest.TestCase):
 
         requests.post = post
 
-        SetUpTestInjections(metrics_db=MetricsTest.BUFFER_FILE, metrics_db_lock=Lock())
+        SetUpTestInjections(metrics_db=MetricsTest.BUFFER_FILE)
 
         metrics_cache = MetricsCacheController()
         config_controller = Mock()
@@ -475,8 +572,7 @@ class MetricsTest(unittest.TestCase):
         self.assertEqual(buffered_metrics, [])
 
     def test_buffer(self):
-        SetUpTestInjections(metrics_db=MetricsTest.BUFFER_FILE,
-                            metrics_db_lock=Lock())
+        SetUpTestInjections(metrics_db=MetricsTest.BUFFER_FILE)
         controller = MetricsCacheController()
         tags = {'name': 'name', 'id': 0}
 
@@ -501,11 +597,96 @@ class MetricsTest(unittest.TestCase):
     @staticmethod
     def _load_buffered_metrics(controller):
         buffered_metrics = []
-        buffer_items = controller._execute_unlocked("SELECT counters, timestamp FROM counters_buffer INNER JOIN counter_sources ON counter_sources.id = counters_buffer.source_id;")
+        buffer_items = controller._database.execute("SELECT counters, timestamp FROM counters_buffer INNER JOIN counter_sources ON counter_sources.id = counters_buffer.source_id;")
         for item in buffer_items:
             buffered_metrics.append({'counter': json.loads(item[0])['counter'], 'timestamp': item[1]})
         return buffered_metrics
 
 
+class MetricsCollectorTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        SetTestMode()
+
+    @staticmethod
+    def _get_collector():
+        collector = MetricsCollector(gateway_api=Mock(), pulse_controller=Mock(), jitter=0)
+        collector._last_runs = dict((metric_type, 0) for metric_type in collector._workloads)
+        for metric_type in collector._workloads:
+            collector._schedule_run(metric_type, collector._get_interval(metric_type))
+        return collector
+
+    @staticmethod
+    def _dispatched(collector):
+        metric_types = []
+        while not collector._work_queue.empty():
+            metric_types.append(collector._work_queue.get())
+        return sorted(metric_types)
+
+    def test_schedule(self):
+        collector = MetricsCollectorTest._get_collector()
+        for metric_type in collector.intervals:
+            collector.intervals[metric_type] = collector._min_intervals[metric_type]
+            collector._schedule_run(metric_type, collector._get_interval(metric_type))
+        self.assertEqual(4.9, collector._dispatch_due_runs(0.1))
+        self.assertEqual([], MetricsCollectorTest._dispatched(collector))
+        self.assertEqual(25, collector._dispatch_due_runs(5))
+        self.assertEqual(['energy', 'sensor'], MetricsCollectorTest._dispatched(collector))
+        # Running collectors are not dispatched again until they're rescheduled
+        collector._dispatch_due_runs(30)
+        self.assertEqual(['counter', 'thermostat'], MetricsCollectorTest._dispatched(collector))
+        self.assertIsNone(collector._next_runs['energy'])
+
+    def test_wake_earlier(self):
+        collector = MetricsCollectorTest._get_collector()
+        self.assertEqual(900, collector._dispatch_due_runs(0))
+        collector.set_cloud_interval('energy', 60)
+        self.assertEqual(60, collector.intervals['energy'])
+        self.assertEqual(60, collector._dispatch_due_runs(0))
+        collector._dispatch_due_runs(60)
+        self.assertEqual(['energy'], MetricsCollectorTest._dispatched(collector))
+        # Longer intervals don't delay the run that is already scheduled
+        collector.set_cloud_interval('sensor', 300)
+        collector.set_cloud_interval('sensor', 1200)
+        self.assertEqual(300, collector._next_runs['sensor'])
+
+    def test_emission_policy(self):
+        collector = MetricsCollectorTest._get_collector()
+
+        def emit(values, timestamp, tags=None):
+            collector._enqueue_metrics('sensor', values, tags or {'id': 0}, timestamp)
+            return [metric['values'] for metric in collector.collect_metrics()]
+
+        self.assertEqual([{'temp': 20.0}], emit({'temp': 20.0}, 0))
+        self.assertEqual([{'temp': 20.0}], emit({'temp': 20.0}, 5))
+        collector.set_emission_policy('sensor', 'change', heartbeat=60)
+        self.assertEqual([{'temp': 20.0}], emit({'temp': 20.0}, 10))  # First value is always emitted
+        self.assertEqual([], emit({'temp': 20.0}, 15))
+        self.assertEqual([{'temp': 20.0}], emit({'temp': 20.0}, 15, tags={'id': 1}))
+        self.assertEqual([{'temp': 20.5}], emit({'temp': 20.5}, 20))
+        self.assertEqual([{'temp': 20.5, 'hum': 40.0}], emit({'temp': 20.5, 'hum': 40.0}, 25))
+        self.assertEqual([], emit({'temp': 20.5, 'hum': 40.0}, 79))
+        self.assertEqual([{'temp': 20.5, 'hum': 40.0}], emit({'temp': 20.5, 'hum': 40.0}, 85))  # Heartbeat
+        collector.set_emission_policy('sensor', 'deadband', deadband=0.5, heartbeat=60)
+        self.assertEqual([{'temp': 20.5}], emit({'temp': 20.5}, 90))
+        self.assertEqual([], emit({'temp': 20.9}, 95))
+        self.assertEqual([], emit({'temp': 20.1}, 100))
+        self.assertEqual([{'temp': 21.1}], emit({'temp': 21.1}, 105))
+        # Values that are or were missing or not numeric count as a change
+        self.assertEqual([{'temp': None}], emit({'temp': None}, 110))
+        self.assertEqual([{'temp': 21.1}], emit({'temp': 21.1}, 115))
+        self.assertEqual([{'temp': 'error'}], emit({'temp': 'error'}, 120))
+        self.assertEqual([], emit({'temp': 'error'}, 125))
+        collector.set_emission_policy('sensor', 'always')
+        self.assertEqual([{'temp': 21.1}], emit({'temp': 21.1}, 130))
+        with self.assertRaises(ValueError):
+            collector.set_emission_policy('sensor', 'foo')
+        with self.assertRaises(ValueError):
+            collector.set_emission_policy('sensor', 'deadband', deadband='foo')
+        with self.assertRaises(ValueError):
+            collector.set_emission_policy('foo', 'change')
+
+
 if __name__ == "__main__":
     unittest.main(testRunner=xmlrunner.XMLTestRunner(output='../gw-unit-reports'))
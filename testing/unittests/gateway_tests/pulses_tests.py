@@ -40,14 +40,16 @@ class PulseCounterControllerTest(unittest.TestCase):
 
     def setUp(self):  # pylint: disable=C0103
         """ Run before each test. """
-        if os.path.exists(PulseCounterControllerTest.FILE):
-            os.remove(PulseCounterControllerTest.FILE)
+        for suffix in ['', '-wal', '-shm']:  # The database runs in WAL mode
+            if os.path.exists(PulseCounterControllerTest.FILE + suffix):
+                os.remove(PulseCounterControllerTest.FILE + suffix)
         self.maxDiff = None
 
     def tearDown(self):  # pylint: disable=C0103
         """ Run after each test. """
-        if os.path.exists(PulseCounterControllerTest.FILE):
-            os.remove(PulseCounterControllerTest.FILE)
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(PulseCounterControllerTest.FILE + suffix):
+                os.remove(PulseCounterControllerTest.FILE + suffix)
 
     @staticmethod
     def _get_controller(master_communicator):
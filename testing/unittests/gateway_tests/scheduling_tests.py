@@ -20,7 +20,7 @@ import unittest
 import xmlrunner
 import time
 import fakesleep
-from threading import Lock, Semaphore
+from threading import Semaphore
 from ioc import SetTestMode, SetUpTestInjections
 from gateway.webservice import WebInterface
 from gateway.scheduling import SchedulingController
@@ -57,17 +57,18 @@ class SchedulingControllerTest(unittest.TestCase):
     def setUp(self):
         self._db = "test.schedule.{0}.db".format(time.time())
         GatewayApi.RETURN_DATA = {}
-        if os.path.exists(self._db):
-            os.remove(self._db)
+        for suffix in ['', '-wal', '-shm']:  # The database runs in WAL mode
+            if os.path.exists(self._db + suffix):
+                os.remove(self._db + suffix)
 
     def tearDown(self):
         GatewayApi.RETURN_DATA = {}
-        if os.path.exists(self._db):
-            os.remove(self._db)
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(self._db + suffix):
+                os.remove(self._db + suffix)
 
     def _get_controller(self):
         SetUpTestInjections(scheduling_db=self._db,
-                            scheduling_db_lock=Lock(),
                             gateway_api=GatewayApi(),
                             user_controller=None,
                             maintenance_controller=None,
@@ -0,0 +1,156 @@
+# Copyright (C) 2019 OpenMotics BV
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the state stream module.
+"""
+import unittest
+import xmlrunner
+from gateway.observer import Event
+from gateway.state_stream import StateStream
+
+
+class StateStreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.states = {'outputs': {0: {'status': 0}, 1: {'status': 1}},
+                       'sensors': {0: {'temperature': 20.5}}}
+        self.loads = []
+
+        def _loader(domain):
+            def _load():
+                self.loads.append(domain)
+                return dict(self.states[domain])
+            return _load
+        self.stream = StateStream(loaders=dict((domain, _loader(domain)) for domain in self.states), history_size=5)
+
+    def _subscribe(self, client_id, domains, sequence=None):
+        frames = []
+        resumed = self.stream.subscribe(client_id, domains, frames.append, sequence=sequence)
+        return frames, resumed
+
+    def test_snapshot_and_deltas(self):
+        frames, resumed = self._subscribe('a', ['outputs', 'unknown'])
+        self.assertFalse(resumed)
+        self.assertEqual(['outputs'], self.loads)
+        self.assertEqual(Event.Types.STATE_SNAPSHOT, frames[0].type)
+        self.assertEqual({'outputs': {0: {'status': 0}, 1: {'status': 1}}}, frames[0].data['state'])
+        sequence = frames[0].data['sequence']
+
+        self.states['outputs'][1] = {'status': 0}
+        self.states['outputs'][2] = {'status': 1}
+        self.stream.invalidate('outputs')
+        self.stream.refresh(now=0)  # Only the invalidated domain
+        self.assertEqual(Event.Types.STATE_DELTA, frames[1].type)
+        self.assertEqual(sequence + 2, frames[1].data['sequence'])
+        self.assertEqual(sorted([['outputs', 1, {'status': 0}], ['outputs', 2, {'status': 1}]]),
+                         sorted(frames[1].data['changes']))
+        # Unchanged and unsubscribed domains don't send anything
+        self.stream.refresh(domains=['outputs', 'sensors'])
+        self.assertEqual(2, len(frames))
+        del self.states['outputs'][0]
+        self.states['sensors'][0] = {'temperature': 21.0}
+        self.stream.refresh(domains=['outputs', 'sensors'])
+        self.assertEqual([['outputs', 0, None]], frames[2].data['changes'])  # Removed
+        self.assertEqual(3, len(frames))
+
+        self.stream.unsubscribe('a')
+        self.states['outputs'][1] = {'status': 1}
+        self.stream.refresh(domains=['outputs'])
+        self.assertEqual(3, len(frames))
+
+    def test_resume(self):
+        frames, _ = self._subscribe('a', ['outputs', 'sensors'])
+        sequence = frames[0].data['sequence']
+        self.stream.unsubscribe('a')
+        self.states['outputs'][0] = {'status': 1}
+        self.states['sensors'][0] = {'temperature': 21.0}
+        self.stream.refresh(domains=['outputs', 'sensors'])
+
+        # Only the missed changes of the subscribed domains are sent
+        frames, resumed = self._subscribe('a', ['outputs'], sequence=sequence)
+        self.assertTrue(resumed)
+        self.assertEqual(Event.Types.STATE_DELTA, frames[0].type)
+        self.assertEqual([['outputs', 0, {'status': 1}]], frames[0].data['changes'])
+        self.assertEqual(sequence + 2, frames[0].data['sequence'])
+        frames, resumed = self._subscribe('a', ['outputs'], sequence=sequence + 2)
+        self.assertTrue(resumed)
+        self.assertEqual([], frames[0].data['changes'])
+
+        # Sequences of another run, or older than the kept history, get a snapshot
+        for unknown_sequence in [self.stream._first_sequence - 1, sequence + 3]:
+            frames, resumed = self._subscribe('a', ['outputs'], sequence=unknown_sequence)
+            self.assertFalse(resumed)
+            self.assertEqual(Event.Types.STATE_SNAPSHOT, frames[0].type)
+        for status in xrange(2, 6):
+            self.states['outputs'][0] = {'status': status}
+            self.stream.refresh(domains=['outputs'])
+        frames, resumed = self._subscribe('a', ['outputs'], sequence=sequence)
+        self.assertFalse(resumed)
+        self.assertEqual({'outputs': {0: {'status': 5}, 1: {'status': 1}}}, frames[0].data['state'])
+
+    def test_resume_new_domain(self):
+        frames, _ = self._subscribe('a', ['outputs'])
+        sequence = frames[0].data['sequence']
+        self.stream.unsubscribe('a')
+        self.states['outputs'][0] = {'status': 1}
+        self.stream.refresh(domains=['outputs'])
+
+        # A domain the client didn't have gets a snapshot, the others only the missed changes
+        frames, resumed = self._subscribe('b', ['outputs', 'sensors'], sequence=sequence)
+        self.assertTrue(resumed)
+        self.assertEqual(Event.Types.STATE_SNAPSHOT, frames[0].type)
+        self.assertEqual({'sensors': {0: {'temperature': 20.5}}}, frames[0].data['state'])
+        self.assertEqual(Event.Types.STATE_DELTA, frames[1].type)
+        self.assertEqual([['outputs', 0, {'status': 1}]], frames[1].data['changes'])
+        self.assertEqual(2, len(frames))
+
+        # Also when a subscription of the same client is extended
+        sequence = frames[1].data['sequence']
+        self._subscribe('c', ['sensors'])
+        frames, resumed = self._subscribe('c', ['sensors', 'outputs'], sequence=sequence)
+        self.assertTrue(resumed)
+        self.assertEqual({'outputs': {0: {'status': 1}, 1: {'status': 1}}}, frames[0].data['state'])
+        self.assertEqual([], frames[1].data['changes'])
+
+    def test_only_subscribed_domains(self):
+        frames, _ = self._subscribe('a', ['outputs'])
+        sequence = frames[0].data['sequence']
+        self.stream.invalidate('outputs')
+        self.stream.invalidate('sensors')
+        self.stream.refresh(now=0)
+        self.stream.refresh(now=StateStream.POLL_INTERVAL)
+        self.assertEqual(['outputs'] * 3, self.loads)
+
+        # Without subscribers nothing is loaded, the domain is brought up to date on the next subscription
+        self.stream.unsubscribe('a')
+        self.states['outputs'][0] = {'status': 1}
+        self.stream.invalidate('outputs')
+        self.stream.refresh(now=2 * StateStream.POLL_INTERVAL)
+        self.assertEqual(['outputs'] * 3, self.loads)
+        frames, resumed = self._subscribe('a', ['outputs'], sequence=sequence)
+        self.assertTrue(resumed)
+        self.assertEqual([['outputs', 0, {'status': 1}]], frames[0].data['changes'])
+
+    def test_poll(self):
+        self._subscribe('a', ['sensors'])
+        self.assertEqual(['sensors'], self.loads)
+        self.stream.refresh(now=StateStream.POLL_INTERVAL)
+        self.assertEqual(['sensors', 'sensors'], self.loads)  # All subscribed domains
+        self.stream.refresh(now=StateStream.POLL_INTERVAL + 0.5)
+        self.assertEqual(['sensors', 'sensors'], self.loads)
+
+
+if __name__ == "__main__":
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='../gw-unit-reports'))
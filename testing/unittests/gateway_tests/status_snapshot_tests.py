@@ -0,0 +1,88 @@
+# Copyright (C) 2019 OpenMotics BV
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the status snapshot module.
+"""
+import time
+import unittest
+import xmlrunner
+from threading import Thread
+from gateway.status_snapshot import StatusSnapshot
+
+
+class StatusSnapshotTest(unittest.TestCase):
+
+    def test_read_through(self):
+        snapshot = StatusSnapshot(max_ages={'outputs': 60})
+        loads = []
+
+        def load():
+            loads.append(1)
+            return [{'id': 0, 'status': 0}]
+
+        status, version, delta = snapshot.get('outputs', load)
+        self.assertEqual([{'id': 0, 'status': 0}], status)
+        self.assertFalse(delta)
+        self.assertEqual((status, version, False), snapshot.get('outputs', load))
+        self.assertEqual(1, len(loads))
+        snapshot.invalidate('outputs')
+        self.assertEqual((status, version, False), snapshot.get('outputs', load))  # Same status, same version
+        self.assertEqual(2, len(loads))
+        snapshot.set_max_age('outputs', 0)
+        snapshot._entries['outputs']['timestamp'] = time.time() - 1
+        snapshot.get('outputs', load)
+        self.assertEqual(3, len(loads))
+
+    def test_concurrent_load(self):
+        snapshot = StatusSnapshot()
+        loads = []
+
+        def load():
+            loads.append(1)
+            time.sleep(0.2)
+            return [1, 2, 3]
+
+        threads = [Thread(target=snapshot.get, args=('sensor_temperature', load)) for _ in xrange(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, len(loads))
+
+    def test_deltas(self):
+        snapshot = StatusSnapshot()
+        version_1 = snapshot.set('outputs', [{'id': 0, 'status': 0}, {'id': 1, 'status': 0}])
+        version_2 = snapshot.set('outputs', [{'id': 0, 'status': 1}, {'id': 1, 'status': 0}])
+        self.assertTrue(version_2 > version_1)
+        load = lambda: self.fail('Status should not be loaded')
+        self.assertEqual(([{'id': 0, 'status': 1}], version_2, True), snapshot.get('outputs', load, since_version=version_1))
+        self.assertEqual(([], version_2, True), snapshot.get('outputs', load, since_version=version_2))
+        # Without elements, the complete status is returned when it changed
+        version_3 = snapshot.set('sensor_temperature', [20.5, None])
+        self.assertEqual(([20.5, None], version_3, False), snapshot.get('sensor_temperature', load, since_version=version_2))
+        self.assertEqual(([], version_3, True), snapshot.get('sensor_temperature', load, since_version=version_3))
+        # A removed element can't be expressed as a delta
+        version_4 = snapshot.set('realtime_power', {'1': [230.0], '2': [231.0]})
+        version_5 = snapshot.set('realtime_power', {'1': [230.0], '2': [232.0]})
+        self.assertEqual(({'2': [232.0]}, version_5, True), snapshot.get('realtime_power', load, since_version=version_4))
+        version_6 = snapshot.set('realtime_power', {'1': [229.0]})
+        self.assertEqual(({'1': [229.0]}, version_6, False), snapshot.get('realtime_power', load, since_version=version_5))
+        version_7 = snapshot.set('realtime_power', {'1': [229.0], '3': [1.0]})
+        self.assertEqual(({'3': [1.0]}, version_7, True), snapshot.get('realtime_power', load, since_version=version_6))
+        self.assertEqual(({'1': [229.0], '3': [1.0]}, version_7, False), snapshot.get('realtime_power', load, since_version=version_5))
+
+
+if __name__ == "__main__":
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='../gw-unit-reports'))
@@ -22,7 +22,6 @@ import unittest
 import xmlrunner
 import time
 import os
-from threading import Lock
 from ioc import SetTestMode, SetUpTestInjections
 from gateway.users import UserController
 
@@ -37,18 +36,19 @@ class UserControllerTest(unittest.TestCase):
     def setUp(self):  # pylint: disable=C0103
         """ Run before each test. """
         self._db = "test.user.{0}.db".format(time.time())
-        if os.path.exists(self._db):
-            os.remove(self._db)
+        for suffix in ['', '-wal', '-shm']:  # The database runs in WAL mode
+            if os.path.exists(self._db + suffix):
+                os.remove(self._db + suffix)
 
     def tearDown(self):  # pylint: disable=C0103
         """ Run after each test. """
-        if os.path.exists(self._db):
-            os.remove(self._db)
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(self._db + suffix):
+                os.remove(self._db + suffix)
 
     def _get_controller(self):
         """ Get a UserController using FILE. """
         SetUpTestInjections(user_db=self._db,
-                            user_db_lock=Lock(),
                             config={'username': 'om', 'password': 'pass'},
                             token_timeout=10)
         return UserController()
@@ -174,6 +174,48 @@ class UserControllerTest(unittest.TestCase):
 
         self.assertEquals(['om', 'test'], user_controller.get_usernames())
 
+    def test_token_persistence(self):
+        """ Test the tokens surviving a restart. """
+        user_controller = self._get_controller()
+        user_controller.create_user('test', 'test', 'admin', True)
+        token = user_controller.login('om', 'pass')[1]
+        other_token = user_controller.login('test', 'test', accept_terms=True)[1]
+        logged_out_token = user_controller.login('test', 'test')[1]
+        user_controller.logout(logged_out_token)
+
+        user_controller = self._get_controller()
+        token_hash = user_controller._tokens._loaded.keys()[0]
+        self.assertFalse(user_controller.check_token(token_hash))  # The stored hashes are no tokens
+        self.assertTrue(user_controller.check_token(token))
+        self.assertTrue(user_controller.check_token(other_token))
+        self.assertFalse(user_controller.check_token(logged_out_token))
+        user_controller.remove_user('test')
+        self.assertFalse(user_controller.check_token(other_token))
+
+        user_controller = self._get_controller()
+        self.assertTrue(user_controller.check_token(token))
+        self.assertFalse(user_controller.check_token(other_token))
+
+        SetUpTestInjections(user_db=self._db,
+                            config={'username': 'om', 'password': 'pass'},
+                            token_timeout=10)
+        user_controller = UserController(persist_tokens=False)
+        self.assertFalse(user_controller.check_token(token))
+
+    def test_token_expiry(self):
+        """ Test the expired tokens being removed. """
+        user_controller = self._get_controller()
+        tokens = [user_controller._gen_token('om', time.time() + valid) for valid in [-2, -1, 60]]
+        self.assertEquals([False, False, True], [user_controller.check_token(token) for token in tokens])
+        token_store = user_controller._tokens
+        self.assertEquals(1, len(token_store._tokens))
+        self.assertEquals(1, len(token_store._user_tokens['om']))
+        self.assertEquals(1, len(token_store._expiry))
+        user_controller.logout(tokens[2])
+        self.assertEquals({}, token_store._user_tokens)
+        self.assertFalse(user_controller.check_token(None))
+        self.assertFalse(user_controller.check_token(u'\u00e9'))
+
 
 if __name__ == '__main__':
     unittest.main(testRunner=xmlrunner.XMLTestRunner(output='../gw-unit-reports'))
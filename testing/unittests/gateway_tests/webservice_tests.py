@@ -0,0 +1,309 @@
+# Copyright (C) 2019 OpenMotics BV
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the webservice module.
+"""
+import gzip
+import unittest
+import cherrypy
+import ujson as json
+import xmlrunner
+from StringIO import StringIO
+from cherrypy.lib.httputil import HeaderMap
+from ioc import SetTestMode, SetUpTestInjections
+from gateway.maintenance_communicator import InMaintenanceModeException
+from gateway.observer import Event
+from gateway.webservice import WebInterface, openmotics_api, dumps_limited, set_etag
+
+
+class GatewayApi(object):
+    def __init__(self):
+        self.calls = []
+
+    def get_snapshot_status(self, key, since_version=None):
+        self.calls.append(('get_snapshot_status', key, since_version))
+        if key == 'sensor_temperature':
+            return [20.5, None, None], 5, False
+        if key in ['sensor_humidity', 'sensor_brightness']:
+            return [None, None, 60], 5, False
+        return [{'id': 1, 'status': 1}], 5, False
+
+    def get_output_configuration(self, output_id, fields=None):
+        self.calls.append(('get_output_configuration', output_id, fields))
+        if output_id > 10:
+            raise ValueError('Invalid output')
+        return {'id': output_id, 'name': 'Output {0}'.format(output_id)}
+
+    def set_output(self, output_id, is_on, dimmer=None, timer=None):
+        self.calls.append(('set_output', output_id, is_on, dimmer, timer))
+        return {}
+
+    def get_configuration_version(self):
+        _ = self
+        return None
+
+
+class WebserviceTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        SetTestMode()
+
+    def setUp(self):
+        cherrypy.request.headers = HeaderMap()
+        cherrypy.response.headers = HeaderMap()
+
+    def test_dumps_limited(self):
+        self.assertEqual('[1.23,2.0,0.01,-1.0,1,{"power":0.33}]',
+                         dumps_limited([1.23456, 2.0, 0.005, -0.999, 1, {'power': 1 / 3.0}]))
+
+    def test_api_response(self):
+        return_data = {'status': [{'id': 1, 'power': 12.3456}]}
+
+        @openmotics_api()
+        def get_status():
+            return return_data
+
+        self.assertEqual({'success': True, 'status': [{'id': 1, 'power': 12.35}]}, json.loads(get_status()))
+        self.assertEqual({'status': [{'id': 1, 'power': 12.3456}]}, return_data)  # The response data isn't changed
+
+    def test_not_modified(self):
+        @openmotics_api()
+        def get_status():
+            set_etag('"outputs-2"')
+            return {'status': []}
+
+        cherrypy.request.headers['If-None-Match'] = '"outputs-1"'
+        self.assertEqual({'success': True, 'status': []}, json.loads(get_status()))
+        self.assertEqual('"outputs-2"', cherrypy.response.headers['ETag'])
+        cherrypy.request.headers['If-None-Match'] = '"outputs-1", "outputs-2"'
+        with self.assertRaises(cherrypy.HTTPRedirect) as context:
+            get_status()
+        self.assertEqual(304, context.exception.status)
+
+    def test_gzip(self):
+        @openmotics_api()
+        def get_status():
+            return {'status': [{'id': i, 'name': 'Output {0}'.format(i)} for i in xrange(100)]}
+
+        contents = get_status()
+        self.assertNotIn('Content-Encoding', cherrypy.response.headers)
+        self.assertEqual('Accept-Encoding', cherrypy.response.headers['Vary'])
+        cherrypy.request.headers['Accept-Encoding'] = 'deflate, gzip;q=0'
+        self.assertEqual(contents, get_status())
+        cherrypy.request.headers['Accept-Encoding'] = 'deflate, gzip;q=0.8'
+        gzipped = get_status()
+        self.assertEqual('gzip', cherrypy.response.headers['Content-Encoding'])
+        self.assertLess(len(gzipped), len(contents) / 4)
+        self.assertEqual(contents, gzip.GzipFile(fileobj=StringIO(gzipped)).read())
+
+        # Small responses are sent as is
+        @openmotics_api()
+        def get_small_status():
+            return {'status': []}
+
+        cherrypy.response.headers = HeaderMap()
+        self.assertEqual({'success': True, 'status': []}, json.loads(get_small_status()))
+        self.assertNotIn('Content-Encoding', cherrypy.response.headers)
+
+    def test_cache_version(self):
+        state = {'version': 1, 'calls': 0}
+
+        class WebInterface(object):
+            @openmotics_api(cache_version=lambda self: state['version'])
+            def get_configurations(self, fields=None):
+                state['calls'] += 1
+                return {'config': [{'id': i, 'name': 'Output {0}'.format(i), 'fields': fields} for i in xrange(100)]}
+
+        web_interface = WebInterface()
+        contents = web_interface.get_configurations(fields='name')
+        etag = cherrypy.response.headers['ETag']
+        self.assertEqual(1, state['calls'])
+        # Unchanged data is served from the cache
+        self.assertEqual(contents, web_interface.get_configurations(fields='name'))
+        self.assertEqual(1, state['calls'])
+        self.assertEqual(etag, cherrypy.response.headers['ETag'])
+        # Other parameters are another response
+        self.assertNotEqual(contents, web_interface.get_configurations(fields='id'))
+        self.assertEqual(2, state['calls'])
+        self.assertNotEqual(etag, cherrypy.response.headers['ETag'])
+        # The gzip encoded response has its own ETag
+        cherrypy.request.headers['Accept-Encoding'] = 'gzip'
+        gzipped = web_interface.get_configurations(fields='name')
+        self.assertEqual(2, state['calls'])
+        self.assertEqual(contents, gzip.GzipFile(fileobj=StringIO(gzipped)).read())
+        gzip_etag = cherrypy.response.headers['ETag']
+        self.assertNotEqual(etag, gzip_etag)
+        # Both ETags are Not Modified
+        for tag in [etag, gzip_etag]:
+            cherrypy.request.headers['If-None-Match'] = tag
+            with self.assertRaises(cherrypy.HTTPRedirect) as context:
+                web_interface.get_configurations(fields='name')
+            self.assertEqual(304, context.exception.status)
+            self.assertEqual(gzip_etag if tag == gzip_etag else etag, cherrypy.response.headers['ETag'])
+        # A new version invalidates the ETags and the cache
+        state['version'] = 2
+        cherrypy.request.headers['Accept-Encoding'] = 'identity'
+        self.assertEqual(contents, web_interface.get_configurations(fields='name'))
+        self.assertEqual(3, state['calls'])
+        self.assertNotEqual(etag, cherrypy.response.headers['ETag'])
+        # Without a version, nothing is cached
+        state['version'] = None
+        cherrypy.response.headers = HeaderMap()
+        web_interface.get_configurations(fields='name')
+        web_interface.get_configurations(fields='name')
+        self.assertEqual(5, state['calls'])
+        self.assertNotIn('ETag', cherrypy.response.headers)
+
+    def test_cache_version_failure(self):
+        state = {'version': 1, 'error': None}
+
+        class WebInterface(object):
+            @openmotics_api(cache_version=lambda self: state['version'])
+            def get_configurations(self):
+                if state['error'] is not None:
+                    raise state['error']
+                return {'config': []}
+
+        web_interface = WebInterface()
+        web_interface.get_configurations()
+        etag = cherrypy.response.headers['ETag']
+        # Failed calls don't get the ETag of the data, so the client doesn't mistake the error for the data
+        for error, status in [(ValueError('Invalid configuration'), 200), (InMaintenanceModeException(), 503)]:
+            state['version'] += 1
+            state['error'] = error
+            cherrypy.response.headers['ETag'] = etag  # Left by the previous call on this thread
+            self.assertFalse(json.loads(web_interface.get_configurations())['success'])
+            self.assertEqual(status, cherrypy.response.status)
+            self.assertNotIn('ETag', cherrypy.response.headers)
+        state['error'] = None
+        web_interface.get_configurations()
+        self.assertNotEqual(etag, cherrypy.response.headers['ETag'])
+
+    @staticmethod
+    def _get_web_interface(gateway_api):
+        SetUpTestInjections(gateway_api=gateway_api,
+                            user_controller=None,
+                            maintenance_controller=None,
+                            message_client=None,
+                            configuration_controller=None,
+                            scheduling_controller=None)
+        return WebInterface()
+
+    def test_batch(self):
+        gateway_api = GatewayApi()
+        web_interface = WebserviceTest._get_web_interface(gateway_api)
+        cherrypy.request.headers['If-None-Match'] = '"outputs-5"'
+        response = json.loads(web_interface.batch(calls=[
+            {'name': 'get_output_status'},
+            {'name': 'get_output_configuration', 'params': {'id': '1', 'fields': '["name"]'}},
+            {'name': 'get_output_status'},
+            {'name': 'get_output_configuration', 'params': {'id': 2}},
+            {'name': 'get_output_configuration', 'params': {'id': 'two'}},
+            {'name': 'get_output_configuration', 'params': {'id': 11}},
+            {'name': 'logout'},
+            {'name': 'batch', 'params': {'calls': '[]'}},
+            {'name': 'unknown'},
+            {}
+        ]))
+        output_status = {'success': True, 'status': [{'id': 1, 'status': 1}]}
+        self.assertEqual({'success': True,
+                          'responses': [output_status,
+                                        {'success': True, 'config': {'id': 1, 'name': 'Output 1'}},
+                                        output_status,
+                                        {'success': True, 'config': {'id': 2, 'name': 'Output 2'}},
+                                        {'success': False, 'msg': 'invalid_parameters'},
+                                        {'success': False, 'msg': 'Invalid output'},
+                                        {'success': False, 'msg': 'unknown_call'},
+                                        {'success': False, 'msg': 'unknown_call'},
+                                        {'success': False, 'msg': 'unknown_call'},
+                                        {'success': False, 'msg': 'unknown_call'}]}, response)
+        # Identical calls are executed once, and not answered with a 304
+        self.assertEqual([('get_snapshot_status', 'outputs', None),
+                          ('get_output_configuration', 1, ['name']),
+                          ('get_output_configuration', 2, None),
+                          ('get_output_configuration', 11, None)], gateway_api.calls)
+        self.assertNotIn('ETag', cherrypy.response.headers)
+        server_timing = cherrypy.response.headers['Server-Timing']
+        self.assertIn('"get_output_status"', server_timing)
+        self.assertIn('call1=', server_timing)
+        self.assertNotIn('call2=', server_timing)
+
+        # Writes are always executed, in order
+        gateway_api.calls = []
+        set_output_on = {'name': 'set_output', 'params': {'id': 1, 'is_on': True}}
+        response = json.loads(web_interface.batch(calls=[set_output_on,
+                                                         {'name': 'set_output', 'params': {'id': 1, 'is_on': False}},
+                                                         set_output_on]))
+        self.assertEqual([{'success': True}] * 3, response['responses'])
+        self.assertEqual([('set_output', 1, True, None, None),
+                          ('set_output', 1, False, None, None),
+                          ('set_output', 1, True, None, None)], gateway_api.calls)
+
+        too_many = [{'name': 'get_output_status'}] * (WebInterface.MAX_BATCH_CALLS + 1)
+        self.assertEqual({'success': False, 'msg': 'invalid_parameters'},
+                         json.loads(web_interface.batch(calls=too_many)))
+
+    def test_plugin_api_call(self):
+        gateway_api = GatewayApi()
+        web_interface = WebserviceTest._get_web_interface(gateway_api)
+        cherrypy.request.headers['Accept-Encoding'] = 'gzip'
+        cherrypy.request.headers['If-None-Match'] = '"outputs-5"'
+        self.assertEqual({'success': True, 'config': {'id': 1, 'name': 'Output 1'}},
+                         json.loads(web_interface.plugin_api_call('get_output_configuration', {'id': '1'})))
+        self.assertEqual({'success': True, 'status': [{'id': 1, 'status': 1}]},
+                         json.loads(web_interface.plugin_api_call('get_output_status', {})))
+        self.assertEqual({'success': False, 'msg': 'unknown_call'},
+                         json.loads(web_interface.plugin_api_call('login', {})))
+        # The cherrypy response of the process isn't touched
+        self.assertEqual({}, dict(cherrypy.response.headers))
+
+    def test_status_etag(self):
+        web_interface = WebserviceTest._get_web_interface(GatewayApi())
+        self.assertEqual({'success': True, 'status': [{'id': 1, 'status': 1}]}, json.loads(web_interface.get_output_status()))
+        self.assertEqual('"outputs-5"', cherrypy.response.headers['ETag'])
+        cherrypy.request.headers['If-None-Match'] = '"outputs-5"'
+        with self.assertRaises(cherrypy.HTTPRedirect) as context:
+            web_interface.get_output_status()
+        self.assertEqual(304, context.exception.status)
+
+    def test_set_metrics_emission_policy(self):
+        policies = []
+        web_interface = WebserviceTest._get_web_interface(GatewayApi())
+        web_interface.set_metrics_controller(type('MetricsController', (), {
+            'set_emission_policy': lambda _self, *args, **kwargs: policies.append((args, kwargs))
+        })())
+        response = json.loads(web_interface.batch(calls=[
+            {'name': 'set_metrics_emission_policy', 'params': {'metric_type': 'sensor', 'mode': 'deadband', 'deadband': '0.5'}},
+            {'name': 'set_metrics_emission_policy', 'params': {'metric_type': 'sensor', 'mode': 'foo'}}
+        ]))
+        self.assertEqual([{'success': True}, {'success': False, 'msg': 'invalid_parameters'}], response['responses'])
+        self.assertEqual([(('sensor', 'deadband'), {'deadband': 0.5, 'heartbeat': 900})], policies)
+
+    def test_state_stream(self):
+        web_interface = WebserviceTest._get_web_interface(GatewayApi())
+        frames = []
+        web_interface._state_stream.subscribe('a', ['outputs', 'sensors'], frames.append)
+        self.assertEqual({'outputs': {1: {'status': 1}},
+                          'sensors': {0: {'temperature': 20.5, 'humidity': None, 'brightness': None},
+                                      2: {'temperature': None, 'humidity': 60, 'brightness': 60}}},
+                         frames[0].data['state'])
+        # Events of a domain refresh it on the next refresh
+        web_interface.send_event_websocket(Event(event_type=Event.Types.OUTPUT_CHANGE, data={'id': 1}))
+        self.assertEqual({'outputs'}, web_interface._state_stream._invalidated)
+
+
+if __name__ == "__main__":
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='../gw-unit-reports'))
@@ -0,0 +1,150 @@
+# Copyright (C) 2019 OpenMotics BV
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Tests for the websockets module.
+"""
+import unittest
+import msgpack
+import xmlrunner
+from threading import Event
+from gateway.websockets import MetricsStream, SocketSender
+
+
+class MetricsStreamTest(unittest.TestCase):
+
+    @staticmethod
+    def _metric(timestamp, power, counter):
+        return {'source': 'OpenMotics',
+                'type': 'energy',
+                'timestamp': timestamp,
+                'tags': {'device': 'OpenMotics energy ID1', 'id': 'E7.3'},
+                'values': {'power': power, 'counter': counter}}
+
+    def _add(self, stream, metric):
+        stream.add(metric, msgpack.dumps(metric))
+
+    def test_batching(self):
+        stream = MetricsStream(interval=1)
+        stream._last_flush = 0
+        metric_1 = MetricsStreamTest._metric(0, 10, 100)
+        metric_2 = MetricsStreamTest._metric(1, 10, 101)
+        self._add(stream, metric_1)
+        self._add(stream, metric_2)
+        self.assertIsNone(stream.pop_frame(now=0.5))
+        self.assertEqual([metric_1, metric_2], msgpack.loads(stream.pop_frame(now=1)))
+        self.assertIsNone(stream.pop_frame(now=2))  # Nothing buffered
+
+    def test_delta_encoding(self):
+        stream = MetricsStream(interval=1, delta=True)
+        stream._last_flush = 0
+        metric_1 = MetricsStreamTest._metric(0, 10, 100)
+        other_metric = MetricsStreamTest._metric(0, 5, 50)
+        other_metric['tags']['id'] = 'E7.4'
+        self._add(stream, metric_1)
+        self._add(stream, other_metric)
+        self._add(stream, MetricsStreamTest._metric(1, 10, 101))
+        self._add(stream, MetricsStreamTest._metric(2, 10, 101))
+        expected_1 = dict(metric_1, series=0)
+        expected_2 = dict(other_metric, series=1)
+        self.assertEqual([expected_1,
+                          expected_2,
+                          {'series': 0, 'timestamp': 1, 'values': {'counter': 101}},
+                          {'series': 0, 'timestamp': 2, 'values': {}}], msgpack.loads(stream.pop_frame(now=1)))
+
+    def test_max_series(self):
+        max_series = MetricsStream.MAX_SERIES
+        MetricsStream.MAX_SERIES = 2
+        try:
+            stream = MetricsStream(interval=1, delta=True)
+            stream._last_flush = 0
+            metrics = []
+            for i in xrange(3):
+                metric = MetricsStreamTest._metric(0, 10, 100)
+                metric['tags']['id'] = 'E7.{0}'.format(i)
+                metrics.append(metric)
+                self._add(stream, metric)
+            self.assertEqual([dict(metrics[0], series=0), dict(metrics[1], series=1), dict(metrics[2], series=0)],
+                             msgpack.loads(stream.pop_frame(now=1)))
+            self.assertEqual(1, len(stream._series))
+            # After the reset, the other series are sent completely again
+            self._add(stream, MetricsStreamTest._metric(2, 10, 101))
+            self._add(stream, MetricsStreamTest._metric(3, 10, 102))
+            self.assertEqual([dict(MetricsStreamTest._metric(2, 10, 101), series=1),
+                              {'series': 1, 'timestamp': 3, 'values': {'counter': 102}}],
+                             msgpack.loads(stream.pop_frame(now=2)))
+        finally:
+            MetricsStream.MAX_SERIES = max_series
+
+
+class SocketSenderTest(unittest.TestCase):
+
+    def test_slow_client(self):
+        class Socket(object):
+            def __init__(self):
+                self.sent = []
+                self.closed = False
+                self.release = Event()
+
+            def send(self, payload, binary=False):
+                self.release.wait(5)  # A client that doesn't read
+                self.sent.append((payload, binary))
+
+            def close_connection(self):
+                self.closed = True
+
+        socket = Socket()
+        sender = SocketSender(socket, max_queue=2)
+        sender.start()
+        self.assertTrue(sender.send('a'))
+        while sender._queue.qsize() > 0:  # The sender thread is blocked sending 'a'
+            pass
+        self.assertTrue(sender.send('b'))
+        self.assertTrue(sender.send('c'))
+        self.assertFalse(socket.closed)
+        self.assertFalse(sender.send('d'))  # Doesn't block, but drops the client
+        self.assertTrue(socket.closed)
+        self.assertFalse(sender.send('e'))
+        socket.release.set()
+        while sender._queue.qsize() > 0:
+            pass
+        sender.stop()
+        sender._thread.join(5)
+        self.assertFalse(sender._thread.is_alive())
+        self.assertEqual([('a', True), ('b', True), ('c', True)], socket.sent)
+
+    def test_close(self):
+        class Socket(object):
+            def __init__(self):
+                self.sent = []
+
+            def send(self, payload, binary=False):
+                self.sent.append((payload, binary))
+
+            def close(self, code, reason):
+                self.sent.append((code, reason))
+
+        socket = Socket()
+        sender = SocketSender(socket)
+        self.assertTrue(sender.send('a'))
+        sender.close(401, 'invalid_token')  # Only queued, doesn't send anything itself
+        self.assertFalse(sender.send('b'))
+        self.assertEqual([], socket.sent)
+        sender.start()
+        sender._thread.join(5)
+        self.assertEqual([('a', True), (401, 'invalid_token')], socket.sent)
+
+
+if __name__ == "__main__":
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='../gw-unit-reports'))
@@ -130,13 +130,15 @@ class EepromControllerTest(unittest.TestCase):
 
     def setUp(self):  # pylint: disable=C0103
         """ Run before each test. """
-        if os.path.exists(EEPROM_DB_FILE):
-            os.remove(EEPROM_DB_FILE)
+        for suffix in ['', '-wal', '-shm']:  # The database runs in WAL mode
+            if os.path.exists(EEPROM_DB_FILE + suffix):
+                os.remove(EEPROM_DB_FILE + suffix)
 
     def tearDown(self):  # pylint: disable=C0103
         """ Run after each test. """
-        if os.path.exists(EEPROM_DB_FILE):
-            os.remove(EEPROM_DB_FILE)
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(EEPROM_DB_FILE + suffix):
+                os.remove(EEPROM_DB_FILE + suffix)
 
     def test_read(self):
         """ Test read. """
@@ -285,11 +287,13 @@ class EepromControllerTest(unittest.TestCase):
     def test_write(self):
         """ Test write. """
         controller = get_eeprom_controller_dummy(["\x00" * 256, "\x00" * 256, "\x00" * 256, "\x00" * 256])
+        generation = controller.generation
         controller.write(Model1.deserialize({'id': 1, 'name': "Hello world !" + "\xff" * 10}))
 
         model = controller.read(Model1, 1)
         self.assertEquals(1, model.id)
         self.assertEquals("Hello world !", model.name)
+        self.assertNotEquals(generation, controller.generation)  # Invalidates the cached API responses
 
     def test_write_sparse(self):
         """ Test write when not all fields of the model are provided. """
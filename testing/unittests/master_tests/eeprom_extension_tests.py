@@ -35,14 +35,16 @@ class EepromExtensionTest(unittest.TestCase):
     def setUp(self):
         """ Run before each test. """
         _ = self
-        if os.path.exists(EepromExtensionTest.FILE):
-            os.remove(EepromExtensionTest.FILE)
+        for suffix in ['', '-wal', '-shm']:  # The database runs in WAL mode
+            if os.path.exists(EepromExtensionTest.FILE + suffix):
+                os.remove(EepromExtensionTest.FILE + suffix)
 
     def tearDown(self):
         """ Run after each test. """
         _ = self
-        if os.path.exists(EepromExtensionTest.FILE):
-            os.remove(EepromExtensionTest.FILE)
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(EepromExtensionTest.FILE + suffix):
+                os.remove(EepromExtensionTest.FILE + suffix)
 
     @staticmethod
     def _get_extension():
@@ -22,6 +22,7 @@ import os
 import plugin_runtime
 import shutil
 import tempfile
+import threading
 import time
 import unittest
 import xmlrunner
@@ -83,8 +84,12 @@ class PluginControllerTest(unittest.TestCase):
                                       runtime_path=PluginControllerTest.RUNTIME_PATH,
                                       plugins_path=PluginControllerTest.PLUGINS_PATH,
                                       plugin_config_path=PluginControllerTest.PLUGIN_CONFIG_PATH)
-        metric_controller = type('MetricController', (), {'get_filter': lambda *args, **kwargs: ['test'],
-                                                          'set_plugin_definitions': lambda _self, *args, **kwargs: None})()
+        from gateway.metrics_controller import MetricsRoutingTable
+        get_filter = lambda *args, **kwargs: ['test']
+        get_rate_key = lambda source, metric_type: '{0}.{1}'.format(source, metric_type)
+        metric_controller = type('MetricController', (), {'get_filter': get_filter,
+                                                          'get_routing_table': lambda _self, subscriptions: MetricsRoutingTable(subscriptions, get_filter, get_rate_key),
+                                                          'update_plugin_definitions': lambda _self, *args, **kwargs: None})()
         controller.set_metrics_controller(metric_controller)
         return controller
 
@@ -383,6 +388,54 @@ class P2(OMPluginBase):
             PluginControllerTest._destroy_plugin('P1')
             PluginControllerTest._destroy_plugin('P2')
 
+    def test_collect_metrics(self):
+        """ Validates whether a slow metric collector doesn't delay the others """
+        controller = None
+        try:
+            PluginControllerTest._create_plugin('Slow', """
+import time
+from plugins.base import *
+
+class Slow(OMPluginBase):
+    name = 'Slow'
+    version = '1.0.0'
+    interfaces = []
+
+    @om_metric_data(interval=10)
+    def collect(self):
+        time.sleep(3)
+        yield {'type': 'slow', 'timestamp': 0, 'tags': {}, 'values': {'value': 0}}
+""")
+            PluginControllerTest._create_plugin('Fast', """
+from plugins.base import *
+
+class Fast(OMPluginBase):
+    name = 'Fast'
+    version = '1.0.0'
+    interfaces = []
+
+    @om_metric_data(interval=1)
+    def collect(self):
+        yield {'type': 'fast', 'timestamp': 0, 'tags': {}, 'values': {'value': 0}}
+""")
+            controller = PluginControllerTest._get_controller()
+            controller.start()
+            start = time.time()
+            metrics = []
+            while time.time() - start < 2.5:
+                metrics.extend((metric['source'], time.time() - start) for metric in controller.collect_metrics())
+            self.assertEqual(['Fast', 'Fast', 'Fast'], [source for source, _ in metrics])
+            self.assertLess(metrics[0][1], 0.5)
+            # The collectors run on a fixed set of workers
+            self.assertEqual(controller.METRIC_COLLECTOR_WORKERS,
+                             len([thread for thread in threading.enumerate()
+                                  if thread.name.startswith('PluginController metric collector')]))
+        finally:
+            if controller is not None:
+                controller.stop()
+            PluginControllerTest._destroy_plugin('Slow')
+            PluginControllerTest._destroy_plugin('Fast')
+
     def test_check_plugin(self):
         """ Test the exception that can occur when checking a plugin. """
         from plugin_runtime.utils import check_plugin
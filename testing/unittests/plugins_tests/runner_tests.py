@@ -16,13 +16,21 @@
 Tests for plugin runner
 """
 
+import cherrypy
+import msgpack
 import os
 import plugin_runtime
 import shutil
 import tempfile
+import threading
+import time
 import unittest
 import xmlrunner
-from plugins.runner import PluginRunner
+from threading import Thread
+from gateway.observer import Event
+from plugin_runtime.utils import get_package_hash, load_introspection
+from plugins.runner import PluginRunner, RuntimeZygote, HttpProxyPool
+from toolbox import PluginIPCStream, MetricsRing
 
 
 class PluginRunnerTest(unittest.TestCase):
@@ -33,7 +41,7 @@ class PluginRunnerTest(unittest.TestCase):
 
     @classmethod
     def setUpClass(cls):
-        cls.RUNTIME_PATH = tempfile.mkdtemp()
+        cls.PLUGIN_PATH = tempfile.mkdtemp()
 
     @classmethod
     def tearDownClass(cls):
@@ -50,6 +58,346 @@ class PluginRunnerTest(unittest.TestCase):
         runner = PluginRunner('foo', self.RUNTIME_PATH, self.PLUGIN_PATH, self._log)
         self.assertEqual(runner.get_queue_length(), 0)
 
+    def _create_plugin(self, name, code):
+        path = os.path.join(self.PLUGIN_PATH, name)
+        os.makedirs(path)
+        with open(os.path.join(path, 'main.py'), 'w') as code_file:
+            code_file.write(code)
+        with open(os.path.join(path, '__init__.py'), 'w'):
+            pass
+        return path
+
+    def test_concurrent_requests(self):
+        path = self._create_plugin('Concurrent', """
+import time
+from plugins.base import *
+
+class Concurrent(OMPluginBase):
+    name = 'Concurrent'
+    version = '1.0.0'
+    interfaces = []
+    concurrency = 2
+
+    @om_expose(auth=False)
+    def slow(self):
+        time.sleep(1)
+        return 'slow'
+
+    @om_expose(auth=False)
+    def fast(self):
+        return 'fast'
+""")
+        runner = PluginRunner('Concurrent', self.RUNTIME_PATH, path, self._log, command_timeout=0.5)
+        runner.start()
+        try:
+            errors = []
+
+            def _slow_request():
+                try:
+                    runner.request('slow')
+                except Exception as ex:
+                    errors.append(str(ex))
+
+            thread = Thread(target=_slow_request)
+            thread.start()
+            time.sleep(0.1)
+            start = time.time()
+            self.assertEqual('fast', runner.request('fast'))
+            self.assertLess(time.time() - start, 0.5)
+            thread.join()
+            self.assertEqual(['Plugin did not respond'], errors)
+            time.sleep(0.6)  # The late response of the slow request is dropped
+            self.assertEqual('fast', runner.request('fast'))
+        finally:
+            runner.stop()
+
+    def test_async_events(self):
+        path = self._create_plugin('Events', """
+from plugins.base import *
+
+class Events(OMPluginBase):
+    name = 'Events'
+    version = '1.0.0'
+    interfaces = []
+
+    def __init__(self, webservice, logger):
+        super(Events, self).__init__(webservice, logger)
+        self.inputs = []
+        self.outputs = []
+
+    @input_status(version=2)
+    def input(self, data):
+        self.inputs.append(data['input_id'])
+
+    @output_status
+    def output(self, status):
+        self.outputs.append(status)
+
+    @om_expose(auth=False)
+    def get_events(self):
+        return {'inputs': self.inputs, 'outputs': self.outputs}
+""")
+        runner = PluginRunner('Events', self.RUNTIME_PATH, path, self._log)
+        runner.start()
+        try:
+            for i in xrange(200):
+                runner.process_input_status(Event(Event.Types.INPUT_CHANGE, {'id': i, 'status': True}))
+                runner.process_output_status([(i, 100)])
+            start = time.time()
+            while runner.get_queue_length() > 0 and time.time() - start < 5:
+                time.sleep(0.1)
+            events = runner.request('get_events')
+            self.assertEqual(range(200), events['inputs'])  # Every input event, in order
+            self.assertEqual([[[199, 100]]], events['outputs'][-1:])  # Superseded output states might be skipped
+            stats = runner.get_async_stats()
+            self.assertEqual(400, stats['delivered'] + stats['coalesced'])
+            self.assertEqual(0, stats['dropped'])
+        finally:
+            runner.stop()
+
+    def test_async_failures(self):
+        runner = PluginRunner('Failing', self.RUNTIME_PATH, None, self._log)
+        now = time.time()
+        entries = [{'action': 'output_status', 'fields': {}, 'queued': now} for _ in xrange(3)]
+        runner._process_async_responses(entries, [{}, {'_exception': 'Failed'}, {}])
+        self.assertEqual(2, runner.get_async_stats()['delivered'])  # Only the successful deliveries
+
+    def test_web_ipc(self):
+        path = self._create_plugin('Web', """
+from plugins.base import *
+
+class Web(OMPluginBase):
+    name = 'Web'
+    version = '1.0.0'
+    interfaces = []
+
+    @om_expose(auth=False)
+    def call(self):
+        return self.webinterface.set_output(id=1, is_on=True, dimmer=None)
+""")
+        calls = []
+
+        class WebInterface(object):
+            def plugin_api_call(self, name, params):
+                calls.append((name, params))
+                return '{"success": true}'
+
+        runner = PluginRunner('Web', self.RUNTIME_PATH, path, self._log, web_interface=WebInterface())
+        runner.start()
+        workers = list(runner._web_call_workers)
+        try:
+            for _ in xrange(5):
+                self.assertEqual('{"success": true}', runner.request('call'))
+            self.assertEqual([('set_output', {'id': '1', 'is_on': 'True', 'dimmer': 'None'})] * 5, calls)
+            # The calls are executed by a fixed set of workers
+            self.assertEqual(PluginRunner.WEB_CALL_WORKERS,
+                             len([thread for thread in threading.enumerate() if '{0} web call'.format(path) in thread.name]))
+        finally:
+            runner.stop()
+        for worker in workers:
+            worker.join(5)
+            self.assertFalse(worker.is_alive())
+
+    def test_zygote(self):
+        path = self._create_plugin('Forked', """
+import os
+from plugins.base import *
+
+class Forked(OMPluginBase):
+    name = 'Forked'
+    version = '1.0.0'
+    interfaces = []
+
+    @om_expose(auth=False)
+    def parent(self):
+        return os.getppid()
+""")
+        zygote = RuntimeZygote(self.RUNTIME_PATH, os.path.join(self.PLUGIN_PATH, 'zygote.sock'))
+        try:
+            runner = PluginRunner('Forked', self.RUNTIME_PATH, path, self._log, zygote=zygote)
+            runner.start()
+            try:
+                self.assertEqual(zygote._proc.pid, runner.request('parent'))
+                self.assertEqual([{'name': 'parent', 'auth': False, 'content_type': 'application/json'}], runner._exposes)
+                self.assertEqual([], runner.get_metric_definitions())  # Sent at start
+                self.assertIsNotNone(runner.get_metric_definitions_version())
+            finally:
+                runner.stop()
+            self.assertEqual(0, runner._proc.poll())  # Reported by the zygote
+            self.assertEqual(0o600, os.stat(zygote.socket_path).st_mode & 0o777)
+            introspection = load_introspection(path, get_package_hash(path))
+            self.assertEqual('Forked', introspection['class'])
+            self.assertEqual(['parent'], introspection['methods']['om_expose'])
+
+            runner.start()  # Uses the cached introspection
+            try:
+                self.assertEqual(zygote._proc.pid, runner.request('parent'))
+                self.assertEqual([{'name': 'parent', 'auth': False, 'content_type': 'application/json'}], runner._exposes)
+            finally:
+                runner.stop()
+        finally:
+            zygote.stop()
+
+    def test_resource_stats(self):
+        path = self._create_plugin('Busy', """
+import time
+from plugins.base import *
+
+class Busy(OMPluginBase):
+    name = 'Busy'
+    version = '1.0.0'
+    interfaces = []
+
+    @om_expose(auth=False)
+    def busy(self, duration):
+        end = time.time() + duration
+        while time.time() < end:
+            pass
+        return 'done'
+""")
+        runner = PluginRunner('Busy', self.RUNTIME_PATH, path, self._log)
+        runner.start()
+        try:
+            self.assertEqual('done', runner.request('busy', kwargs={'duration': 0}))
+            stats = runner.get_resource_stats()
+            self.assertEqual(runner._proc.pid, stats['pid'])
+            self.assertGreater(stats['rss'], 0)
+            self.assertGreater(stats['threads'], 0)
+            self.assertGreater(stats['ipc']['bytes_in'], 0)
+            self.assertGreater(stats['ipc']['bytes_out'], 0)
+            request_stats = stats['commands']['request']
+            self.assertEqual((1, 0), (request_stats['count'], request_stats['timeouts']))
+            self.assertEqual([upper_bound for upper_bound, _ in request_stats['buckets']], PluginRunner.LATENCY_BUCKETS)
+            self.assertEqual(1, request_stats['buckets'][-1][1])
+
+            thread = Thread(target=runner.request, args=('busy',), kwargs={'kwargs': {'duration': 1.5}})
+            thread.start()
+            profile = runner.profile(duration=1, interval=0.01)
+            thread.join()
+            self.assertGreater(profile['samples'], 10)
+            busy_samples = sum(count for stack, count in profile['stacks']
+                               if stack.startswith('Command worker 0;') and stack.endswith('main.py:busy'))
+            self.assertGreater(busy_samples, profile['samples'] / 2)
+            cpu = runner.get_resource_stats()['cpu']
+            self.assertGreater(cpu['user'] + cpu['system'], 0.5)
+        finally:
+            runner.stop()
+
+    def test_http_request(self):
+        path = self._create_plugin('Http', """
+import time
+from plugins.base import *
+
+class Http(OMPluginBase):
+    name = 'Http'
+    version = '1.0.0'
+    interfaces = []
+    concurrency = 2
+
+    @om_expose(auth=False)
+    def small(self):
+        return 'small'
+
+    @om_expose(auth=False)
+    def large(self):
+        return 'x' * 200000
+
+    @om_expose(auth=False)
+    def generated(self):
+        for part in ['a', 'b', u'\u20ac']:
+            yield part
+
+    @om_expose(auth=False)
+    def slow(self):
+        time.sleep(1)
+        return 'slow'
+""")
+        runner = PluginRunner('Http', self.RUNTIME_PATH, path, self._log, http_pool=HttpProxyPool(size=2))
+        runner.start()
+        try:
+            self.assertEqual('small', runner.http_request('small'))
+            response = runner.http_request('large')
+            self.assertEqual('x' * 200000, ''.join(response))
+            self.assertEqual('ab\xe2\x82\xac', ''.join(runner.http_request('generated')))
+            self.assertEqual('small', runner.request('small'))  # Not streamed outside of the webserver
+            runner.http_request('large')  # Dropped unread, e.g. for a HEAD request
+            self.assertEqual(0, runner.get_resource_stats()['http']['active'])
+
+            responses = []
+            threads = [Thread(target=lambda: responses.append(runner.http_request('slow'))) for _ in xrange(2)]
+            for thread in threads:
+                thread.start()
+            time.sleep(0.2)
+            start = time.time()
+            with self.assertRaises(cherrypy.HTTPError) as context:
+                runner.http_request('small')  # The pool is saturated
+            self.assertEqual(503, context.exception.status)
+            self.assertLess(time.time() - start, 0.1)
+            for thread in threads:
+                thread.join()
+            self.assertEqual(['slow', 'slow'], responses)
+            self.assertEqual({'active': 0, 'rejected': 1}, runner.get_resource_stats()['http'])
+        finally:
+            runner.stop()
+
+    def test_async_queue(self):
+        runner = PluginRunner('foo', self.RUNTIME_PATH, self.PLUGIN_PATH, self._log)
+        runner._process_running = True
+        runner._receivers = ['output_status', 'receive_events']
+        runner.process_output_status([(1, 100)])
+        runner.process_output_status([(1, 50)])
+        runner.process_input_status(Event(Event.Types.INPUT_CHANGE, {'id': 1, 'status': True}))  # No receiver
+        self.assertEqual(1, runner.get_queue_length())
+        self.assertEqual({'status': [(1, 50)]}, runner._async_commands[0]['fields'])
+        for i in xrange(PluginRunner.ASYNC_QUEUE_SIZE):
+            runner.process_event(i)
+        self.assertEqual(PluginRunner.ASYNC_QUEUE_SIZE, runner.get_queue_length())
+        self.assertEqual({'delivered': 0, 'dropped': 1, 'coalesced': 1, 'latency': 0.0}, runner.get_async_stats())
+
+    def test_ipc_stream(self):
+        read_fd, write_fd = os.pipe()
+        try:
+            stream = PluginIPCStream(read_fd)
+            start = {'cid': 1, 'action': 'start', 'protocols': ['msgpack']}
+            message = {'cid': 2, 'action': 'request', 'args': [1, 2.5, u'\u20ac'], 'kwargs': {'data': '\n'}}
+            os.write(write_fd, '\n' + PluginIPCStream.encode(start))
+            self.assertEqual(start, stream.read())
+            stream.binary = True
+            data = PluginIPCStream.encode(message, binary=True) * 2
+            os.write(write_fd, data[:3])  # Incomplete frame header
+            os.write(write_fd, data[3:10])
+            os.write(write_fd, data[10:])
+            self.assertEqual(message, stream.read())
+            self.assertEqual(message, stream.read())
+            os.close(write_fd)
+            write_fd = None
+            with self.assertRaises(EOFError):
+                stream.read()
+        finally:
+            os.close(read_fd)
+            if write_fd is not None:
+                os.close(write_fd)
+
+    def test_metrics_ring(self):
+        path = os.path.join(self.PLUGIN_PATH, 'metrics.ring')
+        writer = MetricsRing(path, size=100)
+        reader = MetricsRing(path)
+        records = [msgpack.packb({'id': i, 'data': 'x' * 10}, use_bin_type=True) for i in xrange(10)]  # 4 + 22 bytes each
+        self.assertEqual(([], 0), reader.read())
+        writer.write(records[:3])
+        self.assertEqual(([{'id': 0, 'data': 'x' * 10}, {'id': 1, 'data': 'x' * 10}, {'id': 2, 'data': 'x' * 10}], 3),
+                         reader.read())
+        writer.write(records[3:5])  # Wraps around the end of the ring
+        self.assertEqual(([{'id': 3, 'data': 'x' * 10}, {'id': 4, 'data': 'x' * 10}], 2), reader.read())
+        self.assertEqual(0, reader.dropped)
+        writer.write(records[5:10])  # Overwrites unread records
+        self.assertEqual(([], 5), reader.read())
+        self.assertEqual(5, reader.dropped)
+        writer.write(records[:1])
+        self.assertEqual(([{'id': 0, 'data': 'x' * 10}], 1), reader.read())
+        reader.close()
+        writer.close()
+
 
 if __name__ == "__main__":
     unittest.main(testRunner=xmlrunner.XMLTestRunner(output='../gw-unit-reports'))
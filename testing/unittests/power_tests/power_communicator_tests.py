@@ -40,13 +40,15 @@ class PowerCommunicatorTest(unittest.TestCase):
 
     def setUp(self):
         """ Run before each test. """
-        if os.path.exists(PowerCommunicatorTest.FILE):
-            os.remove(PowerCommunicatorTest.FILE)
+        for suffix in ['', '-wal', '-shm']:  # The database runs in WAL mode
+            if os.path.exists(PowerCommunicatorTest.FILE + suffix):
+                os.remove(PowerCommunicatorTest.FILE + suffix)
 
     def tearDown(self):
         """ Run after each test. """
-        if os.path.exists(PowerCommunicatorTest.FILE):
-            os.remove(PowerCommunicatorTest.FILE)
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(PowerCommunicatorTest.FILE + suffix):
+                os.remove(PowerCommunicatorTest.FILE + suffix)
 
     @staticmethod
     def _get_communicator(serial_mock, time_keeper_period=0, address_mode_timeout=60, power_controller=None):
@@ -37,13 +37,15 @@ class PowerControllerTest(unittest.TestCase):
 
     def setUp(self):  # pylint: disable=C0103
         """ Run before each test. """
-        if os.path.exists(PowerControllerTest.FILE):
-            os.remove(PowerControllerTest.FILE)
+        for suffix in ['', '-wal', '-shm']:  # The database runs in WAL mode
+            if os.path.exists(PowerControllerTest.FILE + suffix):
+                os.remove(PowerControllerTest.FILE + suffix)
 
     def tearDown(self):  # pylint: disable=C0103
         """ Run after each test. """
-        if os.path.exists(PowerControllerTest.FILE):
-            os.remove(PowerControllerTest.FILE)
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(PowerControllerTest.FILE + suffix):
+                os.remove(PowerControllerTest.FILE + suffix)
 
     def __get_controller(self):
         """ Get a PowerController using FILE. """
@@ -46,6 +46,9 @@ python2 plugins_tests/base_tests.py
 echo "Running plugin interfaces tests"
 python2 plugins_tests/interfaces_tests.py
 
+echo "Running plugin runner tests"
+python2 plugins_tests/runner_tests.py
+
 echo "Running pulse counter controller tests"
 python2 gateway_tests/pulses_tests.py
 
@@ -60,3 +63,30 @@ python2 master_core_tests/api_field_tests.py
 
 echo "Running metrics tests"
 python2 gateway_tests/metrics_tests.py
+
+echo "Running metrics exporter tests"
+python2 gateway_tests/metrics_exporter_tests.py
+
+echo "Running webservice tests"
+python2 gateway_tests/webservice_tests.py
+
+echo "Running gateway api tests"
+python2 gateway_tests/gateway_api_tests.py
+
+echo "Running status snapshot tests"
+python2 gateway_tests/status_snapshot_tests.py
+
+echo "Running state stream tests"
+python2 gateway_tests/state_stream_tests.py
+
+echo "Running configuration controller tests"
+python2 gateway_tests/config_tests.py
+
+echo "Running message client tests"
+python2 bus_tests/om_bus_client_tests.py
+
+echo "Running websockets tests"
+python2 gateway_tests/websockets_tests.py
+
+echo "Running database tests"
+python2 database_utils_tests.py